@@ -0,0 +1,165 @@
+"""
+并发入群时的禁言延迟
+
+同时推送大量入群通知，经过 handle_events（入站队列）处理，测量每个用户从入群通知到
+禁言调用发出、到验证消息发出的延迟，以及每个入群事件占用处理函数的时间
+（handle_events 返回的时间，后台发送的验证消息和管理员通知不计入）。
+模拟的连接每次发送等待 send_delay 秒，代表 OneBot 接口的耗时。
+
+默认使用按群分片的文件存储；指定 Redis 往返耗时时改用 RedisStore，连接的是进程内的
+LocalRedisServer，每条命令（和每个事务）阻塞等待一次往返耗时，代表通过网络访问 Redis。
+
+用法：python benchmarks/join_latency.py [入群人数] [发送耗时毫秒] [Redis往返毫秒]
+"""
+
+import os
+import sys
+import atexit
+import re
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+import replay
+
+# 单独检出插件时上三级目录没有 app 包，和 replay.py 一样把当前工作区放到临时目录下导入，
+# 并用替身替换机器人的接口模块，发出的调用由 FakeWebSocket 记录
+_ROOT = tempfile.mkdtemp(prefix="gev-bench-")
+atexit.register(shutil.rmtree, _ROOT, True)
+replay.use_current_tree(_ROOT)
+replay.install_app_stubs(["10000"])
+
+from app.scripts.GroupEntryVerification import main as plugin
+from app.scripts.GroupEntryVerification.store import GroupShardStore, set_store
+from app.scripts.GroupEntryVerification.redis_store import LocalRedisServer, RedisStore
+from app.scripts.GroupEntryVerification.tracing import tracer
+
+GROUP_ID = 123456789
+AT_PATTERN = re.compile(r"\[CQ:at,qq=(\d+)\]")
+
+
+class FakeWebSocket:
+    """记录每次调用的发出时间"""
+
+    def __init__(self, send_delay):
+        self.send_delay = send_delay
+        # (接口名, QQ号) -> 第一次发出的时间
+        self.sent = {}
+
+    async def send(self, data):
+        await asyncio.sleep(self.send_delay)
+        request = json.loads(data)
+        params = request.get("params", {})
+        user_id = params.get("user_id")
+        if user_id is None:
+            # 群消息按消息中 @ 的用户记录
+            mention = AT_PATTERN.search(str(params.get("message", "")))
+            user_id = mention.group(1) if mention else None
+        self.sent.setdefault((request.get("action"), str(user_id)), time.perf_counter())
+
+
+class SlowRedisConnection:
+    """每条命令先阻塞等待一次往返耗时的 LocalRedisServer 连接"""
+
+    def __init__(self, conn, rtt):
+        self.conn = conn
+        self.rtt = rtt
+
+    def execute(self, *args):
+        time.sleep(self.rtt)
+        return self.conn.execute(*args)
+
+    def transaction(self, commands):
+        time.sleep(self.rtt)
+        return self.conn.transaction(commands)
+
+    def subscribe(self, channel, callback, on_disconnect=None):
+        self.conn.subscribe(channel, callback, on_disconnect)
+
+    def close(self):
+        self.conn.close()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
+
+
+async def run(joins, send_delay):
+    websocket = FakeWebSocket(send_delay)
+    joined_at = {}
+    held = []
+
+    async def join(user_id):
+        joined_at[str(user_id)] = time.perf_counter()
+        await plugin.handle_events(
+            websocket,
+            {
+                "post_type": "notice",
+                "notice_type": "group_increase",
+                "group_id": GROUP_ID,
+                "user_id": user_id,
+            },
+        )
+        held.append(time.perf_counter() - joined_at[str(user_id)])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(join(user_id) for user_id in range(10000, 10000 + joins)))
+    elapsed = time.perf_counter() - start
+    # 验证消息和管理员通知在后台发送，等它们全部完成
+    while plugin._background_tasks:
+        await asyncio.gather(*plugin._background_tasks)
+
+    def latencies(action):
+        return [
+            websocket.sent[(action, user_id)] - at
+            for user_id, at in joined_at.items()
+            if (action, user_id) in websocket.sent
+        ]
+
+    return elapsed, latencies("set_group_ban"), latencies("send_group_msg"), held
+
+
+def main():
+    joins = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    send_delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 5) / 1000
+    redis_rtt = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else None
+    print(
+        f"入群人数: {joins}，发送耗时: {send_delay * 1000:.0f} ms，"
+        f"管理员数: {len(plugin.owner_id)}，存储: "
+        + ("文件" if redis_rtt is None else f"Redis（往返 {redis_rtt * 1000:.1f} ms）")
+    )
+    directory = tempfile.mkdtemp()
+    try:
+        if redis_rtt is None:
+            store = GroupShardStore(directory, import_legacy=False, async_writes=True)
+        else:
+            server = LocalRedisServer()
+            store = RedisStore(lambda: SlowRedisConnection(server.connect(), redis_rtt))
+        set_store(store)
+        plugin._function_status_cache[str(GROUP_ID)] = True
+        tracer.trace_dir = None
+        elapsed, bans, prompts, held = asyncio.run(run(joins, send_delay))
+        getattr(store, "flush", lambda: None)()
+        print(f"全部处理完成 {elapsed * 1000:8.1f} ms")
+        for name, samples in (
+            ("入群->禁言", bans),
+            ("入群->验证消息", prompts),
+            ("占用处理函数", held),
+        ):
+            print(
+                f"{name:<10} p50 {percentile(samples, 50) * 1000:8.1f} ms  "
+                f"p99 {percentile(samples, 99) * 1000:8.1f} ms  "
+                f"最大 {max(samples) * 1000:8.1f} ms  ({len(samples)} 个)"
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
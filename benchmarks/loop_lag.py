@@ -0,0 +1,111 @@
+"""
+写入压力下的事件循环延迟
+
+在一个较大的群里连续修改记录（每次修改都要重写该群的分片文件），同时用 LoopLagMonitor 测量
+事件循环的调度延迟，比较同步写文件和后台线程写文件两种方式。
+
+用法：python benchmarks/loop_lag.py [群内用户数] [修改次数]
+"""
+
+import os
+import sys
+import atexit
+import time
+import shutil
+import asyncio
+import tempfile
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+import replay
+
+# 单独检出插件时上三级目录没有 app 包，和 replay.py 一样把当前工作区放到临时目录下导入
+_ROOT = tempfile.mkdtemp(prefix="gev-bench-")
+atexit.register(shutil.rmtree, _ROOT, True)
+replay.use_current_tree(_ROOT)
+
+from app.scripts.GroupEntryVerification.store import (
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+    GroupShardStore,
+)
+from app.scripts.GroupEntryVerification.loop_monitor import LoopLagMonitor
+
+GROUP_ID = "123456789"
+
+
+def fill(store, users):
+    store.update_tables(
+        {
+            USER_VERIFICATION: {
+                f"{user_id}_{GROUP_ID}": (
+                    lambda _: {
+                        "status": "pending",
+                        "remaining_attempts": 3,
+                        "joined_at": 1700000000,
+                    }
+                )
+                for user_id in range(10000, 10000 + users)
+            },
+            VERIFICATION_QUESTIONS: {
+                f"{user_id}_{GROUP_ID}": (
+                    lambda _: {"expression": "12 + 34", "answer": 46, "timestamp": 0.0}
+                )
+                for user_id in range(10000, 10000 + users)
+            },
+        }
+    )
+    store.flush()
+
+
+def consume_attempt(value):
+    value["remaining_attempts"] = max(value["remaining_attempts"] - 1, 0)
+    return value
+
+
+async def run(store, users, updates):
+    monitor = LoopLagMonitor(interval=0.01)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    for i in range(updates):
+        # 模拟事件之间的其他处理
+        store.update(
+            USER_VERIFICATION, f"{10000 + i % users}_{GROUP_ID}", consume_attempt
+        )
+        await asyncio.sleep(0)
+    handled = time.perf_counter() - start
+    await asyncio.sleep(0.05)
+    monitor.stop()
+    store.flush()
+    return handled, monitor.stats()
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    print(f"群内用户数: {users}，修改次数: {updates}")
+    for name, async_writes in (("同步写文件", False), ("后台线程写文件", True)):
+        directory = tempfile.mkdtemp()
+        try:
+            store = GroupShardStore(
+                directory, import_legacy=False, async_writes=async_writes
+            )
+            fill(store, users)
+            before = store.writer.stats()["writes"] if store.writer else 0
+            handled, stats = asyncio.run(run(store, users, updates))
+            writes = (
+                store.writer.stats()["writes"] - before if store.writer else updates
+            )
+            print(
+                f"{name:<12} 处理 {handled * 1000:8.1f} ms  "
+                f"循环延迟 p50 {stats['p50_ms']:6.1f} ms  p99 {stats['p99_ms']:6.1f} ms  "
+                f"最大 {stats['max_ms']:6.1f} ms  实际写盘 {writes} 次"
+            )
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+验证记录内存占用基准测试
+
+比较旧的 {f"{user_id}_{group_id}": {"status": ..., "remaining_attempts": ...}} 字典表示
+与 records.RecordTable 中的 VerificationRecord 在一百万条记录时每条记录占用的字节数。
+
+用法：python benchmarks/record_memory.py [记录数]
+"""
+
+import os
+import sys
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import Status, VerificationRecord, RecordTable
+
+
+def make_ids(count):
+    rng = random.Random(0)
+    group_ids = [rng.randint(100000000, 999999999) for _ in range(max(count // 500, 1))]
+    # 与从存储中读取时一样，QQ号和群号以字符串形式给出，两种表示都要自行创建键
+    return [
+        (str(rng.randint(100000000, 3999999999)), str(rng.choice(group_ids)))
+        for _ in range(count)
+    ]
+
+
+def build_legacy(ids):
+    now = 1700000000
+    return {
+        f"{user_id}_{group_id}": {
+            "status": "pending",
+            "remaining_attempts": 3,
+            "joined_at": now + i,
+        }
+        for i, (user_id, group_id) in enumerate(ids)
+    }
+
+
+def build_records(ids):
+    now = 1700000000
+    return RecordTable(
+        VerificationRecord(user_id, group_id, Status.PENDING, 3, now + i)
+        for i, (user_id, group_id) in enumerate(ids)
+    )
+
+
+def measure(build, ids):
+    tracemalloc.start()
+    data = build(ids)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    ids = make_ids(count)
+    legacy = measure(build_legacy, ids)
+    records = measure(build_records, ids)
+    print(f"记录数: {count}")
+    print(f"字典表示:   {legacy / count:8.1f} 字节/条  共 {legacy / 2**20:8.1f} MiB")
+    print(f"slots 记录: {records / count:8.1f} 字节/条  共 {records / 2**20:8.1f} MiB")
+    print(f"节省: {(1 - records / legacy) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
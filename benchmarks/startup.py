@@ -0,0 +1,144 @@
+"""
+启动加载基准测试
+
+比较三种存储格式在启动时读入全部验证数据所需的时间，
+快照加日志格式另外给出只打开存储（校验快照、重放日志，群数据按需解码）所需的时间：
+    - 旧的每张表一个带缩进的 JSON 文件（JsonFileStore）
+    - 按群分片的 JSON 文件（GroupShardStore）
+    - 二进制快照加日志（JournalStore，快照之后另有一段日志需要重放）
+
+用法：python benchmarks/startup.py [待验证用户数]
+"""
+
+import os
+import sys
+import atexit
+import time
+import random
+import shutil
+import tempfile
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+import replay
+
+# 单独检出插件时上三级目录没有 app 包，和 replay.py 一样把当前工作区放到临时目录下导入
+_ROOT = tempfile.mkdtemp(prefix="gev-bench-")
+atexit.register(shutil.rmtree, _ROOT, True)
+replay.use_current_tree(_ROOT)
+
+from app.scripts.GroupEntryVerification.store import (
+    TABLES,
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+    WARNING_RECORD,
+    MESSAGE_ID_LIST,
+    JsonFileStore,
+    GroupShardStore,
+)
+from app.scripts.GroupEntryVerification.journal_store import JournalStore
+
+# 快照之后需要重放的日志条数
+JOURNAL_ENTRIES = 10000
+
+
+def make_tables(count):
+    rng = random.Random(0)
+    group_ids = [
+        str(rng.randint(100000000, 999999999)) for _ in range(max(count // 500, 1))
+    ]
+    tables = {table: {} for table in TABLES}
+    for _ in range(count):
+        user_id = str(rng.randint(100000000, 3999999999))
+        group_id = rng.choice(group_ids)
+        key = f"{user_id}_{group_id}"
+        tables[USER_VERIFICATION][key] = {
+            "status": "pending",
+            "remaining_attempts": 3,
+            "joined_at": 1700000000 + rng.randint(0, 86400),
+        }
+        tables[VERIFICATION_QUESTIONS][key] = {
+            "expression": f"{rng.randint(1, 99)} + {rng.randint(1, 99)}",
+            "answer": rng.randint(2, 198),
+            "timestamp": 1700000000.0 + rng.random() * 86400,
+        }
+        if rng.random() < 0.3:
+            tables[WARNING_RECORD][key] = rng.randint(1, 3)
+        messages = tables[MESSAGE_ID_LIST].setdefault(group_id, {})
+        messages[user_id] = [rng.randint(1, 2**31) for _ in range(rng.randint(0, 3))]
+    return tables
+
+
+def timed(func, repeat=3):
+    """多次运行取最短时间"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    tables = make_tables(count)
+    root = tempfile.mkdtemp()
+    try:
+        legacy_dir = os.path.join(root, "legacy")
+        legacy = JsonFileStore(legacy_dir)
+        for table, data in tables.items():
+            legacy.save(table, data)
+
+        shard_dir = os.path.join(root, "shard")
+        shutil.copytree(legacy_dir, shard_dir)
+        GroupShardStore(shard_dir)  # 首次启动时导入整表文件
+
+        journal_dir = os.path.join(root, "journal")
+        shutil.copytree(legacy_dir, journal_dir)
+        store = JournalStore(journal_dir, compact_bytes=2**40)
+        keys = list(tables[USER_VERIFICATION])
+        for i in range(JOURNAL_ENTRIES):
+            store.set(
+                USER_VERIFICATION,
+                keys[i % len(keys)],
+                {"status": "verified", "remaining_attempts": 2},
+            )
+        store.close()
+
+        def load_legacy():
+            store = JsonFileStore(legacy_dir)
+            for table in TABLES:
+                store.load(table)
+
+        def load_shard():
+            store = GroupShardStore(shard_dir)
+            for table in TABLES:
+                store.load(table)
+
+        def open_journal():
+            JournalStore(journal_dir).close()
+
+        def load_journal():
+            store = JournalStore(journal_dir)
+            for table in TABLES:
+                store.load(table)
+            store.close()
+
+        print(f"待验证用户数: {count}，快照之后的日志条数: {JOURNAL_ENTRIES}")
+        results = [
+            ("整表 JSON", timed(load_legacy)),
+            ("按群分片 JSON", timed(load_shard)),
+            ("快照加日志（仅打开）", timed(open_journal)),
+            ("快照加日志", timed(load_journal)),
+        ]
+        baseline = results[0][1]
+        for name, seconds in results:
+            print(f"{name:<16} {seconds * 1000:9.1f} ms  {baseline / seconds:6.1f}x")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+事件去重
+
+断线重连后协议端可能重新推送同一个事件（例如 group_increase），重复处理会再次禁言、
+再次发送欢迎消息并生成新的题目覆盖旧题目，用户按旧题目回答就会被判错。
+这里按事件标识记录最近处理过的事件，重复的事件在读取任何状态或调用任何API之前丢弃。
+"""
+
+import time
+import logging
+from collections import OrderedDict
+
+# 最多记录的事件数，超过时淘汰最久未出现的事件
+DEDUP_MAX_ENTRIES = 4096
+# 事件标识的保留时间（秒），期间再次出现会重新计时
+DEDUP_TTL = 10 * 60
+
+
+def event_key(msg):
+    """
+    事件的标识，无法判断是否重复的事件（元事件、回调）返回 None
+
+    消息按 message_id、加群请求按 flag 识别；群成员增减通知没有唯一编号，
+    按群号、QQ号、子类型和事件时间（秒）识别。
+    """
+    post_type = msg.get("post_type")
+    self_id = msg.get("self_id")
+    if post_type == "message":
+        message_id = msg.get("message_id")
+        if message_id is None:
+            return None
+        return (self_id, post_type, msg.get("message_type"), message_id)
+    if post_type == "notice":
+        return (
+            self_id,
+            post_type,
+            msg.get("notice_type"),
+            msg.get("sub_type"),
+            str(msg.get("group_id")),
+            str(msg.get("user_id")),
+            msg.get("time"),
+        )
+    if post_type == "request":
+        flag = msg.get("flag")
+        if flag is None:
+            return None
+        return (self_id, post_type, msg.get("request_type"), flag)
+    return None
+
+
+class EventDeduplicator:
+    """带过期时间的 LRU 事件标识缓存"""
+
+    def __init__(self, max_entries=DEDUP_MAX_ENTRIES, ttl=DEDUP_TTL):
+        """
+        参数:
+            max_entries (int): 最多记录的事件数
+            ttl (float): 事件标识的保留时间（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # 事件标识 -> 最后一次出现的时间，按时间排序
+        self._seen = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # 各类事件的重复次数：(post_type, 子类型) -> 次数
+        self.hits_by_type = {}
+
+    def _expire(self, now):
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.ttl:
+                break
+            del self._seen[key]
+
+    def is_duplicate(self, msg):
+        """
+        记录事件并判断是否在保留时间内处理过
+
+        返回:
+            bool: 重复事件返回 True
+        """
+        key = event_key(msg)
+        if key is None:
+            return False
+        now = time.monotonic()
+        self._expire(now)
+        duplicate = key in self._seen
+        self._seen[key] = now
+        self._seen.move_to_end(key)
+        if duplicate:
+            self.hits += 1
+            event_type = key[1:3]
+            self.hits_by_type[event_type] = self.hits_by_type.get(event_type, 0) + 1
+            logging.info(f"忽略重复的事件 {key}，累计忽略 {self.hits} 个")
+            return True
+        self.misses += 1
+        if len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+            self.evictions += 1
+        return False
+
+    def stats(self):
+        """命中统计"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._seen),
+            "hits_by_type": dict(self.hits_by_type),
+        }
@@ -1,94 +1,93 @@
 import os
-import json
+import sys
+import time
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.store import get_store, MESSAGE_ID_LIST
+
+# 平台允许撤回消息的时间窗口（秒），按机器人在群里的权限调整；超过窗口的消息ID不再撤回，由清理任务删除
+MESSAGE_RECALL_WINDOW = 24 * 60 * 60
+
+
+def message_entries(values, now=None):
+    """
+    把存储中用户的消息列表整理为 [(message_id, 记录时间), ...]
+
+    新格式的每一项为 [message_id, 记录时间]，旧格式只有 message_id，记录时间视为 now
+
+    参数:
+        values (list): 存储中的消息列表
+        now (float): 旧格式消息的记录时间，默认为当前时间
+    """
+    now = time.time() if now is None else now
+    entries = []
+    for value in values or ():
+        if isinstance(value, list) and len(value) == 2:
+            entries.append((value[0], value[1]))
+        else:
+            entries.append((value, now))
+    return entries
+
+
+def recallable_ids(values, now=None):
+    """仍在撤回时间窗口内的消息ID"""
+    now = time.time() if now is None else now
+    return [
+        message_id
+        for message_id, recorded_at in message_entries(values, now)
+        if now - recorded_at < MESSAGE_RECALL_WINDOW
+    ]
 
 
 class DelMessage:
     def __init__(self):
-        self.DATA_DIR = os.path.join(
-            os.path.dirname(
-                os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            ),
-            "data",
-            "GroupEntryVerification",
-        )
-        self.data_file = os.path.join(self.DATA_DIR, "message_id_list.json")
-        os.makedirs(self.DATA_DIR, exist_ok=True)
+        self.store = get_store()
 
     def load_data(self):
         """
         加载消息ID数据
 
-        从文件中读取消息ID数据 (格式: {group_id: {user_id: [message_id, ...]}})
-        如果文件不存在、为空或格式错误，则创建一个空字典并覆盖原文件。
+        从存储中读取消息ID数据 (格式: {group_id: {user_id: [[message_id, 记录时间], ...]}})
 
         返回:
             dict: 消息ID数据字典
         """
-        if not os.path.exists(self.data_file):
-            # 文件不存在，创建空字典并保存
-            with open(self.data_file, "w", encoding="utf-8") as f:
-                json.dump({}, f)
-            return {}
-
-        try:
-            with open(self.data_file, "r", encoding="utf-8") as f:
-                # 处理文件为空的情况
-                content = f.read()
-                if not content:
-                    # 文件为空，返回空字典，并用空字典覆盖（如果需要保持一致性）
-                    with open(self.data_file, "w", encoding="utf-8") as f_write:
-                        json.dump({}, f_write)
-                    return {}
-                message_data = json.loads(content)  # 使用 loads 从已读内容加载
-
-            if not isinstance(message_data, dict):
-                # 文件内容不是字典，视为无效数据，返回空字典并覆盖原文件
-                with open(self.data_file, "w", encoding="utf-8") as f:
-                    json.dump({}, f)
-                return {}
-            return message_data
-        except json.JSONDecodeError:
-            # JSON 格式错误，返回空字典并覆盖原文件
-            with open(self.data_file, "w", encoding="utf-8") as f:
-                json.dump({}, f)
-            return {}
+        return self.store.load(MESSAGE_ID_LIST)
 
     def save_data(self, message_data):
         """
         保存消息ID数据
 
-        将消息ID数据字典保存到文件中
+        将消息ID数据字典保存到存储中
 
         参数:
             message_data (dict): 要保存的消息ID数据字典
         """
-        with open(self.data_file, "w", encoding="utf-8") as f:
-            json.dump(message_data, f, indent=4)
+        self.store.save(MESSAGE_ID_LIST, message_data)
 
     def add_message(self, group_id: str, user_id: str, message_id):
         """
-        添加消息ID到指定群组和用户的列表
+        添加消息ID到指定群组和用户的列表，同时记录添加时间
 
         参数:
             group_id (str): 群组ID
             user_id (str): 用户ID
             message_id (any): 要添加的消息ID
         """
-        message_data = self.load_data()
-
-        group_id_str = str(group_id)
         user_id_str = str(user_id)
+        now = time.time()
 
-        if group_id_str not in message_data:
-            message_data[group_id_str] = {}
-
-        if user_id_str not in message_data[group_id_str]:
-            message_data[group_id_str][user_id_str] = []
-
-        if message_id not in message_data[group_id_str][user_id_str]:
-            message_data[group_id_str][user_id_str].append(message_id)
+        def apply(group_data):
+            group_data = group_data or {}
+            entries = group_data.setdefault(user_id_str, [])
+            if message_id not in (entry for entry, _ in message_entries(entries, now)):
+                entries.append([message_id, now])
+            return group_data
 
-        self.save_data(message_data)
+        self.store.update(MESSAGE_ID_LIST, str(group_id), apply)
 
     def remove_message(self, group_id: str, user_id: str, message_id):
         """
@@ -99,25 +98,27 @@ class DelMessage:
             user_id (str): 用户ID
             message_id (any): 要删除的消息ID
         """
-        message_data = self.load_data()
-
-        group_id_str = str(group_id)
         user_id_str = str(user_id)
 
-        if (
-            group_id_str in message_data
-            and user_id_str in message_data[group_id_str]
-            and message_id in message_data[group_id_str][user_id_str]
-        ):
-            message_data[group_id_str][user_id_str].remove(message_id)
+        def apply(group_data):
+            if not group_data or user_id_str not in group_data:
+                return group_data
+            entries = group_data[user_id_str]
+            kept = [
+                entry
+                for entry, (entry_id, _) in zip(entries, message_entries(entries))
+                if entry_id != message_id
+            ]
+            if len(kept) == len(entries):
+                return group_data
+            group_data[user_id_str] = kept
 
             # 可选: 清理空列表和空字典
-            if not message_data[group_id_str][user_id_str]:  # 如果用户消息列表为空
-                del message_data[group_id_str][user_id_str]
-            if not message_data[group_id_str]:  # 如果群组用户字典为空
-                del message_data[group_id_str]
+            if not group_data[user_id_str]:  # 如果用户消息列表为空
+                del group_data[user_id_str]
+            return group_data or None  # 如果群组用户字典为空则删除
 
-            self.save_data(message_data)
+        self.store.update(MESSAGE_ID_LIST, str(group_id), apply)
 
     def get_user_messages(self, group_id: str, user_id: str) -> list:
         """
@@ -130,10 +131,11 @@ class DelMessage:
         返回:
             list: 消息ID列表，如果找不到则返回空列表
         """
-        message_data = self.load_data()
-        group_id_str = str(group_id)
-        user_id_str = str(user_id)
-        return message_data.get(group_id_str, {}).get(user_id_str, [])
+        group_data = self.store.get(MESSAGE_ID_LIST, str(group_id)) or {}
+        return [
+            message_id
+            for message_id, _ in message_entries(group_data.get(str(user_id), []))
+        ]
 
     def get_all_messages_by_group(self, group_id: str) -> dict:
         """
@@ -145,19 +147,17 @@ class DelMessage:
         返回:
             dict: 用户ID到消息ID列表的映射，如果找不到群组则返回空字典
         """
-        message_data = self.load_data()
-        group_id_str = str(group_id)
-        return message_data.get(group_id_str, {})
+        group_data = self.store.get(MESSAGE_ID_LIST, str(group_id)) or {}
+        return {
+            user_id: [message_id for message_id, _ in message_entries(entries)]
+            for user_id, entries in group_data.items()
+        }
 
 
 # 示例用法 (可选，用于测试)
 # if __name__ == '__main__':
 #     handler = DelMessage()
 #
-#     # 清理旧数据文件（如果存在）
-#     if os.path.exists(handler.data_file):
-#         os.remove(handler.data_file)
-#
 #     print("初始数据:", handler.load_data())
 #
 #     handler.add_message("group1", "userA", 1001)
@@ -0,0 +1,140 @@
+"""
+用于关联本插件发出的API调用与其回调事件
+
+每次调用都会生成唯一的 echo，回调到达时按 echo 直接查表，
+调用方可以选择等待该调用的回调数据（如 message_id）或失败原因。
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+
+# 未收到回调的调用默认保留时间（秒），超时后直接丢弃
+DEFAULT_CALL_TTL = 60
+
+
+class EchoCallError(Exception):
+    """API调用返回失败状态"""
+
+    def __init__(self, echo, response):
+        self.echo = echo
+        self.response = response
+        super().__init__(
+            f"调用 {echo} 失败: {response.get('message') or response.get('wording') or response.get('status')}"
+        )
+
+
+class PendingCall:
+    """一次等待回调的API调用"""
+
+    __slots__ = ("echo", "action", "group_id", "user_id", "future", "created_at")
+
+    def __init__(self, echo, action, group_id, user_id, future):
+        self.echo = echo
+        self.action = action
+        self.group_id = group_id
+        self.user_id = user_id
+        self.future = future
+        self.created_at = time.monotonic()
+
+
+def _consume_exception(future):
+    """没有调用方等待时，避免失败结果产生未读取异常的警告"""
+    if not future.cancelled():
+        future.exception()
+
+
+class EchoRegistry:
+    """以唯一 echo 为键的调用关联表"""
+
+    def __init__(self, note_prefix, action="send_group_msg", ttl=DEFAULT_CALL_TTL):
+        """
+        参数:
+            note_prefix (str): 本插件 note 的前缀
+            action (str): 默认的动作名，echo 的格式为 f"{action}_{note}"
+            ttl (float): 未收到回调的调用保留时间（秒）
+        """
+        self.note_prefix = note_prefix
+        self.action = action
+        self.ttl = ttl
+        self._seq = itertools.count(1)
+        # 按注册顺序排列，便于从头部清理过期调用
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def register(self, group_id, user_id, action=None):
+        """
+        登记一次即将发出的调用
+
+        参数:
+            group_id: 群号
+            user_id: 用户ID，与具体用户无关的调用可传入任意标识
+            action (str): 动作名，默认为构造时指定的动作
+
+        返回:
+            tuple: (note, call)，note 用于传给发送函数，call.echo 为完整的 echo
+        """
+        self._expire()
+        action = action or self.action
+        note = f"{self.note_prefix}{group_id}_{user_id}_{next(self._seq)}"
+        echo = f"{action}_{note}"
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        call = PendingCall(echo, action, str(group_id), str(user_id), future)
+        self._pending[echo] = call
+        return note, call
+
+    def resolve(self, msg):
+        """
+        用回调事件完成对应的调用
+
+        返回:
+            PendingCall: 匹配到的调用，未匹配时返回 None（回调被丢弃）
+        """
+        echo = msg.get("echo")
+        call = self._pending.pop(echo, None)
+        if call is None:
+            return None
+        if not call.future.done():
+            if msg.get("status") == "ok":
+                call.future.set_result(msg.get("data"))
+            else:
+                call.future.set_exception(EchoCallError(echo, msg))
+        return call
+
+    async def wait(self, call, timeout=10):
+        """
+        等待调用的回调数据
+
+        参数:
+            call (PendingCall): register 返回的调用
+            timeout (float): 超时时间（秒）
+
+        返回:
+            回调中的 data，例如发送消息时为 {"message_id": ...}
+
+        异常:
+            EchoCallError: 调用返回失败
+            asyncio.TimeoutError: 超时未收到回调
+            asyncio.CancelledError: 调用已过期被丢弃
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.future), timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(call.echo, None)
+            raise
+
+    def _expire(self):
+        """清理超过保留时间仍未收到回调的调用"""
+        deadline = time.monotonic() - self.ttl
+        while self._pending:
+            echo, call = next(iter(self._pending.items()))
+            if call.created_at > deadline:
+                break
+            self._pending.popitem(last=False)
+            call.future.cancel()
+            logging.debug(f"调用 {echo} 超时未收到回调，已丢弃")
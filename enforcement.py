@@ -0,0 +1,95 @@
+"""
+对在群里发言的待验证用户的处理
+
+待验证用户的每条群消息都会被撤回，但重新禁言和发送提醒在 REMIND_WINDOW 内对同一用户只做一次。
+撤回不逐条立即发出，而是在 RECALL_BATCH_DELAY 内收集后作为一批并发发出（OneBot 没有批量撤回的接口，
+每条消息仍是一次 delete_msg 调用），刷屏 N 条消息的开销是 N 次撤回加每个窗口一次禁言和一次提醒。
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.api import delete_msg
+from app.scripts.GroupEntryVerification.state_machine import run_bounded
+
+# 同一用户重新禁言和提醒的最短间隔（秒）
+REMIND_WINDOW = 60
+# 收集待撤回消息的时间（秒）
+RECALL_BATCH_DELAY = 0.5
+# 同时进行的撤回调用数
+RECALL_CONCURRENCY = 10
+# 提醒记录超过这个数量时清理已过期的记录
+MAX_REMIND_ENTRIES = 4096
+
+
+class PendingMessageEnforcer:
+    """合并待验证用户刷屏时的撤回、禁言和提醒"""
+
+    def __init__(self, window=REMIND_WINDOW, recall_delay=RECALL_BATCH_DELAY):
+        """
+        参数:
+            window (float): 同一用户重新禁言和提醒的最短间隔（秒）
+            recall_delay (float): 收集待撤回消息的时间（秒）
+        """
+        self.window = window
+        self.recall_delay = recall_delay
+        # (群号, QQ号) -> 上次禁言和提醒的时间
+        self._reminded = {}
+        # 待撤回的 (websocket, message_id)
+        self._recalls = []
+        self._flush_task = None
+
+    def should_remind(self, group_id, user_id):
+        """
+        判断是否需要重新禁言和提醒，需要时同时记录本次提醒的时间
+
+        返回:
+            bool: 距离上次提醒超过时间窗口时返回 True
+        """
+        now = time.monotonic()
+        key = (str(group_id), str(user_id))
+        last = self._reminded.get(key)
+        if last is not None and now - last < self.window:
+            return False
+        if len(self._reminded) >= MAX_REMIND_ENTRIES:
+            self._reminded = {
+                k: t for k, t in self._reminded.items() if now - t < self.window
+            }
+        self._reminded[key] = now
+        return True
+
+    def recall(self, websocket, message_id):
+        """把消息加入下一批撤回"""
+        self._recalls.append((websocket, message_id))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.recall_delay)
+        await self.flush()
+
+    async def flush(self):
+        """立即发出所有待撤回的消息"""
+        batch, self._recalls = self._recalls, []
+        self._flush_task = None
+        if not batch:
+            return
+        errors = await run_bounded(
+            [
+                lambda websocket=websocket, message_id=message_id: delete_msg(
+                    websocket, message_id
+                )
+                for websocket, message_id in batch
+            ],
+            RECALL_CONCURRENCY,
+        )
+        failed = sum(1 for error in errors if error is not None)
+        if failed:
+            logging.error(f"撤回待验证用户的消息：{len(batch)} 条中 {failed} 条失败")
@@ -0,0 +1,157 @@
+"""
+验证记录的流式导出
+
+从存储中逐条读取 user_verification 的记录（store.iter_records），按群、状态和入群时间过滤后
+写入 CSV 或 JSONL 文件，文件名以 .gz 结尾时用 gzip 压缩。内存占用只与单个群的记录数有关，
+与导出的总数无关；读取、格式化、压缩和写文件都在线程中进行，导出期间验证照常处理。
+导出先写入临时文件，完成后再改名，导出目录中不会出现写了一半的文件。
+
+导出的是导出时存储中的验证记录，每个用户在每个群最多一条，状态为最后一次转换的结果，
+不是验证历史：用户退群时记录被删除，不会出现在导出中；同一用户重新入群后只有最新的一次。
+各群的历史计数见 stats.py（验证统计命令），每次验证的过程见 tracing.py 写入的追踪日志。
+
+每条记录导出的字段见 EXPORT_FIELDS，joined_time 为本地时间，入群时间未知时为空。
+"""
+
+import os
+import sys
+import csv
+import gzip
+import json
+import time
+import asyncio
+import logging
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.records import VerificationRecord
+from app.scripts.GroupEntryVerification.store import (
+    DATA_DIR,
+    USER_VERIFICATION,
+    get_store,
+)
+
+# 导出文件目录
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+# 支持的导出格式
+EXPORT_FORMATS = ("csv", "jsonl")
+# 导出的字段
+EXPORT_FIELDS = (
+    "group_id",
+    "user_id",
+    "status",
+    "remaining_attempts",
+    "joined_at",
+    "joined_time",
+)
+
+
+def export_path(fmt, compress=False, group_id=None, now=None):
+    """导出文件的路径：EXPORT_DIR/verification-{群号|all}-{时间}.{格式}[.gz]"""
+    now = time.time() if now is None else now
+    scope = "all" if group_id is None else str(group_id)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+    name = f"verification-{scope}-{stamp}.{fmt}"
+    return os.path.join(EXPORT_DIR, name + ".gz" if compress else name)
+
+
+def export_row(key, value, statuses=None, since=None, until=None):
+    """
+    把一条验证记录转换为导出的一行，不满足过滤条件时返回 None
+
+    参数:
+        statuses (set): 只导出这些状态（records.Status），为空时不过滤
+        since (float): 只导出入群时间不早于该时间戳的记录
+        until (float): 只导出入群时间早于该时间戳的记录
+
+    返回:
+        dict: 字段见 EXPORT_FIELDS
+    """
+    try:
+        record = VerificationRecord.from_dict(key, value)
+    except (ValueError, KeyError, AttributeError) as e:
+        logging.warning(f"导出时跳过无法解析的验证记录 {key}: {e}")
+        return None
+    if statuses and record.status not in statuses:
+        return None
+    if since is not None and record.joined_at < since:
+        return None
+    if until is not None and record.joined_at >= until:
+        return None
+    return {
+        "group_id": record.group_id,
+        "user_id": record.user_id,
+        "status": record.status.label,
+        "remaining_attempts": record.remaining_attempts,
+        "joined_at": record.joined_at,
+        "joined_time": (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.joined_at))
+            if record.joined_at
+            else ""
+        ),
+    }
+
+
+def _open_output(path, compress):
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+async def export_records(
+    path, fmt="csv", group_id=None, statuses=None, since=None, until=None, store=None
+):
+    """
+    在线程中把验证记录导出到文件，参数同 write_export
+
+    返回:
+        int: 导出的记录数
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    store = get_store() if store is None else store
+    return await asyncio.to_thread(
+        write_export, path, fmt, group_id, statuses, since, until, store
+    )
+
+
+def write_export(path, fmt, group_id, statuses, since, until, store):
+    """
+    把验证记录导出到文件，过滤参数同 export_row
+
+    参数:
+        path (str): 导出文件路径，以 .gz 结尾时压缩
+        fmt (str): "csv" 或 "jsonl"
+        group_id: 只导出该群，为 None 时导出所有群
+        store: 读取记录的存储
+
+    返回:
+        int: 导出的记录数
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    count = 0
+    try:
+        with _open_output(tmp_path, path.endswith(".gz")) as f:
+            if fmt == "csv":
+                writer = csv.DictWriter(f, EXPORT_FIELDS)
+                writer.writeheader()
+                write = writer.writerow
+            else:
+                write = lambda row: f.write(
+                    json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n"
+                )
+            for key, value in store.iter_records(USER_VERIFICATION, group_id):
+                row = export_row(key, value, statuses, since, until)
+                if row is not None:
+                    write(row)
+                    count += 1
+        os.replace(tmp_path, path)
+    except BaseException:
+        # 出错时不留下临时文件
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
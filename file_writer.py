@@ -0,0 +1,139 @@
+"""
+后台写文件
+
+存储的修改先在内存中生效，序列化和写盘交给后台线程，事件循环不再等待 json.dump 和磁盘。
+同一个文件的写入按提交顺序进行，同一时间最多一个线程在写；
+前一次写入还没完成时提交的新内容会取代排队中的旧内容，只写最后一次。
+"""
+
+import time
+import atexit
+import logging
+import threading
+
+# 后台写文件的线程数
+FILE_WRITER_THREADS = 4
+
+
+class _Job:
+    __slots__ = ("data", "write", "on_done")
+
+    def __init__(self, data, write, on_done):
+        self.data = data
+        self.write = write
+        self.on_done = on_done
+
+
+class OrderedFileWriter:
+    """按文件排序的后台写入"""
+
+    def __init__(self, max_workers=FILE_WRITER_THREADS):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # 路径 -> 正在写入的任务 / 排队中的任务（每个路径最多一个）
+        self._running = {}
+        self._queued = {}
+        # 等待空闲线程的路径，按提交顺序
+        self._ready = []
+        self._threads = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_write_seconds = 0.0
+        atexit.register(self.flush)
+
+    def submit(self, path, data, write, on_done=None):
+        """
+        提交一次写入
+
+        参数:
+            path (str): 文件路径，同一路径的写入按顺序进行
+            data: 要写入的内容，提交后调用方不能再修改
+            write (callable): 在后台线程中调用 write(data)，返回值传给 on_done
+            on_done (callable): 写入成功后在后台线程中调用
+        """
+        with self._lock:
+            if path in self._queued:
+                self.coalesced += 1
+            self._queued[path] = _Job(data, write, on_done)
+            if path in self._running or path in self._ready:
+                return
+            self._ready.append(path)
+            if self._threads < self.max_workers:
+                self._threads += 1
+                threading.Thread(
+                    target=self._work, name="GroupEntryVerification-writer", daemon=True
+                ).start()
+
+    def pending(self, path):
+        """
+        尚未写入磁盘的最新内容
+
+        返回:
+            (bool, 内容): 没有未完成的写入时返回 (False, None)
+        """
+        with self._lock:
+            job = self._queued.get(path) or self._running.get(path)
+            return (False, None) if job is None else (True, job.data)
+
+    def pending_items(self):
+        """
+        所有尚未写入磁盘的最新内容
+
+        返回:
+            dict: 路径 -> 内容
+        """
+        with self._lock:
+            items = {path: job.data for path, job in self._running.items()}
+            items.update((path, job.data) for path, job in self._queued.items())
+            return items
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if not self._ready:
+                    self._threads -= 1
+                    self._idle.notify_all()
+                    return
+                path = self._ready.pop(0)
+                job = self._running[path] = self._queued.pop(path)
+            start = time.perf_counter()
+            try:
+                result = job.write(job.data)
+                if job.on_done is not None:
+                    job.on_done(result)
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"写入 {path} 失败: {e}")
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.writes += 1
+                self.max_write_seconds = max(self.max_write_seconds, elapsed)
+                del self._running[path]
+                # 写入期间又提交了新内容，排到队尾，避免一个频繁写入的文件占住线程
+                if path in self._queued:
+                    self._ready.append(path)
+                self._idle.notify_all()
+
+    def flush(self, timeout=None):
+        """等待所有已提交的写入完成，返回是否全部完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._queued or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stats(self):
+        """写入统计"""
+        with self._lock:
+            return {
+                "writes": self.writes,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "pending": len(self._queued) + len(self._running),
+                "max_write_ms": round(self.max_write_seconds * 1000, 1),
+            }
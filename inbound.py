@@ -0,0 +1,214 @@
+"""
+入站事件的优先级队列
+
+事件先按类别进入一个有容量上限的优先级队列，由固定数量的工作协程按优先级取出处理，
+submit 在事件处理完成（或被丢弃）时返回，调用方的行为与直接调用处理函数一致。
+优先级从高到低：
+    PRIORITY_NOTICE       入群、退群通知和加群申请
+    PRIORITY_ANSWER       用户私聊回答
+    PRIORITY_ADMIN        管理员命令
+    PRIORITY_ENFORCEMENT  对在群里发言的待验证用户的提醒（撤回和禁言在入队前完成，不会被丢弃）
+过载时的降级：
+    - 队列深度达到 INBOUND_DEGRADE_DEPTH 后，最低优先级的新事件直接丢弃；
+    - 最低优先级的事件排队超过 INBOUND_MAX_WAIT 秒后，取出时丢弃，不再处理；
+    - 队列已满时丢弃队列中优先级最低、最晚进入的事件，新事件的优先级不高于它时丢弃新事件。
+回调事件和元事件不经过队列，避免等待回调的处理函数占住所有工作协程后无法收到回调。
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+from collections import deque
+
+PRIORITY_NOTICE = 0
+PRIORITY_ANSWER = 1
+PRIORITY_ADMIN = 2
+PRIORITY_ENFORCEMENT = 3
+PRIORITY_NAMES = {
+    PRIORITY_NOTICE: "notice",
+    PRIORITY_ANSWER: "answer",
+    PRIORITY_ADMIN: "admin",
+    PRIORITY_ENFORCEMENT: "enforcement",
+}
+
+# 队列容量
+INBOUND_QUEUE_SIZE = 2000
+# 同时处理事件的工作协程数
+INBOUND_WORKERS = 16
+# 队列深度达到这个值后丢弃最低优先级的新事件
+INBOUND_DEGRADE_DEPTH = 200
+# 最低优先级的事件最长排队时间（秒）
+INBOUND_MAX_WAIT = 5.0
+# 每个优先级保留的等待时间样本数
+INBOUND_WAIT_SAMPLES = 1000
+
+
+class _Item:
+    __slots__ = ("priority", "seq", "enqueued_at", "job", "future", "removed")
+
+    def __init__(self, priority, seq, job, future):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.job = job
+        self.future = future
+        self.removed = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class InboundQueue:
+    """有容量上限、按优先级处理并在过载时丢弃低优先级事件的队列"""
+
+    def __init__(
+        self,
+        workers=INBOUND_WORKERS,
+        capacity=INBOUND_QUEUE_SIZE,
+        degrade_depth=INBOUND_DEGRADE_DEPTH,
+        max_wait=INBOUND_MAX_WAIT,
+    ):
+        """
+        参数:
+            workers (int): 工作协程数
+            capacity (int): 队列容量
+            degrade_depth (int): 开始丢弃最低优先级新事件的队列深度
+            max_wait (float): 最低优先级事件的最长排队时间（秒）
+        """
+        self.workers = workers
+        self.capacity = capacity
+        self.degrade_depth = degrade_depth
+        self.max_wait = max_wait
+        self._heap = []
+        self._depth = 0
+        self._seq = 0
+        self._loop = None
+        self._ready = None
+        self._tasks = []
+        self._overloaded = False
+        self.max_depth = 0
+        self.processed = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.shed = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._waits = {
+            priority: deque(maxlen=INBOUND_WAIT_SAMPLES) for priority in PRIORITY_NAMES
+        }
+
+    def __len__(self):
+        return self._depth
+
+    def _start(self):
+        # 每个事件循环各自启动工作协程，事件循环更换时丢弃旧的队列
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._heap = []
+        self._depth = 0
+        self._ready = asyncio.Semaphore(0)
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def submit(self, priority, job):
+        """
+        把事件放入队列并等待处理完成
+
+        参数:
+            priority (int): 优先级，数值越小越先处理
+            job (callable): 无参数的异步函数
+
+        返回:
+            bool: 事件被处理时返回 True，被丢弃时返回 False；处理函数抛出的异常会传给调用方
+        """
+        self._start()
+        lowest = max(PRIORITY_NAMES)
+        if priority >= lowest and self._depth >= self.degrade_depth:
+            self._shed(priority, "队列积压")
+            return False
+        if self._depth >= self.capacity:
+            victim = max(
+                (item for item in self._heap if not item.removed), default=None
+            )
+            if victim is None or victim.priority <= priority:
+                self._shed(priority, "队列已满")
+                return False
+            self._remove(victim, "队列已满")
+
+        self._seq += 1
+        item = _Item(priority, self._seq, job, self._loop.create_future())
+        heapq.heappush(self._heap, item)
+        self._depth += 1
+        self.max_depth = max(self.max_depth, self._depth)
+        self._ready.release()
+        return await item.future
+
+    def _remove(self, item, reason):
+        item.removed = True
+        self._depth -= 1
+        self._shed(item.priority, reason)
+        if not item.future.done():
+            item.future.set_result(False)
+
+    def _shed(self, priority, reason):
+        self.shed[priority] += 1
+        if not self._overloaded:
+            self._overloaded = True
+            logging.warning(
+                f"GroupEntryVerification入站事件过载（{reason}，队列深度 {self._depth}），"
+                f"开始丢弃低优先级事件"
+            )
+
+    async def _work(self):
+        lowest = max(PRIORITY_NAMES)
+        while True:
+            await self._ready.acquire()
+            if not self._heap:
+                continue
+            item = heapq.heappop(self._heap)
+            if item.removed:
+                continue
+            self._depth -= 1
+            waited = time.monotonic() - item.enqueued_at
+            if item.priority >= lowest and waited > self.max_wait:
+                self._shed(item.priority, "排队超时")
+                item.future.set_result(False)
+                continue
+            self._waits[item.priority].append(waited)
+            if self._overloaded and self._depth == 0:
+                self._overloaded = False
+                logging.info("GroupEntryVerification入站事件队列已清空，恢复正常处理")
+            try:
+                await item.job()
+            except Exception as e:
+                if not item.future.done():
+                    item.future.set_exception(e)
+                continue
+            finally:
+                self.processed[item.priority] += 1
+            if not item.future.done():
+                item.future.set_result(True)
+
+    def stats(self):
+        """队列深度、各优先级的等待时间（毫秒）和丢弃数"""
+        waits = {}
+        for priority, samples in self._waits.items():
+            samples = sorted(samples)
+            if samples:
+                waits[PRIORITY_NAMES[priority]] = {
+                    "p50_ms": round(samples[len(samples) // 2] * 1000, 1),
+                    "p99_ms": round(
+                        samples[min(int(len(samples) * 0.99), len(samples) - 1)] * 1000,
+                        1,
+                    ),
+                }
+        return {
+            "depth": self._depth,
+            "max_depth": self.max_depth,
+            "wait": waits,
+            "processed": {
+                PRIORITY_NAMES[priority]: count
+                for priority, count in self.processed.items()
+            },
+            "shed": {
+                PRIORITY_NAMES[priority]: count for priority, count in self.shed.items()
+            },
+        }
@@ -0,0 +1,606 @@
+"""
+二进制快照加日志的验证数据存储
+
+所有数据常驻内存，磁盘上保存为：
+    journal/snapshot.bin   某一代的完整数据快照
+    journal/journal.bin    这一代快照之后的每次修改（预写日志），启动时在快照上重放
+
+每个群的数据在快照中单独编码，启动时只读入快照并校验，第一次访问某个群时才解码。
+每次 update / update_many / update_tables 在修改内存之前先向日志追加一条记录，记录的是修改后的值
+（None 表示删除），因此重放是幂等的；update_tables 涉及的所有表写在同一条记录中。日志超过 JOURNAL_COMPACT_BYTES 时写入新一代快照，
+旧的快照和日志保留为 .prev，当前快照损坏时可以从上一代快照加两代日志恢复。
+
+快照和每条日志都带有 CRC32 校验，日志末尾写了一半的记录会被截掉，中途损坏的日志会另存一份后截断，
+不会像 JSON 文件损坏时那样悄悄丢掉所有数据。
+编码优先使用 msgpack（需要安装），未安装时使用标准库 marshal；文件头记录了使用的编码。
+
+所有数据只在一个进程中维护，不能与分片模式或其他进程共用同一个数据目录。
+"""
+
+import gc
+import os
+import sys
+import time
+import zlib
+import struct
+import shutil
+import marshal
+import logging
+import threading
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.store import (
+    DATA_DIR,
+    TABLES,
+    USER_VERIFICATION,
+    USER_INDEX_BUCKETS,
+    GroupShardStore,
+    group_of,
+    user_of,
+    notify_listeners,
+)
+
+# 日志超过这个大小（字节）时写入新一代快照
+JOURNAL_COMPACT_BYTES = 8 * 1024 * 1024
+# 每条日志写入后是否 fsync，关闭时只能在进程崩溃（而不是断电）后恢复
+JOURNAL_FSYNC = False
+
+SNAPSHOT_MAGIC = b"GEVSNAP1"
+JOURNAL_MAGIC = b"GEVJRNL1"
+# 文件头：魔数、编码、代数
+_FILE_HEADER = struct.Struct("<8sBQ")
+# 快照正文头：长度、CRC32
+_SNAPSHOT_HEADER = struct.Struct("<QI")
+# 日志记录头：长度、CRC32
+_ENTRY_HEADER = struct.Struct("<II")
+
+CODEC_MARSHAL = 1
+CODEC_MSGPACK = 2
+
+
+class CorruptFileError(Exception):
+    """快照或日志文件损坏"""
+
+
+def _default_codec():
+    return CODEC_MSGPACK if msgpack is not None else CODEC_MARSHAL
+
+
+def _encode(codec, obj):
+    if codec == CODEC_MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True)
+    return marshal.dumps(obj)
+
+
+def _decode(codec, data):
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise CorruptFileError("文件使用 msgpack 编码，但未安装 msgpack")
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    if codec == CODEC_MARSHAL:
+        return marshal.loads(data)
+    raise CorruptFileError(f"未知的编码: {codec}")
+
+
+def _copy(obj):
+    # 记录都是 JSON 类型的数据，用 marshal 往返复制比 copy.deepcopy 快得多
+    return marshal.loads(marshal.dumps(obj))
+
+
+def _read_header(f, magic):
+    header = f.read(_FILE_HEADER.size)
+    if len(header) < _FILE_HEADER.size:
+        raise CorruptFileError("文件头不完整")
+    file_magic, codec, generation = _FILE_HEADER.unpack(header)
+    if file_magic != magic:
+        raise CorruptFileError("文件类型不匹配")
+    return codec, generation
+
+
+def _fsync_dir(path):
+    if fcntl is None:
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_snapshot(path):
+    """
+    读取快照
+
+    返回:
+        (代数, 编码, 数据)
+    """
+    with open(path, "rb") as f:
+        codec, generation = _read_header(f, SNAPSHOT_MAGIC)
+        header = f.read(_SNAPSHOT_HEADER.size)
+        if len(header) < _SNAPSHOT_HEADER.size:
+            raise CorruptFileError("快照不完整")
+        length, checksum = _SNAPSHOT_HEADER.unpack(header)
+        payload = f.read(length)
+    if len(payload) < length or zlib.crc32(payload) != checksum:
+        raise CorruptFileError("快照校验失败")
+    return generation, codec, _decode(codec, payload)
+
+
+def write_snapshot(path, generation, data, codec=None):
+    """原子地写入快照"""
+    codec = codec or _default_codec()
+    payload = _encode(codec, data)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_FILE_HEADER.pack(SNAPSHOT_MAGIC, codec, generation))
+        f.write(_SNAPSHOT_HEADER.pack(len(payload), zlib.crc32(payload)))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_journal(path):
+    """
+    读取日志
+
+    返回:
+        (代数, 编码, 日志记录列表, 最后一条完整记录的结束位置, 是否在中途遇到损坏)
+    """
+    entries = []
+    with open(path, "rb") as f:
+        codec, generation = _read_header(f, JOURNAL_MAGIC)
+        end = f.tell()
+        corrupt = False
+        while True:
+            header = f.read(_ENTRY_HEADER.size)
+            if not header:
+                break
+            if len(header) < _ENTRY_HEADER.size:
+                break
+            length, checksum = _ENTRY_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                # 写了一半的最后一条记录
+                break
+            if zlib.crc32(payload) != checksum:
+                corrupt = True
+                break
+            entries.append(_decode(codec, payload))
+            end = f.tell()
+        if not corrupt and f.read(1):
+            corrupt = True
+    return generation, codec, entries, end, corrupt
+
+
+def _entry_tables(entry):
+    """一条日志涉及的 [表名, 修改] 列表"""
+    table, changes = entry
+    return changes if table is None else [entry]
+
+
+def _try_lock(f):
+    """获取进程独占的文件锁，已被其他进程持有时返回 False"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+class _LazyPartitions:
+    """按名称分区的数据，每个分区单独编码，第一次访问时才解码"""
+
+    def __init__(self, codec, encoded=None):
+        self.codec = codec
+        self._parts = dict(encoded or {})
+
+    def names(self):
+        return list(self._parts)
+
+    def get(self, name):
+        """获取分区，不存在时返回 None"""
+        part = self._parts.get(name)
+        if isinstance(part, bytes):
+            part = self._parts[name] = _decode(self.codec, part)
+        return part
+
+    def setdefault(self, name):
+        part = self.get(name)
+        if part is None:
+            part = self._parts[name] = {}
+        return part
+
+    def discard_if_empty(self, name):
+        if self._parts.get(name) == {}:
+            del self._parts[name]
+
+    def encoded(self, codec):
+        """所有分区的编码结果，未解码过的分区直接使用原来的编码"""
+        result = {}
+        for name, part in self._parts.items():
+            if isinstance(part, bytes) and codec != self.codec:
+                part = _decode(self.codec, part)
+            result[name] = part if isinstance(part, bytes) else _encode(codec, part)
+        return result
+
+
+class JournalStore:
+    """
+    二进制快照加日志的存储，接口与 store.JsonFileStore 相同
+
+    快照的内容为：
+        {"groups": {群号: 编码后的 {表名: {记录键: 记录}}},
+         "users": {分桶: 编码后的 {user_id: [group_id, ...]}}}
+    "users" 是 user_verification 的用户索引。每个群和每个分桶单独编码，
+    启动时只需读入快照并校验，群的数据在第一次访问时才解码；写入快照时未访问过的群直接沿用原来的编码。
+    """
+
+    def __init__(
+        self,
+        data_dir=DATA_DIR,
+        compact_bytes=JOURNAL_COMPACT_BYTES,
+        import_existing=True,
+    ):
+        """
+        参数:
+            data_dir (str): 数据目录
+            compact_bytes (int): 日志超过这个大小（字节）时写入新一代快照
+            import_existing (bool): 首次启动时是否自动导入按群分片或旧的整表 JSON 数据
+        """
+        self.data_dir = data_dir
+        self.import_existing = import_existing
+        self.directory = os.path.join(data_dir, "journal")
+        self.compact_bytes = compact_bytes
+        self.snapshot_path = os.path.join(self.directory, "snapshot.bin")
+        self.journal_path = os.path.join(self.directory, "journal.bin")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._lock_file = open(os.path.join(self.directory, "journal.lock"), "a+b")
+        if not _try_lock(self._lock_file):
+            self._lock_file.close()
+            raise RuntimeError(
+                f"{self.directory} 正被其他进程使用，JournalStore 只能由一个进程打开"
+            )
+
+        self._codec = _default_codec()
+        self._groups = _LazyPartitions(self._codec)
+        self._users = _LazyPartitions(self._codec)
+        self._generation = 0
+        self._journal = None
+        # 恢复过程中会创建大量容器对象，暂停垃圾回收避免反复触发
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._recover()
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def close(self):
+        """关闭日志文件并释放进程锁"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self._lock_file.close()
+
+    # 启动与恢复
+
+    def _recover(self):
+        """从快照和日志恢复数据"""
+        snapshots = [self.snapshot_path, self.snapshot_path + ".prev"]
+        journals = {}
+        for path in [self.journal_path + ".prev", self.journal_path]:
+            if not os.path.exists(path):
+                continue
+            try:
+                journals[path] = read_journal(path)
+            except CorruptFileError as e:
+                logging.error(f"日志 {path} 无法读取: {e}")
+
+        base = None
+        for path in snapshots:
+            if not os.path.exists(path):
+                continue
+            try:
+                base = read_snapshot(path)
+                break
+            except Exception as e:
+                logging.error(f"快照 {path} 损坏，尝试上一代快照: {e}")
+
+        if base is None:
+            if any(os.path.exists(path) for path in snapshots):
+                logging.error("所有快照都已损坏，只能从日志恢复")
+                base = (min((j[0] for j in journals.values()), default=0), None, {})
+            elif not journals:
+                self._import_existing_data()
+                return
+            else:
+                base = (0, None, {})
+
+        generation, codec, data = base
+        base_generation = generation
+        self._groups = _LazyPartitions(codec or self._codec, data.get("groups"))
+        self._users = _LazyPartitions(codec or self._codec, data.get("users"))
+
+        # 从快照的代数开始，依次重放这一代及之后各代的日志
+        needs_compaction = False
+        replayed = 0
+        for journal_generation, codec, entries, end, corrupt in sorted(
+            journals.values(), key=lambda journal: journal[0]
+        ):
+            if journal_generation < generation:
+                continue
+            for entry in entries:
+                for table, changes in _entry_tables(entry):
+                    self._apply(table, changes)
+            replayed += len(entries)
+            generation = journal_generation
+            if corrupt:
+                needs_compaction = True
+                logging.error(
+                    f"第 {journal_generation} 代日志中途损坏，已恢复到最后一条完整的记录"
+                )
+            if codec != self._codec:
+                needs_compaction = True
+        self._generation = generation
+        logging.info(f"已从第 {base_generation} 代快照和 {replayed} 条日志恢复验证数据")
+
+        current = journals.get(self.journal_path)
+        if (
+            needs_compaction
+            or current is None
+            or current[0] != generation
+            or current[4]
+        ):
+            if current is not None and current[4]:
+                backup = f"{self.journal_path}.corrupt-{int(time.time())}"
+                shutil.copyfile(self.journal_path, backup)
+                logging.error(f"已将损坏的日志另存为 {backup}")
+            self._compact()
+            return
+
+        # 截掉末尾写了一半的记录，继续追加
+        with open(self.journal_path, "r+b") as f:
+            f.truncate(current[3])
+        self._journal = open(self.journal_path, "ab")
+
+    def _import_existing_data(self):
+        """首次启动时导入按群分片或旧的整表 JSON 数据，原文件保持不变"""
+        self._compact()
+        if not self.import_existing:
+            return
+        if os.path.isdir(os.path.join(self.data_dir, "groups")):
+            source = GroupShardStore(self.data_dir, import_legacy=False)
+            for table in TABLES:
+                data = source.load(table)
+                if data:
+                    self.update_many(
+                        table, {key: (lambda _, v=v: v) for key, v in data.items()}
+                    )
+                    logging.info(f"已将 {table} 的 {len(data)} 条记录导入快照存储")
+        else:
+            from app.scripts.GroupEntryVerification.migrate import (
+                import_legacy_tables,
+            )
+
+            import_legacy_tables(self, self.data_dir)
+        self._compact()
+
+    # 内存中的修改
+
+    @staticmethod
+    def _bucket(user_id):
+        return str(zlib.crc32(str(user_id).encode("utf-8")) % USER_INDEX_BUCKETS)
+
+    def _records(self, table, group_id):
+        group = self._groups.get(group_id)
+        return group.get(table, {}) if group else {}
+
+    def _apply(self, table, changes):
+        for key, value in changes:
+            group_id = group_of(table, key)
+            if value is None:
+                group = self._groups.get(group_id)
+                records = group.get(table) if group else None
+                if records is None or records.pop(key, None) is None:
+                    continue
+                if not records:
+                    del group[table]
+                self._groups.discard_if_empty(group_id)
+                if table == USER_VERIFICATION:
+                    self._index_user(user_of(table, key), group_id, False)
+            else:
+                records = self._groups.setdefault(group_id).setdefault(table, {})
+                if key not in records and table == USER_VERIFICATION:
+                    self._index_user(user_of(table, key), group_id, True)
+                records[key] = value
+
+    def _index_user(self, user_id, group_id, present):
+        bucket = self._bucket(user_id)
+        index = self._users.setdefault(bucket)
+        group_ids = index.setdefault(user_id, [])
+        if present and group_id not in group_ids:
+            group_ids.append(group_id)
+        elif not present and group_id in group_ids:
+            group_ids.remove(group_id)
+        if not group_ids:
+            del index[user_id]
+        self._users.discard_if_empty(bucket)
+
+    # 快照与日志
+
+    def _append(self, batch):
+        # 只涉及一张表时写成 [表名, 修改]，涉及多张表时写成 [None, [[表名, 修改], ...]]
+        entry = batch[0] if len(batch) == 1 else [None, batch]
+        payload = _encode(self._codec, entry)
+        self._journal.write(_ENTRY_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._journal.write(payload)
+        self._journal.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(self._journal.fileno())
+
+    def _compact(self):
+        """写入新一代快照，当前的快照和日志保留为 .prev"""
+        with self._lock:
+            generation = self._generation + 1
+            tmp_path = self.snapshot_path + ".new"
+            write_snapshot(
+                tmp_path,
+                generation,
+                {
+                    "groups": self._groups.encoded(self._codec),
+                    "users": self._users.encoded(self._codec),
+                },
+                self._codec,
+            )
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self.snapshot_path):
+                os.replace(self.snapshot_path, self.snapshot_path + ".prev")
+            if os.path.exists(self.journal_path):
+                os.replace(self.journal_path, self.journal_path + ".prev")
+            os.replace(tmp_path, self.snapshot_path)
+
+            journal_tmp = self.journal_path + ".new"
+            with open(journal_tmp, "wb") as f:
+                f.write(_FILE_HEADER.pack(JOURNAL_MAGIC, self._codec, generation))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(journal_tmp, self.journal_path)
+            _fsync_dir(self.directory)
+            self._journal = open(self.journal_path, "ab")
+            self._generation = generation
+
+    def snapshot(self):
+        """立即写入新一代快照"""
+        self._compact()
+
+    # 存储接口
+
+    def load(self, table):
+        """读取整张表（需要解码所有群的数据）"""
+        with self._lock:
+            records = {}
+            for group_id in self._groups.names():
+                records.update(self._records(table, group_id))
+            return _copy(records)
+
+    def load_group(self, table, group_id):
+        """读取表中属于某个群的记录"""
+        with self._lock:
+            return _copy(self._records(table, str(group_id)))
+
+    def user_records(self, table, user_id):
+        """通过用户索引读取表中属于某个用户的记录"""
+        user_id = str(user_id)
+        with self._lock:
+            index = self._users.get(self._bucket(user_id)) or {}
+            records = {}
+            for group_id in index.get(user_id, []):
+                key = f"{user_id}_{group_id}"
+                value = self._records(table, group_id).get(key)
+                if value is not None:
+                    records[key] = _copy(value)
+            return records
+
+    def iter_records(self, table, group_id=None):
+        """
+        逐个群读取表中的记录，每次只复制一个群的数据，group_id 不为 None 时只读取该群
+
+        产生:
+            (记录键, 记录)
+        """
+        with self._lock:
+            group_ids = self._groups.names() if group_id is None else [str(group_id)]
+        for name in group_ids:
+            with self._lock:
+                records = _copy(self._records(table, name))
+            yield from records.items()
+
+    def save(self, table, data):
+        """覆盖整张表"""
+        with self._lock:
+            funcs = {key: (lambda _: None) for key in self.load(table)}
+            funcs.update({key: (lambda _, v=value: v) for key, value in data.items()})
+            self.update_many(table, funcs)
+
+    def get(self, table, key, default=None):
+        """读取单条记录"""
+        with self._lock:
+            value = self._records(table, group_of(table, key)).get(key)
+            return default if value is None else _copy(value)
+
+    def set(self, table, key, value):
+        """写入单条记录"""
+        self.update(table, key, lambda _: value)
+
+    def delete(self, table, key):
+        """删除单条记录"""
+        self.update(table, key, lambda _: None)
+
+    def update(self, table, key, func):
+        """原子地修改单条记录，修改函数的约定同 JsonFileStore.update"""
+        return self.update_many(table, {key: func})[key]
+
+    def update_many(self, table, funcs):
+        """在一条日志中原子地修改多条记录"""
+        if not funcs:
+            return {}
+        return self.update_tables({table: funcs})[table]
+
+    def update_tables(self, tables):
+        """
+        在一条日志中原子地修改多张表的记录
+
+        按 tables 的顺序依次调用各表的修改函数，约定同 JsonFileStore.update_tables
+        """
+        results = {}
+        previous = {}
+        with self._lock:
+            batch = []
+            for table, funcs in tables.items():
+                table_results = results[table] = {}
+                table_previous = previous[table] = {}
+                changes = []
+                for key, func in funcs.items():
+                    old = self._records(table, group_of(table, key)).get(key)
+                    new = func(_copy(old))
+                    table_results[key] = new
+                    table_previous[key] = old
+                    if new is None and old is None:
+                        continue
+                    changes.append([key, new])
+                if changes:
+                    batch.append([table, changes])
+            if batch:
+                # 先写日志再修改内存，内存中保存副本，调用方之后修改返回值不会影响存储
+                self._append(batch)
+                for table, changes in _copy(batch):
+                    self._apply(table, changes)
+                if self._journal.tell() >= self.compact_bytes:
+                    self._compact()
+        for table, changes in results.items():
+            notify_listeners(table, changes, previous[table])
+        return results
@@ -0,0 +1,65 @@
+"""
+事件循环延迟监测
+
+后台任务每隔 LOOP_LAG_INTERVAL 秒休眠一次，实际醒来的时间比预定时间晚多少就是这段时间内
+事件循环被阻塞的时长。最近 LOOP_LAG_SAMPLES 个样本用于计算分位数，超过 LOOP_LAG_WARN 时记录日志。
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+
+# 采样间隔（秒）
+LOOP_LAG_INTERVAL = 0.1
+# 保留的样本数
+LOOP_LAG_SAMPLES = 3000
+# 延迟超过这个值（秒）时记录警告日志
+LOOP_LAG_WARN = 0.2
+
+
+class LoopLagMonitor:
+    """测量事件循环的调度延迟"""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, samples=LOOP_LAG_SAMPLES):
+        self.interval = interval
+        self._samples = deque(maxlen=samples)
+        self._task = None
+        self.max_lag = 0.0
+
+    def start(self):
+        """在当前事件循环中开始采样，已经开始时不做处理"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - expected, 0.0)
+            self._samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > LOOP_LAG_WARN:
+                logging.warning(f"事件循环被阻塞了 {lag * 1000:.0f} ms")
+
+    def percentile(self, p):
+        """最近样本的 p 分位数（秒），没有样本时返回 0"""
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
+
+    def stats(self):
+        """延迟统计（毫秒）"""
+        return {
+            "samples": len(self._samples),
+            "p50_ms": round(self.percentile(50) * 1000, 1),
+            "p99_ms": round(self.percentile(99) * 1000, 1),
+            "max_ms": round(self.max_lag * 1000, 1),
+        }
@@ -3,9 +3,9 @@
 import logging
 import os
 import sys
-import json
 import random
 import time
+import re
 import operator
 import asyncio
 
@@ -18,7 +18,71 @@ from app.config import *
 from app.api import *
 from app.switch import load_switch, save_switch
 from app.scripts.GroupEntryVerification.del_message import DelMessage
-from app.scripts.GroupEntryVerification.scan import ScanVerification
+from app.scripts.GroupEntryVerification.scan import ScanVerification, MAX_WARNING_COUNT
+from app.scripts.GroupEntryVerification.pending_index import (
+    PendingIndex,
+    SORT_KEYS,
+    DEFAULT_SORT,
+)
+from app.scripts.GroupEntryVerification.echo_registry import EchoRegistry
+from app.scripts.GroupEntryVerification.dedup import EventDeduplicator
+from app.scripts.GroupEntryVerification.enforcement import PendingMessageEnforcer
+from app.scripts.GroupEntryVerification.rate_limit import PrivateMessageGate
+from app.scripts.GroupEntryVerification.loop_monitor import LoopLagMonitor
+from app.scripts.GroupEntryVerification.message_sweep import MessageSweeper
+from app.scripts.GroupEntryVerification.inbound import (
+    InboundQueue,
+    PRIORITY_NOTICE,
+    PRIORITY_ANSWER,
+    PRIORITY_ADMIN,
+    PRIORITY_ENFORCEMENT,
+)
+from app.scripts.GroupEntryVerification.tracing import tracer
+from app.scripts.GroupEntryVerification.stats import (
+    count_join,
+    count_events,
+    attempts_used,
+    load_stats,
+    JOIN,
+    TRUSTED,
+)
+from app.scripts.GroupEntryVerification.trust import TrustCache
+from app.scripts.GroupEntryVerification.export import (
+    export_path,
+    export_records,
+    EXPORT_FORMATS,
+)
+from app.scripts.GroupEntryVerification.shard import (
+    ShardDispatcher,
+    is_shard_worker,
+    notify_dispatcher,
+)
+from app.scripts.GroupEntryVerification.reconcile import (
+    MemberListCache,
+    reconcile_pending_users,
+)
+from app.scripts.GroupEntryVerification.state_machine import (
+    state_machine,
+    run_bounded,
+    PASS,
+    FAIL,
+    APPROVE,
+    REJECT,
+    LEAVE,
+)
+from app.scripts.GroupEntryVerification.records import (
+    Status,
+    VerificationRecord,
+    RecordTable,
+    make_key,
+    MAX_ATTEMPTS,
+)
+from app.scripts.GroupEntryVerification.store import (
+    get_store,
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+    VERIFICATION_STATS,
+)
 
 # 数据存储路径，实际开发时，请将GroupEntryVerification替换为具体的数据存放路径
 DATA_DIR = os.path.join(
@@ -27,13 +91,6 @@ DATA_DIR = os.path.join(
     "GroupEntryVerification",
 )
 
-# 用户验证状态文件
-USER_VERIFICATION_FILE = os.path.join(DATA_DIR, "user_verification.json")
-# 验证题目文件
-VERIFICATION_QUESTIONS_FILE = os.path.join(DATA_DIR, "verification_questions.json")
-
-# 最大尝试次数
-MAX_ATTEMPTS = 3
 # 禁言时间（30天，单位：秒）
 BAN_DURATION = 30 * 24 * 60 * 60
 
@@ -42,21 +99,97 @@ ADMIN_APPROVE_CMD = "批准"  # 批准命令
 ADMIN_REJECT_CMD = "拒绝"  # 拒绝命令
 ADMIN_SCAN_CMD = "扫描验证"  # 扫描验证命令
 ADMIN_SCAN_PRIVATE_CMD = "扫描验证"  # 私聊扫描验证命令
-
-# 警告记录文件
-WARNING_RECORD_FILE = os.path.join(DATA_DIR, "warning_record.json")
-# 达到警告上限用户记录文件
-REACHED_LIMIT_FILE = os.path.join(DATA_DIR, "reached_limit.json")
+ADMIN_PENDING_CMD = "待验证"  # 查询待验证用户命令
+ADMIN_STATS_CMD = "验证统计"  # 查询验证统计命令
+ADMIN_EXPORT_CMD = "导出验证"  # 导出验证记录命令
+ADMIN_ALL_ARG = "全部"  # 批量审核命令中表示所有待验证用户
+ADMIN_REVERSE_ARG = "倒序"  # 查询命令中表示倒序排列
+# 查询待验证用户时每页的行数
+PENDING_PAGE_SIZE = 20
+# 导出命令中表示压缩的参数
+EXPORT_COMPRESS_ARGS = ("压缩", "gz")
+# 导出命令中的状态参数，也可以直接使用存储中的状态名称（pending、verified 等）
+EXPORT_STATUS_ARGS = {
+    "待验证": Status.PENDING,
+    "已通过": Status.VERIFIED,
+    "失败": Status.FAILED,
+    "已拒绝": Status.REJECTED,
+    "已踢出": Status.KICKED,
+}
+
+# 分片工作进程数，大于0时按群号把事件分给多个进程处理，0表示在当前进程内处理
+SHARD_WORKERS = 0
+
+# 在入群申请阶段验证的群号（需要群设置为“需要验证消息”），为空时所有群都在入群后验证
+# 申请会先被拒绝并在理由中给出计算式，用户重新申请时在答案中填写结果，答对后直接同意入群
+REQUEST_VERIFICATION_GROUPS = set()
+# 申请阶段的计算式有效期（秒），超过后重新出题，次数用完的用户也要等这么久才能再次验证
+REQUEST_CHALLENGE_TTL = 24 * 60 * 60
+# 申请通过后多久之内的入群通知视为已验证（秒）
+REQUEST_ADMIT_WINDOW = 60 * 60
+
+# 信任其他群验证结果的群号：最近在任意群通过验证的用户加入这些群时不再验证（有效期见 trust.py）
+TRUST_GROUPS = set()
+
+# 本插件发出的调用的 note 前缀，以及需要处理回调的调用的 echo 前缀
+ECHO_NOTE_PREFIX = "GroupEntryVerification_"
+ECHO_PREFIX = "send_group_msg_" + ECHO_NOTE_PREFIX
+ECHO_PREFIXES = (ECHO_PREFIX, "get_group_member_list_" + ECHO_NOTE_PREFIX)
+
+# 验证消息的调用关联表，回调按唯一 echo 匹配
+echo_registry = EchoRegistry(ECHO_NOTE_PREFIX)
+
+# 群成员列表缓存，用于核对待验证用户是否仍在群内
+member_list_cache = MemberListCache(echo_registry)
+
+# 最近处理过的事件，用于丢弃重连后重复推送的事件
+event_deduplicator = EventDeduplicator()
+
+# 待验证用户在群里发言时的撤回、禁言和提醒
+pending_enforcer = PendingMessageEnforcer()
+
+# 私聊消息的限流，在读取任何状态之前丢弃
+private_message_gate = PrivateMessageGate()
+
+# 最近通过验证的用户，开启信任的群据此免验证
+trust_cache = TrustCache()
+
+# 定期撤回已结束验证的用户的验证消息，并删除超过撤回窗口的记录
+message_sweeper = MessageSweeper()
+
+# 入站事件的优先级队列，过载时丢弃低优先级事件
+inbound_queue = InboundQueue()
+
+# 事件循环延迟监测，第一次收到事件时开始采样
+loop_lag_monitor = LoopLagMonitor()
+
+# 待验证用户的内存索引，供查询命令使用
+pending_index = PendingIndex()
+
+# 启动时创建一次数据目录，事件处理过程中不再重复检查
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# 功能开关状态的内存缓存，避免每条消息都读取开关文件。
+# 分片模式下主进程也用它过滤事件，开关在工作进程中切换后经 notify_dispatcher 同步给主进程
+_function_status_cache = {}
+# 同步功能开关的控制消息名称
+FUNCTION_STATUS_CONTROL = "function_status"
 
 
 # 查看功能开关状态
 def load_function_status(group_id):
-    return load_switch(group_id, "GroupEntryVerification")
+    status = _function_status_cache.get(group_id)
+    if status is None:
+        status = bool(load_switch(group_id, "GroupEntryVerification"))
+        _function_status_cache[group_id] = status
+    return status
 
 
 # 保存功能开关状态
 def save_function_status(group_id, status):
     save_switch(group_id, "GroupEntryVerification", status)
+    _function_status_cache[group_id] = bool(status)
+    notify_dispatcher(FUNCTION_STATUS_CONTROL, group_id, bool(status))
 
 
 # 生成数学表达式和答案
@@ -105,69 +238,130 @@ def generate_simple_expression():
 # 保存用户验证状态
 def save_user_verification_status(user_verification):
     """保存用户验证状态到文件"""
-    with open(USER_VERIFICATION_FILE, "w", encoding="utf-8") as f:
-        json.dump(user_verification, f, ensure_ascii=False, indent=4)
+    get_store().save(USER_VERIFICATION, user_verification)
 
 
 # 加载用户验证状态
 def load_user_verification_status():
     """从文件加载用户验证状态"""
-    if not os.path.exists(USER_VERIFICATION_FILE):
-        return {}
+    return get_store().load(USER_VERIFICATION)
 
-    try:
-        with open(USER_VERIFICATION_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"加载用户验证状态失败: {e}")
-        return {}
+
+# 获取单个用户的验证记录
+def get_user_verification(user_id, group_id):
+    """获取特定用户在特定群的验证记录，不存在时返回 None"""
+    key = make_key(user_id, group_id)
+    value = get_store().get(USER_VERIFICATION, key)
+    return VerificationRecord.from_dict(key, value) if value else None
+
+
+# 原子地修改单个用户的验证记录
+def update_user_verification(user_id, group_id, func):
+    """
+    修改特定用户在特定群的验证记录，记录不存在时不做处理
+
+    参数:
+        func (callable): 接收 VerificationRecord 并就地修改
+
+    返回:
+        VerificationRecord: 修改后的记录，不存在时返回 None
+    """
+    key = make_key(user_id, group_id)
+
+    def apply(value):
+        if value is None:
+            return None
+        record = VerificationRecord.from_dict(key, value)
+        func(record)
+        return record.to_dict()
+
+    value = get_store().update(USER_VERIFICATION, key, apply)
+    return VerificationRecord.from_dict(key, value) if value else None
+
+
+# 扣除一次验证机会
+def consume_verification_attempt(user_id, group_id):
+    """扣除一次验证机会，返回剩余次数"""
+
+    def apply(record):
+        record.remaining_attempts -= 1
+
+    record = update_user_verification(user_id, group_id, apply)
+    return record.remaining_attempts if record else 0
+
+
+# 获取用户正在等待验证的群
+def get_pending_group_ids(user_id):
+    """按记录顺序返回用户正在等待验证的群号列表"""
+    records = RecordTable.from_dicts(
+        get_store().user_records(USER_VERIFICATION, user_id)
+    )
+    return [str(record.group_id) for record in records.pending()]
 
 
 # 保存验证题目
 def save_verification_question(user_id, group_id, expression, answer):
     """保存用户的验证题目和答案"""
-    questions = load_verification_questions()
-    key = f"{user_id}_{group_id}"
-
-    questions[key] = {
-        "expression": expression,
-        "answer": answer,
-        "timestamp": time.time(),
-    }
-
-    with open(VERIFICATION_QUESTIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(questions, f, ensure_ascii=False, indent=4)
+    get_store().set(
+        VERIFICATION_QUESTIONS,
+        make_key(user_id, group_id),
+        {
+            "expression": expression,
+            "answer": answer,
+            "timestamp": time.time(),
+        },
+    )
 
 
 # 加载验证题目
 def load_verification_questions():
     """从文件加载验证题目"""
-    if not os.path.exists(VERIFICATION_QUESTIONS_FILE):
-        return {}
-
-    try:
-        with open(VERIFICATION_QUESTIONS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"加载验证题目失败: {e}")
-        return {}
+    return get_store().load(VERIFICATION_QUESTIONS)
 
 
 # 获取用户验证题目和答案
 def get_user_verification_question(user_id, group_id):
     """获取特定用户在特定群的验证题目和答案"""
-    questions = load_verification_questions()
-    key = f"{user_id}_{group_id}"
+    question = get_store().get(VERIFICATION_QUESTIONS, make_key(user_id, group_id))
 
-    if key in questions:
-        return questions[key]["expression"], float(questions[key]["answer"])
+    if question:
+        return question["expression"], float(question["answer"])
     return None, None
 
 
-# 处理元事件，用于启动时确保数据目录存在
+# 发送需要追踪的验证消息
+async def send_verification_msg(websocket, group_id, user_id, message):
+    """
+    发送验证相关的群消息，回调中的 message_id 会被记录以便之后撤回
+
+    返回:
+        PendingCall: 可通过 echo_registry.wait(call, timeout) 等待回调数据或失败原因
+    """
+    note, call = echo_registry.register(group_id, user_id)
+    await send_group_msg(websocket, group_id, message, note=note)
+    tracer.step(group_id, user_id, "prompt_sent")
+    return call
+
+
+# 在后台运行的任务，保留引用直到完成
+_background_tasks = set()
+
+
+def spawn_background(coro):
+    """在后台运行协程，不等待其完成"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+# 处理元事件（心跳事件已在分发前过滤，这里只会收到生命周期事件）
 async def handle_meta_event(websocket, msg):
     """处理元事件"""
-    os.makedirs(DATA_DIR, exist_ok=True)
+    if msg.get("sub_type") == "connect":
+        logging.info("GroupEntryVerification已连接，开始核对待验证用户")
+        # 离线期间退群的用户不会收到通知，连接后在后台核对一次
+        spawn_background(reconcile_pending_users(websocket, member_list_cache))
 
 
 # 处理开关状态
@@ -196,11 +390,51 @@ async def toggle_function_status(websocket, group_id, message_id, authorized):
         )
 
 
+# 待验证用户在群里发言
+async def enforce_pending_member(websocket, msg):
+    """
+    撤回待验证用户的群消息，刷屏时在时间窗口内只重新禁言一次
+
+    返回:
+        callable: 需要提醒时返回发送提醒的函数（返回协程），否则返回 None
+    """
+    user_id = str(msg.get("user_id"))
+    group_id = str(msg.get("group_id"))
+    if not load_function_status(group_id):
+        return None
+    record = get_user_verification(user_id, group_id)
+    if record is None or not record.is_pending:
+        return None
+    # 撤回消息（合并到下一批撤回中）
+    pending_enforcer.recall(websocket, str(msg.get("message_id")))
+    if not pending_enforcer.should_remind(group_id, user_id):
+        return None
+    await set_group_ban(websocket, group_id, user_id, BAN_DURATION)
+    return lambda: send_pending_reminder(websocket, group_id, user_id)
+
+
+# 提醒在群里发言的待验证用户
+async def send_pending_reminder(websocket, group_id, user_id):
+    expression, _ = get_user_verification_question(user_id, group_id)
+    if expression:
+        await send_verification_msg(
+            websocket,
+            group_id,
+            user_id,
+            f"[CQ:at,qq={user_id}]({user_id}) 您尚未完成入群验证，消息已被撤回并禁言30天。请私聊我回答问题完成验证：{expression}",
+        )
+    else:
+        await send_verification_msg(
+            websocket,
+            group_id,
+            user_id,
+            f"[CQ:at,qq={user_id}]({user_id}) 您尚未完成入群验证，消息已被撤回并禁言30天。请私聊机器人完成验证。",
+        )
+
+
 # 群消息处理函数
 async def handle_group_message(websocket, msg):
     """处理群消息"""
-    # 确保数据目录存在
-    os.makedirs(DATA_DIR, exist_ok=True)
     try:
         user_id = str(msg.get("user_id"))
         group_id = str(msg.get("group_id"))
@@ -218,38 +452,10 @@ async def handle_group_message(websocket, msg):
             await handle_scan_verification(websocket, group_id, message_id, user_id)
             return
 
-        # 检查功能是否开启
-        if load_function_status(group_id):
-            # 检查用户是否未验证
-            user_verification = load_user_verification_status()
-            user_group_key = f"{user_id}_{group_id}"
-            if (
-                user_group_key in user_verification
-                and user_verification[user_group_key].get("status") == "pending"
-            ):
-                # 如果用户未验证，撤回消息并禁言
-                await delete_msg(websocket, message_id)
-                await set_group_ban(websocket, group_id, user_id, BAN_DURATION)
-                expression, _ = get_user_verification_question(user_id, group_id)
-                # 发送提示消息
-                if expression:
-                    await send_group_msg(
-                        websocket,
-                        group_id,
-                        f"[CQ:at,qq={user_id}]({user_id}) 您尚未完成入群验证，消息已被撤回并禁言30天。请私聊我回答问题完成验证：{expression}",
-                        note="GroupEntryVerification_" + group_id + "_" + user_id,
-                    )
-                else:
-                    await send_group_msg(
-                        websocket,
-                        group_id,
-                        f"[CQ:at,qq={user_id}]({user_id}) 您尚未完成入群验证，消息已被撤回并禁言30天。请私聊机器人完成验证。",
-                        note="GroupEntryVerification_" + group_id + "_" + user_id,
-                    )
-                return  # 阻止后续处理
-
-            # 其他群消息处理逻辑
-            pass
+        # 待验证用户的消息撤回并禁言，需要时发送提醒
+        remind = await enforce_pending_member(websocket, msg)
+        if remind is not None:
+            await remind()
     except Exception as e:
         logging.error(f"处理GroupEntryVerification群消息失败: {e}")
         await send_group_msg(
@@ -263,7 +469,6 @@ async def handle_group_message(websocket, msg):
 # 私聊消息处理函数
 async def handle_private_message(websocket, msg):
     """处理私聊消息"""
-    os.makedirs(DATA_DIR, exist_ok=True)
     try:
         user_id = str(msg.get("user_id"))
         raw_message = str(msg.get("raw_message"))
@@ -280,155 +485,109 @@ async def handle_private_message(websocket, msg):
                 await handle_admin_reject(websocket, user_id, raw_message)
                 return
 
+            # 处理管理员查询待验证用户命令
+            elif raw_message.startswith(ADMIN_PENDING_CMD):
+                await handle_pending_query(websocket, user_id, raw_message)
+                return
+
+            # 处理管理员查询验证统计命令
+            elif raw_message.startswith(ADMIN_STATS_CMD):
+                await handle_stats_query(websocket, user_id, raw_message)
+                return
+
+            # 处理管理员导出验证记录命令
+            elif raw_message.startswith(ADMIN_EXPORT_CMD):
+                await handle_export_command(websocket, user_id, raw_message)
+                return
+
             # 处理管理员私聊扫描验证命令
             elif raw_message.startswith(ADMIN_SCAN_PRIVATE_CMD):
                 await handle_private_scan_verification(websocket, user_id, raw_message)
                 return
 
-        # 加载用户验证状态
-        user_verification = load_user_verification_status()
-
         # 检查该用户是否需要验证
-        for key in list(user_verification.keys()):
-            if key.startswith(f"{user_id}_"):
-                user_group_key = key
-                group_id = user_group_key.split("_")[1]
-
-                # 如果用户正在等待验证
-                if user_verification[user_group_key]["status"] == "pending":
-                    expression, correct_answer = get_user_verification_question(
-                        user_id, group_id
+        pending_group_ids = get_pending_group_ids(user_id)
+        if not pending_group_ids:
+            # 一段时间内不再读取该用户的状态
+            private_message_gate.note_not_pending(user_id)
+        for group_id in pending_group_ids:
+            # 如果用户正在等待验证
+            expression, correct_answer = get_user_verification_question(
+                user_id, group_id
+            )
+
+            if expression is None:
+                continue
+
+            # 尝试将用户输入转换为数字进行比较
+            try:
+                user_answer = float(raw_message.strip())
+
+                # 判断答案是否正确
+                if (
+                    expression is not None
+                    and correct_answer is not None
+                    and abs(user_answer - correct_answer) < 0.01
+                ):  # 允许小误差
+                    tracer.step(group_id, user_id, "answer", correct=True)
+                    # 回答正确，更新状态并清理验证数据，然后解除禁言、撤回验证消息
+                    result = await state_machine.apply(
+                        websocket, PASS, [(group_id, user_id)]
+                    )
+                    if result.applied:
+                        # 在群里通知验证成功
+                        await send_group_msg(
+                            websocket,
+                            group_id,
+                            f"[CQ:at,qq={user_id}]({user_id}) 恭喜你通过了验证！现在可以正常发言了。",
+                        )
+
+                else:
+                    # 回答错误，减少尝试次数
+                    remaining_attempts = consume_verification_attempt(user_id, group_id)
+                    tracer.step(
+                        group_id,
+                        user_id,
+                        "answer",
+                        correct=False,
+                        remaining=remaining_attempts,
                     )
 
-                    if expression is None:
-                        continue
-
-                    # 尝试将用户输入转换为数字进行比较
-                    try:
-                        user_answer = float(raw_message.strip())
-
-                        # 判断答案是否正确
-                        if (
-                            expression is not None
-                            and correct_answer is not None
-                            and abs(user_answer - correct_answer) < 0.01
-                        ):  # 允许小误差
-                            # 回答正确，解除禁言
-                            await set_group_ban(websocket, group_id, user_id, 0)
-                            # 在群里通知验证成功
-                            await send_group_msg(
-                                websocket,
-                                group_id,
-                                f"[CQ:at,qq={user_id}]({user_id}) 恭喜你通过了验证！现在可以正常发言了。",
-                            )
-
-                            # 更新状态
-                            user_verification[user_group_key]["status"] = "verified"
-                            save_user_verification_status(user_verification)
-
-                            # 清理用户验证相关数据
-                            clean_user_verification_data(user_id, group_id)
-
-                            # 撤回存储的验证消息
-                            del_message = DelMessage()
-                            message_id_list = del_message.get_user_messages(
-                                group_id, user_id
-                            )
-                            for message_id in message_id_list:
-                                await delete_msg(websocket, message_id)
-                                del_message.remove_message(
-                                    group_id, user_id, message_id
-                                )
-
-                        else:
-                            # 回答错误，减少尝试次数
-                            remaining_attempts = (
-                                user_verification[user_group_key]["remaining_attempts"]
-                                - 1
-                            )
-                            user_verification[user_group_key][
-                                "remaining_attempts"
-                            ] = remaining_attempts
-                            save_user_verification_status(user_verification)
-
-                            if remaining_attempts > 0:
-                                # 在群里通知剩余次数
-                                await send_group_msg(
-                                    websocket,
-                                    group_id,
-                                    f"[CQ:at,qq={user_id}]({user_id}) 回答错误！你还有{remaining_attempts}次机会。请重新计算：{expression}",
-                                    note="GroupEntryVerification_"
-                                    + group_id
-                                    + "_"
-                                    + user_id,
-                                )
-                            else:
-                                # 尝试次数用完，踢出群聊
-                                await set_group_kick(websocket, group_id, user_id)
-                                # 在群里通知踢出原因
-                                await send_group_msg(
-                                    websocket,
-                                    group_id,
-                                    f"用户 {user_id} 验证失败，已被踢出群聊。",
-                                )
-
-                                # 更新状态
-                                user_verification[user_group_key]["status"] = "failed"
-                                save_user_verification_status(user_verification)
-                                del_message = DelMessage()
-                                message_id_list = del_message.get_user_messages(
-                                    group_id, user_id
-                                )
-                                for message_id in message_id_list:
-                                    await delete_msg(websocket, message_id)
-                                    del_message.remove_message(
-                                        group_id, user_id, message_id
-                                    )
-                    except ValueError:
-                        # 用户输入的不是数字，也视为回答错误，减少尝试次数
-                        remaining_attempts = (
-                            user_verification[user_group_key]["remaining_attempts"] - 1
+                    if remaining_attempts > 0:
+                        # 在群里通知剩余次数
+                        await send_verification_msg(
+                            websocket,
+                            group_id,
+                            user_id,
+                            f"[CQ:at,qq={user_id}]({user_id}) 回答错误！你还有{remaining_attempts}次机会。请重新计算：{expression}",
                         )
-                        user_verification[user_group_key][
-                            "remaining_attempts"
-                        ] = remaining_attempts
-                        save_user_verification_status(user_verification)
-
-                        if remaining_attempts > 0:
-                            # 在群里通知剩余次数
-                            await send_group_msg(
-                                websocket,
-                                group_id,
-                                f"[CQ:at,qq={user_id}]({user_id}) 请输入一个数字作为答案！你还有{remaining_attempts}次机会。请重新计算：{expression}",
-                                note="GroupEntryVerification_"
-                                + group_id
-                                + "_"
-                                + user_id,
-                            )
-                        else:
-                            # 尝试次数用完，踢出群聊
-                            await set_group_kick(websocket, group_id, user_id)
-                            # 在群里通知踢出原因
-                            await send_group_msg(
-                                websocket,
-                                group_id,
-                                f"用户 {user_id} 验证失败，已被踢出群聊。",
-                            )
-
-                            # 更新状态
-                            user_verification[user_group_key]["status"] = "failed"
-                            save_user_verification_status(user_verification)
-                            del_message = DelMessage()
-                            message_id_list = del_message.get_user_messages(
-                                group_id, user_id
-                            )
-                            for message_id in message_id_list:
-                                await delete_msg(websocket, message_id)
-                                del_message.remove_message(
-                                    group_id, user_id, message_id
-                                )
-
-                    return  # 处理完一个验证请求后返回
+                    else:
+                        # 尝试次数用完，踢出群聊
+                        await fail_verification(websocket, user_id, group_id)
+            except ValueError:
+                # 用户输入的不是数字，也视为回答错误，减少尝试次数
+                remaining_attempts = consume_verification_attempt(user_id, group_id)
+                tracer.step(
+                    group_id,
+                    user_id,
+                    "answer",
+                    correct=False,
+                    remaining=remaining_attempts,
+                )
+
+                if remaining_attempts > 0:
+                    # 在群里通知剩余次数
+                    await send_verification_msg(
+                        websocket,
+                        group_id,
+                        user_id,
+                        f"[CQ:at,qq={user_id}]({user_id}) 请输入一个数字作为答案！你还有{remaining_attempts}次机会。请重新计算：{expression}",
+                    )
+                else:
+                    # 尝试次数用完，踢出群聊
+                    await fail_verification(websocket, user_id, group_id)
+
+            return  # 处理完一个验证请求后返回
     except Exception as e:
         logging.error(f"处理GroupEntryVerification私聊消息失败: {e}")
         # 错误信息也转移到群里
@@ -441,11 +600,22 @@ async def handle_private_message(websocket, msg):
         return
 
 
+# 验证次数用完
+async def fail_verification(websocket, user_id, group_id):
+    """更新状态并清理验证数据，然后踢出用户、撤回验证消息"""
+    result = await state_machine.apply(websocket, FAIL, [(group_id, user_id)])
+    if result.applied:
+        # 在群里通知踢出原因
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"用户 {user_id} 验证失败，已被踢出群聊。",
+        )
+
+
 # 群通知处理函数
 async def handle_group_notice(websocket, msg):
     """处理群通知"""
-    # 确保数据目录存在
-    os.makedirs(DATA_DIR, exist_ok=True)
     try:
         user_id = str(msg.get("user_id"))
         group_id = str(msg.get("group_id"))
@@ -477,34 +647,84 @@ async def handle_group_notice(websocket, msg):
 async def process_new_member(websocket, user_id, group_id):
     """处理新成员入群验证"""
     try:
-        # 禁言新成员30天
+        member_list_cache.note_join(group_id, user_id)
+
+        # 已在申请阶段通过验证的用户直接放行，不再禁言、出题和解禁
+        if admitted_by_request(user_id, group_id):
+            logging.info(f"用户 {user_id} 已在申请阶段通过群 {group_id} 的验证")
+            return
+
+        # 最近在其他群通过验证的用户直接放行，只计入统计，不写入验证记录
+        if group_id in TRUST_GROUPS and trust_cache.is_trusted(user_id):
+            get_store().update_tables(
+                {
+                    VERIFICATION_STATS: count_events(
+                        lambda _: [(JOIN, None), (TRUSTED, None)], [group_id]
+                    )
+                }
+            )
+            logging.info(
+                f"用户 {user_id} 最近已在其他群通过验证，加入群 {group_id} 免验证"
+            )
+            return
+
+        tracer.start(group_id, user_id)
+
+        # 先禁言新成员30天，其他操作都在禁言发出之后
         await set_group_ban(websocket, group_id, user_id, BAN_DURATION)
+        tracer.step(group_id, user_id, "ban")
 
-        # 生成数学表达式和答案
+        # 在一次存储提交中保存验证题目和验证状态，同时计入入群统计
         expression, answer = generate_math_expression()
+        now = time.time()
+        record = VerificationRecord(
+            user_id, group_id, Status.PENDING, MAX_ATTEMPTS, now
+        )
 
-        # 保存验证题目和答案
-        save_verification_question(user_id, group_id, expression, answer)
-
-        # 在群里发送验证消息
+        # 验证消息和管理员通知在后台发送，与提交同时进行。提交在线程中执行，
+        # 使用 Redis 存储时提交的网络往返不会阻塞事件循环；用户看到题目后还要计算并私聊回答，
+        # 回答到达时提交早已完成
+        spawn_background(
+            send_new_member_messages(websocket, user_id, group_id, expression, answer)
+        )
+        await asyncio.to_thread(
+            get_store().update_tables,
+            {
+                VERIFICATION_QUESTIONS: {
+                    record.store_key: lambda _: {
+                        "expression": expression,
+                        "answer": answer,
+                        "timestamp": now,
+                    }
+                },
+                USER_VERIFICATION: {record.store_key: lambda _: record.to_dict()},
+                VERIFICATION_STATS: count_join(group_id, now),
+            },
+        )
+    except Exception as e:
+        logging.error(f"处理新成员入群验证失败: {e}")
         await send_group_msg(
             websocket,
             group_id,
-            f"[CQ:at,qq={user_id}]({user_id}) 欢迎加入本群！请私聊我回复下面计算结果完成验证，你将有{MAX_ATTEMPTS}次机会，如果全部错误将会被踢出群聊\n你的计算式是：{expression}",
-            note="GroupEntryVerification_" + group_id + "_" + user_id,
+            f"处理新成员 {user_id} 入群验证失败，错误信息：{str(e)}",
         )
 
-        # 保存用户验证状态
-        user_verification = load_user_verification_status()
-        user_verification[f"{user_id}_{group_id}"] = {
-            "status": "pending",
-            "remaining_attempts": MAX_ATTEMPTS,
-        }
-        save_user_verification_status(user_verification)
 
+# 发送入群验证消息并通知管理员
+async def send_new_member_messages(websocket, user_id, group_id, expression, answer):
+    """发送验证消息，再向管理员私发计算式和答案，以及可以直接转发的批准和拒绝命令"""
+    try:
+        await send_verification_msg(
+            websocket,
+            group_id,
+            user_id,
+            f"[CQ:at,qq={user_id}]({user_id}) 欢迎加入本群！请私聊我回复下面计算结果完成验证，你将有{MAX_ATTEMPTS}次机会，如果全部错误将会被踢出群聊\n你的计算式是：{expression}",
+        )
         logging.info(f"已向用户 {user_id} 发送群 {group_id} 的入群验证")
+    except Exception as e:
+        logging.error(f"发送用户 {user_id} 在群 {group_id} 的入群验证消息失败: {e}")
 
-        # 通知管理员有新成员加入，并私发计算式和答案
+    try:
         for admin_id in owner_id:
             await send_private_msg(
                 websocket,
@@ -529,44 +749,27 @@ async def process_new_member(websocket, user_id, group_id):
                 f"{ADMIN_REJECT_CMD} {group_id} {user_id}",
             )
     except Exception as e:
-        logging.error(f"处理新成员入群验证失败: {e}")
-        await send_group_msg(
-            websocket,
-            group_id,
-            f"处理新成员 {user_id} 入群验证失败，错误信息：{str(e)}",
-        )
+        logging.error(f"通知管理员新成员 {user_id} 加入群 {group_id} 失败: {e}")
 
 
 # 处理成员退群
 async def process_member_leave(websocket, user_id, group_id):
     """处理成员退群，清理未验证用户的相关数据"""
     try:
+        member_list_cache.note_leave(group_id, user_id)
+
         # 在群内发送退群通知
         await send_group_msg(websocket, group_id, f"用户 {user_id} 退出了本群")
 
-        # 加载用户验证状态
-        user_verification = load_user_verification_status()
-        user_group_key = f"{user_id}_{group_id}"
-
         # 检查用户是否在验证状态中
-        if user_group_key in user_verification:
+        record = get_user_verification(user_id, group_id)
+        if record is not None:
             # 记录日志
-            status = user_verification[user_group_key].get("status", "unknown")
+            status = record.status.label
             logging.info(f"用户 {user_id} 离开群 {group_id}，验证状态为: {status}")
 
-            # 从验证状态中移除用户
-            del user_verification[user_group_key]
-            save_user_verification_status(user_verification)
-
-            # 清理用户验证相关数据
-            clean_user_verification_data(user_id, group_id)
-
-            # 清理删除消息记录
-            del_message = DelMessage()
-            message_id_list = del_message.get_user_messages(group_id, user_id)
-            for message_id in message_id_list:
-                await delete_msg(websocket, message_id)
-                del_message.remove_message(group_id, user_id, message_id)
+            # 在一次提交中删除验证记录和相关数据，然后撤回验证消息
+            await state_machine.apply(websocket, LEAVE, [(group_id, user_id)])
 
             logging.info(f"已清理离开群 {group_id} 的用户 {user_id} 的验证数据")
     except Exception as e:
@@ -589,8 +792,18 @@ async def handle_request_event(websocket, msg):
             group_id = str(msg.get("group_id"))
             user_id = str(msg.get("user_id"))
 
-            # 如果是加群请求，同意加群，后续在入群通知中进行验证
             if msg.get("sub_type") == "add":
+                # 开启了申请阶段验证的群在这里出题和判断答案
+                if group_id in REQUEST_VERIFICATION_GROUPS:
+                    await verify_join_request(
+                        websocket,
+                        group_id,
+                        user_id,
+                        msg.get("flag"),
+                        str(msg.get("comment") or ""),
+                    )
+                    return
+
                 # 此处仅记录，不进行处理，等待用户入群后再处理
                 logging.info(
                     f"收到用户 {user_id} 加入群 {group_id} 的请求，将在入群后进行验证"
@@ -601,100 +814,301 @@ async def handle_request_event(websocket, msg):
         return
 
 
+# 从加群申请的验证消息中取出答案
+def parse_request_answer(comment):
+    """
+    取验证消息中的最后一个数字，群设置了问题时验证消息的格式为“问题：...\n答案：...”
+
+    返回:
+        float: 没有数字时返回 None
+    """
+    numbers = re.findall(r"-?\d+(?:\.\d+)?", comment.rsplit("答案：", 1)[-1])
+    return float(numbers[-1]) if numbers else None
+
+
+# 在入群申请阶段验证
+async def verify_join_request(websocket, group_id, user_id, flag, comment):
+    """
+    按申请中的答案同意或拒绝加群申请
+
+    第一次申请时生成计算式并拒绝申请，拒绝理由中给出计算式；
+    之后的申请答对时同意申请，并在同一次存储提交中写入已验证的记录，入群后不再禁言和出题；
+    答错时扣除次数并再次拒绝，次数用完后在 REQUEST_CHALLENGE_TTL 内直接拒绝。
+    """
+    record = get_user_verification(user_id, group_id)
+    if record is not None and record.status == Status.REJECTED:
+        # 被管理员拒绝过的用户交给管理员处理
+        logging.info(
+            f"用户 {user_id} 曾被群 {group_id} 的管理员拒绝，申请留给管理员处理"
+        )
+        return
+
+    key = make_key(user_id, group_id)
+    answer = parse_request_answer(comment)
+    now = time.time()
+    # 修改函数在存储冲突重试时会重新执行，以最后一次的结果为准
+    outcome = {}
+
+    def apply_question(question):
+        outcome.clear()
+        if (
+            question is None
+            or "remaining_attempts" not in question
+            or now - question["timestamp"] > REQUEST_CHALLENGE_TTL
+        ):
+            # 没有申请阶段的计算式或已过期，重新出题
+            expression, correct_answer = generate_math_expression()
+            outcome["result"] = "challenge"
+            outcome["expression"] = expression
+            return {
+                "expression": expression,
+                "answer": correct_answer,
+                "timestamp": now,
+                "remaining_attempts": MAX_ATTEMPTS,
+            }
+        remaining = question["remaining_attempts"]
+        outcome["expression"] = question["expression"]
+        if remaining <= 0:
+            outcome["result"] = "exhausted"
+            return question
+        if answer is not None and abs(answer - float(question["answer"])) < 0.01:
+            outcome["result"] = "pass"
+            outcome["attempts"] = attempts_used(remaining, True)
+            return None
+        question = dict(question, remaining_attempts=remaining - 1)
+        outcome["remaining"] = remaining - 1
+        outcome["result"] = "retry" if remaining > 1 else "fail"
+        if outcome["result"] == "fail":
+            outcome["attempts"] = attempts_used(0, False)
+        return question
+
+    def apply_record(value):
+        if outcome["result"] != "pass":
+            return value
+        record = VerificationRecord(user_id, group_id, Status.VERIFIED, 0, now)
+        return record.to_dict()
+
+    def events_of(_):
+        if outcome["result"] == "pass":
+            return [(JOIN, None), ("pass", outcome["attempts"])]
+        if outcome["result"] == "fail":
+            return [("fail", outcome["attempts"])]
+        return []
+
+    get_store().update_tables(
+        {
+            VERIFICATION_QUESTIONS: {key: apply_question},
+            USER_VERIFICATION: {key: apply_record},
+            VERIFICATION_STATS: count_events(events_of, [group_id], now),
+        }
+    )
+
+    result = outcome["result"]
+    if result == "pass":
+        await set_group_add_request(websocket, flag, "add", True)
+        logging.info(f"用户 {user_id} 在申请阶段通过了群 {group_id} 的验证，已同意申请")
+        return
+
+    expression = outcome["expression"]
+    if result == "challenge":
+        reason = (
+            f"本群需要验证：请重新申请，并在验证消息中填写 {expression} 的计算结果，"
+            f"你有{MAX_ATTEMPTS}次机会"
+        )
+    elif result == "retry":
+        reason = (
+            f"答案错误，你还有{outcome['remaining']}次机会："
+            f"请重新申请，并在验证消息中填写 {expression} 的计算结果"
+        )
+    else:
+        reason = "验证次数已用完，请稍后再申请或联系管理员"
+    await set_group_add_request(websocket, flag, "add", False, reason)
+    logging.info(f"已拒绝用户 {user_id} 加入群 {group_id} 的申请：{reason}")
+
+
+# 入群前是否已在申请阶段通过验证
+def admitted_by_request(user_id, group_id):
+    """申请阶段通过验证后 REQUEST_ADMIT_WINDOW 内入群的用户不再验证"""
+    if str(group_id) not in REQUEST_VERIFICATION_GROUPS:
+        return False
+    record = get_user_verification(user_id, group_id)
+    return (
+        record is not None
+        and record.status == Status.VERIFIED
+        and time.time() - record.joined_at < REQUEST_ADMIT_WINDOW
+    )
+
+
 # 回应事件处理函数
 async def handle_response(websocket, msg):
     """处理回调事件"""
     try:
-        echo = msg.get("echo")
-        data = msg.get("data")
-        if not echo:  # 如果没有echo内容，直接返回
+        # 按 echo 查找对应的调用，未匹配的回调直接丢弃
+        call = echo_registry.resolve(msg)
+        if call is None or call.action != "send_group_msg":
             return
 
-        if "GroupEntryVerification_" in echo:
-            # 如果 echo 中包含任意一个追踪的短语，
-            # 则认为这是一条验证过程中的消息，使用 DelMessage 进行记录。
-
-            # 解析echo，格式为：send_group_msg_GroupEntryVerification_{group_id}_{user_id}，例如：send_group_msg_GroupEntryVerification_1234567890_1234567890
-            echo = echo.replace("send_group_msg_GroupEntryVerification_", "")
-            group_id = echo.split("_")[0]
-            user_id = echo.split("_")[1]
-
-            del_message = DelMessage()
-            del_message.add_message(group_id, user_id, data.get("message_id"))
-            logging.info(
-                f"已记录用户 {user_id} 在群 {group_id} 的验证消息的message_id：{data.get('message_id')}"
+        if msg.get("status") != "ok":
+            tracer.step(call.group_id, call.user_id, "prompt_failed")
+            logging.warning(
+                f"用户 {call.user_id} 在群 {call.group_id} 的验证消息发送失败：{msg.get('message') or msg.get('wording')}"
             )
+            return
+
+        # 这是一条验证过程中的消息，使用 DelMessage 进行记录
+        message_id = (msg.get("data") or {}).get("message_id")
+        tracer.step(call.group_id, call.user_id, "prompt_echo")
+        del_message = DelMessage()
+        del_message.add_message(call.group_id, call.user_id, message_id)
+        logging.info(
+            f"已记录用户 {call.user_id} 在群 {call.group_id} 的验证消息的message_id：{message_id}"
+        )
 
     except Exception as e:
         logging.error(f"处理GroupEntryVerification回调事件失败: {e}")
         return
 
 
+# 解析批量审核命令的目标
+async def parse_admin_targets(command):
+    """
+    解析审核命令中的目标用户
+
+    支持的格式：
+        命令 群号 QQ号 [QQ号 ...]
+        命令 群号 全部      该群所有待验证用户
+        命令 全部           所有群的待验证用户
+
+    返回:
+        list: [(群号, QQ号), ...]，格式错误时返回 None
+    """
+    parts = command.strip().split()[1:]
+    if not parts:
+        return None
+
+    if parts[0] == ADMIN_ALL_ARG:
+        # 内存索引可能落后于其他进程的修改，处理时会逐个核对存储中的记录
+        return [
+            (str(record.group_id), str(record.user_id))
+            for record in await pending_index.pending()
+        ]
+
+    group_id, args = parts[0], parts[1:]
+    if not group_id.isdigit() or not args:
+        return None
+
+    if args[0] == ADMIN_ALL_ARG:
+        records = RecordTable.from_dicts(
+            get_store().load_group(USER_VERIFICATION, group_id)
+        )
+        return [(group_id, str(record.user_id)) for record in records.pending()]
+
+    # QQ号之后的其他文本忽略
+    targets = []
+    for user_id in args:
+        if not user_id.isdigit():
+            break
+        if (group_id, user_id) not in targets:
+            targets.append((group_id, user_id))
+    return targets or None
+
+
+# 按群整理目标用户
+def group_targets(targets):
+    """[(群号, QQ号), ...] -> {群号: [QQ号, ...]}"""
+    by_group = {}
+    for group_id, user_id in targets:
+        by_group.setdefault(group_id, []).append(user_id)
+    return by_group
+
+
+# 通知群内一批用户
+async def notify_group_users(websocket, group_id, user_ids, text):
+    """在群里 @ 一批用户并发送同一条通知"""
+    mentions = " ".join(f"[CQ:at,qq={user_id}]({user_id})" for user_id in user_ids)
+    await send_group_msg(websocket, group_id, f"{mentions} {text}")
+
+
+# 把批量审核的结果汇总成一条消息
+def format_admin_summary(action, done, failed, skipped):
+    """
+    参数:
+        action (str): 批准 / 拒绝
+        done (list): 成功处理的 (群号, QQ号)
+        failed (dict): (群号, QQ号) -> 异常
+        skipped (list): 不在验证队列中而跳过的 (群号, QQ号)
+    """
+    lines = [
+        f"{action}完成：成功 {len(done)} 人，失败 {len(failed)} 人，跳过 {len(skipped)} 人"
+    ]
+    for group_id, user_ids in group_targets(done).items():
+        lines.append(f"群 {group_id} 已{action}：{', '.join(user_ids)}")
+    for (group_id, user_id), error in failed.items():
+        lines.append(f"群 {group_id} 用户 {user_id} 失败：{error}")
+    for group_id, user_ids in group_targets(skipped).items():
+        lines.append(f"群 {group_id} 不在验证队列中：{', '.join(user_ids)}")
+    return "\n".join(lines)
+
+
 # 添加管理员批准命令处理函数
 async def handle_admin_approve(websocket, admin_id, command):
-    """处理管理员批准命令"""
+    """处理管理员批准命令，支持多个QQ号、一个群的全部待验证用户和所有群"""
     try:
         # 确保是验证功能的命令
         if not command.startswith(ADMIN_APPROVE_CMD):
             return
 
-        # 解析命令参数
-        parts = command.strip().split()
-        if len(parts) < 3:
+        targets = await parse_admin_targets(command)
+        if targets is None:
             await send_private_msg(
                 websocket,
                 admin_id,
-                f"验证功能命令格式错误，正确格式：{ADMIN_APPROVE_CMD} 群号 QQ号",
+                f"验证功能命令格式错误，正确格式：{ADMIN_APPROVE_CMD} 群号 QQ号 [QQ号...]"
+                f"，{ADMIN_APPROVE_CMD} 群号 {ADMIN_ALL_ARG}，或 {ADMIN_APPROVE_CMD} {ADMIN_ALL_ARG}",
             )
             return
 
-        # 只取前三个部分，忽略后面可能的额外文本
-        _, group_id, user_id = parts[0:3]
-
-        # 加载用户验证状态
-        user_verification = load_user_verification_status()
-        user_group_key = f"{user_id}_{group_id}"
-
-        # 检查用户是否在等待验证
-        if (
-            user_group_key not in user_verification
-            or user_verification[user_group_key]["status"] != "pending"
-        ):
+        # 在一次提交中更新状态并清理验证数据，只处理仍在等待验证的用户
+        result = state_machine.commit(APPROVE, targets)
+        if len(targets) == 1 and not result.applied:
+            group_id, user_id = targets[0]
             await send_private_msg(
                 websocket, admin_id, f"用户 {user_id} 不在群 {group_id} 的验证队列中"
             )
             return
 
-        # 解除用户禁言
-        await set_group_ban(websocket, group_id, user_id, 0)
+        # 解除禁言并撤回验证消息
+        await state_machine.dispatch(websocket, result)
+        done = result.done
 
-        # 在群里通知用户已被批准
-        await send_group_msg(
-            websocket,
-            group_id,
-            f"[CQ:at,qq={user_id}]({user_id}) 管理员手动通过了你的验证，现在可以正常发言了。",
+        # 每个群只发一条通知
+        notified = group_targets(done)
+        await run_bounded(
+            [
+                (
+                    lambda group_id=group_id, user_ids=user_ids: notify_group_users(
+                        websocket,
+                        group_id,
+                        user_ids,
+                        "管理员手动通过了你的验证，现在可以正常发言了。",
+                    )
+                )
+                for group_id, user_ids in notified.items()
+            ]
         )
 
-        # 更新用户状态
-        user_verification[user_group_key]["status"] = "verified"
-        save_user_verification_status(user_verification)
-
-        # 清理用户验证相关数据
-        clean_user_verification_data(user_id, group_id)
+        # 通知管理员操作结果
+        if len(targets) == 1 and done:
+            group_id, user_id = done[0]
+            summary = f"已批准用户 {user_id} 在群 {group_id} 的验证"
+        else:
+            summary = format_admin_summary("批准", done, result.failed, result.skipped)
+        await send_private_msg(websocket, admin_id, summary)
 
-        # 撤回存储的验证消息
-        del_message = DelMessage()
-        message_id_list = del_message.get_user_messages(group_id, user_id)
-        for message_id in message_id_list:
-            await delete_msg(websocket, message_id)
-            del_message.remove_message(group_id, user_id, message_id)
-        # 通知管理员操作成功
-        await send_private_msg(
-            websocket, admin_id, f"已批准用户 {user_id} 在群 {group_id} 的验证"
+        logging.info(
+            f"管理员 {admin_id} 批准了 {len(done)} 个用户的验证：{group_targets(done)}"
         )
 
-        logging.info(f"管理员 {admin_id} 批准了用户 {user_id} 在群 {group_id} 的验证")
-
     except Exception as e:
         logging.error(f"处理管理员批准命令失败: {e}")
         await send_private_msg(
@@ -704,52 +1118,57 @@ async def handle_admin_approve(websocket, admin_id, command):
 
 # 添加管理员拒绝命令处理函数
 async def handle_admin_reject(websocket, admin_id, command):
-    """处理管理员拒绝命令"""
+    """处理管理员拒绝命令，支持多个QQ号、一个群的全部待验证用户和所有群"""
     try:
         # 确保是验证功能的命令
         if not command.startswith(ADMIN_REJECT_CMD):
             return
 
-        # 解析命令参数
-        parts = command.strip().split()
-        if len(parts) < 3:
+        targets = await parse_admin_targets(command)
+        if targets is None:
             await send_private_msg(
                 websocket,
                 admin_id,
-                f"验证功能命令格式错误，正确格式：{ADMIN_REJECT_CMD} 群号 QQ号",
+                f"验证功能命令格式错误，正确格式：{ADMIN_REJECT_CMD} 群号 QQ号 [QQ号...]"
+                f"，{ADMIN_REJECT_CMD} 群号 {ADMIN_ALL_ARG}，或 {ADMIN_REJECT_CMD} {ADMIN_ALL_ARG}",
             )
             return
 
-        # 只取前三个部分，忽略后面可能的额外文本
-        _, group_id, user_id = parts[0:3]
+        # 在一次提交中更新状态并清理验证数据
+        result = state_machine.commit(REJECT, targets)
 
-        # 加载用户验证状态
-        user_verification = load_user_verification_status()
-        user_group_key = f"{user_id}_{group_id}"
-
-        # 在群里通知用户已被拒绝
-        await send_group_msg(
-            websocket,
-            group_id,
-            f"[CQ:at,qq={user_id}]({user_id}) 管理员拒绝了你的验证，你将被踢出群聊。",
+        # 踢出之前在群里通知，每个群只发一条通知
+        by_group = group_targets(result.applied)
+        await run_bounded(
+            [
+                (
+                    lambda group_id=group_id, user_ids=user_ids: notify_group_users(
+                        websocket,
+                        group_id,
+                        user_ids,
+                        "管理员拒绝了你的验证，你将被踢出群聊。",
+                    )
+                )
+                for group_id, user_ids in by_group.items()
+            ]
         )
 
-        # 踢出用户
-        await set_group_kick(websocket, group_id, user_id)
+        # 踢出用户并撤回验证消息
+        await state_machine.dispatch(websocket, result)
+        done = result.done
 
-        # 更新用户状态
-        user_verification[user_group_key]["status"] = "rejected"
-        save_user_verification_status(user_verification)
+        # 通知管理员操作结果
+        if len(targets) == 1 and done:
+            group_id, user_id = done[0]
+            summary = f"已拒绝用户 {user_id} 在群 {group_id} 的验证并将其踢出"
+        else:
+            summary = format_admin_summary("拒绝", done, result.failed, [])
+        await send_private_msg(websocket, admin_id, summary)
 
-        # 通知管理员操作成功
-        await send_private_msg(
-            websocket,
-            admin_id,
-            f"已拒绝用户 {user_id} 在群 {group_id} 的验证并将其踢出",
+        logging.info(
+            f"管理员 {admin_id} 拒绝了 {len(done)} 个用户的验证：{group_targets(done)}"
         )
 
-        logging.info(f"管理员 {admin_id} 拒绝了用户 {user_id} 在群 {group_id} 的验证")
-
     except Exception as e:
         logging.error(f"处理管理员拒绝命令失败: {e}")
         await send_private_msg(
@@ -762,7 +1181,7 @@ async def handle_scan_verification(websocket, group_id, message_id, user_id):
     """处理管理员发送的扫描验证命令"""
     try:
         # 创建扫描验证对象
-        scanner = ScanVerification()
+        scanner = ScanVerification(member_list_cache)
 
         # 支持扫描所有群：group_id为None时自动扫描
         if group_id is None:
@@ -795,6 +1214,308 @@ async def handle_scan_verification(websocket, group_id, message_id, user_id):
         )
 
 
+# 格式化剩余时间
+def format_time_left(seconds):
+    if seconds is None:
+        return "未知"
+    if seconds <= 0:
+        return "已超时"
+    hours, minutes = divmod(int(seconds) // 60, 60)
+    return f"{hours}小时{minutes}分钟" if hours else f"{minutes}分钟"
+
+
+# 添加查询待验证用户处理函数
+async def handle_pending_query(websocket, admin_id, command):
+    """
+    处理管理员查询待验证用户的命令，只读，不修改任何数据
+
+    格式：待验证 [群号|全部] [页码] [排序字段] [倒序]
+    """
+    try:
+        parts = command.strip().split()[1:]
+        reverse = ADMIN_REVERSE_ARG in parts
+        parts = [part for part in parts if part != ADMIN_REVERSE_ARG]
+        sort = next((part for part in parts if part in SORT_KEYS), DEFAULT_SORT)
+        parts = [part for part in parts if part not in SORT_KEYS]
+
+        # 群号至少5位，较短的数字视为页码
+        group_id = None
+        if parts and parts[0] == ADMIN_ALL_ARG:
+            parts = parts[1:]
+        elif parts and parts[0].isdigit() and len(parts[0]) >= 5:
+            group_id, parts = parts[0], parts[1:]
+        page = int(parts[0]) if parts and parts[0].isdigit() else 1
+        page = max(page, 1)
+
+        entries, total = await pending_index.query(
+            group_id, page, PENDING_PAGE_SIZE, sort, reverse
+        )
+        scope_name = f"群 {group_id} " if group_id is not None else "所有群"
+        if not total:
+            await send_private_msg(websocket, admin_id, f"{scope_name}没有待验证用户")
+            return
+
+        pages = (total + PENDING_PAGE_SIZE - 1) // PENDING_PAGE_SIZE
+        now = time.time()
+        lines = [
+            f"{scope_name}待验证用户 {total} 人，第 {page}/{pages} 页"
+            f"（按{sort}{'倒序' if reverse else '排序'}）"
+        ]
+        for entry in entries:
+            joined = (
+                time.strftime("%m-%d %H:%M", time.localtime(entry.joined_at))
+                if entry.joined_at
+                else "未知"
+            )
+            lines.append(
+                f"群 {entry.group_id} QQ {entry.user_id}｜入群 {joined}"
+                f"｜剩余次数 {entry.remaining_attempts}"
+                f"｜警告 {entry.warnings}/{MAX_WARNING_COUNT}"
+                f"｜剩余时间 {format_time_left(entry.time_left(now))}"
+            )
+        if not entries:
+            lines.append("该页没有数据")
+        lines.append(
+            f"用法：{ADMIN_PENDING_CMD} [群号|{ADMIN_ALL_ARG}] [页码] "
+            f"[{'|'.join(SORT_KEYS)}] [{ADMIN_REVERSE_ARG}]"
+        )
+        await send_private_msg(websocket, admin_id, "\n".join(lines))
+
+    except Exception as e:
+        logging.error(f"处理查询待验证用户命令失败: {e}")
+        await send_private_msg(
+            websocket, admin_id, f"处理查询命令失败，错误信息：{str(e)}"
+        )
+
+
+# 格式化一组验证统计计数
+def format_stats_counts(counts):
+    return (
+        f"入群 {counts['join']}｜答题通过 {counts['pass']}｜批准 {counts['approve']}"
+        f"｜验证失败 {counts['fail']}｜拒绝 {counts['reject']}"
+        f"｜超时踢出 {counts['kick']}｜未验证退群 {counts['leave']}"
+        f"｜信任放行 {counts['trusted']}"
+    )
+
+
+# 入站事件类别在统计回复中的名称
+INBOUND_KIND_NAMES = {
+    "notice": "通知",
+    "answer": "回答",
+    "admin": "管理",
+    "enforcement": "提醒",
+}
+
+
+# 本进程的运行状态
+def format_runtime_stats():
+    """本进程自启动以来各组件的统计，每个组件一行"""
+    dedup = event_deduplicator.stats()
+    gate = private_message_gate.stats()
+    lag = loop_lag_monitor.stats()
+    trust = trust_cache.stats()
+    inbound = inbound_queue.stats()
+    sweep = message_sweeper.stats()
+    lines = [
+        f"重复事件：丢弃 {dedup['hits']}｜新事件 {dedup['misses']}"
+        f"｜淘汰 {dedup['evictions']}｜缓存 {dedup['size']} 条",
+        f"私聊过滤：限速丢弃 {gate['rate_limited']}"
+        f"｜非待验证丢弃 {gate['not_pending']}｜跟踪 {gate['tracked_users']} 人",
+        f"事件循环延迟：中位数 {lag['p50_ms']:.0f} ms，P99 {lag['p99_ms']:.0f} ms"
+        f"，最大 {lag['max_ms']:.0f} ms",
+        f"信任放行：命中 {trust['hits']}｜未命中 {trust['misses']}"
+        f"｜信任 {trust['trusted_users']} 人",
+        f"入站队列：当前 {inbound['depth']}｜最深 {inbound['max_depth']}"
+        f"｜处理 {sum(inbound['processed'].values())}"
+        f"｜丢弃 {sum(inbound['shed'].values())}",
+        f"验证消息清理：撤回 {sweep['recalled']}｜删除过期记录 {sweep['expired']}",
+    ]
+    if inbound["wait"]:
+        lines.append(
+            "排队等待 P99："
+            + "｜".join(
+                f"{INBOUND_KIND_NAMES.get(kind, kind)} {wait['p99_ms']:.0f} ms"
+                for kind, wait in inbound["wait"].items()
+            )
+        )
+    # 只有异步写盘的分片存储有后台写入线程
+    writer = getattr(get_store(), "writer", None)
+    if writer is not None:
+        writes = writer.stats()
+        lines.append(
+            f"后台写盘：写入 {writes['writes']}｜合并 {writes['coalesced']}"
+            f"｜失败 {writes['errors']}｜排队 {writes['pending']}"
+            f"｜最长 {writes['max_write_ms']:.0f} ms"
+        )
+    return lines
+
+
+# 查询验证统计
+async def handle_stats_query(websocket, admin_id, command):
+    """
+    处理管理员查询验证统计的命令，只读取该群的一条统计记录或固定数量的合计记录
+
+    格式：验证统计 [群号]
+    """
+    try:
+        parts = command.strip().split()[1:]
+        group_id = parts[0] if parts and parts[0].isdigit() else None
+        stats = load_stats(group_id)
+        scope_name = f"群 {group_id} " if group_id is not None else "所有群"
+
+        pass_rate = stats["pass_rate"]
+        median_attempts = stats["median_attempts"]
+        lines = [
+            f"{scope_name}验证统计",
+            f"累计：{format_stats_counts(stats['total'])}",
+            f"最近24小时：{format_stats_counts(stats['recent'])}",
+            f"通过率：{'暂无' if pass_rate is None else f'{pass_rate:.1%}'}"
+            f"｜答题次数中位数：{'暂无' if median_attempts is None else median_attempts}",
+        ]
+        # 本进程自启动以来的耗时分位数
+        if group_id is not None:
+            timings = tracer.percentiles(group_id)
+            if "first_prompt" in timings:
+                lines.append(
+                    f"入群到验证消息送达：中位数 {timings['first_prompt']['p50_ms']:.0f} ms"
+                    f"，P99 {timings['first_prompt']['p99_ms']:.0f} ms"
+                )
+            if "verify" in timings:
+                lines.append(
+                    f"入群到完成验证：中位数 {timings['verify']['p50_ms'] / 1000:.0f} 秒"
+                    f"，P99 {timings['verify']['p99_ms'] / 1000:.0f} 秒"
+                )
+        else:
+            lines.append("本进程运行状态")
+            lines.extend(format_runtime_stats())
+        await send_private_msg(websocket, admin_id, "\n".join(lines))
+
+    except Exception as e:
+        logging.error(f"处理查询验证统计命令失败: {e}")
+        await send_private_msg(
+            websocket, admin_id, f"处理查询统计命令失败，错误信息：{str(e)}"
+        )
+
+
+# 解析导出命令
+def parse_export_command(command):
+    """
+    解析导出验证记录的命令，参数顺序不限
+
+    格式：导出验证 [群号|全部] [状态...] [开始日期 [结束日期]] [csv|jsonl] [压缩]
+    日期格式为 YYYY-MM-DD，结束日期当天包括在内
+
+    返回:
+        dict: group_id、statuses、since、until、fmt、compress
+    异常:
+        ValueError: 参数无法识别
+    """
+    statuses = {status.label: status for status in Status}
+    statuses.update(EXPORT_STATUS_ARGS)
+    options = {
+        "group_id": None,
+        "statuses": set(),
+        "since": None,
+        "until": None,
+        "fmt": EXPORT_FORMATS[0],
+        "compress": False,
+    }
+    dates = []
+    for part in command.strip().split()[1:]:
+        if part == ADMIN_ALL_ARG:
+            continue
+        elif part.lower() in EXPORT_FORMATS:
+            options["fmt"] = part.lower()
+        elif part.lower() in EXPORT_COMPRESS_ARGS:
+            options["compress"] = True
+        elif part.lower() in statuses:
+            options["statuses"].add(statuses[part.lower()])
+        elif part.isdigit() and len(part) >= 5:
+            options["group_id"] = part
+        else:
+            try:
+                dates.append(time.mktime(time.strptime(part, "%Y-%m-%d")))
+            except ValueError:
+                raise ValueError(f"无法识别的参数：{part}")
+    if len(dates) > 2:
+        raise ValueError("最多指定开始和结束两个日期")
+    if dates:
+        options["since"] = dates[0]
+    if len(dates) == 2:
+        options["until"] = dates[1] + 24 * 60 * 60
+    return options
+
+
+# 正在进行的导出，同一时间只进行一个
+_export_task = None
+
+
+# 导出验证记录
+async def handle_export_command(websocket, admin_id, command):
+    """
+    处理管理员导出验证记录的命令，导出在后台进行，完成后私聊通知文件路径
+
+    格式：导出验证 [群号|全部] [状态...] [开始日期 [结束日期]] [csv|jsonl] [压缩]
+    """
+    global _export_task
+    try:
+        if _export_task is not None and not _export_task.done():
+            await send_private_msg(
+                websocket, admin_id, "已有导出正在进行，请等待完成后再试"
+            )
+            return
+        try:
+            options = parse_export_command(command)
+        except ValueError as e:
+            await send_private_msg(
+                websocket,
+                admin_id,
+                f"{e}\n用法：{ADMIN_EXPORT_CMD} [群号|{ADMIN_ALL_ARG}] "
+                f"[{'|'.join(EXPORT_STATUS_ARGS)}] [开始日期 [结束日期]] "
+                f"[{'|'.join(EXPORT_FORMATS)}] [{EXPORT_COMPRESS_ARGS[0]}]",
+            )
+            return
+
+        path = export_path(options["fmt"], options["compress"], options["group_id"])
+        _export_task = spawn_background(run_export(websocket, admin_id, path, options))
+        await send_private_msg(
+            websocket, admin_id, "开始导出验证记录，完成后会发送文件路径"
+        )
+
+    except Exception as e:
+        logging.error(f"处理导出验证记录命令失败: {e}")
+        await send_private_msg(
+            websocket, admin_id, f"处理导出命令失败，错误信息：{str(e)}"
+        )
+
+
+async def run_export(websocket, admin_id, path, options):
+    """在后台导出验证记录，并把结果私聊发给管理员"""
+    started = time.monotonic()
+    try:
+        count = await export_records(
+            path,
+            options["fmt"],
+            options["group_id"],
+            options["statuses"],
+            options["since"],
+            options["until"],
+        )
+        logging.info(f"已导出 {count} 条验证记录到 {path}")
+        await send_private_msg(
+            websocket,
+            admin_id,
+            f"导出完成：{count} 条记录，用时 {time.monotonic() - started:.1f} 秒\n"
+            f"文件：{path}\n"
+            f"只包含当前的验证记录，已退群的用户不在其中",
+        )
+    except Exception as e:
+        logging.error(f"导出验证记录失败: {e}")
+        await send_private_msg(
+            websocket, admin_id, f"导出验证记录失败，错误信息：{str(e)}"
+        )
+
+
 # 添加私聊扫描验证处理函数
 async def handle_private_scan_verification(websocket, admin_id, command):
     """处理管理员私聊发送的扫描验证命令"""
@@ -808,7 +1529,7 @@ async def handle_private_scan_verification(websocket, admin_id, command):
         # 支持无群号参数，自动扫描所有群
         if len(parts) < 2:
             # 无群号，扫描所有群
-            scanner = ScanVerification()
+            scanner = ScanVerification(member_list_cache)
             await send_private_msg(
                 websocket,
                 admin_id,
@@ -840,7 +1561,7 @@ async def handle_private_scan_verification(websocket, admin_id, command):
         )
 
         # 创建扫描验证对象
-        scanner = ScanVerification()
+        scanner = ScanVerification(member_list_cache)
 
         # 执行扫描和警告
         result = await scanner.warn_pending_users(websocket, group_id)
@@ -870,81 +1591,190 @@ async def handle_private_scan_verification(websocket, admin_id, command):
         )
 
 
-# 清理用户验证相关数据
-def clean_user_verification_data(user_id, group_id):
-    """清理用户验证成功后的相关数据"""
-    try:
-        user_group_key = f"{user_id}_{group_id}"
-
-        # 清理验证问题
-        questions = load_verification_questions()
-        if user_group_key in questions:
-            del questions[user_group_key]
-            with open(VERIFICATION_QUESTIONS_FILE, "w", encoding="utf-8") as f:
-                json.dump(questions, f, ensure_ascii=False, indent=4)
-
-        # 清理警告记录
-        warning_record = {}
-        if os.path.exists(WARNING_RECORD_FILE):
-            with open(WARNING_RECORD_FILE, "r", encoding="utf-8") as f:
-                warning_record = json.load(f)
-
-        if user_group_key in warning_record:
-            del warning_record[user_group_key]
-            with open(WARNING_RECORD_FILE, "w", encoding="utf-8") as f:
-                json.dump(warning_record, f, ensure_ascii=False, indent=4)
-
-        # 清理警告上限记录
-        reached_limit = {}
-        if os.path.exists(REACHED_LIMIT_FILE):
-            with open(REACHED_LIMIT_FILE, "r", encoding="utf-8") as f:
-                reached_limit = json.load(f)
-
-        if group_id in reached_limit and user_id in reached_limit[group_id]:
-            reached_limit[group_id].remove(user_id)
-            # 如果组为空，删除该组
-            if not reached_limit[group_id]:
-                del reached_limit[group_id]
-            with open(REACHED_LIMIT_FILE, "w", encoding="utf-8") as f:
-                json.dump(reached_limit, f, ensure_ascii=False, indent=4)
-
-        logging.info(f"已清理用户 {user_id} 在群 {group_id} 的验证相关数据")
-    except Exception as e:
-        logging.error(f"清理用户验证数据失败: {e}")
+# 无需开启功能也要响应的群命令
+GROUP_COMMANDS = {"gev", ADMIN_SCAN_CMD}
+# 管理员私聊命令的前缀
+ADMIN_PRIVATE_COMMANDS = (
+    ADMIN_APPROVE_CMD,
+    ADMIN_REJECT_CMD,
+    ADMIN_PENDING_CMD,
+    ADMIN_STATS_CMD,
+    ADMIN_EXPORT_CMD,
+    ADMIN_SCAN_PRIVATE_CMD,
+)
+
+
+# 群内事件是否需要处理：功能开启的群，或者是开关/扫描命令
+def _group_enabled(msg):
+    return load_function_status(str(msg.get("group_id")))
+
+
+def _group_message_enabled(msg):
+    return msg.get("raw_message") in GROUP_COMMANDS or _group_enabled(msg)
+
+
+# 私聊消息是否需要处理：管理员不限流，其他用户经过令牌桶和“无待验证记录”缓存
+def _private_message_allowed(msg):
+    user_id = str(msg.get("user_id"))
+    return user_id in owner_id or private_message_gate.allow(user_id)
+
+
+# 各类事件用于区分子类型的字段
+EVENT_SUBTYPE_FIELDS = {
+    "message": "message_type",
+    "notice": "notice_type",
+    "request": "request_type",
+    "meta_event": "meta_event_type",
+}
+
+# 事件分发表：(post_type, 子类型) -> (处理函数, 过滤函数)
+# 不在表中的事件（心跳、其他通知等）以及过滤函数返回 False 的事件直接丢弃，
+# 不会触发任何文件或状态读取
+EVENT_DISPATCH = {
+    ("message", "group"): (handle_group_message, _group_message_enabled),
+    ("message", "private"): (handle_private_message, _private_message_allowed),
+    ("notice", "group_increase"): (handle_group_notice, _group_enabled),
+    ("notice", "group_decrease"): (handle_group_notice, _group_enabled),
+    ("request", "group"): (handle_request_event, _group_enabled),
+    ("meta_event", "lifecycle"): (handle_meta_event, None),
+}
+
+
+# 事件在入站队列中的优先级
+def event_priority(msg):
+    """返回事件的优先级，回调事件和元事件返回 None，不经过队列直接处理"""
+    post_type = msg.get("post_type")
+    if post_type in ("notice", "request"):
+        return PRIORITY_NOTICE
+    if post_type != "message":
+        return None
+    raw_message = str(msg.get("raw_message"))
+    if msg.get("message_type") == "private":
+        if str(msg.get("user_id")) in owner_id and raw_message.startswith(
+            ADMIN_PRIVATE_COMMANDS
+        ):
+            return PRIORITY_ADMIN
+        return PRIORITY_ANSWER
+    if raw_message in GROUP_COMMANDS:
+        return PRIORITY_ADMIN
+    return PRIORITY_ENFORCEMENT
+
+
+# 查找事件的处理函数
+def resolve_handler(msg):
+    """返回事件的处理函数，与本插件无关的事件返回 None"""
+    post_type = msg.get("post_type")
+
+    # 回调事件，只关心本插件发出的验证消息（成功或失败）
+    if post_type is None:
+        echo = msg.get("echo")
+        if isinstance(echo, str) and echo.startswith(ECHO_PREFIXES):
+            return handle_response
+        return None
+
+    subtype_field = EVENT_SUBTYPE_FIELDS.get(post_type)
+    if subtype_field is None:
+        return None
+
+    entry = EVENT_DISPATCH.get((post_type, msg.get(subtype_field)))
+    if entry is None:
+        return None
+
+    handler, accept = entry
+    if accept is not None and not accept(msg):
+        return None
+    return handler
+
+
+# 分片模式下事件所属的群
+def get_event_group_ids(msg):
+    """返回事件应交给哪些群的分片处理，返回 None 表示交给所有分片"""
+    post_type = msg.get("post_type")
+
+    # 回调事件，echo 格式：{action}_GroupEntryVerification_{group_id}_{user_id}_{seq}
+    if post_type is None:
+        return [msg["echo"].split(ECHO_NOTE_PREFIX, 1)[1].split("_")[0]]
+
+    if post_type == "meta_event":
+        return None
+
+    if post_type == "message" and msg.get("message_type") == "private":
+        user_id = str(msg.get("user_id"))
+        raw_message = str(msg.get("raw_message"))
+        if user_id in owner_id and raw_message.startswith(ADMIN_PRIVATE_COMMANDS):
+            # 管理员命令按命令中的群号路由，没有群号的命令交给固定的分片
+            parts = raw_message.strip().split()
+            return [parts[1] if len(parts) > 1 else ""]
+        # 验证答案交给用户第一个待验证群所在的分片，与 handle_private_message 的处理顺序一致
+        pending_group_ids = get_pending_group_ids(user_id)
+        if not pending_group_ids:
+            private_message_gate.note_not_pending(user_id)
+        return pending_group_ids[:1]
+
+    return [str(msg.get("group_id"))]
+
+
+# 主进程处理工作进程发来的控制消息
+def handle_shard_control(name, *args):
+    if name == FUNCTION_STATUS_CONTROL:
+        group_id, status = args
+        _function_status_cache[group_id] = status
+
+
+_shard_dispatcher = None
+
+
+def get_shard_dispatcher():
+    """获取分片模式下的事件路由器"""
+    global _shard_dispatcher
+    if _shard_dispatcher is None:
+        _shard_dispatcher = ShardDispatcher(
+            SHARD_WORKERS, get_event_group_ids, handle_shard_control
+        )
+    return _shard_dispatcher
 
 
 # 统一事件处理入口
 async def handle_events(websocket, msg):
     """统一事件处理入口"""
     post_type = msg.get("post_type", "response")  # 添加默认值
+    loop_lag_monitor.start()
     try:
-
-        # 处理回调事件
-        if msg.get("status") == "ok":
-            await handle_response(websocket, msg)
+        handler = resolve_handler(msg)
+        if handler is None:
             return
 
-        post_type = msg.get("post_type")
+        # 重复推送的事件直接丢弃，分片模式下由主进程去重
+        if not is_shard_worker() and event_deduplicator.is_duplicate(msg):
+            return
 
-        # 处理元事件
-        if post_type == "meta_event":
-            await handle_meta_event(websocket, msg)
+        # 入群的用户之后会有待验证记录；分片模式下记录由工作进程写入，主进程收不到存储的修改通知
+        if msg.get("notice_type") == "group_increase":
+            private_message_gate.note_pending(msg.get("user_id"))
 
-        # 处理消息事件
-        elif post_type == "message":
-            message_type = msg.get("message_type")
-            if message_type == "group":
-                await handle_group_message(websocket, msg)
-            elif message_type == "private":
-                await handle_private_message(websocket, msg)
+        # 分片模式下由主进程路由给工作进程处理
+        if SHARD_WORKERS > 0 and not is_shard_worker():
+            await get_shard_dispatcher().dispatch(websocket, msg)
+            return
 
-        # 处理通知事件
-        elif post_type == "notice":
-            await handle_group_notice(websocket, msg)
+        # 消息记录由处理事件的进程清理
+        message_sweeper.start(websocket)
+        # 信任缓存由处理事件的进程在后台读取
+        if TRUST_GROUPS:
+            trust_cache.start()
 
-        # 处理请求事件
-        elif post_type == "request":
-            await handle_request_event(websocket, msg)
+        priority = event_priority(msg)
+        if priority is None:
+            await handler(websocket, msg)
+            return
+        if priority == PRIORITY_ENFORCEMENT:
+            # 撤回和禁言在入队前完成，过载时只丢弃提醒
+            remind = await enforce_pending_member(websocket, msg)
+            if remind is not None:
+                await inbound_queue.submit(priority, remind)
+            return
+        # 按优先级排队处理，过载时低优先级的事件会被丢弃
+        await inbound_queue.submit(priority, lambda: handler(websocket, msg))
 
     except Exception as e:
         error_type = {
@@ -0,0 +1,156 @@
+"""
+验证消息记录的定期清理
+
+正常结束验证时状态机会撤回并删除用户的验证消息记录，但处理出错或离线期间结束的验证会留下记录。
+后台任务每隔 MESSAGE_SWEEP_INTERVAL 秒检查一次所有群的消息记录：
+    - 已不在等待验证的用户：仍在撤回时间窗口内的消息批量撤回，记录全部删除；
+    - 超过撤回时间窗口（del_message.MESSAGE_RECALL_WINDOW）的消息：直接删除记录。
+一次清理的所有修改在一次存储提交中完成。
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.api import delete_msg
+from app.scripts.GroupEntryVerification.records import RecordTable
+from app.scripts.GroupEntryVerification.shard import owns_group
+from app.scripts.GroupEntryVerification.state_machine import run_bounded
+from app.scripts.GroupEntryVerification.del_message import (
+    MESSAGE_RECALL_WINDOW,
+    message_entries,
+)
+from app.scripts.GroupEntryVerification.store import (
+    get_store,
+    USER_VERIFICATION,
+    MESSAGE_ID_LIST,
+)
+
+# 清理间隔（秒）
+MESSAGE_SWEEP_INTERVAL = 10 * 60
+# 同时进行的撤回调用数
+MESSAGE_SWEEP_CONCURRENCY = 10
+
+
+def collect_stale_messages(now=None):
+    """
+    删除已结束验证的用户和超过撤回窗口的消息记录
+
+    返回:
+        tuple: ({群号: [需要撤回的message_id, ...]}, 删除的过期记录数)
+    """
+    store = get_store()
+    # 读取验证状态之前的时间，之后新记录的消息可能属于重新入群的用户，不在本次清理
+    snapshot = time.time() if now is None else now
+    group_ids = [
+        group_id for group_id in store.load(MESSAGE_ID_LIST) if owns_group(group_id)
+    ]
+    pending = {
+        group_id: {
+            str(record.user_id)
+            for record in RecordTable.from_dicts(
+                store.load_group(USER_VERIFICATION, group_id)
+            ).pending()
+        }
+        for group_id in group_ids
+    }
+    recalls = {}
+    expired = {}
+
+    def sweep(group_id):
+        # 存储冲突重试时会重新调用，以最后一次为准
+        def apply(value):
+            recalls.pop(group_id, None)
+            expired.pop(group_id, None)
+            if not value:
+                return None
+            kept_group = {}
+            for user_id, values in value.items():
+                resolved = user_id not in pending[group_id]
+                kept = []
+                for message_id, recorded_at in message_entries(values, snapshot):
+                    if snapshot - recorded_at >= MESSAGE_RECALL_WINDOW:
+                        expired[group_id] = expired.get(group_id, 0) + 1
+                    elif resolved and recorded_at <= snapshot:
+                        recalls.setdefault(group_id, []).append(message_id)
+                    else:
+                        kept.append([message_id, recorded_at])
+                if kept:
+                    kept_group[user_id] = kept
+            return kept_group or None
+
+        return apply
+
+    if group_ids:
+        store.update_many(
+            MESSAGE_ID_LIST, {group_id: sweep(group_id) for group_id in group_ids}
+        )
+    return recalls, sum(expired.values())
+
+
+async def sweep_messages(websocket, now=None):
+    """
+    清理一次消息记录，并批量撤回已结束验证的用户仍可撤回的验证消息
+
+    返回:
+        tuple: (撤回的消息数, 删除的过期记录数)
+    """
+    recalls, expired = collect_stale_messages(now)
+    message_ids = [message_id for ids in recalls.values() for message_id in ids]
+    errors = await run_bounded(
+        [
+            lambda message_id=message_id: delete_msg(websocket, message_id)
+            for message_id in message_ids
+        ],
+        MESSAGE_SWEEP_CONCURRENCY,
+    )
+    failed = sum(1 for error in errors if error is not None)
+    if message_ids or expired:
+        logging.info(
+            f"清理验证消息记录：撤回 {len(message_ids) - failed} 条"
+            f"（失败 {failed} 条），删除过期记录 {expired} 条"
+        )
+    return len(message_ids) - failed, expired
+
+
+class MessageSweeper:
+    """在后台定期清理验证消息记录"""
+
+    def __init__(self, interval=MESSAGE_SWEEP_INTERVAL):
+        self.interval = interval
+        self.websocket = None
+        self._task = None
+        self.recalled = 0
+        self.expired = 0
+
+    def start(self, websocket):
+        """记录最新的连接，并在当前事件循环中开始定期清理，已经开始时不重复启动"""
+        self.websocket = websocket
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                recalled, expired = await sweep_messages(self.websocket)
+                self.recalled += recalled
+                self.expired += expired
+            except Exception as e:
+                logging.error(f"清理验证消息记录失败: {e}")
+
+    def stats(self):
+        """累计撤回和删除的记录数"""
+        return {"recalled": self.recalled, "expired": self.expired}
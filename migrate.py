@@ -0,0 +1,299 @@
+"""
+从旧的整表 JSON 文件流式迁移验证数据
+
+旧版本把每张表保存为 DATA_DIR 下的一个 JSON 文件（user_verification.json 等），
+文件很大时整个读入内存会让峰值内存翻倍。这里用增量解析器逐条读取记录，
+按固定大小的批次写入目标存储，内存占用只与单条记录和批次大小有关。
+
+迁移进度按表保存在状态文件中，中断后重新运行会跳过已经写入的记录；源文件的大小或修改时间变化时从头开始。
+写入的是记录的完整值，重复写入是幂等的。全部写入后再流式读一遍源文件，逐条核对目标存储中的记录，
+核对通过的记录数与源文件的记录数一致时才算迁移成功。源文件只读，不会被修改或删除。
+
+用法：
+    python migrate.py --to shard
+    python migrate.py --to journal
+    python migrate.py --to redis --redis-url redis://127.0.0.1:6379/0
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.store import (
+    DATA_DIR,
+    TABLES,
+    GroupShardStore,
+    _write_json,
+)
+
+# 每次从文件读取的字符数
+CHUNK_SIZE = 1 << 20
+# 每批写入的记录数
+BATCH_SIZE = 5000
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# 数字后面可能还没读入的部分：小数、指数（"-0" 后面可能是 ".5"，"1" 后面可能是 "e3"）
+_VALUE_TAIL = re.compile(r"[0-9.eE+\-]*[ \t\n\r]*")
+
+
+class StreamingParseError(ValueError):
+    """源文件不是顶层为对象的 JSON"""
+
+
+class _ChunkReader:
+    """按块读取文本，缓冲区中只保留尚未解析的部分"""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """读入下一块，文件已读完时返回 False"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符，文件结束时返回空字符串"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise StreamingParseError(f"期望 {char!r}，实际为 {found!r}")
+        self.pos += 1
+
+    def decode(self):
+        """解析下一个完整的 JSON 值"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self.fill():
+                    continue
+                raise StreamingParseError(str(e)) from e
+            # 数字可能被块边界截断，值后面必须还能看到分隔符才算完整
+            if _VALUE_TAIL.match(self.buffer, end).end() == len(self.buffer):
+                if self.fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def iter_json_object(path, chunk_size=CHUNK_SIZE):
+    """
+    逐条读取顶层为对象的 JSON 文件
+
+    产生:
+        (键, 值)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        reader = _ChunkReader(f, chunk_size)
+        if reader.peek() == "":
+            # 旧的加载函数把空文件当作空表
+            return
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key = reader.decode()
+            if not isinstance(key, str):
+                raise StreamingParseError(f"键必须是字符串: {key!r}")
+            reader.expect(":")
+            yield key, reader.decode()
+            separator = reader.peek()
+            if separator == "}":
+                return
+            reader.expect(",")
+
+
+def _write_batch(store, table, batch):
+    store.update_many(table, {key: (lambda _, v=value: v) for key, value in batch})
+
+
+def migrate_table(store, table, path, batch_size=BATCH_SIZE, skip=0, on_batch=None):
+    """
+    把一张表的记录按批写入目标存储
+
+    参数:
+        store: 目标存储
+        table (str): 表名
+        path (str): 源文件路径
+        batch_size (int): 每批写入的记录数
+        skip (int): 跳过前面已经写入的记录数
+        on_batch (callable): 每批写入后调用，参数为已写入的记录总数
+
+    返回:
+        int: 源文件中的记录总数
+    """
+    batch = []
+    count = 0
+    for key, value in iter_json_object(path):
+        count += 1
+        if count <= skip:
+            continue
+        batch.append((key, value))
+        if len(batch) >= batch_size:
+            _write_batch(store, table, batch)
+            batch = []
+            if on_batch is not None:
+                on_batch(count)
+    if batch:
+        _write_batch(store, table, batch)
+    if on_batch is not None:
+        on_batch(count)
+    return count
+
+
+def verify_table(store, table, path):
+    """
+    逐条核对目标存储中的记录与源文件是否一致
+
+    返回:
+        (源文件记录数, 一致的记录数)
+    """
+    total = matched = 0
+    for key, value in iter_json_object(path):
+        total += 1
+        if store.get(table, key) == value:
+            matched += 1
+        else:
+            logging.warning(f"{table} 中的记录 {key} 与源文件不一致")
+    return total, matched
+
+
+def import_legacy_tables(store, data_dir=DATA_DIR, batch_size=BATCH_SIZE):
+    """把 data_dir 下旧的整表 JSON 文件流式导入存储，不记录进度，供存储首次启动时使用"""
+    for table in TABLES:
+        path = os.path.join(data_dir, f"{table}.json")
+        if not os.path.exists(path):
+            continue
+        try:
+            count = migrate_table(store, table, path, batch_size)
+        except (StreamingParseError, UnicodeDecodeError) as e:
+            logging.error(f"导入{table}失败: {e}")
+            continue
+        logging.info(f"已将 {table} 的 {count} 条记录导入{type(store).__name__}")
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def migrate(store, source_dir, state_path, batch_size=BATCH_SIZE):
+    """
+    迁移所有表并核对
+
+    返回:
+        bool: 所有表核对通过
+    """
+    state = _load_state(state_path)
+    ok = True
+    for table in TABLES:
+        path = os.path.join(source_dir, f"{table}.json")
+        if not os.path.exists(path):
+            continue
+        signature = _source_signature(path)
+        progress = state.get(table)
+        if progress is None or progress.get("source") != signature:
+            progress = {"source": signature, "done": 0, "complete": False}
+            state[table] = progress
+
+        if progress["complete"]:
+            logging.info(f"{table} 已迁移，跳过写入")
+        else:
+            if progress["done"]:
+                logging.info(f"{table} 从第 {progress['done'] + 1} 条记录继续迁移")
+
+            def save_progress(done):
+                progress["done"] = done
+                _write_json(state_path, state)
+                logging.info(f"{table}: 已写入 {done} 条记录")
+
+            migrate_table(
+                store, table, path, batch_size, progress["done"], save_progress
+            )
+            progress["complete"] = True
+            _write_json(state_path, state)
+
+        total, matched = verify_table(store, table, path)
+        if total == matched:
+            logging.info(f"{table}: 源文件 {total} 条记录，全部核对一致")
+        else:
+            ok = False
+            logging.error(f"{table}: 源文件 {total} 条记录，只有 {matched} 条核对一致")
+    return ok
+
+
+def open_target(name, data_dir, redis_url=None):
+    """创建迁移目标存储，不触发存储自身的首次导入"""
+    if name == "shard":
+        return GroupShardStore(data_dir, import_legacy=False)
+    if name == "journal":
+        from app.scripts.GroupEntryVerification.journal_store import JournalStore
+
+        return JournalStore(data_dir, import_existing=False)
+    if name == "redis":
+        from app.scripts.GroupEntryVerification.redis_store import RedisStore
+
+        if not redis_url:
+            raise ValueError("迁移到 Redis 需要指定 --redis-url")
+        return RedisStore.from_url(redis_url)
+    raise ValueError(f"未知的目标存储: {name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="把旧的整表 JSON 验证数据流式迁移到新的存储"
+    )
+    parser.add_argument("--to", required=True, choices=("shard", "journal", "redis"))
+    parser.add_argument("--source", default=DATA_DIR, help="旧 JSON 文件所在目录")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="目标存储的数据目录")
+    parser.add_argument("--redis-url", default="")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--state", default=None, help="迁移进度文件路径")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    state_path = args.state or os.path.join(args.data_dir, f"migration_{args.to}.json")
+    store = open_target(args.to, args.data_dir, args.redis_url)
+    try:
+        ok = migrate(store, args.source, state_path, args.batch_size)
+    finally:
+        close = getattr(store, "close", None)
+        if close is not None:
+            close()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
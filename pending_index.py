@@ -0,0 +1,203 @@
+"""
+待验证用户的内存索引
+
+第一次查询时从存储读入所有待验证记录和警告次数，之后通过存储的修改通知保持更新，
+查询只在内存中进行，不读写存储，也不会修改警告次数。
+其他进程（分片工作进程、共用 Redis 的其他实例）的修改收不到通知，
+索引超过 PENDING_INDEX_MAX_AGE 后会在下次查询时从存储重建。
+重建在线程中读取存储，不阻塞事件循环；读取期间收到的修改通知先缓存，替换索引后按顺序重放。
+"""
+
+import os
+import sys
+import time
+import heapq
+import asyncio
+import threading
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.records import (
+    VerificationRecord,
+    RecordTable,
+    parse_key,
+)
+from app.scripts.GroupEntryVerification.store import (
+    get_store,
+    add_listener,
+    USER_VERIFICATION,
+    WARNING_RECORD,
+)
+
+# 入群后应在多长时间内完成验证（秒），查询命令据此显示剩余时间
+# 超时的用户仍由扫描验证命令警告和踢出
+VERIFICATION_DEADLINE = 24 * 60 * 60
+# 索引从存储重建的最长间隔（秒）
+PENDING_INDEX_MAX_AGE = 5 * 60
+
+# 排序字段：名称 -> 排序键，参数为 (记录, 警告次数字典)
+# 剩余时间由入群时间决定，按入群时间排序即按剩余时间排序
+SORT_KEYS = {
+    "入群": lambda record, warnings: record.joined_at,
+    "次数": lambda record, warnings: record.remaining_attempts,
+    "警告": lambda record, warnings: warnings.get(record.key, 0),
+}
+DEFAULT_SORT = "入群"
+
+
+class PendingEntry:
+    """查询结果中的一行"""
+
+    __slots__ = ("user_id", "group_id", "joined_at", "remaining_attempts", "warnings")
+
+    def __init__(self, record, warnings):
+        self.user_id = record.user_id
+        self.group_id = record.group_id
+        self.joined_at = record.joined_at
+        self.remaining_attempts = record.remaining_attempts
+        self.warnings = warnings
+
+    def time_left(self, now=None):
+        """距离验证截止的秒数，已超时为负数，没有入群时间的旧记录返回 None"""
+        if not self.joined_at:
+            return None
+        return self.joined_at + VERIFICATION_DEADLINE - (now or time.time())
+
+
+def _load_pending(store):
+    """从存储读取所有待验证记录和警告次数，在线程中调用"""
+    records = RecordTable.from_dicts(store.load(USER_VERIFICATION))
+    warnings = {}
+    for key, count in store.load(WARNING_RECORD).items():
+        ids = parse_key(key)
+        if ids is not None:
+            warnings[ids] = int(count)
+    return RecordTable(records.pending()), warnings
+
+
+class PendingIndex:
+    """待验证记录和警告次数的内存索引"""
+
+    def __init__(self, max_age=PENDING_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._records = None
+        self._warnings = {}
+        self._built_at = 0
+        # 还没有建立索引，或整张表被覆盖后需要重建
+        self._invalid = True
+        # 重建期间收到的修改，替换索引后按顺序重放
+        self._buffer = None
+        self._rebuilding = None
+        add_listener(self._on_change)
+
+    async def refresh(self):
+        """索引不存在或已过期时在线程中从存储重建，同时进行的查询等待同一次重建"""
+        if not self._invalid and time.monotonic() - self._built_at <= self.max_age:
+            return
+        # 重建期间整张表又被覆盖时再读取一次
+        while True:
+            if self._rebuilding is None:
+                self._rebuilding = asyncio.ensure_future(self._rebuild())
+            await asyncio.shield(self._rebuilding)
+            if not self._invalid:
+                return
+
+    async def _rebuild(self):
+        with self._lock:
+            self._buffer = []
+        try:
+            records, warnings = await asyncio.to_thread(_load_pending, get_store())
+            with self._lock:
+                self._records = records
+                self._warnings = warnings
+                self._built_at = time.monotonic()
+                self._invalid = False
+                # 读取期间的修改可能已包含在读取结果中，重放的是同样的最终值
+                for table, changes in self._buffer:
+                    self._apply(table, changes)
+        finally:
+            with self._lock:
+                self._buffer = None
+            self._rebuilding = None
+
+    def _on_change(self, table, changes, previous):
+        if table not in (USER_VERIFICATION, WARNING_RECORD):
+            return
+        with self._lock:
+            if self._buffer is not None:
+                self._buffer.append((table, changes))
+            elif self._records is not None:
+                self._apply(table, changes)
+
+    def _apply(self, table, changes):
+        if changes is None:
+            # 整张表被覆盖，下次查询时重建
+            self._invalid = True
+            return
+        for key, value in changes.items():
+            ids = parse_key(key)
+            if ids is None:
+                continue
+            user_id, group_id = ids
+            if table == WARNING_RECORD:
+                if value is None:
+                    self._warnings.pop((user_id, group_id), None)
+                else:
+                    self._warnings[(user_id, group_id)] = int(value)
+                continue
+            record = VerificationRecord.from_dict(key, value) if value else None
+            if record is not None and record.is_pending:
+                self._records.add(record)
+            else:
+                self._records.remove(user_id, group_id)
+
+    async def pending(self, group_id=None):
+        """待验证的记录，可按群过滤"""
+        await self.refresh()
+        with self._lock:
+            return self._records.pending(group_id)
+
+    async def query(
+        self, group_id=None, page=1, page_size=20, sort=DEFAULT_SORT, reverse=False
+    ):
+        """
+        分页查询待验证用户
+
+        参数:
+            group_id: 群号，None 表示所有群
+            page (int): 页码，从 1 开始
+            page_size (int): 每页行数
+            sort (str): 排序字段，见 SORT_KEYS
+            reverse (bool): 是否倒序
+
+        返回:
+            (当前页的 PendingEntry 列表, 总数)
+        """
+        key = SORT_KEYS[sort]
+        # 只需要前 page * page_size 行，用堆取代完整排序
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        await self.refresh()
+        with self._lock:
+            warnings = self._warnings
+            records = (
+                self._records.by_group(group_id)
+                if group_id is not None
+                else list(self._records)
+            )
+            top = select(
+                page * page_size,
+                records,
+                key=lambda record: (
+                    key(record, warnings),
+                    record.group_id,
+                    record.user_id,
+                ),
+            )
+            entries = [
+                PendingEntry(record, warnings.get(record.key, 0))
+                for record in top[(page - 1) * page_size :]
+            ]
+        return entries, len(records)
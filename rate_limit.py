@@ -0,0 +1,130 @@
+"""
+私聊消息的限流
+
+任何人都可以高频私聊机器人，每条私聊都会按用户索引读取待验证记录和题目，答错还会写入存储。
+这里在读取任何状态之前用内存中的数据过滤：
+    - 最近确认过没有待验证记录的用户，在 NOT_PENDING_TTL 内的私聊直接丢弃；
+    - 每个用户一个令牌桶，超过 PRIVATE_MSG_BURST 条后按 PRIVATE_MSG_RATE 条/秒放行。
+本进程写入新的待验证记录时（存储的修改通知）以及收到入群通知时，会清除该用户的“无待验证记录”缓存。
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.records import Status
+from app.scripts.GroupEntryVerification.store import (
+    add_listener,
+    user_of,
+    USER_VERIFICATION,
+)
+
+# 令牌桶容量：连续私聊的条数
+PRIVATE_MSG_BURST = 5
+# 令牌恢复速度（条/秒）
+PRIVATE_MSG_RATE = 0.5
+# 没有待验证记录的用户的缓存时间（秒）
+NOT_PENDING_TTL = 30
+# 记录的用户数超过这个数量时清理已恢复满的令牌桶和已过期的缓存
+MAX_TRACKED_USERS = 10000
+
+
+class PrivateMessageGate:
+    """在读取状态之前过滤私聊消息"""
+
+    def __init__(
+        self,
+        burst=PRIVATE_MSG_BURST,
+        rate=PRIVATE_MSG_RATE,
+        not_pending_ttl=NOT_PENDING_TTL,
+    ):
+        """
+        参数:
+            burst (int): 令牌桶容量
+            rate (float): 令牌恢复速度（条/秒）
+            not_pending_ttl (float): 没有待验证记录的用户的缓存时间（秒）
+        """
+        self.burst = burst
+        self.rate = rate
+        self.not_pending_ttl = not_pending_ttl
+        # QQ号 -> (剩余令牌数, 上次更新时间)
+        self._buckets = {}
+        # QQ号 -> 确认没有待验证记录的时间
+        self._not_pending = {}
+        self.rate_limited = 0
+        self.not_pending_dropped = 0
+        add_listener(self._on_change)
+
+    def allow(self, user_id):
+        """
+        私聊消息是否需要处理
+
+        返回:
+            bool: 缓存中没有待验证记录或超过速率时返回 False
+        """
+        user_id = str(user_id)
+        now = time.monotonic()
+
+        checked_at = self._not_pending.get(user_id)
+        if checked_at is not None:
+            if now - checked_at < self.not_pending_ttl:
+                self.not_pending_dropped += 1
+                return False
+            del self._not_pending[user_id]
+
+        tokens, updated_at = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            self.rate_limited += 1
+            return False
+        if user_id not in self._buckets and len(self._buckets) >= MAX_TRACKED_USERS:
+            self._prune(now)
+        self._buckets[user_id] = (tokens - 1, now)
+        return True
+
+    def note_not_pending(self, user_id):
+        """记录用户当前没有待验证记录"""
+        now = time.monotonic()
+        if len(self._not_pending) >= MAX_TRACKED_USERS:
+            self._prune(now)
+        self._not_pending[str(user_id)] = now
+
+    def note_pending(self, user_id):
+        """用户有了新的待验证记录，之后的私聊需要处理"""
+        self._not_pending.pop(str(user_id), None)
+
+    def _prune(self, now):
+        self._buckets = {
+            user_id: (tokens, updated_at)
+            for user_id, (tokens, updated_at) in self._buckets.items()
+            if tokens + (now - updated_at) * self.rate < self.burst
+        }
+        self._not_pending = {
+            user_id: checked_at
+            for user_id, checked_at in self._not_pending.items()
+            if now - checked_at < self.not_pending_ttl
+        }
+
+    def _on_change(self, table, changes, previous):
+        if table != USER_VERIFICATION:
+            return
+        if changes is None:
+            # 整张表被覆盖
+            self._not_pending.clear()
+            return
+        for key, value in changes.items():
+            if value is not None and value.get("status") == Status.PENDING.label:
+                self.note_pending(user_of(table, key))
+
+    def stats(self):
+        """丢弃统计"""
+        return {
+            "rate_limited": self.rate_limited,
+            "not_pending": self.not_pending_dropped,
+            "tracked_users": len(self._buckets),
+        }
@@ -0,0 +1,180 @@
+"""
+用群成员列表核对待验证用户
+
+机器人离线期间退群的用户不会触发退群通知，他们的记录会一直停留在 pending 状态。
+这里一次性拉取每个群的成员列表（带过期时间的缓存），把已经不在群里的待验证用户
+按退群处理（state_machine.LEAVE），在一次批量提交中清理掉。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.records import RecordTable, make_key
+from app.scripts.GroupEntryVerification.shard import owns_group
+from app.scripts.GroupEntryVerification.state_machine import state_machine, LEAVE
+from app.scripts.GroupEntryVerification.store import (
+    get_store,
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+)
+
+# 群成员列表缓存时间（秒）
+MEMBER_LIST_TTL = 10 * 60
+# 等待群成员列表回调的超时时间（秒）
+MEMBER_LIST_TIMEOUT = 15
+
+
+class MemberListCache:
+    """群成员列表缓存，群号 -> (拉取时间, 请求发出时的时间戳, 成员QQ号集合)"""
+
+    def __init__(self, echo_registry, ttl=MEMBER_LIST_TTL):
+        """
+        参数:
+            echo_registry (EchoRegistry): 用于关联 get_group_member_list 的回调
+            ttl (float): 缓存时间（秒）
+        """
+        self.echo_registry = echo_registry
+        self.ttl = ttl
+        self._members = {}
+
+    async def get_members(self, websocket, group_id):
+        """
+        获取群成员QQ号集合，缓存过期时重新拉取
+
+        返回:
+            set: 成员QQ号集合，拉取失败时返回 None
+        """
+        group_id = str(group_id)
+        cached = self._members.get(group_id)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[2]
+
+        requested_at = time.time()
+        note, call = self.echo_registry.register(
+            group_id, "members", action="get_group_member_list"
+        )
+        await websocket.send(
+            json.dumps(
+                {
+                    "action": "get_group_member_list",
+                    "params": {"group_id": int(group_id), "no_cache": True},
+                    "echo": call.echo,
+                }
+            )
+        )
+        try:
+            data = await self.echo_registry.wait(call, MEMBER_LIST_TIMEOUT)
+        except Exception as e:
+            logging.error(f"获取群 {group_id} 成员列表失败: {e}")
+            return None
+
+        members = {str(member.get("user_id")) for member in data or []}
+        self._members[group_id] = (time.monotonic(), requested_at, members)
+        return members
+
+    def snapshot_time(self, group_id):
+        """缓存的成员列表是在什么时间（时间戳）请求的，没有缓存时返回 None"""
+        cached = self._members.get(str(group_id))
+        return cached[1] if cached is not None else None
+
+    def note_join(self, group_id, user_id):
+        """入群通知到达时同步更新缓存"""
+        cached = self._members.get(str(group_id))
+        if cached is not None:
+            cached[2].add(str(user_id))
+
+    def note_leave(self, group_id, user_id):
+        """退群通知到达时同步更新缓存"""
+        cached = self._members.get(str(group_id))
+        if cached is not None:
+            cached[2].discard(str(user_id))
+
+
+def _pending_users_by_group(group_ids=None):
+    """按群整理待验证用户：群号 -> [QQ号, ...]；指定了群时只读取这些群的记录"""
+    store = get_store()
+    if group_ids is None:
+        data = store.load(USER_VERIFICATION)
+    else:
+        data = {}
+        for group_id in group_ids:
+            data.update(store.load_group(USER_VERIFICATION, group_id))
+    pending = {}
+    for record in RecordTable.from_dicts(data).pending():
+        user_id, group_id = str(record.user_id), str(record.group_id)
+        # 分片模式下只核对本分片负责的群
+        if not owns_group(group_id):
+            continue
+        pending.setdefault(group_id, []).append(user_id)
+    return pending
+
+
+def drop_absent_users(absent):
+    """
+    在一次存储提交中清理已不在群里的用户的所有验证数据
+
+    参数:
+        absent (dict): 群号 -> 已不在群里的QQ号集合
+
+    返回:
+        TransitionResult: 其中包含提交时取出的验证消息
+    """
+    return state_machine.commit(
+        LEAVE,
+        [
+            (group_id, user_id)
+            for group_id, users in absent.items()
+            for user_id in users
+        ],
+    )
+
+
+async def reconcile_pending_users(websocket, member_list_cache, group_ids=None):
+    """
+    核对待验证用户是否仍在群中，清理已离开的用户
+
+    参数:
+        websocket: 连接
+        member_list_cache (MemberListCache): 群成员列表缓存
+        group_ids (iterable): 只核对这些群，None 表示所有有待验证用户的群
+
+    返回:
+        dict: 群号 -> 被清理的QQ号集合
+    """
+    if group_ids is not None:
+        group_ids = {str(group_id) for group_id in group_ids}
+    pending = _pending_users_by_group(group_ids)
+
+    absent = {}
+    for group_id, user_ids in pending.items():
+        members = await member_list_cache.get_members(websocket, group_id)
+        if members is None:
+            # 拉取失败时不能判断用户是否还在群里，跳过该群
+            continue
+        snapshot_time = member_list_cache.snapshot_time(group_id)
+        questions = get_store().load_group(VERIFICATION_QUESTIONS, group_id)
+        missing = {
+            user_id
+            for user_id in user_ids
+            if user_id not in members
+            # 成员列表请求发出之后才入群的用户可能还不在列表里
+            and questions.get(make_key(user_id, group_id), {}).get("timestamp", 0)
+            < snapshot_time
+        }
+        if missing:
+            absent[group_id] = missing
+
+    # 撤回这些用户的验证消息
+    await state_machine.dispatch(websocket, drop_absent_users(absent))
+    for group_id, user_ids in absent.items():
+        logging.info(
+            f"群 {group_id} 中的待验证用户 {', '.join(sorted(user_ids))} 已不在群内，已清理其验证数据"
+        )
+    return absent
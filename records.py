@@ -0,0 +1,262 @@
+"""
+验证记录模型
+
+验证状态使用带 __slots__ 的记录对象，QQ号和群号为整数，状态为小整数枚举，
+时间戳为整数秒，按 (user_id, group_id) 元组索引。
+常驻内存的是 pending_index.PendingIndex 中所有待验证记录的 RecordTable，
+其他地方按需从存储读取一个群或一个用户的记录后转换。
+存储中仍然保存为 {f"{user_id}_{group_id}": {"status": "pending", ...}} 的格式，
+在读写存储时通过 from_dict / to_dict 转换。
+"""
+
+import logging
+from enum import IntEnum
+
+# 每个用户的答题次数
+MAX_ATTEMPTS = 3
+
+
+class Status(IntEnum):
+    """验证状态"""
+
+    PENDING = 0  # 等待验证
+    VERIFIED = 1  # 验证通过
+    FAILED = 2  # 验证失败
+    REJECTED = 3  # 管理员拒绝
+    KICKED = 4  # 多次警告后被踢出
+
+    @classmethod
+    def parse(cls, name):
+        """从存储中的状态名称解析"""
+        return cls[str(name).upper()]
+
+    @property
+    def label(self):
+        """存储中使用的状态名称"""
+        return self.name.lower()
+
+
+def make_key(user_id, group_id):
+    """存储中使用的记录键"""
+    return f"{user_id}_{group_id}"
+
+
+# 已经记录过警告的格式错误的记录键
+_malformed_keys = set()
+
+
+def parse_key(key):
+    """
+    把存储中的记录键解析为 (user_id, group_id)
+
+    旧数据中格式错误的键返回 None，每个键只记录一次警告
+    """
+    user_id, separator, group_id = str(key).partition("_")
+    if separator and user_id.isdigit() and group_id.isdigit():
+        return int(user_id), int(group_id)
+    if key not in _malformed_keys:
+        _malformed_keys.add(key)
+        logging.warning(f"跳过格式错误的验证记录键: {key}")
+    return None
+
+
+# 打包状态字段的位布局：低3位为状态，接下来5位为剩余次数，其余为入群时间（整数秒）
+_STATUS_BITS = 3
+_ATTEMPTS_BITS = 5
+_STATUS_MASK = (1 << _STATUS_BITS) - 1
+_ATTEMPTS_MASK = (1 << _ATTEMPTS_BITS) - 1
+_TIME_SHIFT = _STATUS_BITS + _ATTEMPTS_BITS
+
+
+def _pack(status, remaining_attempts, joined_at):
+    attempts = min(max(int(remaining_attempts), 0), _ATTEMPTS_MASK)
+    return (
+        (max(int(joined_at), 0) << _TIME_SHIFT)
+        | (attempts << _STATUS_BITS)
+        | int(status)
+    )
+
+
+class VerificationRecord:
+    """
+    一个用户在一个群的验证状态
+
+    状态、剩余次数和入群时间打包在一个整数中，每条记录只有三个槽位。
+    """
+
+    __slots__ = ("user_id", "group_id", "_state")
+
+    def __init__(self, user_id, group_id, status, remaining_attempts, joined_at=0):
+        self.user_id = int(user_id)
+        self.group_id = int(group_id)
+        self._state = _pack(status, remaining_attempts, joined_at)
+
+    @property
+    def status(self):
+        return Status(self._state & _STATUS_MASK)
+
+    @status.setter
+    def status(self, value):
+        self._state = (self._state & ~_STATUS_MASK) | int(value)
+
+    @property
+    def remaining_attempts(self):
+        return (self._state >> _STATUS_BITS) & _ATTEMPTS_MASK
+
+    @remaining_attempts.setter
+    def remaining_attempts(self, value):
+        self._state = _pack(self._state & _STATUS_MASK, value, self.joined_at)
+
+    @property
+    def joined_at(self):
+        return self._state >> _TIME_SHIFT
+
+    @property
+    def key(self):
+        return (self.user_id, self.group_id)
+
+    @property
+    def store_key(self):
+        return make_key(self.user_id, self.group_id)
+
+    @property
+    def is_pending(self):
+        return self._state & _STATUS_MASK == Status.PENDING
+
+    @classmethod
+    def from_dict(cls, key, value):
+        """从存储中的记录创建，键格式错误时抛出 ValueError"""
+        ids = parse_key(key)
+        if ids is None:
+            raise ValueError(f"记录键格式错误: {key}")
+        user_id, group_id = ids
+        return cls(
+            user_id,
+            group_id,
+            Status.parse(value.get("status", "pending")),
+            value.get("remaining_attempts", 0),
+            value.get("joined_at", 0),
+        )
+
+    def to_dict(self):
+        """转换为存储中的记录"""
+        value = {
+            "status": self.status.label,
+            "remaining_attempts": self.remaining_attempts,
+        }
+        if self.joined_at:
+            value["joined_at"] = self.joined_at
+        return value
+
+    def __repr__(self):
+        return (
+            f"VerificationRecord(user_id={self.user_id}, group_id={self.group_id}, "
+            f"status={self.status.label}, remaining_attempts={self.remaining_attempts})"
+        )
+
+
+class RecordTable:
+    """
+    按 (user_id, group_id) 索引的验证记录表
+
+    记录按群嵌套保存（群号 -> {QQ号: 记录}），省去每条记录一个元组键的开销；
+    按用户的索引在用户只在一个群时直接保存群号，多个群时保存群号元组。
+    """
+
+    def __init__(self, records=()):
+        self._groups = {}
+        self._by_user = {}
+        self._count = 0
+        for record in records:
+            self.add(record)
+
+    @classmethod
+    def from_dicts(cls, items):
+        """从存储中的 {记录键: 记录} 创建，跳过键格式错误的旧记录"""
+        return cls(
+            VerificationRecord.from_dict(key, value)
+            for key, value in items.items()
+            if parse_key(key) is not None
+        )
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for records in self._groups.values():
+            yield from records.values()
+
+    def __contains__(self, key):
+        return self.get(*key) is not None
+
+    def __getitem__(self, key):
+        record = self.get(*key)
+        if record is None:
+            raise KeyError(key)
+        return record
+
+    def get(self, user_id, group_id):
+        records = self._groups.get(int(group_id))
+        return records.get(int(user_id)) if records else None
+
+    def add(self, record):
+        records = self._groups.setdefault(record.group_id, {})
+        if record.user_id not in records:
+            self._count += 1
+            self._index_user(record.user_id, record.group_id)
+        records[record.user_id] = record
+
+    def remove(self, user_id, group_id):
+        user_id, group_id = int(user_id), int(group_id)
+        records = self._groups.get(group_id)
+        record = records.pop(user_id, None) if records else None
+        if record is None:
+            return None
+        self._count -= 1
+        if not records:
+            del self._groups[group_id]
+        self._unindex_user(user_id, group_id)
+        return record
+
+    def _index_user(self, user_id, group_id):
+        groups = self._by_user.get(user_id)
+        if groups is None:
+            self._by_user[user_id] = group_id
+        elif isinstance(groups, tuple):
+            self._by_user[user_id] = groups + (group_id,)
+        else:
+            self._by_user[user_id] = (groups, group_id)
+
+    def _unindex_user(self, user_id, group_id):
+        groups = self._by_user.get(user_id)
+        if not isinstance(groups, tuple):
+            self._by_user.pop(user_id, None)
+            return
+        groups = tuple(g for g in groups if g != group_id)
+        self._by_user[user_id] = groups[0] if len(groups) == 1 else groups
+
+    def _user_group_ids(self, user_id):
+        groups = self._by_user.get(int(user_id))
+        if groups is None:
+            return ()
+        return groups if isinstance(groups, tuple) else (groups,)
+
+    def by_user(self, user_id):
+        """用户在各群的记录，按加入索引的顺序"""
+        user_id = int(user_id)
+        return [
+            self._groups[group_id][user_id]
+            for group_id in self._user_group_ids(user_id)
+        ]
+
+    def by_group(self, group_id):
+        """群内所有用户的记录"""
+        return list(self._groups.get(int(group_id), {}).values())
+
+    def pending(self, group_id=None):
+        """等待验证的记录，可按群过滤"""
+        records = self if group_id is None else self.by_group(group_id)
+        return [record for record in records if record.is_pending]
+
+    def group_ids(self):
+        return list(self._groups)
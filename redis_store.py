@@ -0,0 +1,791 @@
+"""
+基于 Redis 协议的共享验证数据存储
+
+多个机器人实例（或分片工作进程）连接同一个 Redis 服务时，看到的是同一份验证数据。
+每条记录保存为一个独立的键，修改时用 WATCH/MULTI/EXEC 保证单条记录的原子性；
+每次写入后通过发布订阅通知其他实例清除本地缓存。读取 Redis 期间收到失效通知时，
+读到的可能是修改前的值，这次读取的结果不放入缓存（见 RedisStore._epoch）。
+
+LocalRedisServer 是进程内的替身，实现了同样的命令子集，可在测试中代替真实的 Redis 服务。
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import socket
+import threading
+from urllib.parse import urlparse
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.store import (
+    GROUP_KEYED_TABLES,
+    group_of,
+    user_of,
+    notify_listeners,
+)
+
+# 键前缀
+KEY_PREFIX = "GroupEntryVerification"
+# 缓存失效通知的频道
+INVALIDATE_CHANNEL = f"{KEY_PREFIX}:invalidate"
+# 乐观锁冲突时的最大重试次数
+MAX_UPDATE_RETRIES = 50
+# 逐条读取记录时每次 MGET 的键数
+ITER_BATCH_SIZE = 500
+# 失效通知的订阅断开后重新订阅的等待时间（秒），每次失败加倍，最长 RESUBSCRIBE_MAX_DELAY
+RESUBSCRIBE_DELAY = 1
+RESUBSCRIBE_MAX_DELAY = 30
+
+
+class RedisError(Exception):
+    """Redis 服务返回错误"""
+
+
+class RedisConnection:
+    """最小化的 RESP2 协议客户端"""
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, timeout=5):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile("rb")
+        self._lock = threading.Lock()
+        if password:
+            self.execute("AUTH", password)
+        if db:
+            self.execute("SELECT", db)
+
+    @classmethod
+    def from_url(cls, url):
+        """从 redis://[:password@]host:port/db 形式的地址创建连接"""
+        parsed = urlparse(url)
+        db = parsed.path.lstrip("/")
+        return cls(
+            host=parsed.hostname or "127.0.0.1",
+            port=parsed.port or 6379,
+            db=int(db) if db else 0,
+            password=parsed.password,
+        )
+
+    @staticmethod
+    def _encode(args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(f"${len(arg)}\r\n".encode())
+            parts.append(arg)
+            parts.append(b"\r\n")
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Redis 连接已关闭")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)[:-2]
+            return data.decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"无法解析的回复: {line!r}")
+
+    def _raise_errors(self, reply):
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def _call(self, payload, replies):
+        """
+        发送命令并读取 replies 条回复
+
+        发送或读取中途出错（超时、连接断开、无法解析）时剩余的回复已无法对齐，
+        关闭连接并抛出 ConnectionError，之后的调用也会抛出 ConnectionError，不会读到上一条命令的回复
+        """
+        with self._lock:
+            if self._sock is None:
+                raise ConnectionError("Redis 连接已关闭")
+            try:
+                self._sock.sendall(payload)
+                return [self._read_reply() for _ in range(replies)]
+            except Exception as e:
+                self.close()
+                raise ConnectionError(f"Redis 连接出错: {e}") from e
+
+    def execute(self, *args):
+        """执行一条命令并返回结果"""
+        return self._raise_errors(self._call(self._encode(args), 1)[0])
+
+    def transaction(self, commands):
+        """
+        以 MULTI/EXEC 执行一组命令
+
+        总是读完 MULTI、每条命令和 EXEC 的回复，命令入队失败时抛出第一个错误
+
+        返回:
+            list: 每条命令的结果；被 WATCH 的键已被修改时返回 None
+        """
+        payload = [self._encode(("MULTI",))]
+        payload.extend(self._encode(command) for command in commands)
+        payload.append(self._encode(("EXEC",)))
+        replies = self._call(b"".join(payload), len(commands) + 2)
+        for reply in replies[:-1]:
+            self._raise_errors(reply)  # +OK / +QUEUED
+        return self._raise_errors(replies[-1])
+
+    def subscribe(self, channel, callback, on_disconnect=None):
+        """
+        在后台线程中订阅频道，收到消息时调用 callback(message)
+
+        连接断开时关闭连接并调用 on_disconnect()，订阅不会自动恢复
+        """
+        self._sock.settimeout(None)
+        self.execute("SUBSCRIBE", channel)
+
+        def listen():
+            while True:
+                try:
+                    reply = self._read_reply()
+                except Exception as e:
+                    if self._sock is None:
+                        # 主动关闭
+                        return
+                    logging.warning(f"Redis 订阅连接断开: {e}")
+                    self.close()
+                    if on_disconnect is not None:
+                        on_disconnect()
+                    return
+                if isinstance(reply, list) and reply[0] == "message":
+                    callback(reply[2])
+
+        threading.Thread(
+            target=listen, name=f"{KEY_PREFIX}-subscriber", daemon=True
+        ).start()
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if sock is None:
+            return
+        try:
+            self._file.close()
+            sock.close()
+        except OSError:
+            pass
+
+
+class LocalRedisServer:
+    """进程内的 Redis 替身，支持本存储用到的命令子集"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+        # 每个键的版本号，用于 WATCH
+        self._versions = {}
+        # 频道 -> [(callback, on_disconnect), ...]
+        self._subscribers = {}
+        # 每次 disconnect_all 加一，之前创建的连接全部失效
+        self._generation = 0
+
+    def connect(self):
+        """创建一个连接"""
+        return _LocalConnection(self)
+
+    def disconnect_all(self):
+        """断开所有已有的连接（数据保留），模拟 Redis 重启或网络中断"""
+        with self._lock:
+            self._generation += 1
+            subscribers = [
+                on_disconnect
+                for entries in self._subscribers.values()
+                for _, on_disconnect in entries
+                if on_disconnect is not None
+            ]
+            self._subscribers = {}
+        for on_disconnect in subscribers:
+            on_disconnect()
+
+    def _touch(self, key):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _run(self, command, args):
+        command = command.upper()
+        data = self._data
+        if command == "GET":
+            value = data.get(args[0])
+            return value if isinstance(value, str) else None
+        if command == "MGET":
+            return [
+                data.get(key) if isinstance(data.get(key), str) else None
+                for key in args
+            ]
+        if command == "SET":
+            data[args[0]] = str(args[1])
+            self._touch(args[0])
+            return "OK"
+        if command == "DEL":
+            removed = 0
+            for key in args:
+                if data.pop(key, None) is not None:
+                    removed += 1
+                    self._touch(key)
+            return removed
+        if command == "SADD":
+            members = data.setdefault(args[0], set())
+            added = len(set(args[1:]) - members)
+            members.update(args[1:])
+            self._touch(args[0])
+            return added
+        if command == "SREM":
+            members = data.get(args[0], set())
+            removed = len(members & set(args[1:]))
+            members.difference_update(args[1:])
+            if not members:
+                data.pop(args[0], None)
+            self._touch(args[0])
+            return removed
+        if command == "SMEMBERS":
+            return sorted(data.get(args[0], set()))
+        if command == "PUBLISH":
+            entries = list(self._subscribers.get(args[0], []))
+            for callback, _ in entries:
+                callback(str(args[1]))
+            return len(entries)
+        if command in ("PING",):
+            return "PONG"
+        raise RedisError(f"ERR unknown command '{command}'")
+
+
+class _LocalConnection:
+    """LocalRedisServer 的连接，接口与 RedisConnection 相同"""
+
+    def __init__(self, server):
+        self.server = server
+        self._watched = {}
+        self._generation = server._generation
+
+    def _check(self):
+        if self._generation != self.server._generation:
+            raise ConnectionError("Redis 连接已断开")
+
+    def execute(self, *args):
+        command = args[0].upper()
+        with self.server._lock:
+            self._check()
+            if command == "WATCH":
+                for key in args[1:]:
+                    self._watched[key] = self.server._versions.get(key, 0)
+                return "OK"
+            if command == "UNWATCH":
+                self._watched = {}
+                return "OK"
+            return self.server._run(command, [str(arg) for arg in args[1:]])
+
+    def transaction(self, commands):
+        with self.server._lock:
+            self._check()
+            watched, self._watched = self._watched, {}
+            for key, version in watched.items():
+                if self.server._versions.get(key, 0) != version:
+                    return None
+            return [
+                self.server._run(command[0], [str(arg) for arg in command[1:]])
+                for command in commands
+            ]
+
+    def subscribe(self, channel, callback, on_disconnect=None):
+        with self.server._lock:
+            self._check()
+            self.server._subscribers.setdefault(channel, []).append(
+                (callback, on_disconnect)
+            )
+
+    def close(self):
+        pass
+
+
+class RedisStore:
+    """
+    以 Redis 保存验证数据，接口与 JsonFileStore 相同
+
+    记录键为 f"{KEY_PREFIX}:{table}:{key}"，值为 JSON 字符串；
+    集合 f"{KEY_PREFIX}:{table}" 保存表中的所有记录键。以 f"{user_id}_{group_id}" 为键的表
+    另有按群和按用户的索引集合 f"{KEY_PREFIX}:{table}:g:{group_id}"、f"{KEY_PREFIX}:{table}:u:{user_id}"，
+    与记录在同一个事务中修改，load_group 和 user_records 只读取索引中的记录。
+    没有索引的旧数据在第一次按群或按用户读取时补建，补建后写入标记 f"{KEY_PREFIX}:{table}:indexed"。
+
+    连接出错（Redis 重启、网络中断、超时）时换一个新连接并清除本地缓存，只读命令重试一次，
+    事务不重试（不知道是否已执行），错误抛给调用方，之后的调用使用新连接。
+    失效通知的订阅断开时停止使用缓存，由后台线程重新订阅，订阅恢复后缓存从空开始。
+
+    所有方法都是同步的：在事件循环中调用时，每次未命中缓存的读取阻塞一次网络往返，
+    每次 update / update_tables 至少阻塞三次（WATCH、MGET、EXEC），冲突重试时更多。
+    main.py 中只有入群时的提交（process_new_member）放在线程中执行，其他处理函数仍直接调用，
+    Redis 往返耗时较大时会相应地推迟同一事件循环中其他事件的处理，
+    延迟的量级可用 benchmarks/join_latency.py 的 Redis 往返参数估计。
+    主连接上的操作由一把锁串行执行，线程中的提交与事件循环中的调用不会交错使用同一个 WATCH。
+    """
+
+    def __init__(self, connect):
+        """
+        参数:
+            connect (callable): 无参数，返回一个新连接（RedisConnection 或 LocalRedisServer.connect）
+        """
+        self._connect = connect
+        self._conn = connect()
+        # WATCH 到 EXEC 跨越多条命令，同一时间只有一个操作使用主连接
+        self._lock = threading.RLock()
+        # 本地缓存：表名 -> {记录键: 记录}；_complete 中的表已缓存完整内容
+        self._cache = {}
+        self._complete = set()
+        self._cache_lock = threading.Lock()
+        # 收到其他实例的失效通知的次数。读取前记下，读取后不同则不写入缓存
+        self._epoch = 0
+        # 失效通知中标识本实例，本实例的写入已直接更新缓存，不再处理自己的通知
+        self._instance_id = uuid.uuid4().hex
+        # 已确认建有索引的表
+        self._indexed = set()
+        # 订阅失效通知期间才使用本地缓存
+        self._listening = False
+        self._subscriber = None
+        self._subscribe()
+
+    @classmethod
+    def from_url(cls, url):
+        return cls(lambda: RedisConnection.from_url(url))
+
+    @staticmethod
+    def _record_key(table, key):
+        return f"{KEY_PREFIX}:{table}:{key}"
+
+    @staticmethod
+    def _table_key(table):
+        return f"{KEY_PREFIX}:{table}"
+
+    @staticmethod
+    def _group_index_key(table, group_id):
+        return f"{KEY_PREFIX}:{table}:g:{group_id}"
+
+    @staticmethod
+    def _user_index_key(table, user_id):
+        return f"{KEY_PREFIX}:{table}:u:{user_id}"
+
+    @staticmethod
+    def _indexed_marker_key(table):
+        return f"{KEY_PREFIX}:{table}:indexed"
+
+    def _index_keys(self, table, key):
+        """记录所在的索引集合，以群号为键的表没有索引"""
+        if table in GROUP_KEYED_TABLES:
+            return []
+        return [
+            self._group_index_key(table, group_of(table, key)),
+            self._user_index_key(table, user_of(table, key)),
+        ]
+
+    def _index_commands(self, table, keys):
+        """把 keys 加入各自索引集合的命令"""
+        members = {}
+        for key in keys:
+            for index_key in self._index_keys(table, key):
+                members.setdefault(index_key, []).append(key)
+        return [("SADD", index_key, *keys) for index_key, keys in members.items()]
+
+    # 连接管理
+
+    def _reset_cache(self):
+        """清除所有缓存，进行中的读取不再写入缓存，调用时需持有 _cache_lock"""
+        self._epoch += 1
+        self._cache.clear()
+        self._complete.clear()
+
+    def _subscribe(self):
+        subscriber = self._connect()
+        subscriber.subscribe(
+            INVALIDATE_CHANNEL, self._on_invalidate, self._on_subscriber_lost
+        )
+        # 订阅之前错过的失效通知无从得知，缓存从头开始
+        with self._cache_lock:
+            self._subscriber = subscriber
+            self._reset_cache()
+            self._listening = True
+
+    def _on_subscriber_lost(self):
+        """订阅断开：停止使用缓存，在后台线程中重新订阅"""
+        with self._cache_lock:
+            self._listening = False
+            self._reset_cache()
+        logging.warning("Redis 失效通知的订阅已断开，重新订阅之前不使用本地缓存")
+        threading.Thread(
+            target=self._resubscribe, name=f"{KEY_PREFIX}-resubscribe", daemon=True
+        ).start()
+
+    def _resubscribe(self):
+        delay = RESUBSCRIBE_DELAY
+        while True:
+            try:
+                self._subscribe()
+            except Exception as e:
+                logging.warning(f"重新订阅 Redis 失效通知失败，{delay} 秒后重试: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, RESUBSCRIBE_MAX_DELAY)
+                continue
+            logging.info("已重新订阅 Redis 失效通知")
+            return
+
+    def _reconnect(self):
+        """主连接出错后换一个新连接；断开期间可能错过了失效通知，同时清除缓存"""
+        self._conn.close()
+        with self._cache_lock:
+            self._reset_cache()
+        self._conn = self._connect()
+        logging.warning("Redis 连接出错，已重新连接")
+
+    def _read(self, *args):
+        """在主连接上执行只读命令，连接出错时重新连接并重试一次"""
+        with self._lock:
+            try:
+                return self._conn.execute(*args)
+            except ConnectionError:
+                self._reconnect()
+                return self._conn.execute(*args)
+
+    def _transaction(self, commands):
+        """在主连接上执行事务，连接出错时重新连接，但不重试（不知道事务是否已执行）"""
+        with self._lock:
+            try:
+                return self._conn.transaction(commands)
+            except ConnectionError:
+                self._reconnect()
+                raise
+
+    def _ensure_indexed(self, table):
+        """为没有索引的旧数据补建索引"""
+        if table in self._indexed:
+            return
+        marker = self._indexed_marker_key(table)
+        if self._read("GET", marker) is None:
+            keys = self._read("SMEMBERS", self._table_key(table))
+            self._transaction(
+                self._index_commands(table, keys) + [("SET", marker, "1")]
+            )
+            logging.info(f"已为 {table} 的 {len(keys)} 条记录建立按群和按用户的索引")
+        self._indexed.add(table)
+
+    def _invalidate_message(self, table, key=""):
+        return f"{self._instance_id}\0{table}\0{key}"
+
+    def _on_invalidate(self, message):
+        """其他实例写入后清除对应的缓存"""
+        instance_id, _, target = message.partition("\0")
+        if instance_id == self._instance_id:
+            return
+        table, _, key = target.partition("\0")
+        with self._cache_lock:
+            self._epoch += 1
+            self._drop_cached(table, key)
+
+    def _drop_cached(self, table, key=""):
+        """清除缓存中的一条记录（key 为空时为整张表），调用时需持有 _cache_lock"""
+        self._complete.discard(table)
+        if key:
+            self._cache.get(table, {}).pop(key, None)
+        else:
+            self._cache.pop(table, None)
+
+    def _cache_put(self, table, key, value, epoch):
+        """把读到或写入的记录放入缓存，epoch 之后收到过失效通知时改为清除"""
+        with self._cache_lock:
+            if epoch != self._epoch or not self._listening:
+                self._drop_cached(table, key)
+                return
+            records = self._cache.setdefault(table, {})
+            if value is None:
+                records.pop(key, None)
+            else:
+                records[key] = json.loads(json.dumps(value))
+
+    def load(self, table):
+        """读取整张表"""
+        with self._cache_lock:
+            if table in self._complete:
+                return json.loads(json.dumps(self._cache.get(table, {})))
+            epoch = self._epoch
+        keys = self._read("SMEMBERS", self._table_key(table))
+        records = {}
+        if keys:
+            values = self._read("MGET", *(self._record_key(table, key) for key in keys))
+            for key, value in zip(keys, values):
+                if value is not None:
+                    records[key] = json.loads(value)
+        with self._cache_lock:
+            if epoch == self._epoch and self._listening:
+                self._cache[table] = records
+                self._complete.add(table)
+        return json.loads(json.dumps(records))
+
+    def _load_indexed(self, table, index_key, belongs):
+        """
+        读取索引集合中的记录；整张表已缓存时直接从缓存中筛选
+
+        参数:
+            belongs (callable): 接收记录键，判断缓存中的记录是否属于这个索引
+        """
+        with self._cache_lock:
+            if table in self._complete:
+                return {
+                    key: json.loads(json.dumps(value))
+                    for key, value in self._cache.get(table, {}).items()
+                    if belongs(key)
+                }
+            epoch = self._epoch
+        self._ensure_indexed(table)
+        keys = self._read("SMEMBERS", index_key)
+        records = {}
+        if keys:
+            values = self._read("MGET", *(self._record_key(table, key) for key in keys))
+            for key, value in zip(keys, values):
+                if value is not None:
+                    records[key] = json.loads(value)
+        with self._cache_lock:
+            if epoch == self._epoch and self._listening:
+                cached = self._cache.setdefault(table, {})
+                for key, value in records.items():
+                    cached[key] = json.loads(json.dumps(value))
+        return records
+
+    def load_group(self, table, group_id):
+        """通过群索引读取表中属于某个群的记录"""
+        group_id = str(group_id)
+        if table in GROUP_KEYED_TABLES:
+            value = self.get(table, group_id)
+            return {} if value is None else {group_id: value}
+        return self._load_indexed(
+            table,
+            self._group_index_key(table, group_id),
+            lambda key: group_of(table, key) == group_id,
+        )
+
+    def user_records(self, table, user_id):
+        """通过用户索引读取表中属于某个用户的记录"""
+        if table in GROUP_KEYED_TABLES:
+            return {}
+        user_id = str(user_id)
+        return self._load_indexed(
+            table,
+            self._user_index_key(table, user_id),
+            lambda key: user_of(table, key) == user_id,
+        )
+
+    def iter_records(self, table, group_id=None):
+        """
+        分批读取表中的记录，不经过本地缓存，group_id 不为 None 时只读取该群的记录
+
+        产生:
+            (记录键, 记录)
+        """
+        if group_id is None:
+            keys = self._read("SMEMBERS", self._table_key(table))
+        elif table in GROUP_KEYED_TABLES:
+            keys = [str(group_id)]
+        else:
+            self._ensure_indexed(table)
+            keys = self._read("SMEMBERS", self._group_index_key(table, group_id))
+        for start in range(0, len(keys), ITER_BATCH_SIZE):
+            batch = keys[start : start + ITER_BATCH_SIZE]
+            values = self._read(
+                "MGET", *(self._record_key(table, key) for key in batch)
+            )
+            for key, value in zip(batch, values):
+                if value is not None:
+                    yield key, json.loads(value)
+
+    def save(self, table, data):
+        """覆盖整张表"""
+        with self._lock:
+            self._save(table, data)
+        with self._cache_lock:
+            self._drop_cached(table)
+        notify_listeners(table, None)
+
+    def _save(self, table, data):
+        old_keys = self._read("SMEMBERS", self._table_key(table))
+        commands = []
+        if old_keys:
+            commands.append(
+                ("DEL", *(self._record_key(table, key) for key in old_keys))
+            )
+            old_index_keys = {
+                index_key
+                for key in old_keys
+                for index_key in self._index_keys(table, key)
+            }
+            if old_index_keys:
+                commands.append(("DEL", *old_index_keys))
+        commands.append(("DEL", self._table_key(table)))
+        for key, value in data.items():
+            commands.append(
+                (
+                    "SET",
+                    self._record_key(table, key),
+                    json.dumps(value, ensure_ascii=False),
+                )
+            )
+        if data:
+            commands.append(("SADD", self._table_key(table), *data.keys()))
+            commands.extend(self._index_commands(table, data))
+        if table not in GROUP_KEYED_TABLES:
+            commands.append(("SET", self._indexed_marker_key(table), "1"))
+        commands.append(
+            ("PUBLISH", INVALIDATE_CHANNEL, self._invalidate_message(table))
+        )
+        self._transaction(commands)
+
+    def get(self, table, key, default=None):
+        """读取单条记录"""
+        with self._cache_lock:
+            records = self._cache.get(table, {})
+            if key in records:
+                return json.loads(json.dumps(records[key]))
+            if table in self._complete:
+                return default
+            epoch = self._epoch
+        value = self._read("GET", self._record_key(table, key))
+        if value is None:
+            return default
+        self._cache_put(table, key, json.loads(value), epoch)
+        return json.loads(value)
+
+    def set(self, table, key, value):
+        """写入单条记录"""
+        self.update(table, key, lambda _: value)
+
+    def delete(self, table, key):
+        """删除单条记录"""
+        self.update(table, key, lambda _: None)
+
+    def _write_commands(self, table, key, new):
+        record_key = self._record_key(table, key)
+        if new is None:
+            return [
+                ("DEL", record_key),
+                ("SREM", self._table_key(table), key),
+                *(
+                    ("SREM", index_key, key)
+                    for index_key in self._index_keys(table, key)
+                ),
+                ("PUBLISH", INVALIDATE_CHANNEL, self._invalidate_message(table, key)),
+            ]
+        return [
+            ("SET", record_key, json.dumps(new, ensure_ascii=False)),
+            ("SADD", self._table_key(table), key),
+            *(("SADD", index_key, key) for index_key in self._index_keys(table, key)),
+            ("PUBLISH", INVALIDATE_CHANNEL, self._invalidate_message(table, key)),
+        ]
+
+    def update(self, table, key, func):
+        """
+        原子地修改单条记录，修改函数的约定同 JsonFileStore.update
+
+        其他实例同时修改同一条记录时，重新读取并再次调用 func
+        """
+        return self.update_many(table, {key: func})[key]
+
+    def update_many(self, table, funcs):
+        """在一个事务中原子地修改多条记录"""
+        if not funcs:
+            return {}
+        return self.update_tables({table: funcs})[table]
+
+    def update_tables(self, tables):
+        """
+        在一个事务中原子地修改多张表的记录
+
+        按 tables 的顺序依次调用各表的修改函数，约定同 JsonFileStore.update_tables；
+        冲突重试时所有修改函数会按同样的顺序重新调用
+        """
+        items = [
+            (table, key, func)
+            for table, funcs in tables.items()
+            for key, func in funcs.items()
+        ]
+        if not items:
+            return {table: {} for table in tables}
+        record_keys = [self._record_key(table, key) for table, key, _ in items]
+        for _ in range(MAX_UPDATE_RETRIES):
+            with self._lock:
+                attempt = self._try_update(tables, items, record_keys)
+            if attempt is None:
+                logging.debug(f"{', '.join(tables)} 的记录被其他实例修改，重试")
+                continue
+            epoch, results, previous, written = attempt
+            if written:
+                for table, changes in results.items():
+                    for key, new in changes.items():
+                        self._cache_put(table, key, new, epoch)
+                for table, changes in results.items():
+                    notify_listeners(table, changes, previous[table])
+            return results
+        raise RedisError(f"修改 {', '.join(tables)} 的记录冲突次数过多")
+
+    def _try_update(self, tables, items, record_keys):
+        """
+        WATCH 记录后读取、调用修改函数并提交一次，调用时需持有 _lock
+
+        修改函数抛出异常时先 UNWATCH 再抛出；EXEC 之前连接出错时重新连接并返回 None，
+        由调用方重新读取；EXEC 时连接出错不知道事务是否已执行，重新连接后抛出 ConnectionError
+
+        返回:
+            (读取前的 epoch, 结果, 修改前的记录, 是否写入)；需要重试时返回 None
+        """
+        with self._cache_lock:
+            epoch = self._epoch
+        try:
+            self._conn.execute("WATCH", *record_keys)
+            values = self._conn.execute("MGET", *record_keys)
+        except ConnectionError:
+            self._reconnect()
+            return None
+        try:
+            results = {table: {} for table in tables}
+            previous = {table: {} for table in tables}
+            commands = []
+            for (table, key, func), value in zip(items, values):
+                old = json.loads(value) if value is not None else None
+                previous[table][key] = old
+                new = func(json.loads(value) if value is not None else None)
+                results[table][key] = new
+                if new is None and value is None:
+                    continue
+                commands.extend(self._write_commands(table, key, new))
+        except BaseException:
+            self._unwatch()
+            raise
+        if not commands:
+            self._unwatch()
+            return epoch, results, previous, False
+        if self._transaction(commands) is None:
+            return None
+        return epoch, results, previous, True
+
+    def _unwatch(self):
+        try:
+            self._conn.execute("UNWATCH")
+        except ConnectionError:
+            # 连接已断开，WATCH 随连接失效，下次使用时重新连接
+            pass
@@ -0,0 +1,627 @@
+"""
+差分回放：用同一串事件比较两个版本的行为和性能
+
+把一串 OneBot 事件（JSONL，每行一个事件）依次交给两个版本的 handle_events 处理，
+比较两边发出的 API 调用序列和最终保存的验证数据，并并排列出处理速度、写入字节数和 API 调用数。
+每个版本是一个 git 提交（或 "." 表示当前工作区），在单独的子进程中运行：
+    - 代码放在临时目录的 app/scripts/GroupEntryVerification 下，数据写入该临时目录，不影响真实数据；
+    - app.api 换成记录调用的替身，每个调用都像 OneBot 一样异步回调（发消息的调用返回递增的 message_id），
+      app.config 中的管理员为 --owner，app.switch 对所有群返回开启；
+    - time.time 按事件的 time 字段推进（没有时取 REPLAY_START 加事件序号），random 使用固定的种子，
+      不超过 REPLAY_MAX_SKIPPED_SLEEP 秒的 asyncio.sleep（发消息之间的间隔等）直接跳过；
+    - 每个事件处理完后等到没有新的 API 调用和回调再处理下一个事件，调用顺序是确定的。
+私聊消息中的 {answer} 会替换为该用户在 replay_group 字段指定的群的验证答案，用于回放答题。
+
+比较数据时忽略 REPLAY_IGNORED_FIELDS 中的字段，消息记录只比较消息ID；只有一边存在的表单独列出。
+写入字节数取子进程的 /proc/self/io 中的 wchar（没有时取数据目录的大小）。
+
+用法：
+    python replay.py events.jsonl --baseline d814607 --candidate .
+    python replay.py events.jsonl --candidate . --candidate-set store.STORE_FORMAT='"journal"'
+    python replay.py --generate 200 > events.jsonl
+有差异时退出码为 1。
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import random
+import shutil
+import asyncio
+import difflib
+import logging
+import tarfile
+import argparse
+import tempfile
+import importlib
+import subprocess
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_PACKAGE = "app.scripts.GroupEntryVerification"
+
+# 没有 time 字段的事件的虚拟时间起点
+REPLAY_START = 1700000000
+# 回放时直接跳过的 asyncio.sleep 的最长时间（秒），更长的是后台定时任务，照常等待
+REPLAY_MAX_SKIPPED_SLEEP = 5
+# 每个事件处理完后，连续多少轮没有新调用和回调视为处理结束
+REPLAY_IDLE_ROUNDS = 3
+# 回调的 message_id 起始值
+REPLAY_MESSAGE_ID_START = 1000000
+# 比较数据时忽略的字段（与处理时间有关，版本之间格式也可能不同）
+REPLAY_IGNORED_FIELDS = ("joined_at", "timestamp")
+# 报告中最多列出的差异行数
+REPLAY_MAX_DIFF_LINES = 40
+
+# app.api 替身提供的接口：接口名 -> 位置参数名
+API_ACTIONS = {
+    "send_group_msg": ("group_id", "message"),
+    "send_private_msg": ("user_id", "message"),
+    "delete_msg": ("message_id",),
+    "set_group_ban": ("group_id", "user_id", "duration"),
+    "set_group_kick": ("group_id", "user_id", "reject_add_request"),
+    "set_group_add_request": ("flag", "sub_type", "approve", "reason"),
+    "get_group_member_list": ("group_id",),
+}
+# 回调中返回 message_id 的接口
+MESSAGE_ACTIONS = ("send_group_msg", "send_private_msg")
+
+
+# 子进程：在一个版本上回放事件
+
+
+class _VirtualClock:
+    def __init__(self):
+        self.now = float(REPLAY_START)
+
+    def time(self):
+        return self.now
+
+
+class ReplayWebSocket:
+    """记录发出的所有调用，并像 OneBot 一样异步送回回调"""
+
+    def __init__(self, handle_events):
+        self.handle_events = handle_events
+        self.calls = []
+        self.responses = 0
+        self._next_message_id = REPLAY_MESSAGE_ID_START
+        self._pending = set()
+
+    async def send(self, data):
+        request = json.loads(data)
+        action = request.get("action")
+        self.calls.append([action, request.get("params", {})])
+        response = {"status": "ok", "retcode": 0, "data": None}
+        if action in MESSAGE_ACTIONS:
+            response["data"] = {"message_id": self._next_message_id}
+            self._next_message_id += 1
+        elif action not in API_ACTIONS or action == "get_group_member_list":
+            # 替身没有群成员数据，按接口调用失败回调
+            response = {"status": "failed", "retcode": 1404, "data": None}
+        if request.get("echo"):
+            response["echo"] = request["echo"]
+        task = asyncio.get_running_loop().create_task(self._respond(response))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _respond(self, response):
+        await asyncio.sleep(0)
+        self.responses += 1
+        await self.handle_events(self, response)
+
+    async def settle(self):
+        """等到连续 REPLAY_IDLE_ROUNDS 轮没有新调用、也没有未送达的回调"""
+        idle = 0
+        seen = len(self.calls)
+        while idle < REPLAY_IDLE_ROUNDS:
+            if self._pending:
+                await asyncio.gather(*self._pending, return_exceptions=True)
+            await asyncio.sleep(0)
+            if self._pending or len(self.calls) != seen:
+                seen = len(self.calls)
+                idle = 0
+            else:
+                idle += 1
+
+
+def _make_api_module():
+    module = types.ModuleType("app.api")
+
+    def make(action, names):
+        async def call(websocket, *args, note="", **kwargs):
+            params = dict(zip(names, args))
+            params.update(kwargs)
+            await websocket.send(
+                json.dumps(
+                    {"action": action, "params": params, "echo": f"{action}_{note}"},
+                    ensure_ascii=False,
+                )
+            )
+
+        call.__name__ = action
+        return call
+
+    for action, names in API_ACTIONS.items():
+        setattr(module, action, make(action, names))
+    module.__all__ = list(API_ACTIONS)
+    return module
+
+
+def install_app_stubs(owner_ids):
+    """用替身替换机器人的 app.api、app.config 和 app.switch，所有群都开启验证"""
+    config = types.ModuleType("app.config")
+    config.owner_id = list(owner_ids)
+    config.__all__ = ["owner_id"]
+    switch = types.ModuleType("app.switch")
+    switch.load_switch = lambda group_id, name: True
+    switch.save_switch = lambda group_id, name, status: None
+    sys.modules["app.api"] = _make_api_module()
+    sys.modules["app.config"] = config
+    sys.modules["app.switch"] = switch
+
+
+def _apply_overrides(overrides):
+    for override in overrides:
+        target, _, value = override.partition("=")
+        module_name, _, name = target.rpartition(".")
+        module = importlib.import_module(f"{PLUGIN_PACKAGE}.{module_name}")
+        setattr(module, name, json.loads(value))
+
+
+def _bytes_written():
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split(":")[1])
+    except OSError:
+        return None
+    return None
+
+
+def _directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for directory, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _format_answer(answer):
+    return str(int(answer)) if float(answer).is_integer() else str(answer)
+
+
+async def _replay(main, events, clock):
+    websocket = ReplayWebSocket(main.handle_events)
+    for index, event in enumerate(events):
+        clock.now = float(event.get("time", REPLAY_START + index))
+        group_id = event.pop("replay_group", None)
+        raw_message = event.get("raw_message")
+        if group_id is not None and raw_message and "{answer}" in raw_message:
+            _, answer = main.get_user_verification_question(
+                str(event.get("user_id")), str(group_id)
+            )
+            text = "0" if answer is None else _format_answer(answer)
+            event["raw_message"] = event["message"] = raw_message.replace(
+                "{answer}", text
+            )
+        await main.handle_events(websocket, event)
+        await websocket.settle()
+    return websocket
+
+
+def run_engine(root, events_path, result_path, seed, owner_ids, overrides):
+    """在 root 下的一个版本上回放事件，结果写入 result_path"""
+    sys.path.insert(0, root)
+    install_app_stubs(owner_ids)
+    logging.basicConfig(level=logging.ERROR)
+    clock = _VirtualClock()
+    time.time = clock.time
+    random.seed(seed)
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, *args, **kwargs):
+        if delay <= REPLAY_MAX_SKIPPED_SLEEP:
+            delay = 0
+        return await real_sleep(delay, *args, **kwargs)
+
+    asyncio.sleep = sleep
+
+    with open(events_path, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    main = importlib.import_module(f"{PLUGIN_PACKAGE}.main")
+    _apply_overrides(overrides)
+
+    written = _bytes_written()
+    started = time.perf_counter()
+    websocket = asyncio.run(_replay(main, events, clock))
+    # 等待后台写入完成，旧版本没有存储模块
+    try:
+        store = importlib.import_module(f"{PLUGIN_PACKAGE}.store").get_store()
+        getattr(store, "close", getattr(store, "flush", lambda: None))()
+    except (ImportError, AttributeError):
+        pass
+    elapsed = time.perf_counter() - started
+    data_dir = os.path.join(root, "app", "data", "GroupEntryVerification")
+    if written is not None:
+        written = _bytes_written() - written
+    else:
+        written = _directory_size(data_dir)
+
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "events": len(events),
+                "responses": websocket.responses,
+                "seconds": elapsed,
+                "bytes_written": written,
+                "calls": websocket.calls,
+            },
+            f,
+            ensure_ascii=False,
+        )
+
+
+# 主进程：准备版本、比较结果
+
+
+def prepare_engine(ref, root):
+    """把版本 ref（"." 为当前工作区）放到 root/app/scripts/GroupEntryVerification"""
+    target = os.path.join(root, "app", "scripts", "GroupEntryVerification")
+    os.makedirs(os.path.dirname(target))
+    # app 和 app.scripts 是普通包，不会与 sys.path 上其他位置的 app 合并
+    for package in (("app",), ("app", "scripts")):
+        open(os.path.join(root, *package, "__init__.py"), "w").close()
+    if ref == ".":
+        os.symlink(PLUGIN_DIR, target)
+        return
+    os.makedirs(target)
+    archive = os.path.join(root, "source.tar")
+    with open(archive, "wb") as f:
+        subprocess.run(
+            ["git", "archive", "--format=tar", ref],
+            cwd=PLUGIN_DIR,
+            stdout=f,
+            check=True,
+        )
+    with tarfile.open(archive) as tar:
+        tar.extractall(target)
+    os.remove(archive)
+
+
+def use_current_tree(root):
+    """
+    让主进程能导入当前工作区的模块
+
+    插件上三级目录不一定是机器人的根目录（单独检出插件时没有 app 包），
+    所以和回放的版本一样，把当前工作区放到 root/app/scripts/GroupEntryVerification，
+    并把 root 加到 sys.path 的最前面。之后 load_engine_state 和 normalize_state 用它读取数据。
+    """
+    prepare_engine(".", root)
+    sys.path.insert(0, root)
+
+
+def load_engine_state(data_dir):
+    """用当前版本的存储读取一个版本留下的全部验证数据，需要先调用 use_current_tree"""
+    from app.scripts.GroupEntryVerification.store import (
+        TABLES,
+        JsonFileStore,
+        GroupShardStore,
+    )
+
+    if os.path.isdir(os.path.join(data_dir, "journal")):
+        from app.scripts.GroupEntryVerification.journal_store import JournalStore
+
+        store = JournalStore(data_dir, import_existing=False)
+    elif os.path.isdir(os.path.join(data_dir, "groups")):
+        store = GroupShardStore(data_dir, import_legacy=False)
+    else:
+        store = JsonFileStore(data_dir)
+    # 空表和不存在的表一样，不计入
+    state = {table: store.load(table) for table in TABLES}
+    getattr(store, "close", lambda: None)()
+    return {table: records for table, records in state.items() if records}
+
+
+def normalize_state(state, ignored_fields=REPLAY_IGNORED_FIELDS):
+    """去掉忽略的字段，消息记录只保留消息ID"""
+    from app.scripts.GroupEntryVerification.store import MESSAGE_ID_LIST
+
+    result = {}
+    for table, records in state.items():
+        normalized = {}
+        for key, value in records.items():
+            if isinstance(value, dict):
+                value = {
+                    field: item
+                    for field, item in value.items()
+                    if field not in ignored_fields
+                }
+            if table == MESSAGE_ID_LIST and isinstance(value, dict):
+                value = {
+                    user_id: [
+                        entry[0] if isinstance(entry, list) else entry
+                        for entry in entries
+                    ]
+                    for user_id, entries in value.items()
+                }
+            normalized[key] = value
+        result[table] = normalized
+    return result
+
+
+def run_side(ref, events_path, seed, owner_ids, overrides):
+    """在子进程中回放一个版本，返回回放结果和最终数据"""
+    root = tempfile.mkdtemp(prefix="gev-replay-")
+    try:
+        prepare_engine(ref, root)
+        result_path = os.path.join(root, "result.json")
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            events_path,
+            "--run-engine",
+            root,
+            "--result",
+            result_path,
+            "--seed",
+            str(seed),
+            "--owner",
+            ",".join(owner_ids),
+        ]
+        for override in overrides:
+            command += ["--set", override]
+        subprocess.run(command, check=True)
+        with open(result_path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        result["state"] = load_engine_state(
+            os.path.join(root, "app", "data", "GroupEntryVerification")
+        )
+        return result
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _call_lines(calls):
+    return [
+        f"{action} {json.dumps(params, ensure_ascii=False, sort_keys=True)}"
+        for action, params in calls
+    ]
+
+
+def diff_calls(baseline, candidate):
+    """两边 API 调用序列的差异（unified diff 的行）"""
+    return list(
+        difflib.unified_diff(
+            _call_lines(baseline),
+            _call_lines(candidate),
+            "baseline",
+            "candidate",
+            lineterm="",
+            n=1,
+        )
+    )
+
+
+def diff_state(baseline, candidate):
+    """
+    两边最终数据的差异
+
+    返回:
+        tuple: (只有一边存在的表 {表名: "baseline"|"candidate"},
+            [(表名, 记录键, 基线的值, 候选的值), ...])
+    """
+    only = {}
+    changes = []
+    for table in sorted(set(baseline) | set(candidate)):
+        if table not in candidate:
+            only[table] = "baseline"
+            continue
+        if table not in baseline:
+            only[table] = "candidate"
+            continue
+        old, new = baseline[table], candidate[table]
+        for key in sorted(set(old) | set(new)):
+            if old.get(key) != new.get(key):
+                changes.append((table, key, old.get(key), new.get(key)))
+    return only, changes
+
+
+def _delta(old, new):
+    if not old:
+        return ""
+    return f"{(new - old) / old:+.1%}"
+
+
+def format_report(baseline_ref, candidate_ref, baseline, candidate):
+    """并排的性能对比和行为差异"""
+    lines = [
+        f"{'':<12}{'基线 ' + baseline_ref:>20}{'候选 ' + candidate_ref:>20}{'变化':>10}"
+    ]
+    rows = []
+    for result in (baseline, candidate):
+        rows.append(
+            {
+                "事件数": result["events"],
+                "耗时(ms)": round(result["seconds"] * 1000, 1),
+                "事件/秒": (
+                    round(result["events"] / result["seconds"], 1)
+                    if result["seconds"]
+                    else 0
+                ),
+                "API调用": len(result["calls"]),
+                "回调": result["responses"],
+                "写入字节": result["bytes_written"],
+            }
+        )
+    for name in rows[0]:
+        old, new = rows[0][name], rows[1][name]
+        lines.append(f"{name:<12}{old:>20}{new:>20}{_delta(old, new):>10}")
+
+    call_diff = diff_calls(baseline["calls"], candidate["calls"])
+    only, changes = diff_state(
+        normalize_state(baseline["state"]), normalize_state(candidate["state"])
+    )
+    lines.append("")
+    if call_diff:
+        lines.append(f"API 调用序列不同（差异 {len(call_diff)} 行）：")
+        lines.extend(call_diff[:REPLAY_MAX_DIFF_LINES])
+        if len(call_diff) > REPLAY_MAX_DIFF_LINES:
+            lines.append("...")
+    else:
+        lines.append("API 调用序列相同")
+    for table, side in only.items():
+        lines.append(f"表 {table} 只存在于{'基线' if side == 'baseline' else '候选'}")
+    if changes:
+        lines.append(f"最终数据不同（{len(changes)} 条记录）：")
+        for table, key, old, new in changes[:REPLAY_MAX_DIFF_LINES]:
+            lines.append(
+                f"  {table} {key}: "
+                f"{json.dumps(old, ensure_ascii=False)} -> {json.dumps(new, ensure_ascii=False)}"
+            )
+        if len(changes) > REPLAY_MAX_DIFF_LINES:
+            lines.append("  ...")
+    else:
+        lines.append("最终数据相同")
+    return "\n".join(lines), bool(call_diff or changes)
+
+
+def generate_events(count, seed=0, owner_id="10000"):
+    """
+    生成一串合成的事件：入群、答对、答错到次数用完、待验证时在群里发言、退群和管理员批准或拒绝
+    """
+    rng = random.Random(seed)
+    group_ids = [str(rng.randint(100000000, 999999999)) for _ in range(3)]
+    events = []
+    now = REPLAY_START
+    message_id = 1
+
+    def add(event):
+        nonlocal now, message_id
+        now += rng.randint(1, 5)
+        event.update(time=now, self_id=1)
+        if event.get("post_type") == "message":
+            event.setdefault("message_id", message_id)
+            message_id += 1
+        events.append(event)
+
+    for index in range(count):
+        group_id = rng.choice(group_ids)
+        user_id = str(200000000 + index)
+        add(
+            {
+                "post_type": "notice",
+                "notice_type": "group_increase",
+                "sub_type": "approve",
+                "group_id": int(group_id),
+                "user_id": int(user_id),
+            }
+        )
+        private = {
+            "post_type": "message",
+            "message_type": "private",
+            "sub_type": "friend",
+            "user_id": int(user_id),
+        }
+        fate = rng.random()
+        if fate < 0.1:
+            add(
+                {
+                    "post_type": "message",
+                    "message_type": "group",
+                    "group_id": int(group_id),
+                    "user_id": int(user_id),
+                    "raw_message": "hello",
+                    "message": "hello",
+                }
+            )
+        if fate < 0.5:
+            add(dict(private, raw_message="{answer}", replay_group=group_id))
+        elif fate < 0.65:
+            for _ in range(3):
+                add(dict(private, raw_message="99999", message="99999"))
+        elif fate < 0.8:
+            add(
+                {
+                    "post_type": "notice",
+                    "notice_type": "group_decrease",
+                    "sub_type": "leave",
+                    "group_id": int(group_id),
+                    "user_id": int(user_id),
+                }
+            )
+        elif fate < 0.9:
+            command = f"{rng.choice(['批准', '拒绝'])} {group_id} {user_id}"
+            add(
+                {
+                    "post_type": "message",
+                    "message_type": "private",
+                    "sub_type": "friend",
+                    "user_id": int(owner_id),
+                    "raw_message": command,
+                    "message": command,
+                }
+            )
+    return events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="差分回放两个版本的事件处理")
+    parser.add_argument("events", nargs="?", help="事件文件（JSONL）")
+    parser.add_argument("--baseline", default="HEAD", help="基线版本的 git 提交")
+    parser.add_argument("--candidate", default=".", help="候选版本，. 为当前工作区")
+    parser.add_argument("--baseline-set", action="append", default=[])
+    parser.add_argument(
+        "--candidate-set",
+        action="append",
+        default=[],
+        help="回放前修改候选版本的模块常量，例如 store.STORE_FORMAT='\"journal\"'",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--owner", default="10000", help="管理员QQ号，多个用逗号分隔")
+    parser.add_argument("--generate", type=int, help="输出指定人数的合成事件")
+    parser.add_argument("--run-engine", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--set", action="append", default=[], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    owner_ids = [owner for owner in args.owner.split(",") if owner]
+
+    if args.generate is not None:
+        for event in generate_events(args.generate, args.seed, owner_ids[0]):
+            print(json.dumps(event, ensure_ascii=False))
+        return 0
+    if args.run_engine:
+        run_engine(
+            args.run_engine, args.events, args.result, args.seed, owner_ids, args.set
+        )
+        return 0
+    if not args.events:
+        parser.error("需要事件文件")
+
+    events_path = os.path.abspath(args.events)
+    current_root = tempfile.mkdtemp(prefix="gev-replay-")
+    try:
+        use_current_tree(current_root)
+        baseline = run_side(
+            args.baseline, events_path, args.seed, owner_ids, args.baseline_set
+        )
+        candidate = run_side(
+            args.candidate, events_path, args.seed, owner_ids, args.candidate_set
+        )
+        report, changed = format_report(
+            args.baseline, args.candidate, baseline, candidate
+        )
+    finally:
+        shutil.rmtree(current_root, ignore_errors=True)
+    print(report)
+    return 1 if changed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
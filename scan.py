@@ -3,7 +3,6 @@
 """
 
 import os
-import json
 import logging
 from collections import defaultdict
 import asyncio
@@ -16,23 +15,20 @@ sys.path.append(
     os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 )
 
-from app.api import send_group_msg, set_group_kick, send_private_msg
-
-# 数据存储路径
-DATA_DIR = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
-    "data",
-    "GroupEntryVerification",
+from app.api import send_group_msg, send_private_msg
+from app.scripts.GroupEntryVerification.reconcile import reconcile_pending_users
+from app.scripts.GroupEntryVerification.state_machine import state_machine, KICK
+from app.scripts.GroupEntryVerification.records import (
+    RecordTable,
+    make_key,
+)
+from app.scripts.GroupEntryVerification.store import (
+    get_store,
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+    WARNING_RECORD,
+    REACHED_LIMIT,
 )
-
-# 用户验证状态文件
-USER_VERIFICATION_FILE = os.path.join(DATA_DIR, "user_verification.json")
-# 验证题目文件
-VERIFICATION_QUESTIONS_FILE = os.path.join(DATA_DIR, "verification_questions.json")
-# 警告记录文件
-WARNING_RECORD_FILE = os.path.join(DATA_DIR, "warning_record.json")
-# 达到警告上限用户记录文件
-REACHED_LIMIT_FILE = os.path.join(DATA_DIR, "reached_limit.json")
 
 # 最大警告次数
 MAX_WARNING_COUNT = 3
@@ -41,73 +37,78 @@ MAX_WARNING_COUNT = 3
 class ScanVerification:
     """扫描未验证用户并发送警告的类"""
 
-    def __init__(self):
-        """初始化扫描验证类"""
-        self.user_verification = self._load_user_verification()
+    def __init__(self, member_list_cache=None):
+        """
+        初始化扫描验证类
+
+        参数:
+            member_list_cache (MemberListCache): 提供时，扫描每个群前先用群成员列表核对待验证用户
+        """
+        self.store = get_store()
+        self.member_list_cache = member_list_cache
+        # 当前加载的群，只加载正在扫描的群的数据
+        self.group_id = None
+        self.records = RecordTable()
+        self.verification_questions = {}
+        self.warning_record = {}
+        self.reached_limit = {}
+        # 本次扫描中修改过的警告记录和警告上限记录，保存时只写入这些记录
+        self._dirty_warnings = set()
+        self._dirty_groups = set()
+
+    def _load_all(self, group_id):
+        """加载扫描某个群用到的全部数据"""
+        self.group_id = group_id
+        self.records = self._load_user_verification()
         self.verification_questions = self._load_verification_questions()
         self.warning_record = self._load_warning_record()
         self.reached_limit = self._load_reached_limit()
 
     def _load_user_verification(self):
         """加载用户验证状态"""
-        if not os.path.exists(USER_VERIFICATION_FILE):
-            return {}
-        try:
-            with open(USER_VERIFICATION_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"加载用户验证状态失败: {e}")
-            return {}
+        return RecordTable.from_dicts(
+            self.store.load_group(USER_VERIFICATION, self.group_id)
+        )
 
     def _load_verification_questions(self):
         """加载用户验证问题"""
-        if not os.path.exists(VERIFICATION_QUESTIONS_FILE):
-            return {}
-        try:
-            with open(VERIFICATION_QUESTIONS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"加载验证问题失败: {e}")
-            return {}
+        return self.store.load_group(VERIFICATION_QUESTIONS, self.group_id)
 
     def _load_warning_record(self):
         """加载警告记录"""
-        if not os.path.exists(WARNING_RECORD_FILE):
-            return {}  # 返回普通字典而不是defaultdict
-        try:
-            with open(WARNING_RECORD_FILE, "r", encoding="utf-8") as f:
-                # 返回普通字典而不是defaultdict
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"加载警告记录失败: {e}")
-            return {}
+        return self.store.load_group(WARNING_RECORD, self.group_id)
 
     def _load_reached_limit(self):
         """加载达到警告上限的用户记录"""
-        if not os.path.exists(REACHED_LIMIT_FILE):
-            return {}
-        try:
-            with open(REACHED_LIMIT_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"加载达到警告上限用户记录失败: {e}")
-            return {}
+        return self.store.load_group(REACHED_LIMIT, self.group_id)
 
     def _save_warning_record(self):
         """保存警告记录"""
-        os.makedirs(os.path.dirname(WARNING_RECORD_FILE), exist_ok=True)
         try:
-            with open(WARNING_RECORD_FILE, "w", encoding="utf-8") as f:
-                json.dump(dict(self.warning_record), f, ensure_ascii=False, indent=4)
+            self.store.update_many(
+                WARNING_RECORD,
+                {
+                    key: (lambda _, value=self.warning_record.get(key): value)
+                    for key in self._dirty_warnings
+                },
+            )
+            self._dirty_warnings.clear()
         except Exception as e:
             logging.error(f"保存警告记录失败: {e}")
 
     def _save_reached_limit(self):
         """保存达到警告上限的用户记录"""
-        os.makedirs(os.path.dirname(REACHED_LIMIT_FILE), exist_ok=True)
         try:
-            with open(REACHED_LIMIT_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.reached_limit, f, ensure_ascii=False, indent=4)
+            self.store.update_many(
+                REACHED_LIMIT,
+                {
+                    group_id: (
+                        lambda _, value=self.reached_limit.get(group_id): value or None
+                    )
+                    for group_id in self._dirty_groups
+                },
+            )
+            self._dirty_groups.clear()
         except Exception as e:
             logging.error(f"保存达到警告上限用户记录失败: {e}")
 
@@ -115,40 +116,26 @@ class ScanVerification:
         """获取指定群中所有未验证的用户"""
         pending_users = []
 
-        for key, value in self.user_verification.items():
-            if "_" in key and value.get("status") == "pending":
-                user_id, gid = key.split("_")
-                if gid == group_id:
-                    # 检查是否有对应的验证问题
-                    expression = None
-                    if key in self.verification_questions:
-                        expression = self.verification_questions[key].get("expression")
-                    elif f"{user_id}_{group_id}" in self.verification_questions:
-                        expression = self.verification_questions[
-                            f"{user_id}_{group_id}"
-                        ].get("expression")
-
-                    if expression:
-                        pending_users.append(
-                            {
-                                "user_id": user_id,
-                                "expression": expression,
-                                "remaining_attempts": value.get(
-                                    "remaining_attempts", 3
-                                ),
-                            }
-                        )
+        for record in self.records.pending(group_id):
+            # 检查是否有对应的验证问题
+            question = self.verification_questions.get(record.store_key)
+            expression = question.get("expression") if question else None
+
+            if expression:
+                pending_users.append(
+                    {
+                        "user_id": str(record.user_id),
+                        "expression": expression,
+                        "remaining_attempts": record.remaining_attempts,
+                    }
+                )
 
         return pending_users
 
     def get_all_group_ids(self):
         """获取所有存在未验证用户的群号列表"""
-        group_ids = set()
-        for key, value in self.user_verification.items():
-            if "_" in key and value.get("status") == "pending":
-                _, gid = key.split("_")
-                group_ids.add(gid)
-        return list(group_ids)
+        records = RecordTable.from_dicts(self.store.load(USER_VERIFICATION))
+        return list({str(record.group_id) for record in records.pending()})
 
     async def warn_all_pending_users(self, websocket):
         """扫描所有群的未验证用户并进行提醒"""
@@ -167,6 +154,12 @@ class ScanVerification:
         """警告未验证的用户，支持扫描所有群"""
         if group_id is None:
             return await self.warn_all_pending_users(websocket)
+
+        # 先清理已经不在群里的待验证用户，避免提醒或踢出已离开的用户
+        if self.member_list_cache is not None:
+            await reconcile_pending_users(websocket, self.member_list_cache, [group_id])
+        self._load_all(group_id)
+
         # 先处理上次达到警告上限的用户
         kick_result = await self.check_and_kick_users(websocket, group_id)
 
@@ -182,7 +175,7 @@ class ScanVerification:
         about_to_kick_users = []
 
         for user in pending_users:
-            user_key = f"{user['user_id']}_{group_id}"
+            user_key = make_key(user["user_id"], group_id)
 
             # 检查用户是否已有警告记录，如果没有则初始化为0而不是默认的自增
             if user_key not in self.warning_record:
@@ -190,6 +183,7 @@ class ScanVerification:
 
             # 增加警告次数
             self.warning_record[user_key] += 1
+            self._dirty_warnings.add(user_key)
 
             # 获取当前用户的警告次数
             current_warning_count = self.warning_record[user_key]
@@ -201,6 +195,7 @@ class ScanVerification:
                     self.reached_limit[group_id] = []
                 if user["user_id"] not in self.reached_limit[group_id]:
                     self.reached_limit[group_id].append(user["user_id"])
+                    self._dirty_groups.add(group_id)
                     about_to_kick_users.append(user["user_id"])
 
                 # 格式化最后一次警告消息，包含计算式和强调这是最后一次机会
@@ -237,52 +232,25 @@ class ScanVerification:
         if group_id not in self.reached_limit or not self.reached_limit[group_id]:
             return False
 
-        kicked_users = []
-        for user_id in self.reached_limit[group_id]:
-            # 踢出用户
-            try:
-                await set_group_kick(websocket, group_id, user_id)
-                kicked_users.append(user_id)
-
-                # 从警告记录中移除
-                user_key = f"{user_id}_{group_id}"
-                if user_key in self.warning_record:
-                    del self.warning_record[user_key]
-
-                # 从验证状态中移除
-                if user_key in self.user_verification:
-                    self.user_verification[user_key]["status"] = "kicked"
-                    # 立即保存状态更新
-                    with open(USER_VERIFICATION_FILE, "w", encoding="utf-8") as f:
-                        json.dump(
-                            self.user_verification,
-                            f,
-                            ensure_ascii=False,
-                            indent=4,
-                        )
-
-                # 立即重新加载用户验证状态，确保后续操作使用最新数据
-                self.user_verification = self._load_user_verification()
-
-                # 从验证问题中移除
-                verification_questions = self._load_verification_questions()
-                if user_key in verification_questions:
-                    del verification_questions[user_key]
-                    with open(VERIFICATION_QUESTIONS_FILE, "w", encoding="utf-8") as f:
-                        json.dump(
-                            verification_questions, f, ensure_ascii=False, indent=4
-                        )
-
-                logging.info(
-                    f"用户 {user_id} 被警告超过 {MAX_WARNING_COUNT} 次，已被踢出群 {group_id}"
-                )
-            except Exception as e:
-                logging.error(f"踢出用户 {user_id} 失败: {e}")
-        # 清空该群组的达到警告上限用户列表
-        if kicked_users:
-            self.reached_limit[group_id] = []
-            self._save_reached_limit()
+        # 在一次提交中把仍在等待验证的用户标记为已踢出并清理验证数据，然后踢出并撤回验证消息
+        result = await state_machine.apply(
+            websocket,
+            KICK,
+            [(group_id, user_id) for user_id in self.reached_limit[group_id]],
+        )
+        for _, user_id in result.applied:
+            logging.info(
+                f"用户 {user_id} 被警告超过 {MAX_WARNING_COUNT} 次，已被踢出群 {group_id}"
+            )
+
+        # 清空该群组的达到警告上限用户列表，已不在等待验证的用户也不再踢出
+        if result.skipped:
+            self.store.delete(REACHED_LIMIT, group_id)
+        # 重新加载该群的数据，确保后续操作使用最新数据
+        self._load_all(group_id)
 
+        kicked_users = [user_id for _, user_id in result.done]
+        if kicked_users:
             # 如果有用户被踢出，发送通知
             users_str_warning_msg = "".join(
                 f"[CQ:at,qq={user_id}]({user_id})" for user_id in kicked_users
@@ -292,10 +260,6 @@ class ScanVerification:
                 group_id,
                 f"{users_str_warning_msg}因多次未完成验证已被踢出群聊",
             )
-
-            # 保存更新的警告记录
-            self._save_warning_record()
-
             return True
 
         return False
@@ -0,0 +1,210 @@
+"""
+按群分片的多进程部署模式
+
+主进程只负责过滤和路由：每个事件按群号的一致性哈希交给对应的工作进程处理，
+工作进程发出的API调用经队列交回主进程，由主进程写入真实的 websocket。
+工作进程中改变了主进程过滤所依赖的状态（如功能开关）时，用 notify_dispatcher
+经同一个队列发送控制消息，主进程交给 ShardDispatcher 的 on_control 处理。
+进程之间只使用本机的 multiprocessing 队列通信。
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import queue
+
+# 每个工作进程在哈希环上的虚拟节点数
+VIRTUAL_NODES = 160
+
+# 当前进程是工作进程时为分片序号，用于判断群归属的哈希环，以及发往主进程的队列
+_worker_index = None
+_worker_ring = None
+_worker_outbox = None
+
+
+def is_shard_worker():
+    """当前进程是否是分片工作进程"""
+    return _worker_index is not None
+
+
+def worker_index():
+    """当前工作进程的分片序号，不是工作进程时返回 None"""
+    return _worker_index
+
+
+def owns_group(group_id):
+    """当前进程是否负责该群，非分片模式下负责所有群"""
+    if _worker_ring is None:
+        return True
+    return _worker_ring.get_shard(group_id) == _worker_index
+
+
+def notify_dispatcher(*message):
+    """工作进程向主进程发送控制消息 (名称, 参数...)，不是工作进程时什么也不做"""
+    if _worker_outbox is not None:
+        _worker_outbox.put(message)
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """群号到分片序号的一致性哈希环"""
+
+    def __init__(self, shard_count, virtual_nodes=VIRTUAL_NODES):
+        points = sorted(
+            (_hash(f"{shard}#{node}"), shard)
+            for shard in range(shard_count)
+            for node in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def get_shard(self, group_id):
+        """获取群所属的分片序号"""
+        index = bisect.bisect(self._points, _hash(str(group_id)))
+        return self._shards[index % len(self._shards)]
+
+
+class _QueueWebSocket:
+    """工作进程中代替 websocket，发出的数据经队列交给主进程发送"""
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    async def send(self, data):
+        self.outbox.put(data)
+
+
+def _worker_main(shard_index, shard_count, inbox, outbox):
+    """工作进程入口"""
+    global _worker_index, _worker_ring, _worker_outbox
+    _worker_index = shard_index
+    _worker_ring = HashRing(shard_count)
+    _worker_outbox = outbox
+
+    from app.scripts.GroupEntryVerification.main import handle_events
+
+    asyncio.run(_worker_loop(handle_events, inbox, outbox))
+    outbox.put(None)
+
+
+async def _worker_loop(handle_events, inbox, outbox):
+    """逐个取出分配给本分片的事件并发处理，收到 None 时退出"""
+    loop = asyncio.get_running_loop()
+    websocket = _QueueWebSocket(outbox)
+    tasks = set()
+    while True:
+        msg = await loop.run_in_executor(None, inbox.get)
+        if msg is None:
+            break
+        task = asyncio.create_task(handle_events(websocket, msg))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class ShardDispatcher:
+    """主进程中的事件路由器"""
+
+    def __init__(self, shard_count, route, on_control=None):
+        """
+        参数:
+            shard_count (int): 工作进程数
+            route (callable): 接收事件，返回事件所属的群号列表；返回 None 表示交给所有分片
+            on_control (callable): 接收工作进程用 notify_dispatcher 发送的控制消息
+        """
+        self.shard_count = shard_count
+        self.route = route
+        self.on_control = on_control
+        self.ring = HashRing(shard_count)
+        self.websocket = None
+        self._inboxes = []
+        self._outbox = None
+        self._processes = []
+        self._pump_task = None
+
+    @property
+    def started(self):
+        return bool(self._processes)
+
+    def start(self):
+        """启动工作进程"""
+        if self.started:
+            return
+        ctx = multiprocessing.get_context("spawn")
+        self._outbox = ctx.Queue()
+        for shard_index in range(self.shard_count):
+            inbox = ctx.Queue()
+            process = ctx.Process(
+                target=_worker_main,
+                args=(shard_index, self.shard_count, inbox, self._outbox),
+                name=f"GroupEntryVerification-shard-{shard_index}",
+                daemon=True,
+            )
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        logging.info(f"GroupEntryVerification已启动 {self.shard_count} 个分片工作进程")
+
+    def get_shards(self, msg):
+        """获取事件应交给的分片序号"""
+        group_ids = self.route(msg)
+        if group_ids is None:
+            return range(self.shard_count)
+        return sorted({self.ring.get_shard(group_id) for group_id in group_ids})
+
+    async def dispatch(self, websocket, msg):
+        """把事件交给所属的工作进程"""
+        self.websocket = websocket
+        if not self.started:
+            self.start()
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump())
+        for shard_index in self.get_shards(msg):
+            self._inboxes[shard_index].put(msg)
+
+    async def _pump(self):
+        """把工作进程发出的数据写入当前的 websocket"""
+        loop = asyncio.get_running_loop()
+        running = len(self._processes)
+        while running:
+            try:
+                data = await loop.run_in_executor(None, self._outbox.get, True, 1)
+            except queue.Empty:
+                # 工作进程异常退出时不会发送结束标记
+                if not any(process.is_alive() for process in self._processes):
+                    logging.error("GroupEntryVerification分片工作进程已全部退出")
+                    break
+                continue
+            if data is None:
+                running -= 1
+                continue
+            if isinstance(data, tuple):
+                if self.on_control is not None:
+                    try:
+                        self.on_control(*data)
+                    except Exception as e:
+                        logging.error(f"处理分片工作进程的控制消息 {data[0]} 失败: {e}")
+                continue
+            try:
+                await self.websocket.send(data)
+            except Exception as e:
+                logging.error(f"转发分片工作进程的消息失败: {e}")
+
+    async def stop(self):
+        """通知工作进程处理完已分配的事件后退出，并等待转发完成"""
+        for inbox in self._inboxes:
+            inbox.put(None)
+        if self._pump_task is not None:
+            await self._pump_task
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join)
+        self._inboxes = []
+        self._processes = []
+        self._pump_task = None
@@ -0,0 +1,365 @@
+"""
+验证状态机
+
+用户的验证记录从 pending 出发，经过以下转换结束验证：
+    PASS      回答正确              pending -> verified   解除禁言，撤回验证消息
+    FAIL      次数用完              pending -> failed     踢出，撤回验证消息
+    APPROVE   管理员批准            pending -> verified   解除禁言，撤回验证消息
+    REJECT    管理员拒绝            任意状态 -> rejected  踢出，撤回验证消息
+    KICK      多次警告后扫描踢出    pending -> kicked     踢出，撤回验证消息
+    LEAVE     退群                  任意状态 -> 删除记录  撤回验证消息
+
+每次转换在一次存储提交（store.update_tables）中修改验证记录，并清理验证题目、警告记录、
+警告上限记录和消息记录，同时更新验证统计；状态不符合转换起点的用户不做任何修改。
+提交之后再把解禁、踢人和撤回作为一批 API 调用并发发出。
+"""
+
+import os
+import sys
+import asyncio
+import logging
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.api import set_group_ban, set_group_kick, delete_msg
+from app.scripts.GroupEntryVerification.records import (
+    Status,
+    VerificationRecord,
+    make_key,
+)
+from app.scripts.GroupEntryVerification.tracing import tracer
+from app.scripts.GroupEntryVerification.stats import count_events, attempts_used
+from app.scripts.GroupEntryVerification.del_message import recallable_ids
+from app.scripts.GroupEntryVerification.store import (
+    get_store,
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+    WARNING_RECORD,
+    REACHED_LIMIT,
+    MESSAGE_ID_LIST,
+    VERIFICATION_STATS,
+)
+
+# 同时进行的API调用数
+ACTION_CONCURRENCY = 10
+
+# 转换之后的API操作
+ACTION_UNBAN = "unban"
+ACTION_KICK = "kick"
+ACTION_RECALL = "recall"
+
+
+class Transition:
+    """一种结束验证的状态转换"""
+
+    __slots__ = ("code", "name", "status", "from_states", "allow_missing", "actions")
+
+    def __init__(
+        self, code, name, status, from_states=None, allow_missing=False, actions=()
+    ):
+        """
+        参数:
+            code (str): 标识，用于验证追踪
+            name (str): 名称，用于日志
+            status (Status): 转换后的状态，None 表示删除验证记录
+            from_states (tuple): 允许的起始状态，None 表示任意状态
+            allow_missing (bool): 没有验证记录的用户是否也执行清理和API操作
+            actions (tuple): 提交后执行的API操作
+        """
+        self.code = code
+        self.name = name
+        self.status = status
+        self.from_states = from_states
+        self.allow_missing = allow_missing
+        self.actions = actions
+
+    def accepts(self, record):
+        """记录是否可以执行这个转换"""
+        if record is None:
+            return self.allow_missing
+        return self.from_states is None or record.status in self.from_states
+
+    def __repr__(self):
+        return f"Transition({self.name})"
+
+
+PASS = Transition(
+    "pass",
+    "通过验证",
+    Status.VERIFIED,
+    (Status.PENDING,),
+    actions=(ACTION_UNBAN, ACTION_RECALL),
+)
+FAIL = Transition(
+    "fail",
+    "验证失败",
+    Status.FAILED,
+    (Status.PENDING,),
+    actions=(ACTION_KICK, ACTION_RECALL),
+)
+APPROVE = Transition(
+    "approve",
+    "管理员批准",
+    Status.VERIFIED,
+    (Status.PENDING,),
+    actions=(ACTION_UNBAN, ACTION_RECALL),
+)
+REJECT = Transition(
+    "reject",
+    "管理员拒绝",
+    Status.REJECTED,
+    allow_missing=True,
+    actions=(ACTION_KICK, ACTION_RECALL),
+)
+KICK = Transition(
+    "kick",
+    "警告后踢出",
+    Status.KICKED,
+    (Status.PENDING,),
+    actions=(ACTION_KICK, ACTION_RECALL),
+)
+LEAVE = Transition("leave", "退群", None, actions=(ACTION_RECALL,))
+
+
+class TransitionResult:
+    """一次转换的结果"""
+
+    __slots__ = ("transition", "applied", "skipped", "messages", "failed")
+
+    def __init__(self, transition, applied, skipped, messages):
+        self.transition = transition
+        # 执行了转换的 (群号, QQ号)
+        self.applied = applied
+        # 状态不符合而跳过的 (群号, QQ号)
+        self.skipped = skipped
+        # 提交时取出的验证消息：{群号: {QQ号: [message_id, ...]}}
+        self.messages = messages
+        # 解禁或踢人失败的 (群号, QQ号) -> 异常
+        self.failed = {}
+
+    @property
+    def done(self):
+        """转换和API操作都成功的 (群号, QQ号)"""
+        return [target for target in self.applied if target not in self.failed]
+
+
+async def run_bounded(calls, limit=ACTION_CONCURRENCY):
+    """
+    并发执行一批调用，同时进行的调用不超过 limit 个
+
+    参数:
+        calls (list): 无参数的异步函数列表
+
+    返回:
+        list: 每个调用抛出的异常，成功时为 None
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(call):
+        async with semaphore:
+            try:
+                await call()
+            except Exception as e:
+                return e
+            return None
+
+    return await asyncio.gather(*(run(call) for call in calls))
+
+
+class VerificationStateMachine:
+    """执行验证状态转换：一次存储提交，之后一批API调用"""
+
+    def __init__(self, concurrency=ACTION_CONCURRENCY):
+        self.concurrency = concurrency
+
+    def commit(self, transition, targets):
+        """
+        在一次存储提交中对一批用户执行转换
+
+        参数:
+            transition (Transition): 转换
+            targets (list): [(群号, QQ号), ...]
+
+        返回:
+            TransitionResult
+        """
+        targets = [(str(group_id), str(user_id)) for group_id, user_id in targets]
+        keys = {
+            make_key(user_id, group_id): (group_id, user_id)
+            for group_id, user_id in targets
+        }
+        by_group = {}
+        for group_id, user_id in keys.values():
+            by_group.setdefault(group_id, []).append(user_id)
+        applied = set()
+        messages = {}
+        # 记录键 -> (统计计数名, 答题次数)，只统计仍在等待验证的用户
+        outcomes = {}
+
+        # 存储在冲突重试时会按同样的顺序重新调用所有修改函数，以最后一次为准
+        def apply_record(key):
+            def apply(value):
+                applied.discard(key)
+                outcomes.pop(key, None)
+                record = VerificationRecord.from_dict(key, value) if value else None
+                if not transition.accepts(record):
+                    return value
+                applied.add(key)
+                if record is not None and record.status == Status.PENDING:
+                    used = None
+                    if transition in (PASS, FAIL):
+                        used = attempts_used(
+                            record.remaining_attempts, transition is PASS
+                        )
+                    outcomes[key] = (transition.code, used)
+                if record is None or transition.status is None:
+                    return None
+                record.status = transition.status
+                return record.to_dict()
+
+            return apply
+
+        def drop(key):
+            def apply(value):
+                return None if key in applied else value
+
+            return apply
+
+        def transitioned(group_id, user_ids):
+            return {
+                user_id
+                for user_id in user_ids
+                if make_key(user_id, group_id) in applied
+            }
+
+        def remove_users(group_id, user_ids):
+            def apply(value):
+                users = transitioned(group_id, user_ids)
+                if value:
+                    value = [user_id for user_id in value if user_id not in users]
+                return value or None
+
+            return apply
+
+        def events_of(group_id):
+            return [
+                outcomes[make_key(user_id, group_id)]
+                for user_id in by_group[group_id]
+                if make_key(user_id, group_id) in outcomes
+            ]
+
+        def pop_messages(group_id, user_ids):
+            def apply(value):
+                messages.pop(group_id, None)
+                if not value:
+                    return None
+                # 超过撤回时间窗口的消息只删除记录，不再撤回
+                popped = {
+                    user_id: recallable_ids(value.pop(user_id))
+                    for user_id in transitioned(group_id, user_ids)
+                    if user_id in value
+                }
+                if popped:
+                    messages[group_id] = popped
+                return value or None
+
+            return apply
+
+        get_store().update_tables(
+            {
+                USER_VERIFICATION: {key: apply_record(key) for key in keys},
+                VERIFICATION_QUESTIONS: {key: drop(key) for key in keys},
+                WARNING_RECORD: {key: drop(key) for key in keys},
+                REACHED_LIMIT: {
+                    group_id: remove_users(group_id, user_ids)
+                    for group_id, user_ids in by_group.items()
+                },
+                MESSAGE_ID_LIST: {
+                    group_id: pop_messages(group_id, user_ids)
+                    for group_id, user_ids in by_group.items()
+                },
+                VERIFICATION_STATS: count_events(events_of, by_group),
+            }
+        )
+        result = TransitionResult(
+            transition,
+            [target for key, target in keys.items() if key in applied],
+            [target for key, target in keys.items() if key not in applied],
+            messages,
+        )
+        if result.applied:
+            logging.info(
+                f"{transition.name}：已在一次提交中更新 {len(result.applied)} 个用户的验证数据"
+            )
+        for group_id, user_id in result.applied:
+            tracer.step(group_id, user_id, transition.code)
+        return result
+
+    async def dispatch(self, websocket, result):
+        """
+        把转换后的解禁、踢人和撤回作为一批API调用发出
+
+        解禁或踢人失败的用户记录在 result.failed 中，撤回失败只记录日志
+
+        返回:
+            TransitionResult: 传入的 result
+        """
+        actions = result.transition.actions
+        calls, owners = [], []
+        for group_id, user_id in result.applied:
+            if ACTION_UNBAN in actions:
+                calls.append(
+                    lambda group_id=group_id, user_id=user_id: set_group_ban(
+                        websocket, group_id, user_id, 0
+                    )
+                )
+                owners.append((group_id, user_id))
+            if ACTION_KICK in actions:
+                calls.append(
+                    lambda group_id=group_id, user_id=user_id: set_group_kick(
+                        websocket, group_id, user_id
+                    )
+                )
+                owners.append((group_id, user_id))
+            if ACTION_RECALL in actions:
+                for message_id in result.messages.get(group_id, {}).get(user_id, []):
+                    calls.append(
+                        lambda message_id=message_id: delete_msg(websocket, message_id)
+                    )
+                    owners.append(None)
+
+        errors = await run_bounded(calls, self.concurrency)
+        for owner, error in zip(owners, errors):
+            if error is None:
+                continue
+            if owner is None:
+                logging.error(f"撤回验证消息失败: {error}")
+            else:
+                result.failed[owner] = error
+                logging.error(
+                    f"{result.transition.name}：群 {owner[0]} 用户 {owner[1]} 的操作失败: {error}"
+                )
+
+        # 解禁和踢人完成后结束验证追踪
+        transition = result.transition
+        for group_id, user_id in result.applied:
+            ok = (group_id, user_id) not in result.failed
+            for action in (ACTION_UNBAN, ACTION_KICK):
+                if action in actions:
+                    tracer.step(group_id, user_id, f"{action}_done", ok=ok)
+            tracer.finish(
+                group_id,
+                user_id,
+                transition.code,
+                verified=ok and transition.status == Status.VERIFIED,
+            )
+        return result
+
+    async def apply(self, websocket, transition, targets):
+        """提交转换并发出API调用"""
+        return await self.dispatch(websocket, self.commit(transition, targets))
+
+
+state_machine = VerificationStateMachine()
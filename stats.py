@@ -0,0 +1,185 @@
+"""
+验证统计
+
+每个群的统计是 VERIFICATION_STATS 表中以群号为键的一条记录。所有群的合计分散在固定的
+STATS_TOTAL_SLOTS 条合计记录（键为 total-0、total-1……）中，每个群按群号的哈希固定计入其中一条。
+入群和每次结束验证的状态转换在同一次存储提交中更新所属群的统计和它的合计记录，
+不同群的更新只在少数情况下争用同一条合计记录；查询一个群时只读取一条记录，
+查询合计时读取固定数量的合计记录相加，与群数和历史记录的数量都无关。
+
+记录格式（计数按 STATS_FIELDS 的顺序保存为整数列表）：
+    {
+        "total": [入群, 答题通过, 批准, 验证失败, 拒绝, 超时踢出, 未验证退群, 信任放行],
+        "attempts": {"答题次数": 人数, ...},   # 答题通过和验证失败的用户用了几次机会
+        "hours": {"小时序号": [...], ...},      # 最近 STATS_BUCKET_HOURS 小时，每小时一组计数
+    }
+结束验证的转换只在用户仍在等待验证时计数，已通过验证的用户之后退群不计入未验证退群。
+"""
+
+import os
+import sys
+import time
+import zlib
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.records import MAX_ATTEMPTS
+from app.scripts.GroupEntryVerification.store import get_store, VERIFICATION_STATS
+
+# 计数的顺序，新增的计数只能追加在末尾
+JOIN = "join"
+TRUSTED = "trusted"
+STATS_FIELDS = (JOIN, "pass", "approve", "fail", "reject", "kick", "leave", TRUSTED)
+# 所有群合计分散保存的记录数
+STATS_TOTAL_SLOTS = 16
+# 按小时分桶保留的时长（小时）
+STATS_BUCKET_HOURS = 7 * 24
+
+
+def _hour(now):
+    return int(now // 3600)
+
+
+def _counters(values):
+    """补齐旧记录中缺少的计数"""
+    values = list(values or ())
+    return values + [0] * (len(STATS_FIELDS) - len(values))
+
+
+def _add(record, events, now):
+    record = dict(record or {})
+    hour = _hour(now)
+    total = _counters(record.get("total"))
+    hours = {
+        key: value
+        for key, value in (record.get("hours") or {}).items()
+        if int(key) > hour - STATS_BUCKET_HOURS
+    }
+    bucket = _counters(hours.get(str(hour)))
+    attempts = dict(record.get("attempts") or {})
+    for event, used in events:
+        index = STATS_FIELDS.index(event)
+        total[index] += 1
+        bucket[index] += 1
+        if used is not None:
+            attempts[str(used)] = attempts.get(str(used), 0) + 1
+    hours[str(hour)] = bucket
+    record.update(total=total, attempts=attempts, hours=hours)
+    return record
+
+
+def count_events(events_of, group_ids, now=None):
+    """
+    生成更新统计的修改函数，供 store.update_tables 使用
+
+    参数:
+        events_of (callable): events_of(群号) 在修改函数执行时调用，返回 [(计数名, 答题次数或None), ...]；
+            存储冲突重试时会再次调用，需要返回与本次提交一致的结果
+        group_ids (iterable): 要更新的群号
+
+    返回:
+        dict: {记录键: 修改函数}，包括各群和它们所在的合计记录
+    """
+    now = time.time() if now is None else now
+    group_ids = [str(group_id) for group_id in group_ids]
+    slots = {}
+    for group_id in group_ids:
+        slots.setdefault(total_key_of(group_id), []).append(group_id)
+
+    def update(group_ids):
+        def apply(value):
+            events = [event for group_id in group_ids for event in events_of(group_id)]
+            return _add(value, events, now) if events else value
+
+        return apply
+
+    funcs = {group_id: update([group_id]) for group_id in group_ids}
+    funcs.update((key, update(members)) for key, members in slots.items())
+    return funcs
+
+
+def total_key_of(group_id):
+    """群计入的合计记录的键"""
+    slot = zlib.crc32(str(group_id).encode("utf-8")) % STATS_TOTAL_SLOTS
+    return f"total-{slot}"
+
+
+def count_join(group_id, now=None):
+    """入群计数的修改函数"""
+    return count_events(lambda _: [(JOIN, None)], [group_id], now)
+
+
+def attempts_used(remaining_attempts, passed):
+    """用户结束验证时用了几次答题机会"""
+    used = MAX_ATTEMPTS - max(int(remaining_attempts), 0)
+    return used + 1 if passed else used
+
+
+def _median(histogram):
+    count = sum(histogram.values())
+    if not count:
+        return None
+    seen = 0
+    for used in sorted(histogram, key=int):
+        seen += histogram[used]
+        if seen * 2 >= count:
+            return int(used)
+
+
+def summarize(record, now=None, hours=24):
+    """
+    把统计记录整理为累计和最近 hours 小时的计数
+
+    返回:
+        dict: {"total": {计数名: 数量}, "recent": {计数名: 数量}, "pass_rate": 通过率或None,
+            "median_attempts": 答题次数中位数或None}
+    """
+    record = record or {}
+    now = time.time() if now is None else now
+    first_hour = _hour(now) - hours
+    recent = [0] * len(STATS_FIELDS)
+    for key, values in (record.get("hours") or {}).items():
+        if int(key) > first_hour:
+            recent = [a + b for a, b in zip(recent, _counters(values))]
+    total = dict(zip(STATS_FIELDS, _counters(record.get("total"))))
+    # 信任放行的用户没有参与验证，不计入通过率
+    finished = sum(total.values()) - total[JOIN] - total[TRUSTED]
+    return {
+        "total": total,
+        "recent": dict(zip(STATS_FIELDS, recent)),
+        "pass_rate": (
+            (total["pass"] + total["approve"]) / finished if finished else None
+        ),
+        "median_attempts": _median(record.get("attempts") or {}),
+    }
+
+
+def _merge(records):
+    """把多个群的统计记录相加"""
+    total = _counters(None)
+    attempts = {}
+    hours = {}
+    for record in records:
+        total = [a + b for a, b in zip(total, _counters(record.get("total")))]
+        for used, count in (record.get("attempts") or {}).items():
+            attempts[used] = attempts.get(used, 0) + count
+        for key, values in (record.get("hours") or {}).items():
+            hours[key] = [
+                a + b for a, b in zip(_counters(hours.get(key)), _counters(values))
+            ]
+    return {"total": total, "attempts": attempts, "hours": hours}
+
+
+def load_stats(group_id=None):
+    """读取一个群或所有群合计（group_id 为 None）的统计"""
+    store = get_store()
+    if group_id is not None:
+        return summarize(store.get(VERIFICATION_STATS, str(group_id)))
+    return summarize(
+        _merge(
+            store.get(VERIFICATION_STATS, f"total-{slot}") or {}
+            for slot in range(STATS_TOTAL_SLOTS)
+        )
+    )
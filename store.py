@@ -0,0 +1,687 @@
+"""
+验证数据存储
+
+所有验证数据按表保存，每张表是一个以字符串为键的字典：
+    user_verification:      {f"{user_id}_{group_id}": {"status": ..., "remaining_attempts": ...}}
+    verification_questions: {f"{user_id}_{group_id}": {"expression": ..., "answer": ..., "timestamp": ...}}
+    warning_record:         {f"{user_id}_{group_id}": 警告次数}
+    reached_limit:          {group_id: [user_id, ...]}
+    message_id_list:        {group_id: {user_id: [message_id, ...]}}
+
+默认使用 GroupShardStore，每个群的数据保存在单独的文件中，写入只涉及对应的群；
+JsonFileStore 是旧的每张表一个文件的布局。
+单条记录的修改通过 update 完成，读改写在锁内进行，多个进程同时修改不同记录时不会互相覆盖；
+涉及多张表的修改（例如验证结束时同时清理题目、警告和消息记录）通过 update_tables 一次提交。
+导出等需要遍历整张表的操作通过 iter_records 逐条读取，不需要把整张表读入内存。
+STORE_FORMAT 为 "journal" 时改用 journal_store.JournalStore（二进制快照加日志，单进程）。
+设置 REDIS_URL 后改用 redis_store.RedisStore，多个机器人实例共用同一份数据。
+"""
+
+import os
+import copy
+import json
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 数据存储路径
+DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "data",
+    "GroupEntryVerification",
+)
+
+# 共享存储的 Redis 地址，例如 "redis://127.0.0.1:6379/0"
+# 多个机器人实例需要共用验证数据时设置，为空时使用本地 JSON 文件
+REDIS_URL = ""
+
+# 本地存储格式："shard" 为按群分片的 JSON 文件，"journal" 为二进制快照加日志
+# journal 格式启动更快且能检测文件损坏，但只能由一个进程使用，不能与分片模式同时开启
+STORE_FORMAT = "shard"
+
+USER_VERIFICATION = "user_verification"
+VERIFICATION_QUESTIONS = "verification_questions"
+WARNING_RECORD = "warning_record"
+REACHED_LIMIT = "reached_limit"
+MESSAGE_ID_LIST = "message_id_list"
+VERIFICATION_STATS = "verification_stats"
+
+TABLES = (
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+    WARNING_RECORD,
+    REACHED_LIMIT,
+    MESSAGE_ID_LIST,
+    VERIFICATION_STATS,
+)
+
+# 以群号为键的表，其余的表以 f"{user_id}_{group_id}" 为键
+GROUP_KEYED_TABLES = (REACHED_LIMIT, MESSAGE_ID_LIST, VERIFICATION_STATS)
+
+# 按群分片存储的序列化和写盘是否在后台线程中进行（见 file_writer.py）
+# 分片工作进程之间共用用户索引文件，工作进程中始终同步写入；
+# 其他进程也会读写同一个数据目录时应设为 False
+ASYNC_WRITES = True
+
+# 内存中最多缓存的群数据分片数
+MAX_CACHED_SHARDS = 512
+# 用户索引的分桶数
+USER_INDEX_BUCKETS = 256
+# 文件锁的条带数
+LOCK_STRIPES = 64
+
+
+# 记录修改的监听函数
+_listeners = []
+
+
+def add_listener(listener):
+    """
+    注册记录修改的监听函数，只能收到当前进程中的修改
+
+    参数:
+        listener (callable): 接收 (表名, {记录键: 修改后的记录}, {记录键: 修改前的记录})，
+            记录为 None 表示已删除（或修改前不存在）；整张表被覆盖时后两个参数为 None
+    """
+    _listeners.append(listener)
+
+
+def notify_listeners(table, changes, previous=None):
+    """通知监听函数记录已修改，由各存储在写入成功后调用"""
+    for listener in _listeners:
+        try:
+            listener(table, changes, previous)
+        except Exception as e:
+            logging.error(f"处理{table}的修改通知失败: {e}")
+
+
+def group_of(table, key):
+    """记录所属的群号"""
+    if table in GROUP_KEYED_TABLES:
+        return key
+    return key.rsplit("_", 1)[-1]
+
+
+def user_of(table, key):
+    """记录所属的用户，以群号为键的表返回 None"""
+    if table in GROUP_KEYED_TABLES:
+        return None
+    return key.split("_", 1)[0]
+
+
+def _write_json(path, data):
+    # 先写临时文件再替换，避免写入中途出错留下不完整的文件
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _file_lock(lock_path):
+    """跨进程的文件锁"""
+    with open(lock_path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class JsonFileStore:
+    """每张表保存为数据目录下的一个 JSON 文件"""
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        os.makedirs(self.data_dir, exist_ok=True)
+
+    def table_path(self, table):
+        return os.path.join(self.data_dir, f"{table}.json")
+
+    def _read(self, table):
+        path = self.table_path(table)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            if not content:
+                return {}
+            data = json.loads(content)
+            return data if isinstance(data, dict) else {}
+        except Exception as e:
+            logging.error(f"加载{table}失败: {e}")
+            return {}
+
+    def _write(self, table, data):
+        _write_json(self.table_path(table), data)
+
+    @contextmanager
+    def _locked(self, table):
+        with _file_lock(self.table_path(table) + ".lock"):
+            yield
+
+    def load(self, table):
+        """读取整张表"""
+        return self._read(table)
+
+    def save(self, table, data):
+        """覆盖整张表"""
+        with self._locked(table):
+            self._write(table, data)
+        notify_listeners(table, None)
+
+    def load_group(self, table, group_id):
+        """读取表中属于某个群的记录"""
+        group_id = str(group_id)
+        return {
+            key: value
+            for key, value in self._read(table).items()
+            if group_of(table, key) == group_id
+        }
+
+    def user_records(self, table, user_id):
+        """读取表中属于某个用户的记录"""
+        prefix = f"{user_id}_"
+        return {
+            key: value
+            for key, value in self._read(table).items()
+            if key.startswith(prefix)
+        }
+
+    def iter_records(self, table, group_id=None):
+        """
+        逐条读取表中的记录，group_id 不为 None 时只读取该群的记录
+
+        产生:
+            (记录键, 记录)
+        """
+        from app.scripts.GroupEntryVerification.migrate import iter_json_object
+
+        path = self.table_path(table)
+        if not os.path.exists(path):
+            return
+        group_id = None if group_id is None else str(group_id)
+        # 写入是先写临时文件再替换，已打开的文件不会被修改
+        for key, value in iter_json_object(path):
+            if group_id is None or group_of(table, key) == group_id:
+                yield key, value
+
+    def get(self, table, key, default=None):
+        """读取单条记录"""
+        return self._read(table).get(key, default)
+
+    def set(self, table, key, value):
+        """写入单条记录"""
+        self.update(table, key, lambda _: value)
+
+    def delete(self, table, key):
+        """删除单条记录"""
+        self.update(table, key, lambda _: None)
+
+    def update(self, table, key, func):
+        """
+        原子地修改单条记录
+
+        参数:
+            table (str): 表名
+            key (str): 记录键
+            func (callable): 接收旧记录（不存在时为 None），返回新记录；返回 None 表示删除
+
+        返回:
+            修改后的记录
+        """
+        with self._locked(table):
+            data = self._read(table)
+            old = copy.deepcopy(data.get(key))
+            new = func(data.get(key))
+            if new is None:
+                if key not in data:
+                    return None
+                del data[key]
+            else:
+                data[key] = new
+            self._write(table, data)
+        notify_listeners(table, {key: new}, {key: old})
+        return new
+
+    def update_many(self, table, funcs):
+        """
+        在一次写入中原子地修改多条记录
+
+        参数:
+            table (str): 表名
+            funcs (dict): 记录键到修改函数的映射，修改函数的约定同 update
+
+        返回:
+            dict: 记录键到修改后记录的映射
+        """
+        if not funcs:
+            return {}
+        return self.update_tables({table: funcs})[table]
+
+    def update_tables(self, tables):
+        """
+        在一次提交中修改多张表的记录
+
+        按 tables 的顺序依次调用各表的修改函数，后面的修改函数可以依赖前面修改函数的调用结果。
+        所有表的锁在修改前一起获取，但每张表是单独的文件，写入中途进程崩溃时只有部分表被写入。
+
+        参数:
+            tables (dict): 表名到 {记录键: 修改函数} 的映射
+
+        返回:
+            dict: 表名到 {记录键: 修改后记录} 的映射
+        """
+        results = {}
+        previous = {}
+        with ExitStack() as stack:
+            # 按固定顺序加锁，避免与其他进程互相等待
+            for table in sorted(tables):
+                stack.enter_context(self._locked(table))
+            for table, funcs in tables.items():
+                data = self._read(table)
+                table_results = results[table] = {}
+                table_previous = previous[table] = {}
+                for key, func in funcs.items():
+                    table_previous[key] = copy.deepcopy(data.get(key))
+                    new = func(data.get(key))
+                    if new is None:
+                        data.pop(key, None)
+                    else:
+                        data[key] = new
+                    table_results[key] = new
+                if funcs:
+                    self._write(table, data)
+        for table, changes in results.items():
+            notify_listeners(table, changes, previous[table])
+        return results
+
+
+# 缓存中的内容已修改、尚未确认写入磁盘时的文件状态
+_UNSYNCED = object()
+
+
+class _JsonFileCache:
+    """
+    目录下 JSON 文件的 LRU 缓存，文件被其他进程修改后自动重新读取
+
+    提供 writer 时写入在后台线程中进行，写入完成之前读取返回内存中的最新内容。
+    """
+
+    def __init__(self, directory, max_entries, lock_dir, writer=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.lock_dir = lock_dir
+        self.writer = writer
+        os.makedirs(self.directory, exist_ok=True)
+        # 名称 -> (文件状态, 数据)
+        self._entries = OrderedDict()
+        self._entries_lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def names(self):
+        names = {
+            file_name[:-5]
+            for file_name in os.listdir(self.directory)
+            if file_name.endswith(".json")
+        }
+        if self.writer is None:
+            return list(names)
+        # 还没有写入磁盘的新文件和删除
+        for path, data in self.writer.pending_items().items():
+            directory, file_name = os.path.split(path)
+            if directory == self.directory:
+                if data:
+                    names.add(file_name[:-5])
+                else:
+                    names.discard(file_name[:-5])
+        return list(names)
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def read(self, name):
+        """读取文件内容，返回缓存中的对象，调用方不应修改"""
+        path = self.path(name)
+        with self._entries_lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] is _UNSYNCED:
+                self._entries.move_to_end(name)
+                return entry[1]
+        if self.writer is not None:
+            # 缓存已淘汰但后台写入尚未完成
+            pending, data = self.writer.pending(path)
+            if pending:
+                self._remember(name, _UNSYNCED, data)
+                return data
+        stat = self._stat(path)
+        if entry is not None and entry[0] == stat:
+            with self._entries_lock:
+                self._entries.move_to_end(name)
+            return entry[1]
+
+        data = {}
+        if stat is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    content = f.read()
+                data = json.loads(content) if content else {}
+            except Exception as e:
+                logging.error(f"加载{path}失败: {e}")
+                data = {}
+        self._remember(name, stat, data)
+        return data
+
+    def write(self, name, data):
+        """写入文件并更新缓存，data 为空时删除文件；之后不能再修改 data"""
+        path = self.path(name)
+        if self.writer is None:
+            self._remember(name, self._write_file(path, data), data)
+            return
+        self._remember(name, _UNSYNCED, data)
+        self.writer.submit(
+            path,
+            data,
+            lambda data: self._write_file(path, data),
+            lambda stat: self._synced(name, data, stat),
+        )
+
+    def _write_file(self, path, data):
+        if data:
+            _write_json(path, data)
+        elif os.path.exists(path):
+            os.remove(path)
+        return self._stat(path)
+
+    def _synced(self, name, data, stat):
+        # 只有缓存中仍是这次写入的内容时才记录文件状态，之后的读取按文件状态判断是否被其他进程修改
+        with self._entries_lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[1] is data:
+                self._entries[name] = (stat, data)
+
+    def _remember(self, name, stat, data):
+        with self._entries_lock:
+            self._entries[name] = (stat, data)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, name):
+        with self._entries_lock:
+            self._entries.pop(name, None)
+
+    @contextmanager
+    def locked(self, name):
+        stripe = zlib.crc32(f"{self.directory}/{name}".encode("utf-8")) % LOCK_STRIPES
+        with _file_lock(os.path.join(self.lock_dir, f"{stripe}.lock")):
+            yield
+
+
+class GroupShardStore:
+    """
+    按群分片保存验证数据，接口与 JsonFileStore 相同
+
+    groups/{group_id}.json 保存该群所有表的记录：{表名: {记录键: 记录}}
+    users/{bucket}.json 是 user_verification 的用户索引：{user_id: [group_id, ...]}
+    分片按需加载，超过 MAX_CACHED_SHARDS 时淘汰最久未使用的分片。
+    开启后台写入时，修改立即在内存中生效，序列化和写盘由后台线程按文件顺序完成。
+    """
+
+    def __init__(
+        self,
+        data_dir=DATA_DIR,
+        max_cached_shards=MAX_CACHED_SHARDS,
+        import_legacy=True,
+        async_writes=False,
+    ):
+        """
+        参数:
+            data_dir (str): 数据目录
+            max_cached_shards (int): 内存中最多缓存的群数据分片数
+            import_legacy (bool): 首次启动时是否自动导入旧的整表 JSON 文件
+            async_writes (bool): 是否在后台线程中写文件，只有一个进程使用数据目录时才能开启
+        """
+        self.data_dir = data_dir
+        lock_dir = os.path.join(data_dir, "locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        first_run = not os.path.isdir(os.path.join(data_dir, "groups"))
+        self.writer = None
+        if async_writes:
+            from app.scripts.GroupEntryVerification.file_writer import (
+                OrderedFileWriter,
+            )
+
+            self.writer = OrderedFileWriter()
+        self._groups = _JsonFileCache(
+            os.path.join(data_dir, "groups"), max_cached_shards, lock_dir, self.writer
+        )
+        self._users = _JsonFileCache(
+            os.path.join(data_dir, "users"), USER_INDEX_BUCKETS, lock_dir, self.writer
+        )
+        if first_run and import_legacy:
+            self._import_legacy_tables()
+
+    def flush(self, timeout=None):
+        """等待后台写入完成，返回是否全部完成"""
+        return self.writer.flush(timeout) if self.writer is not None else True
+
+    def close(self):
+        self.flush()
+
+    def _import_legacy_tables(self):
+        """首次启动时流式导入旧的每张表一个文件的数据，原文件保持不变"""
+        from app.scripts.GroupEntryVerification.migrate import import_legacy_tables
+
+        import_legacy_tables(self, self.data_dir)
+
+    @staticmethod
+    def _bucket(user_id):
+        return str(zlib.crc32(str(user_id).encode("utf-8")) % USER_INDEX_BUCKETS)
+
+    def load(self, table):
+        """读取整张表（需要读取所有群的分片）"""
+        records = {}
+        for group_id in self._groups.names():
+            records.update(self._groups.read(group_id).get(table, {}))
+        return copy.deepcopy(records)
+
+    def load_group(self, table, group_id):
+        """读取表中属于某个群的记录"""
+        return copy.deepcopy(self._groups.read(str(group_id)).get(table, {}))
+
+    def user_records(self, table, user_id):
+        """通过用户索引读取表中属于某个用户的记录"""
+        user_id = str(user_id)
+        records = {}
+        for group_id in self._users.read(self._bucket(user_id)).get(user_id, []):
+            key = f"{user_id}_{group_id}"
+            value = self._groups.read(group_id).get(table, {}).get(key)
+            if value is not None:
+                records[key] = copy.deepcopy(value)
+        return records
+
+    def iter_records(self, table, group_id=None):
+        """
+        逐个群读取表中的记录，同一时间只需要一个群的分片，group_id 不为 None 时只读取该群
+
+        产生:
+            (记录键, 记录)
+        """
+        group_ids = self._groups.names() if group_id is None else [str(group_id)]
+        for name in group_ids:
+            # 修改分片时会替换缓存中的对象，已读取的分片内容不会再变化
+            records = list(self._groups.read(name).get(table, {}).items())
+            for key, value in records:
+                yield key, copy.deepcopy(value)
+
+    def save(self, table, data):
+        """覆盖整张表"""
+        by_group = {}
+        for key, value in data.items():
+            by_group.setdefault(group_of(table, key), {})[key] = value
+        for group_id in set(self._groups.names()) | set(by_group):
+            records = by_group.get(group_id, {})
+            old_keys = set(self._groups.read(group_id).get(table, {}))
+            funcs = {key: (lambda _, v=value: v) for key, value in records.items()}
+            funcs.update(
+                {key: (lambda _: None) for key in old_keys if key not in records}
+            )
+            self._update_group(group_id, {table: funcs})
+        notify_listeners(table, None)
+
+    def get(self, table, key, default=None):
+        """读取单条记录"""
+        value = self._groups.read(group_of(table, key)).get(table, {}).get(key)
+        return default if value is None else copy.deepcopy(value)
+
+    def set(self, table, key, value):
+        """写入单条记录"""
+        self.update(table, key, lambda _: value)
+
+    def delete(self, table, key):
+        """删除单条记录"""
+        self.update(table, key, lambda _: None)
+
+    def update(self, table, key, func):
+        """原子地修改单条记录，修改函数的约定同 JsonFileStore.update"""
+        return self.update_many(table, {key: func})[key]
+
+    def update_many(self, table, funcs):
+        """修改多条记录，每个群的记录在一次写入中原子地修改"""
+        return self.update_tables({table: funcs})[table]
+
+    def update_tables(self, tables):
+        """
+        修改多张表的记录，同一个群的所有表在一次分片写入中原子地修改
+
+        按 tables 的顺序依次调用各表的修改函数，约定同 JsonFileStore.update_tables
+        """
+        by_group = {}
+        for table, funcs in tables.items():
+            for key, func in funcs.items():
+                group_funcs = by_group.setdefault(group_of(table, key), {})
+                group_funcs.setdefault(table, {})[key] = func
+        results = {table: {} for table in tables}
+        previous = {table: {} for table in tables}
+        for group_id, group_tables in by_group.items():
+            group_results, group_previous = self._update_group(group_id, group_tables)
+            for table, changes in group_results.items():
+                results[table].update(changes)
+                previous[table].update(group_previous[table])
+        for table, changes in results.items():
+            notify_listeners(table, changes, previous[table])
+        return results
+
+    def _update_group(self, group_id, tables):
+        results = {}
+        previous = {}
+        added, removed = [], []
+        changed = False
+        with self._groups.locked(group_id):
+            # 缓存中的对象可能正在被后台线程写入，只复制要修改的表，修改函数拿到的是记录的副本
+            shard = dict(self._groups.read(group_id))
+            for table, funcs in tables.items():
+                records = shard[table] = dict(shard.get(table, {}))
+                table_results = results[table] = {}
+                table_previous = previous[table] = {}
+                for key, func in funcs.items():
+                    existed = key in records
+                    table_previous[key] = records.get(key)
+                    new = func(copy.deepcopy(records.get(key)))
+                    if new is None:
+                        records.pop(key, None)
+                    else:
+                        records[key] = new
+                    if existed or new is not None:
+                        changed = True
+                    if table == USER_VERIFICATION:
+                        if new is None and existed:
+                            removed.append(key)
+                        elif new is not None and not existed:
+                            added.append(key)
+                    table_results[key] = new
+                if not records:
+                    del shard[table]
+            if changed:
+                self._groups.write(group_id, shard)
+        if added or removed:
+            self._update_user_index(group_id, added, removed)
+        return results, previous
+
+    def _update_user_index(self, group_id, added, removed):
+        by_bucket = {}
+        for key, present in [(key, True) for key in added] + [
+            (key, False) for key in removed
+        ]:
+            user_id = user_of(USER_VERIFICATION, key)
+            by_bucket.setdefault(self._bucket(user_id), []).append((user_id, present))
+        for bucket, changes in by_bucket.items():
+            with self._users.locked(bucket):
+                index = dict(self._users.read(bucket))
+                for user_id, present in changes:
+                    group_ids = list(index.get(user_id, []))
+                    if present and group_id not in group_ids:
+                        group_ids.append(group_id)
+                    elif not present and group_id in group_ids:
+                        group_ids.remove(group_id)
+                    if group_ids:
+                        index[user_id] = group_ids
+                    else:
+                        index.pop(user_id, None)
+                self._users.write(bucket, index)
+
+
+_store = None
+
+
+def get_store():
+    """获取当前使用的存储"""
+    global _store
+    if _store is None:
+        if REDIS_URL:
+            from app.scripts.GroupEntryVerification.redis_store import RedisStore
+
+            _store = RedisStore.from_url(REDIS_URL)
+        elif STORE_FORMAT == "journal":
+            from app.scripts.GroupEntryVerification.journal_store import JournalStore
+
+            _store = JournalStore()
+        else:
+            from app.scripts.GroupEntryVerification.shard import is_shard_worker
+
+            _store = GroupShardStore(
+                async_writes=ASYNC_WRITES and not is_shard_worker()
+            )
+    return _store
+
+
+def set_store(store):
+    """替换当前使用的存储"""
+    global _store
+    _store = store
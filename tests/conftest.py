@@ -0,0 +1,46 @@
+"""
+测试的公共准备
+
+和 replay.py 一样，把当前工作区放到临时目录的 app/scripts/GroupEntryVerification 下，
+并用替身替换机器人的 app.api、app.config 和 app.switch，
+插件模块按 app.scripts.GroupEntryVerification.X 导入，不需要机器人的根目录。
+"""
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+import pytest
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+import replay
+
+_ROOT = tempfile.mkdtemp(prefix="gev-tests-")
+atexit.register(shutil.rmtree, _ROOT, True)
+replay.use_current_tree(_ROOT)
+replay.install_app_stubs(["10000"])
+
+from app.scripts.GroupEntryVerification import store as store_module
+
+
+@pytest.fixture(autouse=True)
+def restore_listeners():
+    """测试中注册的存储监听函数在测试结束后移除"""
+    listeners = list(store_module._listeners)
+    yield
+    store_module._listeners[:] = listeners
+
+
+@pytest.fixture
+def store(tmp_path):
+    """临时目录中的按群分片存储，测试结束后恢复原来的存储"""
+    previous = store_module._store
+    store = store_module.GroupShardStore(str(tmp_path), import_legacy=False)
+    store_module.set_store(store)
+    yield store
+    store.close()
+    store_module.set_store(previous)
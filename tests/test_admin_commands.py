@@ -0,0 +1,138 @@
+"""main.py 的批量审核命令：目标解析、一次提交、每群一条通知和汇总回复"""
+
+import json
+import asyncio
+
+from app.scripts.GroupEntryVerification import main
+from app.scripts.GroupEntryVerification.store import (
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+)
+
+
+class RecordingWebSocket:
+    """记录发出的API调用，fail_actions 中的接口调用返回失败"""
+
+    def __init__(self, fail_actions=()):
+        self.sent = []
+        self.fail_actions = fail_actions
+
+    async def send(self, data):
+        request = json.loads(data)
+        if request["action"] in self.fail_actions:
+            raise ConnectionError(request["action"])
+        self.sent.append((request["action"], request["params"]))
+
+
+def _seed(store, user_id, group_id="100", status="pending"):
+    key = f"{user_id}_{group_id}"
+    store.set(USER_VERIFICATION, key, {"status": status, "remaining_attempts": 3})
+    store.set(
+        VERIFICATION_QUESTIONS,
+        key,
+        {"expression": "1 + 1", "answer": 2, "timestamp": 0},
+    )
+
+
+def _run(handler, command, websocket=None):
+    websocket = websocket or RecordingWebSocket()
+    asyncio.run(handler(websocket, "10000", command))
+    return websocket
+
+
+def _calls(websocket, action):
+    return [params for sent_action, params in websocket.sent if sent_action == action]
+
+
+def _reply(websocket):
+    [params] = _calls(websocket, "send_private_msg")
+    return params["message"]
+
+
+def test_parse_targets():
+    parse = lambda command: asyncio.run(main.parse_admin_targets(command))
+    assert parse("批准 100 1 2 1 备注") == [("100", "1"), ("100", "2")]
+    for command in ("批准", "批准 100", "批准 群 1", "批准 100 备注"):
+        assert parse(command) is None
+
+
+def test_parse_group_wide_targets(store):
+    _seed(store, "1")
+    _seed(store, "2", status="verified")
+    _seed(store, "3", group_id="200")
+    assert asyncio.run(main.parse_admin_targets("拒绝 100 全部")) == [("100", "1")]
+
+
+def test_batch_approve(store):
+    for user_id in ("1", "2", "3"):
+        _seed(store, user_id)
+    _seed(store, "4", group_id="200")
+    _seed(store, "5", status="verified")
+
+    websocket = _run(main.handle_admin_approve, "批准 100 1 2 3 5")
+    for user_id in ("1", "2", "3"):
+        record = store.get(USER_VERIFICATION, f"{user_id}_100")
+        assert record["status"] == "verified"
+        assert store.get(VERIFICATION_QUESTIONS, f"{user_id}_100") is None
+    assert store.get(USER_VERIFICATION, "4_200")["status"] == "pending"
+
+    bans = _calls(websocket, "set_group_ban")
+    assert sorted(params["user_id"] for params in bans) == ["1", "2", "3"]
+    assert {params["duration"] for params in bans} == {0}
+    # 同一个群只发一条通知
+    [notice] = _calls(websocket, "send_group_msg")
+    assert notice["group_id"] == "100"
+    assert all(f"[CQ:at,qq={user_id}]" in notice["message"] for user_id in "123")
+    assert _reply(websocket).splitlines() == [
+        "批准完成：成功 3 人，失败 0 人，跳过 1 人",
+        "群 100 已批准：1, 2, 3",
+        "群 100 不在验证队列中：5",
+    ]
+
+
+def test_single_approve(store):
+    _seed(store, "1")
+    websocket = _run(main.handle_admin_approve, "批准 100 1")
+    assert _reply(websocket) == "已批准用户 1 在群 100 的验证"
+    # 已经处理过的用户不再解禁和通知
+    websocket = _run(main.handle_admin_approve, "批准 100 1")
+    assert _reply(websocket) == "用户 1 不在群 100 的验证队列中"
+    assert len(websocket.sent) == 1
+
+
+def test_batch_reject_notifies_before_kicking(store):
+    _seed(store, "1")
+    _seed(store, "2")
+    _seed(store, "3", group_id="200")
+
+    websocket = RecordingWebSocket()
+    _run(main.handle_admin_reject, "拒绝 100 全部", websocket)
+    actions = [action for action, _ in websocket.sent]
+    assert actions.index("send_group_msg") < actions.index("set_group_kick")
+    kicks = _calls(websocket, "set_group_kick")
+    assert sorted(params["user_id"] for params in kicks) == ["1", "2"]
+    assert store.get(USER_VERIFICATION, "1_100")["status"] == "rejected"
+    assert store.get(USER_VERIFICATION, "3_200")["status"] == "pending"
+    assert _reply(websocket).splitlines() == [
+        "拒绝完成：成功 2 人，失败 0 人，跳过 0 人",
+        "群 100 已拒绝：1, 2",
+    ]
+
+
+def test_failed_kicks_are_reported(store):
+    _seed(store, "1")
+    websocket = _run(
+        main.handle_admin_reject,
+        "拒绝 100 1",
+        RecordingWebSocket(fail_actions=("set_group_kick",)),
+    )
+    assert _reply(websocket).splitlines() == [
+        "拒绝完成：成功 0 人，失败 1 人，跳过 0 人",
+        "群 100 用户 1 失败：set_group_kick",
+    ]
+
+
+def test_malformed_command_replies_with_usage(store):
+    websocket = _run(main.handle_admin_approve, "批准 100")
+    assert _reply(websocket).startswith("验证功能命令格式错误")
+    assert len(websocket.sent) == 1
@@ -0,0 +1,101 @@
+"""dedup.py：事件标识、保留时间窗口和容量淘汰"""
+
+import pytest
+
+from app.scripts.GroupEntryVerification import dedup
+from app.scripts.GroupEntryVerification.dedup import EventDeduplicator, event_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "monotonic", clock)
+    return clock
+
+
+def _join(user_id, when=1700000000, group_id=100):
+    return {
+        "post_type": "notice",
+        "notice_type": "group_increase",
+        "sub_type": "approve",
+        "self_id": 1,
+        "group_id": group_id,
+        "user_id": user_id,
+        "time": when,
+    }
+
+
+def _message(message_id):
+    return {
+        "post_type": "message",
+        "message_type": "group",
+        "self_id": 1,
+        "message_id": message_id,
+    }
+
+
+def test_event_keys():
+    assert event_key(_join(5)) == event_key({**_join(5), "group_id": "100"})
+    assert event_key(_join(5)) != event_key(_join(5, when=1700000001))
+    assert event_key(_message(7)) != event_key(_message(8))
+    # 无法判断是否重复的事件
+    assert event_key({"post_type": "message", "message_type": "group"}) is None
+    assert event_key({"post_type": "request", "request_type": "group"}) is None
+    assert event_key({"post_type": "meta_event"}) is None
+
+
+def test_duplicate_within_ttl(clock):
+    deduplicator = EventDeduplicator(ttl=60)
+    assert not deduplicator.is_duplicate(_join(5))
+    clock.now += 30
+    assert deduplicator.is_duplicate(_join(5))
+    assert not deduplicator.is_duplicate(_join(6))
+    assert not deduplicator.is_duplicate({"post_type": "meta_event"})
+    assert not deduplicator.is_duplicate({"post_type": "meta_event"})
+    stats = deduplicator.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["hits_by_type"] == {("notice", "group_increase"): 1}
+
+
+def test_repeat_restarts_window(clock):
+    deduplicator = EventDeduplicator(ttl=60)
+    deduplicator.is_duplicate(_message(1))
+    clock.now += 50
+    assert deduplicator.is_duplicate(_message(1))
+    # 距第一次出现已超过保留时间，但距上一次出现没有
+    clock.now += 50
+    assert deduplicator.is_duplicate(_message(1))
+
+
+def test_expired_event_is_processed_again(clock):
+    deduplicator = EventDeduplicator(ttl=60)
+    deduplicator.is_duplicate(_message(1))
+    deduplicator.is_duplicate(_message(2))
+    clock.now += 60
+    assert deduplicator.stats()["size"] == 2
+    assert not deduplicator.is_duplicate(_message(1))
+    # 过期的标识在下次检查时清理
+    assert deduplicator.stats()["size"] == 1
+
+
+def test_least_recently_seen_is_evicted(clock):
+    deduplicator = EventDeduplicator(max_entries=2, ttl=60)
+    deduplicator.is_duplicate(_message(1))
+    clock.now += 1
+    deduplicator.is_duplicate(_message(2))
+    clock.now += 1
+    # 重新出现的事件移到最后，最久未出现的是 2
+    assert deduplicator.is_duplicate(_message(1))
+    deduplicator.is_duplicate(_message(3))
+    assert deduplicator.stats()["evictions"] == 1
+    assert deduplicator.is_duplicate(_message(1))
+    assert not deduplicator.is_duplicate(_message(2))
@@ -0,0 +1,97 @@
+"""main.py 的事件分发表：无关事件在读取任何状态之前丢弃，功能开关只读取一次"""
+
+import asyncio
+
+import pytest
+
+from app.scripts.GroupEntryVerification import main
+
+
+@pytest.fixture
+def switches(monkeypatch):
+    """功能开关替身：群号 -> 是否开启，记录读取次数"""
+    enabled = {"100": True, "200": False}
+    reads = []
+
+    def load_switch(group_id, name):
+        reads.append(group_id)
+        return enabled.get(group_id, False)
+
+    monkeypatch.setattr(main, "load_switch", load_switch)
+    monkeypatch.setattr(main, "_function_status_cache", {})
+    return reads
+
+
+def _group_message(group_id, raw_message="hello"):
+    return {
+        "post_type": "message",
+        "message_type": "group",
+        "group_id": group_id,
+        "user_id": 1,
+        "raw_message": raw_message,
+    }
+
+
+@pytest.mark.parametrize(
+    "msg",
+    [
+        {"post_type": "meta_event", "meta_event_type": "heartbeat"},
+        {"post_type": "notice", "notice_type": "group_recall", "group_id": 100},
+        {"post_type": "notice", "notice_type": "group_ban", "group_id": 100},
+        {"post_type": "request", "request_type": "friend"},
+        {"post_type": "message_sent", "message_type": "group"},
+        {"status": "ok", "echo": "send_group_msg_OtherPlugin_1"},
+        {"status": "ok", "echo": 12},
+        {"status": "ok"},
+    ],
+)
+def test_irrelevant_events_are_dropped(switches, msg):
+    assert main.resolve_handler(msg) is None
+    assert switches == []
+
+
+def test_relevant_events(switches):
+    resolve = main.resolve_handler
+    assert (
+        resolve({"post_type": "meta_event", "meta_event_type": "lifecycle"})
+        is main.handle_meta_event
+    )
+    assert resolve({"echo": main.ECHO_PREFIX + "100_1_1"}) is main.handle_response
+    assert (
+        resolve({"echo": "get_group_member_list_" + main.ECHO_NOTE_PREFIX + "100"})
+        is main.handle_response
+    )
+    for notice_type in ("group_increase", "group_decrease"):
+        msg = {"post_type": "notice", "notice_type": notice_type, "group_id": 100}
+        assert resolve(msg) is main.handle_group_notice
+    msg = {"post_type": "request", "request_type": "group", "group_id": 100}
+    assert resolve(msg) is main.handle_request_event
+    assert resolve(_group_message(100)) is main.handle_group_message
+
+
+def test_disabled_group_is_dropped_and_switch_is_cached(switches):
+    for _ in range(3):
+        assert main.resolve_handler(_group_message(200)) is None
+        assert main.resolve_handler(_group_message(100)) is main.handle_group_message
+    assert sorted(switches) == ["100", "200"]
+    # 开关和扫描命令在功能关闭的群里也要响应
+    for command in main.GROUP_COMMANDS:
+        msg = _group_message(200, command)
+        assert main.resolve_handler(msg) is main.handle_group_message
+
+
+def test_saving_switch_updates_cache(switches, monkeypatch):
+    monkeypatch.setattr(main, "save_switch", lambda group_id, name, status: None)
+    assert not main.load_function_status("200")
+    main.save_function_status("200", True)
+    assert main.resolve_handler(_group_message(200)) is main.handle_group_message
+    assert switches == ["200"]
+
+
+def test_dropped_event_sends_nothing(switches):
+    class FailingWebSocket:
+        async def send(self, data):
+            raise AssertionError(data)
+
+    msg = {"post_type": "notice", "notice_type": "group_recall", "group_id": 100}
+    asyncio.run(main.handle_events(FailingWebSocket(), msg))
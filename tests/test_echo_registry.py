@@ -0,0 +1,134 @@
+"""echo_registry.py：唯一 echo、回调匹配、等待超时和过期清理，以及验证消息回调的记录"""
+
+import json
+import asyncio
+
+import pytest
+
+from app.scripts.GroupEntryVerification import echo_registry as echo_module
+from app.scripts.GroupEntryVerification import main
+from app.scripts.GroupEntryVerification.echo_registry import EchoCallError, EchoRegistry
+from app.scripts.GroupEntryVerification.store import MESSAGE_ID_LIST
+
+PREFIX = "GroupEntryVerification_"
+
+
+def test_each_call_gets_a_unique_echo():
+    async def scenario():
+        registry = EchoRegistry(PREFIX)
+        first = registry.register(100, 1)
+        second = registry.register(100, 1)
+        other = registry.register(100, "list", action="get_group_member_list")
+        return registry, first, second, other
+
+    registry, (note, call), (_, again), (_, other) = asyncio.run(scenario())
+    assert note.startswith(f"{PREFIX}100_1_")
+    assert call.echo == f"send_group_msg_{note}"
+    assert call.echo != again.echo
+    assert other.echo.startswith(f"get_group_member_list_{PREFIX}100_list_")
+    assert len(registry) == 3
+
+
+def test_resolve_matches_by_echo():
+    async def scenario():
+        registry = EchoRegistry(PREFIX)
+        _, ok = registry.register(100, 1)
+        _, failed = registry.register(100, 2)
+        assert (
+            registry.resolve({"echo": "send_group_msg_other", "status": "ok"}) is None
+        )
+        assert (
+            registry.resolve(
+                {"echo": ok.echo, "status": "ok", "data": {"message_id": 7}}
+            )
+            is ok
+        )
+        registry.resolve({"echo": failed.echo, "status": "failed", "message": "禁言中"})
+        # 同一个回调再次到达时不再匹配
+        assert registry.resolve({"echo": ok.echo, "status": "ok"}) is None
+        data = await registry.wait(ok)
+        with pytest.raises(EchoCallError, match="禁言中"):
+            await registry.wait(failed)
+        return registry, data
+
+    registry, data = asyncio.run(scenario())
+    assert data == {"message_id": 7}
+    assert len(registry) == 0
+
+
+def test_wait_timeout_drops_the_call():
+    async def scenario():
+        registry = EchoRegistry(PREFIX)
+        _, call = registry.register(100, 1)
+        with pytest.raises(asyncio.TimeoutError):
+            await registry.wait(call, timeout=0.01)
+        # 超时之后到达的回调被丢弃
+        assert registry.resolve({"echo": call.echo, "status": "ok"}) is None
+        return registry
+
+    assert len(asyncio.run(scenario())) == 0
+
+
+def test_unanswered_calls_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(echo_module.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        registry = EchoRegistry(PREFIX, ttl=60)
+        _, old = registry.register(100, 1)
+        now[0] += 30
+        _, recent = registry.register(100, 2)
+        now[0] += 31
+        registry.register(100, 3)
+        with pytest.raises(asyncio.CancelledError):
+            await registry.wait(old)
+        return registry, recent
+
+    registry, recent = asyncio.run(scenario())
+    assert len(registry) == 2
+    assert recent.echo in registry._pending
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, data):
+        request = json.loads(data)
+        self.sent.append((request["action"], request["params"], request["echo"]))
+
+
+def test_prompt_response_records_message_id(store, monkeypatch):
+    monkeypatch.setattr(main, "echo_registry", EchoRegistry(main.ECHO_NOTE_PREFIX))
+
+    async def scenario():
+        websocket = RecordingWebSocket()
+        call = await main.send_verification_msg(websocket, "100", "1", "请回答")
+        [(_, _, echo)] = websocket.sent
+        assert echo == call.echo
+        response = {"echo": echo, "status": "ok", "data": {"message_id": 55}}
+        assert main.resolve_handler(response) is main.handle_response
+        await main.handle_response(websocket, response)
+        # 其他插件的回调和重复的回调都被丢弃
+        await main.handle_response(websocket, {**response, "echo": "send_group_msg_x"})
+        await main.handle_response(websocket, response)
+        return await main.echo_registry.wait(call)
+
+    assert asyncio.run(scenario()) == {"message_id": 55}
+    [entry] = store.get(MESSAGE_ID_LIST, "100")["1"]
+    assert entry[0] == 55
+
+
+def test_failed_prompt_records_nothing(store, monkeypatch):
+    monkeypatch.setattr(main, "echo_registry", EchoRegistry(main.ECHO_NOTE_PREFIX))
+
+    async def scenario():
+        call = await main.send_verification_msg(RecordingWebSocket(), "100", "1", "")
+        await main.handle_response(
+            None, {"echo": call.echo, "status": "failed", "wording": "消息过长"}
+        )
+        with pytest.raises(EchoCallError):
+            await main.echo_registry.wait(call)
+
+    asyncio.run(scenario())
+    assert store.get(MESSAGE_ID_LIST, "100") is None
@@ -0,0 +1,135 @@
+"""enforcement.py：禁言和提醒的时间窗口、撤回的合并发出"""
+
+import json
+import asyncio
+
+import pytest
+
+from app.scripts.GroupEntryVerification import enforcement, main
+from app.scripts.GroupEntryVerification.enforcement import PendingMessageEnforcer
+from app.scripts.GroupEntryVerification.store import USER_VERIFICATION
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, data):
+        request = json.loads(data)
+        self.sent.append((request["action"], request["params"]))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(enforcement.time, "monotonic", clock)
+    return clock
+
+
+def _actions(websocket):
+    return [action for action, _ in websocket.sent]
+
+
+def test_remind_once_per_window(clock):
+    enforcer = PendingMessageEnforcer(window=60)
+    assert enforcer.should_remind(100, 1)
+    assert not enforcer.should_remind("100", "1")
+    # 不同群、不同用户各自计算
+    assert enforcer.should_remind(100, 2)
+    assert enforcer.should_remind(200, 1)
+    clock.now += 59
+    assert not enforcer.should_remind(100, 1)
+    clock.now += 1
+    assert enforcer.should_remind(100, 1)
+
+
+def test_expired_entries_are_pruned(clock, monkeypatch):
+    monkeypatch.setattr(enforcement, "MAX_REMIND_ENTRIES", 2)
+    enforcer = PendingMessageEnforcer(window=60)
+    enforcer.should_remind(100, 1)
+    enforcer.should_remind(100, 2)
+    clock.now += 60
+    enforcer.should_remind(100, 3)
+    assert list(enforcer._reminded) == [("100", "3")]
+
+
+def test_recalls_are_sent_in_one_flush():
+    async def scenario():
+        websocket = RecordingWebSocket()
+        enforcer = PendingMessageEnforcer(recall_delay=0.05)
+        for message_id in range(5):
+            enforcer.recall(websocket, message_id)
+        # 收集期间不发出
+        await asyncio.sleep(0)
+        assert websocket.sent == []
+        flush = enforcer._flush_task
+        await flush
+        assert enforcer._flush_task is None
+        return websocket
+
+    websocket = asyncio.run(scenario())
+    assert websocket.sent == [
+        ("delete_msg", {"message_id": message_id}) for message_id in range(5)
+    ]
+
+
+def test_flooding_pending_member(store, monkeypatch):
+    monkeypatch.setattr(
+        main, "pending_enforcer", PendingMessageEnforcer(recall_delay=0.05)
+    )
+    store.set(
+        USER_VERIFICATION, "1_100", {"status": "pending", "remaining_attempts": 3}
+    )
+    messages = [
+        {"group_id": 100, "user_id": 1, "message_id": message_id}
+        for message_id in range(10)
+    ]
+
+    async def scenario():
+        websocket = RecordingWebSocket()
+        reminders = [
+            await main.enforce_pending_member(websocket, msg) for msg in messages
+        ]
+        before_flush = list(websocket.sent)
+        for remind in reminders:
+            if remind is not None:
+                await remind()
+        # 所有撤回由第一条消息安排的同一次发出完成
+        await main.pending_enforcer._flush_task
+        return websocket, before_flush, reminders
+
+    websocket, before_flush, reminders = asyncio.run(scenario())
+    # 禁言立即发出，撤回等到一起发出
+    assert [action for action, _ in before_flush] == ["set_group_ban"]
+    assert len([remind for remind in reminders if remind is not None]) == 1
+    actions = _actions(websocket)
+    assert actions.count("set_group_ban") == 1
+    assert actions.count("send_group_msg") == 1
+    assert actions[-10:] == ["delete_msg"] * 10
+
+
+def test_verified_member_is_left_alone(store, monkeypatch):
+    monkeypatch.setattr(main, "pending_enforcer", PendingMessageEnforcer())
+    store.set(
+        USER_VERIFICATION, "1_100", {"status": "verified", "remaining_attempts": 3}
+    )
+
+    async def scenario():
+        websocket = RecordingWebSocket()
+        remind = await main.enforce_pending_member(
+            websocket, {"group_id": 100, "user_id": 1, "message_id": 7}
+        )
+        await main.pending_enforcer.flush()
+        return websocket, remind
+
+    websocket, remind = asyncio.run(scenario())
+    assert remind is None
+    assert websocket.sent == []
@@ -0,0 +1,116 @@
+"""export.py：状态和入群时间过滤、导出格式和压缩、在线程中写文件"""
+
+import csv
+import gzip
+import json
+import asyncio
+import threading
+
+import pytest
+
+from app.scripts.GroupEntryVerification.export import export_row, export_records
+from app.scripts.GroupEntryVerification.records import Status
+from app.scripts.GroupEntryVerification.store import USER_VERIFICATION
+
+
+def _record(status, joined_at=None, attempts=3):
+    value = {"status": status, "remaining_attempts": attempts}
+    if joined_at is not None:
+        value["joined_at"] = joined_at
+    return value
+
+
+def test_row_fields():
+    row = export_row("1_100", _record("pending", 1700000000, 2))
+    assert row["group_id"] == 100
+    assert row["user_id"] == 1
+    assert row["status"] == "pending"
+    assert row["remaining_attempts"] == 2
+    assert row["joined_at"] == 1700000000
+    assert row["joined_time"]
+    # 入群时间未知
+    assert export_row("1_100", _record("pending"))["joined_time"] == ""
+
+
+def test_status_filter():
+    verified = {Status.VERIFIED}
+    assert export_row("1_100", _record("verified"), statuses=verified)
+    assert export_row("1_100", _record("pending"), statuses=verified) is None
+    # 空集合不过滤
+    assert export_row("1_100", _record("pending"), statuses=set())
+
+
+def test_time_filter_is_half_open():
+    value = _record("pending", 1000)
+    assert export_row("1_100", value, since=1000)
+    assert export_row("1_100", value, since=1001) is None
+    assert export_row("1_100", value, until=1001)
+    assert export_row("1_100", value, until=1000) is None
+    # 入群时间未知的旧记录按 0 处理
+    assert export_row("1_100", _record("pending"), since=1) is None
+
+
+def test_unparsable_records_are_skipped():
+    assert export_row("not-a-key", _record("pending")) is None
+    assert export_row("1_100", _record("unknown")) is None
+
+
+@pytest.fixture
+def records(store):
+    store.set(USER_VERIFICATION, "1_100", _record("pending", 1000))
+    store.set(USER_VERIFICATION, "2_100", _record("verified", 2000))
+    store.set(USER_VERIFICATION, "3_100", _record("kicked", 3000))
+    store.set(USER_VERIFICATION, "1_200", _record("verified", 4000))
+    return store
+
+
+def test_export_csv_for_one_group(records, tmp_path):
+    path = str(tmp_path / "out.csv")
+    count = asyncio.run(
+        export_records(path, "csv", group_id=100, statuses={Status.VERIFIED})
+    )
+    assert count == 1
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [(row["user_id"], row["status"]) for row in rows] == [("2", "verified")]
+
+
+def test_export_gzip_jsonl(records, tmp_path):
+    path = str(tmp_path / "out.jsonl.gz")
+    count = asyncio.run(export_records(path, "jsonl", since=2000, until=4000))
+    assert count == 2
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert sorted(row["user_id"] for row in rows) == [2, 3]
+    assert not [p for p in tmp_path.iterdir() if ".tmp." in p.name]
+
+
+def test_export_rejects_unknown_format(records, tmp_path):
+    with pytest.raises(ValueError):
+        asyncio.run(export_records(str(tmp_path / "out.xml"), "xml"))
+
+
+def test_export_runs_in_a_thread(records, tmp_path, monkeypatch):
+    threads = []
+    iter_records = records.iter_records
+
+    def recording(table, group_id=None):
+        threads.append(threading.get_ident())
+        return iter_records(table, group_id)
+
+    monkeypatch.setattr(records, "iter_records", recording)
+    count = asyncio.run(export_records(str(tmp_path / "out.csv")))
+    assert count == 4
+    assert threads and threading.get_ident() not in threads
+
+
+def test_failed_export_leaves_no_file(records, tmp_path, monkeypatch):
+    def failing(table, group_id=None):
+        yield "1_100", _record("pending", 1000)
+        raise OSError("读取失败")
+
+    monkeypatch.setattr(records, "iter_records", failing)
+    with pytest.raises(OSError):
+        asyncio.run(export_records(str(tmp_path / "out.csv")))
+    # 临时文件已删除，也没有写了一半的正式文件
+    assert not [p for p in tmp_path.iterdir() if p.name.startswith("out.csv")]
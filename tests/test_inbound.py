@@ -0,0 +1,149 @@
+"""inbound.py：优先级顺序和过载时的丢弃"""
+
+import asyncio
+
+from app.scripts.GroupEntryVerification import inbound
+from app.scripts.GroupEntryVerification.inbound import (
+    InboundQueue,
+    PRIORITY_NOTICE,
+    PRIORITY_ANSWER,
+    PRIORITY_ADMIN,
+    PRIORITY_ENFORCEMENT,
+)
+
+
+async def _blocked(queue):
+    """提交一个占住唯一工作协程的事件，返回放行它的 Event 和它的任务"""
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def hold():
+        started.set()
+        await release.wait()
+
+    task = asyncio.create_task(queue.submit(PRIORITY_NOTICE, hold))
+    await started.wait()
+    return release, task
+
+
+def _recorder(done, name):
+    async def job():
+        done.append(name)
+
+    return job
+
+
+def test_higher_priority_runs_first():
+    async def scenario():
+        queue = InboundQueue(workers=1)
+        release, blocker = await _blocked(queue)
+        done = []
+        tasks = [
+            asyncio.create_task(queue.submit(priority, _recorder(done, name)))
+            for priority, name in (
+                (PRIORITY_ENFORCEMENT, "enforcement"),
+                (PRIORITY_ADMIN, "admin"),
+                (PRIORITY_NOTICE, "notice"),
+                (PRIORITY_ANSWER, "answer"),
+            )
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        assert all(await asyncio.gather(blocker, *tasks))
+        return done
+
+    assert asyncio.run(scenario()) == ["notice", "answer", "admin", "enforcement"]
+
+
+def test_lowest_priority_shed_when_backlogged():
+    async def scenario():
+        queue = InboundQueue(workers=1, degrade_depth=2)
+        release, blocker = await _blocked(queue)
+        done = []
+        queued = [
+            asyncio.create_task(queue.submit(PRIORITY_ANSWER, _recorder(done, n)))
+            for n in ("a1", "a2")
+        ]
+        await asyncio.sleep(0)
+        # 深度已达到 degrade_depth，最低优先级的新事件直接丢弃，其他优先级照常排队
+        assert not await queue.submit(PRIORITY_ENFORCEMENT, _recorder(done, "low"))
+        admin = asyncio.create_task(queue.submit(PRIORITY_ADMIN, _recorder(done, "x")))
+        await asyncio.sleep(0)
+        release.set()
+        assert all(await asyncio.gather(blocker, admin, *queued))
+        return done, queue.stats()
+
+    done, stats = asyncio.run(scenario())
+    assert done == ["a1", "a2", "x"]
+    assert stats["shed"]["enforcement"] == 1
+    assert stats["processed"]["enforcement"] == 0
+
+
+def test_stale_lowest_priority_dropped(monkeypatch):
+    async def scenario():
+        queue = InboundQueue(workers=1, max_wait=5)
+        release, blocker = await _blocked(queue)
+        done = []
+        stale = asyncio.create_task(
+            queue.submit(PRIORITY_ENFORCEMENT, _recorder(done, "low"))
+        )
+        answer = asyncio.create_task(
+            queue.submit(PRIORITY_ANSWER, _recorder(done, "answer"))
+        )
+        await asyncio.sleep(0)
+        # 两个事件都排队超过 max_wait，只有最低优先级的被丢弃
+        now = inbound.time.monotonic() + 10
+        monkeypatch.setattr(inbound.time, "monotonic", lambda: now)
+        release.set()
+        return done, await asyncio.gather(blocker, stale, answer), queue.stats()
+
+    done, results, stats = asyncio.run(scenario())
+    assert done == ["answer"]
+    assert results == [True, False, True]
+    assert stats["shed"]["enforcement"] == 1
+
+
+def test_full_queue_evicts_lowest_priority():
+    async def scenario():
+        queue = InboundQueue(workers=1, capacity=2, degrade_depth=100)
+        release, blocker = await _blocked(queue)
+        done = []
+        admin = asyncio.create_task(queue.submit(PRIORITY_ADMIN, _recorder(done, "a")))
+        low = asyncio.create_task(
+            queue.submit(PRIORITY_ENFORCEMENT, _recorder(done, "low"))
+        )
+        await asyncio.sleep(0)
+        # 队列已满：新的通知挤掉最低优先级的事件
+        notice = asyncio.create_task(
+            queue.submit(PRIORITY_NOTICE, _recorder(done, "notice"))
+        )
+        await asyncio.sleep(0)
+        # 队列中没有优先级更低的事件时丢弃新事件
+        rejected = await queue.submit(PRIORITY_ADMIN, _recorder(done, "late"))
+        release.set()
+        results = await asyncio.gather(blocker, admin, low, notice)
+        return done, rejected, results, queue.stats()
+
+    done, rejected, results, stats = asyncio.run(scenario())
+    assert done == ["notice", "a"]
+    assert not rejected
+    assert results == [True, True, False, True]
+    assert stats["shed"] == {"notice": 0, "answer": 0, "admin": 1, "enforcement": 1}
+
+
+def test_job_exception_reaches_caller():
+    async def scenario():
+        queue = InboundQueue(workers=1)
+
+        async def fail():
+            raise ValueError("处理失败")
+
+        try:
+            await queue.submit(PRIORITY_ANSWER, fail)
+        except ValueError as e:
+            error = e
+        # 工作协程继续处理后面的事件
+        return error, await queue.submit(PRIORITY_ANSWER, _recorder([], "next"))
+
+    error, processed = asyncio.run(scenario())
+    assert str(error) == "处理失败"
+    assert processed
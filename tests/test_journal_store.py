@@ -0,0 +1,166 @@
+"""journal_store.py：日志重放、CRC 校验、损坏恢复和快照压缩"""
+
+import os
+
+import pytest
+
+from app.scripts.GroupEntryVerification.journal_store import (
+    JournalStore,
+    read_journal,
+    read_snapshot,
+)
+from app.scripts.GroupEntryVerification.store import (
+    add_listener,
+    USER_VERIFICATION,
+    WARNING_RECORD,
+    REACHED_LIMIT,
+)
+
+
+def _open(tmp_path, **kwargs):
+    return JournalStore(str(tmp_path), import_existing=False, **kwargs)
+
+
+def _pending(attempts=3):
+    return {"status": "pending", "remaining_attempts": attempts}
+
+
+def test_reopen_replays_journal(tmp_path):
+    store = _open(tmp_path)
+    store.set(USER_VERIFICATION, "1_100", _pending())
+    store.update_tables(
+        {
+            USER_VERIFICATION: {"2_100": lambda _: _pending(2)},
+            WARNING_RECORD: {"2_100": lambda _: 1},
+            REACHED_LIMIT: {"100": lambda _: ["3"]},
+        }
+    )
+    store.delete(USER_VERIFICATION, "1_100")
+    store.close()
+
+    store = _open(tmp_path)
+    assert store.load(USER_VERIFICATION) == {"2_100": _pending(2)}
+    assert store.get(WARNING_RECORD, "2_100") == 1
+    assert store.get(REACHED_LIMIT, "100") == ["3"]
+    assert store.user_records(USER_VERIFICATION, "2") == {"2_100": _pending(2)}
+    assert store.user_records(USER_VERIFICATION, "1") == {}
+    store.close()
+
+
+def test_multi_table_update_is_one_entry(tmp_path):
+    store = _open(tmp_path)
+    store.update_tables(
+        {
+            USER_VERIFICATION: {"1_100": lambda _: _pending()},
+            WARNING_RECORD: {"1_100": lambda _: 2},
+        }
+    )
+    store.close()
+    _, _, entries, _, corrupt = read_journal(store.journal_path)
+    assert len(entries) == 1
+    assert not corrupt
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    store = _open(tmp_path)
+    store.set(USER_VERIFICATION, "1_100", _pending())
+    store.set(USER_VERIFICATION, "2_100", _pending())
+    store.close()
+    size = os.path.getsize(store.journal_path)
+    # 最后一条记录只写了一半
+    with open(store.journal_path, "r+b") as f:
+        f.truncate(size - 3)
+
+    store = _open(tmp_path)
+    assert store.load(USER_VERIFICATION) == {"1_100": _pending()}
+    store.set(USER_VERIFICATION, "3_100", _pending())
+    store.close()
+
+    store = _open(tmp_path)
+    assert set(store.load(USER_VERIFICATION)) == {"1_100", "3_100"}
+    store.close()
+    assert not [name for name in os.listdir(store.directory) if ".corrupt-" in name]
+
+
+def test_mid_journal_corruption_is_backed_up(tmp_path):
+    store = _open(tmp_path)
+    store.set(USER_VERIFICATION, "1_100", _pending())
+    first_end = os.path.getsize(store.journal_path)
+    store.set(USER_VERIFICATION, "2_100", _pending())
+    store.set(USER_VERIFICATION, "3_100", _pending())
+    store.close()
+    # 破坏第二条记录的正文，CRC 校验失败
+    with open(store.journal_path, "r+b") as f:
+        f.seek(first_end + 10)
+        byte = f.read(1)
+        f.seek(first_end + 10)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    _, _, entries, _, corrupt = read_journal(store.journal_path)
+    assert len(entries) == 1
+    assert corrupt
+
+    store = _open(tmp_path)
+    assert store.load(USER_VERIFICATION) == {"1_100": _pending()}
+    store.close()
+    backups = [name for name in os.listdir(store.directory) if ".corrupt-" in name]
+    assert len(backups) == 1
+    # 恢复后写入了新一代快照，新的日志是干净的
+    _, _, entries, _, corrupt = read_journal(store.journal_path)
+    assert entries == []
+    assert not corrupt
+
+
+def test_compaction_starts_new_generation(tmp_path):
+    store = _open(tmp_path, compact_bytes=512)
+    for user_id in range(50):
+        store.set(USER_VERIFICATION, f"{user_id}_100", _pending())
+    generation, _, _ = read_snapshot(store.snapshot_path)
+    assert generation > 1
+    assert os.path.exists(store.snapshot_path + ".prev")
+    assert os.path.getsize(store.journal_path) < 512
+    store.close()
+
+    store = _open(tmp_path)
+    assert len(store.load(USER_VERIFICATION)) == 50
+    store.close()
+
+
+def test_corrupt_snapshot_falls_back_to_previous_generation(tmp_path):
+    store = _open(tmp_path)
+    store.set(USER_VERIFICATION, "1_100", _pending())
+    store.snapshot()
+    store.set(USER_VERIFICATION, "2_100", _pending())
+    store.close()
+    with open(store.snapshot_path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    # 上一代快照加两代日志
+    store = _open(tmp_path)
+    assert set(store.load(USER_VERIFICATION)) == {"1_100", "2_100"}
+    store.close()
+
+
+def test_second_process_cannot_open(tmp_path):
+    store = _open(tmp_path)
+    try:
+        with pytest.raises(RuntimeError):
+            _open(tmp_path)
+    finally:
+        store.close()
+
+
+def test_listeners_receive_previous_values(tmp_path):
+    journal = _open(tmp_path / "journal")
+    received = []
+    add_listener(lambda table, changes, previous: received.append((changes, previous)))
+    journal.set(USER_VERIFICATION, "1_100", _pending())
+    journal.set(USER_VERIFICATION, "1_100", {"status": "verified"})
+    journal.close()
+    assert received == [
+        ({"1_100": _pending()}, {"1_100": None}),
+        ({"1_100": {"status": "verified"}}, {"1_100": _pending()}),
+    ]
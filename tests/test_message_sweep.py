@@ -0,0 +1,113 @@
+"""message_sweep.py：已结束验证和超过撤回窗口的消息记录清理，以及后台定期清理"""
+
+import json
+import asyncio
+
+from app.scripts.GroupEntryVerification.del_message import MESSAGE_RECALL_WINDOW
+from app.scripts.GroupEntryVerification.message_sweep import (
+    MessageSweeper,
+    collect_stale_messages,
+    sweep_messages,
+)
+from app.scripts.GroupEntryVerification.store import (
+    USER_VERIFICATION,
+    MESSAGE_ID_LIST,
+)
+
+NOW = 1_700_000_000.0
+
+
+class RecordingWebSocket:
+    """记录发出的API调用，fail_ids 中的消息撤回失败"""
+
+    def __init__(self, fail_ids=()):
+        self.sent = []
+        self.fail_ids = fail_ids
+
+    async def send(self, data):
+        request = json.loads(data)
+        if request["params"].get("message_id") in self.fail_ids:
+            raise ConnectionError(request["params"]["message_id"])
+        self.sent.append((request["action"], request["params"]))
+
+
+def _status(store, user_id, status, group_id="100"):
+    store.set(
+        USER_VERIFICATION,
+        f"{user_id}_{group_id}",
+        {"status": status, "remaining_attempts": 3},
+    )
+
+
+def _seed(store):
+    _status(store, "1", "pending")
+    _status(store, "2", "verified")
+    _status(store, "3", "pending")
+    store.set(
+        MESSAGE_ID_LIST,
+        "100",
+        {
+            # 仍在等待验证，保留
+            "1": [[11, NOW - 60]],
+            # 已通过验证，撤回；清理开始之后记录的消息保留
+            "2": [[21, NOW - 60], [22, NOW + 5]],
+            # 超过撤回窗口，只删除记录
+            "3": [[31, NOW - MESSAGE_RECALL_WINDOW], [32, NOW - 60]],
+            # 旧格式的消息ID，没有验证记录
+            "4": [41],
+        },
+    )
+    store.set(MESSAGE_ID_LIST, "200", {"5": [[51, NOW - MESSAGE_RECALL_WINDOW - 1]]})
+
+
+def test_collect_stale_messages(store):
+    _seed(store)
+    recalls, expired = collect_stale_messages(NOW)
+    assert recalls == {"100": [21, 41]}
+    assert expired == 2
+    assert store.get(MESSAGE_ID_LIST, "100") == {
+        "1": [[11, NOW - 60]],
+        "2": [[22, NOW + 5]],
+        "3": [[32, NOW - 60]],
+    }
+    assert store.get(MESSAGE_ID_LIST, "200") is None
+    # 再次清理没有可清理的记录
+    assert collect_stale_messages(NOW) == ({}, 0)
+
+
+def test_sweep_recalls_in_one_batch(store):
+    _seed(store)
+    websocket = RecordingWebSocket(fail_ids=(41,))
+    recalled, expired = asyncio.run(sweep_messages(websocket, NOW))
+    assert (recalled, expired) == (1, 2)
+    assert websocket.sent == [("delete_msg", {"message_id": 21})]
+    # 撤回失败的记录也已删除，不会重复撤回
+    assert "4" not in store.get(MESSAGE_ID_LIST, "100")
+
+
+def test_nothing_to_sweep(store):
+    websocket = RecordingWebSocket()
+    assert asyncio.run(sweep_messages(websocket)) == (0, 0)
+    assert websocket.sent == []
+
+
+def test_sweeper_runs_periodically(store):
+    async def scenario():
+        sweeper = MessageSweeper(interval=0.01)
+        first, second = RecordingWebSocket(), RecordingWebSocket()
+        sweeper.start(first)
+        task = sweeper._task
+        # 重复启动只更新连接
+        sweeper.start(second)
+        assert sweeper._task is task
+        _status(store, "2", "verified")
+        store.set(MESSAGE_ID_LIST, "100", {"2": [21]})
+        await asyncio.sleep(0.05)
+        sweeper.stop()
+        return sweeper, first, second
+
+    sweeper, first, second = asyncio.run(scenario())
+    assert sweeper._task is None
+    assert sweeper.stats() == {"recalled": 1, "expired": 0}
+    assert first.sent == []
+    assert second.sent == [("delete_msg", {"message_id": 21})]
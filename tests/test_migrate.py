@@ -0,0 +1,122 @@
+"""migrate.py：块边界上的流式 JSON 解析、断点续传和核对"""
+
+import json
+
+import pytest
+
+from app.scripts.GroupEntryVerification.migrate import (
+    StreamingParseError,
+    iter_json_object,
+    migrate,
+    migrate_table,
+    verify_table,
+)
+from app.scripts.GroupEntryVerification.store import (
+    USER_VERIFICATION,
+    WARNING_RECORD,
+)
+
+SAMPLE = {
+    "1_100": {"status": "pending", "remaining_attempts": 3, "joined_at": 1700000000},
+    "22_100": {"status": "verified", "remaining_attempts": 12345.678},
+    "333_200": {"note": '含有转义 " \\ 和中文：验证', "list": [1, -2.5e10, None]},
+    "empty": {},
+    "number": 1234567890123,
+}
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_values_split_across_chunks(tmp_path, chunk_size, indent):
+    path = _write(
+        tmp_path / "table.json", json.dumps(SAMPLE, ensure_ascii=False, indent=indent)
+    )
+    assert dict(iter_json_object(path, chunk_size)) == SAMPLE
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3])
+def test_number_at_end_of_chunk_is_not_cut(tmp_path, chunk_size):
+    # 每个数字都可能在块边界处看起来已经结束
+    path = _write(tmp_path / "table.json", '{"a":12345,"b":-0.25e3 ,"c":7}')
+    assert list(iter_json_object(path, chunk_size)) == [
+        ("a", 12345),
+        ("b", -250.0),
+        ("c", 7),
+    ]
+
+
+@pytest.mark.parametrize("text", ["", "  \n", "{}", " { } "])
+def test_empty_inputs(tmp_path, text):
+    assert list(iter_json_object(_write(tmp_path / "table.json", text), 2)) == []
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["[1, 2]", '{"a": 1', '{"a": 1 "b": 2}', "{1: 2}", '{"a" 1}', '{"a": tru}'],
+)
+def test_malformed_inputs(tmp_path, text):
+    path = _write(tmp_path / "table.json", text)
+    with pytest.raises(StreamingParseError):
+        list(iter_json_object(path, 3))
+
+
+def test_migrate_table_in_batches(store, tmp_path):
+    source = {f"{user_id}_100": {"status": "pending"} for user_id in range(25)}
+    path = _write(tmp_path / "source.json", json.dumps(source))
+    progress = []
+    count = migrate_table(store, USER_VERIFICATION, path, 10, 0, progress.append)
+    assert count == 25
+    assert progress == [10, 20, 25]
+    assert verify_table(store, USER_VERIFICATION, path) == (25, 25)
+
+    store.set(USER_VERIFICATION, "3_100", {"status": "verified"})
+    assert verify_table(store, USER_VERIFICATION, path) == (25, 24)
+
+
+class _FailingStore:
+    """写入 fail_after 批之后中断，模拟迁移中途退出"""
+
+    def __init__(self, store, fail_after):
+        self.store = store
+        self.fail_after = fail_after
+        self.batches = 0
+
+    def update_many(self, table, funcs):
+        if self.batches >= self.fail_after:
+            raise RuntimeError("中断")
+        self.batches += 1
+        return self.store.update_many(table, funcs)
+
+    def get(self, table, key, default=None):
+        return self.store.get(table, key, default)
+
+
+def test_migrate_resumes_from_state(store, tmp_path):
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    users = {f"{user_id}_100": {"status": "pending"} for user_id in range(25)}
+    _write(source_dir / f"{USER_VERIFICATION}.json", json.dumps(users))
+    _write(source_dir / f"{WARNING_RECORD}.json", json.dumps({"1_100": 2}))
+    state_path = str(tmp_path / "state.json")
+
+    failing = _FailingStore(store, fail_after=2)
+    with pytest.raises(RuntimeError):
+        migrate(failing, str(source_dir), state_path, batch_size=10)
+    with open(state_path, "r", encoding="utf-8") as f:
+        assert json.load(f)[USER_VERIFICATION]["done"] == 20
+
+    resumed = _FailingStore(store, fail_after=100)
+    assert migrate(resumed, str(source_dir), state_path, batch_size=10)
+    # 只写入剩下的 5 条和警告表
+    assert resumed.batches == 2
+    assert store.load(USER_VERIFICATION) == users
+    assert store.get(WARNING_RECORD, "1_100") == 2
+
+    # 已完成的表再次运行时只核对
+    again = _FailingStore(store, fail_after=0)
+    assert migrate(again, str(source_dir), state_path, batch_size=10)
@@ -0,0 +1,113 @@
+"""main.py 的入群处理：先禁言，验证消息和管理员通知在后台发送，不阻塞验证记录的提交"""
+
+import json
+import asyncio
+
+import pytest
+
+from app.scripts.GroupEntryVerification import main
+from app.scripts.GroupEntryVerification.echo_registry import EchoRegistry
+from app.scripts.GroupEntryVerification.stats import JOIN, load_stats
+from app.scripts.GroupEntryVerification.tracing import VerificationTracer
+from app.scripts.GroupEntryVerification.store import (
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+)
+
+
+class RecordingWebSocket:
+    """记录发出的API调用，blocked 中的接口调用等到 release 之后才完成"""
+
+    def __init__(self, blocked=()):
+        self.sent = []
+        self.blocked = blocked
+        self.release = asyncio.Event()
+
+    async def send(self, data):
+        request = json.loads(data)
+        if request["action"] in self.blocked:
+            await self.release.wait()
+        self.sent.append((request["action"], request["params"]))
+
+
+@pytest.fixture
+def new_member(monkeypatch):
+    monkeypatch.setattr(main, "echo_registry", EchoRegistry(main.ECHO_NOTE_PREFIX))
+    monkeypatch.setattr(main, "tracer", VerificationTracer(None))
+    monkeypatch.setattr(main, "generate_math_expression", lambda: ("3 + 4", 7))
+
+
+async def _cancel_background():
+    tasks = list(main._background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_ban_is_sent_first(store, new_member):
+    async def scenario():
+        websocket = RecordingWebSocket()
+        await main.process_new_member(websocket, "1", "100")
+        # 后台发送验证消息和第一条管理员通知，之后的通知间隔 1 秒
+        await asyncio.sleep(0.05)
+        await _cancel_background()
+        return websocket
+
+    websocket = asyncio.run(scenario())
+    (ban_action, ban), (prompt_action, prompt), (admin_action, admin) = websocket.sent
+    assert ban_action == "set_group_ban"
+    assert (ban["group_id"], ban["user_id"]) == ("100", "1")
+    assert ban["duration"] == main.BAN_DURATION
+    assert prompt_action == "send_group_msg"
+    assert "你的计算式是：3 + 4" in prompt["message"]
+    assert admin_action == "send_private_msg"
+    assert admin["user_id"] == "10000"
+    assert "答案：7" in admin["message"]
+
+
+def test_commit_does_not_wait_for_prompt(store, new_member):
+    async def scenario():
+        websocket = RecordingWebSocket(blocked=("send_group_msg",))
+        await main.process_new_member(websocket, "1", "100")
+        # 验证消息还没有发出，验证记录已经提交
+        actions = [action for action, _ in websocket.sent]
+        record = store.get(USER_VERIFICATION, "1_100")
+        question = store.get(VERIFICATION_QUESTIONS, "1_100")
+        websocket.release.set()
+        await asyncio.sleep(0.05)
+        await _cancel_background()
+        return websocket, actions, record, question
+
+    websocket, actions, record, question = asyncio.run(scenario())
+    assert actions == ["set_group_ban"]
+    assert record["status"] == "pending"
+    assert record["remaining_attempts"] == main.MAX_ATTEMPTS
+    assert question["expression"] == "3 + 4"
+    assert question["answer"] == 7
+    assert load_stats(100)["total"][JOIN] == 1
+    assert [action for action, _ in websocket.sent][:2] == [
+        "set_group_ban",
+        "send_group_msg",
+    ]
+
+
+def test_failed_prompt_does_not_block_admin_notice(store, new_member):
+    class FailingPromptWebSocket(RecordingWebSocket):
+        async def send(self, data):
+            if json.loads(data)["action"] == "send_group_msg":
+                raise ConnectionError("send_group_msg")
+            await super().send(data)
+
+    async def scenario():
+        websocket = FailingPromptWebSocket()
+        await main.process_new_member(websocket, "1", "100")
+        await asyncio.sleep(0.05)
+        await _cancel_background()
+        return websocket
+
+    websocket = asyncio.run(scenario())
+    assert [action for action, _ in websocket.sent] == [
+        "set_group_ban",
+        "send_private_msg",
+    ]
+    assert store.get(USER_VERIFICATION, "1_100")["status"] == "pending"
@@ -0,0 +1,176 @@
+"""pending_index.py：从存储建立索引、通过修改通知保持更新、在线程中重建和分页排序"""
+
+import asyncio
+import threading
+
+from app.scripts.GroupEntryVerification import main, pending_index
+from app.scripts.GroupEntryVerification import store as store_module
+from app.scripts.GroupEntryVerification.pending_index import (
+    PendingIndex,
+    VERIFICATION_DEADLINE,
+)
+from app.scripts.GroupEntryVerification.store import (
+    USER_VERIFICATION,
+    WARNING_RECORD,
+)
+
+
+def _pending(joined_at, attempts=3):
+    return {"status": "pending", "remaining_attempts": attempts, "joined_at": joined_at}
+
+
+def _query(index, *args, **kwargs):
+    return asyncio.run(index.query(*args, **kwargs))
+
+
+def _users(entries):
+    return [entry.user_id for entry in entries]
+
+
+def test_query_sorts_and_pages(store):
+    store.set(USER_VERIFICATION, "1_100", _pending(3000, 1))
+    store.set(USER_VERIFICATION, "2_100", _pending(1000, 3))
+    store.set(USER_VERIFICATION, "3_100", _pending(2000, 2))
+    store.set(USER_VERIFICATION, "4_100", {"status": "verified"})
+    store.set(USER_VERIFICATION, "5_200", _pending(500))
+    store.set(WARNING_RECORD, "3_100", 2)
+    index = PendingIndex()
+
+    entries, total = _query(index, 100)
+    assert total == 3
+    assert _users(entries) == [2, 3, 1]
+    assert entries[1].warnings == 2
+
+    assert _users(_query(index, 100, sort="次数")[0]) == [1, 3, 2]
+    assert _users(_query(index, 100, sort="警告", reverse=True)[0]) == [3, 2, 1]
+    assert _users(_query(index, 100, page=2, page_size=2)[0]) == [1]
+    entries, total = _query(index)
+    assert total == 4
+    assert _users(entries) == [5, 2, 3, 1]
+
+
+def test_updates_follow_store_changes(store):
+    store.set(USER_VERIFICATION, "1_100", _pending(1000))
+    index = PendingIndex()
+    assert _query(index, 100)[1] == 1
+
+    store.set(USER_VERIFICATION, "2_100", _pending(2000))
+    store.set(WARNING_RECORD, "2_100", 1)
+    store.set(USER_VERIFICATION, "1_100", {"status": "verified"})
+    entries, total = _query(index, 100)
+    assert total == 1
+    assert entries[0].user_id == 2
+    assert entries[0].warnings == 1
+
+    store.delete(WARNING_RECORD, "2_100")
+    store.delete(USER_VERIFICATION, "2_100")
+    assert _query(index, 100) == ([], 0)
+
+
+def test_rebuilds_after_table_overwrite(store):
+    store.set(USER_VERIFICATION, "1_100", _pending(1000))
+    index = PendingIndex()
+    _query(index)
+    store.save(USER_VERIFICATION, {"2_100": _pending(2000)})
+    assert _users(_query(index)[0]) == [2]
+
+
+def test_rebuilds_when_stale(store):
+    store.set(USER_VERIFICATION, "1_100", _pending(1000))
+    index = PendingIndex(max_age=3600)
+    _query(index)
+    # 其他进程的修改收不到通知，只能等索引过期后重建
+    store_module._listeners.remove(index._on_change)
+    store.set(USER_VERIFICATION, "1_100", {"status": "verified"})
+    assert _query(index)[1] == 1
+    index.max_age = 0
+    assert _query(index) == ([], 0)
+
+
+def test_time_left(store):
+    store.set(USER_VERIFICATION, "1_100", _pending(1000))
+    store.set(USER_VERIFICATION, "2_100", {"status": "pending"})
+    entries, _ = _query(PendingIndex(), 100)
+    assert entries[0].time_left(now=1500) is None
+    assert entries[1].time_left(now=1500) == VERIFICATION_DEADLINE - 500
+
+
+def test_pending_records(store):
+    store.set(USER_VERIFICATION, "1_100", _pending(1000))
+    store.set(USER_VERIFICATION, "2_200", _pending(2000))
+    store.set(USER_VERIFICATION, "3_200", {"status": "verified"})
+    store.set(USER_VERIFICATION, "bad_200", _pending(3000))
+    store.set(WARNING_RECORD, "bad", 1)
+    index = PendingIndex()
+    pending = asyncio.run(index.pending())
+    assert sorted(record.key for record in pending) == [(1, 100), (2, 200)]
+    assert [record.user_id for record in asyncio.run(index.pending(200))] == [2]
+
+
+def _slow_load(monkeypatch):
+    """读取存储后等待放行再返回，返回 (已读取, 放行, 读取次数)"""
+    loaded, resume, calls = threading.Event(), threading.Event(), []
+    load = pending_index._load_pending
+
+    def slow(store):
+        calls.append(threading.get_ident())
+        result = load(store)
+        loaded.set()
+        resume.wait(5)
+        return result
+
+    monkeypatch.setattr(pending_index, "_load_pending", slow)
+    return loaded, resume, calls
+
+
+def test_rebuild_runs_off_the_loop_and_keeps_changes(store, monkeypatch):
+    store.set(USER_VERIFICATION, "1_100", _pending(1000))
+    store.set(USER_VERIFICATION, "2_100", _pending(2000))
+    loaded, resume, calls = _slow_load(monkeypatch)
+
+    async def scenario():
+        index = PendingIndex()
+        first = asyncio.create_task(index.query())
+        second = asyncio.create_task(index.query(100))
+        await asyncio.to_thread(loaded.wait, 5)
+        # 读取完成之后、替换索引之前的修改，事件循环在重建期间照常处理
+        store.set(USER_VERIFICATION, "1_100", {"status": "verified"})
+        store.set(USER_VERIFICATION, "3_100", _pending(3000))
+        store.set(WARNING_RECORD, "2_100", 2)
+        resume.set()
+        return await first, await second
+
+    (entries, total), (group_entries, _) = asyncio.run(scenario())
+    assert _users(entries) == [2, 3]
+    assert entries[0].warnings == 2
+    assert _users(group_entries) == [2, 3]
+    # 同时进行的查询共用一次重建，读取不在事件循环线程中
+    assert len(calls) == 1
+    assert calls[0] != threading.get_ident()
+
+
+def test_overwrite_during_rebuild_rebuilds_again(store, monkeypatch):
+    store.set(USER_VERIFICATION, "1_100", _pending(1000))
+    loaded, resume, calls = _slow_load(monkeypatch)
+
+    async def scenario():
+        index = PendingIndex()
+        query = asyncio.create_task(index.query())
+        await asyncio.to_thread(loaded.wait, 5)
+        store.save(USER_VERIFICATION, {"2_100": _pending(2000)})
+        resume.set()
+        return await query
+
+    entries, _ = asyncio.run(scenario())
+    assert _users(entries) == [2]
+    assert len(calls) == 2
+
+
+def test_admin_targets_for_all_groups(store, monkeypatch):
+    monkeypatch.setattr(main, "pending_index", PendingIndex())
+    store.set(USER_VERIFICATION, "1_100", _pending(1000))
+    store.set(USER_VERIFICATION, "2_200", _pending(2000))
+    store.set(USER_VERIFICATION, "3_200", {"status": "verified"})
+    targets = asyncio.run(main.parse_admin_targets("批准 全部"))
+    assert sorted(targets) == [("100", "1"), ("200", "2")]
+    assert asyncio.run(main.parse_admin_targets("批准 200 全部")) == [("200", "2")]
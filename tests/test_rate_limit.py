@@ -0,0 +1,103 @@
+"""rate_limit.py：私聊的令牌桶、“无待验证记录”缓存及其失效，以及分发表中的私聊过滤"""
+
+import pytest
+
+from app.scripts.GroupEntryVerification import main, rate_limit
+from app.scripts.GroupEntryVerification.rate_limit import PrivateMessageGate
+from app.scripts.GroupEntryVerification.store import USER_VERIFICATION
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def _allowed(gate, user_id, count):
+    return sum(gate.allow(user_id) for _ in range(count))
+
+
+def test_token_bucket(clock):
+    gate = PrivateMessageGate(burst=3, rate=0.5)
+    assert _allowed(gate, 1, 10) == 3
+    assert gate.rate_limited == 7
+    # 每个用户各自一个令牌桶
+    assert _allowed(gate, 2, 3) == 3
+    clock.now += 1.9
+    assert not gate.allow(1)
+    clock.now += 0.1
+    assert gate.allow(1)
+    assert not gate.allow(1)
+    # 令牌最多恢复到桶的容量
+    clock.now += 3600
+    assert _allowed(gate, "1", 10) == 3
+
+
+def test_not_pending_users_are_dropped_until_ttl(clock):
+    gate = PrivateMessageGate(burst=100, not_pending_ttl=30)
+    gate.note_not_pending(1)
+    assert _allowed(gate, "1", 5) == 0
+    assert gate.stats() == {"rate_limited": 0, "not_pending": 5, "tracked_users": 0}
+    clock.now += 30
+    assert gate.allow(1)
+    assert gate.allow(1)
+
+
+def test_new_pending_record_clears_cache(store, clock):
+    gate = PrivateMessageGate(burst=100)
+    for user_id in (1, 2, 3):
+        gate.note_not_pending(user_id)
+    store.set(
+        USER_VERIFICATION, "1_100", {"status": "pending", "remaining_attempts": 3}
+    )
+    # 其他状态的记录不清除缓存
+    store.set(
+        USER_VERIFICATION, "2_100", {"status": "verified", "remaining_attempts": 3}
+    )
+    assert gate.allow(1)
+    assert not gate.allow(2)
+    # 整张表被覆盖时清除所有缓存
+    store.save(USER_VERIFICATION, {})
+    assert gate.allow(2)
+    assert gate.allow(3)
+
+
+def test_tracked_users_are_pruned(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "MAX_TRACKED_USERS", 3)
+    gate = PrivateMessageGate(burst=2, rate=1, not_pending_ttl=10)
+    for user_id in range(3):
+        gate.allow(user_id)
+        gate.note_not_pending(100 + user_id)
+    clock.now += 10
+    # 令牌桶已恢复满、缓存已过期的用户被清理
+    gate.allow(3)
+    gate.note_not_pending(103)
+    assert set(gate._buckets) == {"3"}
+    assert set(gate._not_pending) == {"103"}
+
+
+def test_private_messages_are_filtered_before_dispatch(monkeypatch, clock):
+    monkeypatch.setattr(main, "private_message_gate", PrivateMessageGate(burst=1))
+
+    def private(user_id, raw_message="42"):
+        return {
+            "post_type": "message",
+            "message_type": "private",
+            "user_id": user_id,
+            "raw_message": raw_message,
+        }
+
+    assert main.resolve_handler(private(1)) is main.handle_private_message
+    assert main.resolve_handler(private(1)) is None
+    # 管理员不限流
+    for _ in range(3):
+        assert main.resolve_handler(private(10000, "验证统计")) is not None
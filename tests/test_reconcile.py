@@ -0,0 +1,148 @@
+"""reconcile.py：群成员列表的缓存和超时，以及按成员列表清理已退群的待验证用户"""
+
+import json
+import time
+import asyncio
+
+from app.scripts.GroupEntryVerification import reconcile
+from app.scripts.GroupEntryVerification.del_message import DelMessage
+from app.scripts.GroupEntryVerification.echo_registry import EchoRegistry
+from app.scripts.GroupEntryVerification.reconcile import (
+    MemberListCache,
+    reconcile_pending_users,
+)
+from app.scripts.GroupEntryVerification.store import (
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+    MESSAGE_ID_LIST,
+)
+
+
+class MemberListWebSocket:
+    """记录发出的API调用，按 members 中的成员列表回应 get_group_member_list"""
+
+    def __init__(self, registry, members=None):
+        self.registry = registry
+        self.members = members or {}
+        self.sent = []
+
+    async def send(self, data):
+        request = json.loads(data)
+        self.sent.append((request["action"], request["params"]))
+        group_id = str(request["params"].get("group_id"))
+        if request["action"] == "get_group_member_list" and group_id in self.members:
+            response = {
+                "echo": request["echo"],
+                "status": "ok",
+                "data": [
+                    {"user_id": int(user_id)} for user_id in self.members[group_id]
+                ],
+            }
+            asyncio.get_running_loop().call_soon(self.registry.resolve, response)
+
+
+def _member_list_requests(websocket):
+    return [
+        params for action, params in websocket.sent if action == "get_group_member_list"
+    ]
+
+
+def test_member_list_is_cached(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(reconcile.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        registry = EchoRegistry("GroupEntryVerification_")
+        cache = MemberListCache(registry, ttl=60)
+        websocket = MemberListWebSocket(registry, {"100": ["1", "2"]})
+        first = set(await cache.get_members(websocket, 100))
+        now[0] += 59
+        cached = set(await cache.get_members(websocket, "100"))
+        cache.note_join(100, 3)
+        cache.note_leave(100, 1)
+        updated = set(await cache.get_members(websocket, 100))
+        now[0] += 1
+        websocket.members["100"] = ["1"]
+        refreshed = await cache.get_members(websocket, 100)
+        return websocket, first, cached, updated, refreshed
+
+    websocket, first, cached, updated, refreshed = asyncio.run(scenario())
+    assert first == cached == {"1", "2"}
+    assert updated == {"2", "3"}
+    assert refreshed == {"1"}
+    assert _member_list_requests(websocket) == [{"group_id": 100, "no_cache": True}] * 2
+
+
+def test_unanswered_member_list_times_out(monkeypatch):
+    monkeypatch.setattr(reconcile, "MEMBER_LIST_TIMEOUT", 0.01)
+
+    async def scenario():
+        registry = EchoRegistry("GroupEntryVerification_")
+        cache = MemberListCache(registry)
+        members = await cache.get_members(MemberListWebSocket(registry), 100)
+        return registry, cache, members
+
+    registry, cache, members = asyncio.run(scenario())
+    assert members is None
+    # 超时的请求不留在等待列表里，也不缓存
+    assert len(registry) == 0
+    assert cache.snapshot_time(100) is None
+
+
+def _seed_pending(store, user_id, group_id="100", timestamp=None):
+    key = f"{user_id}_{group_id}"
+    store.set(USER_VERIFICATION, key, {"status": "pending", "remaining_attempts": 3})
+    store.set(
+        VERIFICATION_QUESTIONS,
+        key,
+        {
+            "expression": "1 + 1",
+            "answer": 2,
+            "timestamp": timestamp or time.time() - 60,
+        },
+    )
+
+
+def test_absent_pending_users_are_dropped(store):
+    _seed_pending(store, "1")
+    _seed_pending(store, "2")
+    # 成员列表请求发出之后才入群的用户不在列表里，但不能清理
+    _seed_pending(store, "3", timestamp=time.time() + 60)
+    _seed_pending(store, "4", group_id="200")
+    store.set(
+        USER_VERIFICATION, "5_100", {"status": "verified", "remaining_attempts": 3}
+    )
+    DelMessage().add_message("100", "2", 77)
+
+    async def scenario():
+        registry = EchoRegistry("GroupEntryVerification_")
+        websocket = MemberListWebSocket(registry, {"100": ["1"]})
+        cache = MemberListCache(registry)
+        absent = await reconcile_pending_users(websocket, cache, group_ids=[100])
+        return websocket, absent
+
+    websocket, absent = asyncio.run(scenario())
+    assert absent == {"100": {"2"}}
+    assert _member_list_requests(websocket) == [{"group_id": 100, "no_cache": True}]
+    assert ("delete_msg", {"message_id": 77}) in websocket.sent
+    assert store.get(USER_VERIFICATION, "2_100") is None
+    assert store.get(VERIFICATION_QUESTIONS, "2_100") is None
+    assert store.get(MESSAGE_ID_LIST, "100") is None
+    for key in ("1_100", "3_100", "4_200"):
+        assert store.get(USER_VERIFICATION, key)["status"] == "pending"
+
+
+def test_group_is_skipped_when_member_list_fails(store, monkeypatch):
+    monkeypatch.setattr(reconcile, "MEMBER_LIST_TIMEOUT", 0.01)
+    _seed_pending(store, "1")
+    _seed_pending(store, "2", group_id="200")
+
+    async def scenario():
+        registry = EchoRegistry("GroupEntryVerification_")
+        # 群 100 的成员列表没有回应
+        websocket = MemberListWebSocket(registry, {"200": []})
+        return await reconcile_pending_users(websocket, MemberListCache(registry))
+
+    assert asyncio.run(scenario()) == {"200": {"2"}}
+    assert store.get(USER_VERIFICATION, "1_100")["status"] == "pending"
+    assert store.get(USER_VERIFICATION, "2_200") is None
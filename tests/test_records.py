@@ -0,0 +1,86 @@
+"""records.py：打包的记录字段、存储格式的往返和按群、按用户的索引"""
+
+import pytest
+
+from app.scripts.GroupEntryVerification.records import (
+    Status,
+    VerificationRecord,
+    RecordTable,
+    make_key,
+    parse_key,
+)
+
+
+def test_packed_fields_are_independent():
+    record = VerificationRecord(1, 100, Status.PENDING, 3, 1700000000)
+    record.status = Status.KICKED
+    assert record.remaining_attempts == 3
+    assert record.joined_at == 1700000000
+    record.remaining_attempts = 1
+    assert record.status == Status.KICKED
+    assert record.joined_at == 1700000000
+    assert not record.is_pending
+
+
+def test_attempts_are_clamped():
+    assert VerificationRecord(1, 100, Status.PENDING, -2).remaining_attempts == 0
+    assert VerificationRecord(1, 100, Status.PENDING, 1000).remaining_attempts == 31
+
+
+def test_dict_round_trip():
+    value = {"status": "verified", "remaining_attempts": 2, "joined_at": 1700000000}
+    record = VerificationRecord.from_dict("123_456", value)
+    assert record.key == (123, 456)
+    assert record.store_key == "123_456"
+    assert record.to_dict() == value
+    # 没有入群时间的旧记录写回时也没有
+    legacy = {"status": "pending", "remaining_attempts": 3}
+    assert VerificationRecord.from_dict("1_2", legacy).to_dict() == legacy
+    assert VerificationRecord.from_dict("1_2", {}).status == Status.PENDING
+
+
+def test_keys(caplog):
+    assert make_key(1, 2) == "1_2"
+    assert parse_key("1_2") == (1, 2)
+    assert parse_key("1_2_3") is None
+    assert parse_key("a_b") is None
+    # 同一个格式错误的键只警告一次
+    assert parse_key("a_b") is None
+    assert len(caplog.records) == 2
+    with pytest.raises(ValueError):
+        VerificationRecord.from_dict("a_b", {})
+    with pytest.raises(KeyError):
+        Status.parse("unknown")
+
+
+def test_table_indexes():
+    table = RecordTable.from_dicts(
+        {
+            "1_100": {"status": "pending"},
+            "1_200": {"status": "verified"},
+            "2_100": {"status": "pending"},
+            "ignored": {"status": "pending"},
+            "3_100_old": {"status": "pending"},
+        }
+    )
+    assert len(table) == 3
+    assert (1, 200) in table
+    assert table[(2, 100)].status == Status.PENDING
+    assert [record.group_id for record in table.by_user(1)] == [100, 200]
+    assert sorted(record.user_id for record in table.by_group(100)) == [1, 2]
+    assert sorted(record.key for record in table.pending()) == [(1, 100), (2, 100)]
+    assert table.pending(200) == []
+
+    # 替换已有记录不会重复计数
+    table.add(VerificationRecord(1, 100, Status.VERIFIED, 0))
+    assert len(table) == 3
+    assert table.get(1, 100).status == Status.VERIFIED
+
+    assert table.remove(1, 100).key == (1, 100)
+    assert table.remove(1, 100) is None
+    assert [record.group_id for record in table.by_user(1)] == [200]
+    table.remove(1, 200)
+    assert table.by_user(1) == []
+    assert sorted(table.group_ids()) == [100]
+    with pytest.raises(KeyError):
+        table[(1, 200)]
@@ -0,0 +1,187 @@
+"""redis_store.py：乐观锁重试、跨实例缓存失效、索引补建、覆盖整张表和断线恢复"""
+
+import time
+import socket
+import threading
+
+import pytest
+
+from app.scripts.GroupEntryVerification.redis_store import (
+    KEY_PREFIX,
+    LocalRedisServer,
+    RedisConnection,
+    RedisError,
+    RedisStore,
+)
+from app.scripts.GroupEntryVerification.store import (
+    add_listener,
+    USER_VERIFICATION,
+    REACHED_LIMIT,
+)
+
+
+@pytest.fixture
+def server():
+    return LocalRedisServer()
+
+
+def _store(server):
+    return RedisStore(server.connect)
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_conflicting_update_is_retried(server):
+    first, second = _store(server), _store(server)
+    first.set(USER_VERIFICATION, "1_100", {"remaining_attempts": 3})
+    calls = []
+
+    def decrement(value):
+        calls.append(value["remaining_attempts"])
+        if len(calls) == 1:
+            # WATCH 之后、EXEC 之前另一个实例修改了同一条记录
+            second.set(USER_VERIFICATION, "1_100", {"remaining_attempts": 2})
+        return {"remaining_attempts": value["remaining_attempts"] - 1}
+
+    result = first.update(USER_VERIFICATION, "1_100", decrement)
+    assert calls == [3, 2]
+    assert result == {"remaining_attempts": 1}
+    assert second.get(USER_VERIFICATION, "1_100") == {"remaining_attempts": 1}
+
+
+def test_failing_update_unwatches(server):
+    store = _store(server)
+    store.set(USER_VERIFICATION, "1_100", {"status": "pending"})
+
+    def fail(value):
+        raise ValueError("修改失败")
+
+    with pytest.raises(ValueError):
+        store.update(USER_VERIFICATION, "1_100", fail)
+    assert store._conn._watched == {}
+
+
+def test_other_instance_writes_invalidate_cache(server):
+    first, second = _store(server), _store(server)
+    first.set(USER_VERIFICATION, "1_100", {"status": "pending"})
+    first.set(USER_VERIFICATION, "2_100", {"status": "pending"})
+    assert second.get(USER_VERIFICATION, "1_100") == {"status": "pending"}
+    assert len(second.load(USER_VERIFICATION)) == 2
+
+    first.set(USER_VERIFICATION, "1_100", {"status": "verified"})
+    first.delete(USER_VERIFICATION, "2_100")
+    assert second.get(USER_VERIFICATION, "1_100") == {"status": "verified"}
+    assert second.load(USER_VERIFICATION) == {"1_100": {"status": "verified"}}
+    assert second.load_group(USER_VERIFICATION, 100) == {
+        "1_100": {"status": "verified"}
+    }
+
+
+def test_indexes_are_backfilled_for_legacy_data(server):
+    # 没有按群和按用户索引的旧数据
+    conn = server.connect()
+    for key in ("1_100", "2_100", "1_200"):
+        conn.execute("SET", f"{KEY_PREFIX}:{USER_VERIFICATION}:{key}", '{"a": 1}')
+        conn.execute("SADD", f"{KEY_PREFIX}:{USER_VERIFICATION}", key)
+
+    store = _store(server)
+    assert set(store.load_group(USER_VERIFICATION, 100)) == {"1_100", "2_100"}
+    assert set(store.user_records(USER_VERIFICATION, 1)) == {"1_100", "1_200"}
+    assert conn.execute("GET", f"{KEY_PREFIX}:{USER_VERIFICATION}:indexed") == "1"
+    assert conn.execute("SMEMBERS", f"{KEY_PREFIX}:{USER_VERIFICATION}:g:200") == [
+        "1_200"
+    ]
+    assert [key for key, _ in store.iter_records(USER_VERIFICATION, 200)] == ["1_200"]
+
+
+def test_save_replaces_table_and_indexes(server):
+    first, second = _store(server), _store(server)
+    first.set(USER_VERIFICATION, "1_100", {"status": "pending"})
+    first.set(USER_VERIFICATION, "2_200", {"status": "pending"})
+    first.set(REACHED_LIMIT, "100", ["1"])
+    assert len(second.load(USER_VERIFICATION)) == 2
+
+    received = []
+    add_listener(lambda table, changes, previous: received.append((table, changes)))
+    first.save(USER_VERIFICATION, {"3_300": {"status": "verified"}})
+    assert received == [(USER_VERIFICATION, None)]
+
+    for store in (first, second):
+        assert store.load(USER_VERIFICATION) == {"3_300": {"status": "verified"}}
+        assert store.load_group(USER_VERIFICATION, 100) == {}
+        assert store.user_records(USER_VERIFICATION, 3) == {
+            "3_300": {"status": "verified"}
+        }
+    conn = server.connect()
+    assert conn.execute("SMEMBERS", f"{KEY_PREFIX}:{USER_VERIFICATION}:g:100") == []
+    # 其他表不受影响
+    assert first.get(REACHED_LIMIT, "100") == ["1"]
+
+
+def test_recovers_after_disconnect(server):
+    first, second = _store(server), _store(server)
+    first.set(USER_VERIFICATION, "1_100", {"status": "pending"})
+    assert second.get(USER_VERIFICATION, "1_100") == {"status": "pending"}
+
+    server.disconnect_all()
+    # 断开期间的修改收不到失效通知
+    server.connect().execute(
+        "SET", f"{KEY_PREFIX}:{USER_VERIFICATION}:1_100", '{"status": "verified"}'
+    )
+    assert second.get(USER_VERIFICATION, "1_100") == {"status": "verified"}
+    first.set(USER_VERIFICATION, "2_100", {"status": "pending"})
+
+    # 重新订阅后缓存和失效通知照常工作
+    _wait_for(lambda: second._listening and first._listening)
+    assert second.get(USER_VERIFICATION, "2_100") == {"status": "pending"}
+    first.set(USER_VERIFICATION, "2_100", {"status": "kicked"})
+    assert second.get(USER_VERIFICATION, "2_100") == {"status": "kicked"}
+
+
+def _scripted_server(replies):
+    """每收到一次请求按顺序回复一段数据的 TCP 服务，回复用完后保持连接不再回复"""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+
+    def serve():
+        conn, _ = listener.accept()
+        for reply in replies:
+            conn.recv(65536)
+            conn.sendall(reply)
+        while conn.recv(65536):
+            pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def test_transaction_reads_every_reply_after_queue_error():
+    port = _scripted_server(
+        [
+            b"+OK\r\n-ERR unknown command\r\n+QUEUED\r\n"
+            b"-EXECABORT Transaction discarded\r\n",
+            b"+PONG\r\n",
+        ]
+    )
+    conn = RedisConnection(port=port)
+    with pytest.raises(RedisError):
+        conn.transaction([("BAD",), ("SET", "a", "1")])
+    # 下一条命令读到的是自己的回复
+    assert conn.execute("PING") == "PONG"
+    conn.close()
+
+
+def test_connection_is_reset_after_timeout():
+    # 回复只写了一半
+    port = _scripted_server([b"$5\r\nab"])
+    conn = RedisConnection(port=port, timeout=0.2)
+    with pytest.raises(ConnectionError):
+        conn.execute("GET", "a")
+    with pytest.raises(ConnectionError):
+        conn.execute("PING")
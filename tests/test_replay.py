@@ -0,0 +1,63 @@
+"""
+replay.py 的冒烟测试：在单独检出的插件目录中（上层没有机器人的 app 包，也不设置 PYTHONPATH）
+按 README 中的用法运行命令行，同一个版本和自己比较时没有差异
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(command, cwd, **kwargs):
+    env = {name: value for name, value in os.environ.items() if name != "PYTHONPATH"}
+    return subprocess.run(
+        command, cwd=cwd, env=env, capture_output=True, text=True, **kwargs
+    )
+
+
+@pytest.fixture
+def checkout(tmp_path):
+    """当前工作区的一份干净检出，包含一个 git 提交作为基线"""
+    if shutil.which("git") is None:
+        pytest.skip("没有 git")
+    target = tmp_path / "GroupEntryVerification"
+    shutil.copytree(
+        PLUGIN_DIR,
+        target,
+        ignore=shutil.ignore_patterns(".git", "__pycache__", ".pytest_cache", "data"),
+    )
+    git = ["git", "-c", "user.name=test", "-c", "user.email=test@localhost"]
+    _run(["git", "init", "-q"], target, check=True)
+    _run(git + ["add", "-A"], target, check=True)
+    _run(git + ["commit", "-q", "-m", "checkout"], target, check=True)
+    return target
+
+
+def test_replay_cli_from_clean_checkout(checkout, tmp_path):
+    events = tmp_path / "events.jsonl"
+    generated = _run(
+        [sys.executable, "replay.py", "--generate", "10"], checkout, check=True
+    )
+    events.write_text(generated.stdout, encoding="utf-8")
+    assert generated.stdout.strip()
+
+    result = _run(
+        [
+            sys.executable,
+            "replay.py",
+            str(events),
+            "--baseline",
+            "HEAD",
+            "--candidate",
+            ".",
+        ],
+        checkout,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "API 调用序列相同" in result.stdout
+    assert "最终数据相同" in result.stdout
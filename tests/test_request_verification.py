@@ -0,0 +1,135 @@
+"""main.py 的申请阶段验证：出题、答错扣次数、次数用完、答对同意申请和入群后免验证"""
+
+import json
+import time
+import asyncio
+
+import pytest
+
+from app.scripts.GroupEntryVerification import main
+from app.scripts.GroupEntryVerification.stats import JOIN, load_stats
+from app.scripts.GroupEntryVerification.store import (
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+)
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, data):
+        request = json.loads(data)
+        self.sent.append((request["action"], request["params"]))
+
+
+@pytest.fixture
+def request_groups(monkeypatch):
+    monkeypatch.setattr(main, "REQUEST_VERIFICATION_GROUPS", {"100"})
+    monkeypatch.setattr(main, "generate_math_expression", lambda: ("3 + 4", 7))
+
+
+def _apply(comment, user_id="1", flag="f"):
+    """发出一次加群申请，返回 set_group_add_request 的参数"""
+    websocket = RecordingWebSocket()
+    msg = {
+        "post_type": "request",
+        "request_type": "group",
+        "sub_type": "add",
+        "group_id": 100,
+        "user_id": int(user_id),
+        "flag": flag,
+        "comment": comment,
+    }
+    asyncio.run(main.handle_request_event(websocket, msg))
+    if not websocket.sent:
+        return None
+    [(action, params)] = websocket.sent
+    assert action == "set_group_add_request"
+    return params
+
+
+def _remaining(store, user_id="1"):
+    return store.get(VERIFICATION_QUESTIONS, f"{user_id}_100")["remaining_attempts"]
+
+
+def test_parse_request_answer():
+    parse = main.parse_request_answer
+    assert parse("问题：1 + 2 = ?\n答案：3") == 3
+    assert parse("答案：大概是 -1.5 吧") == -1.5
+    # 问题中的数字不作为答案
+    assert parse("问题：1 + 2 = ?\n答案：不知道") is None
+    assert parse("7") == 7
+    assert parse("") is None
+
+
+def test_challenge_then_pass(store, request_groups):
+    params = _apply("")
+    assert params["approve"] is False
+    assert "3 + 4" in params["reason"]
+    assert _remaining(store) == main.MAX_ATTEMPTS
+    assert store.get(USER_VERIFICATION, "1_100") is None
+
+    params = _apply("问题：验证\n答案：5")
+    assert params["approve"] is False
+    assert f"还有{main.MAX_ATTEMPTS - 1}次机会" in params["reason"]
+    assert _remaining(store) == main.MAX_ATTEMPTS - 1
+
+    params = _apply("问题：验证\n答案：7", flag="g")
+    assert params["flag"] == "g"
+    assert params["approve"] is True
+    assert store.get(VERIFICATION_QUESTIONS, "1_100") is None
+    assert store.get(USER_VERIFICATION, "1_100")["status"] == "verified"
+    stats = load_stats(100)["total"]
+    assert stats[JOIN] == 1
+    assert stats["pass"] == 1
+
+    # 申请通过后入群不再禁言和出题
+    websocket = RecordingWebSocket()
+    asyncio.run(main.process_new_member(websocket, "1", "100"))
+    assert websocket.sent == []
+
+
+def test_attempts_run_out(store, request_groups):
+    _apply("")
+    for remaining in range(main.MAX_ATTEMPTS - 1, -1, -1):
+        params = _apply("答案：0")
+        assert _remaining(store) == remaining
+    assert params["reason"].startswith("验证次数已用完")
+    # 次数用完之后的申请直接拒绝，答对也不同意，失败只计一次
+    for comment in ("答案：0", "答案：7"):
+        params = _apply(comment)
+        assert params["approve"] is False
+        assert params["reason"].startswith("验证次数已用完")
+    assert _remaining(store) == 0
+    assert load_stats(100)["total"]["fail"] == 1
+    assert store.get(USER_VERIFICATION, "1_100") is None
+
+
+def test_expired_challenge_is_reissued(store, request_groups):
+    _apply("")
+    for _ in range(main.MAX_ATTEMPTS):
+        _apply("答案：0")
+    question = store.get(VERIFICATION_QUESTIONS, "1_100")
+    question["timestamp"] = time.time() - main.REQUEST_CHALLENGE_TTL - 1
+    store.set(VERIFICATION_QUESTIONS, "1_100", question)
+
+    params = _apply("答案：7")
+    assert params["approve"] is False
+    assert "3 + 4" in params["reason"]
+    assert _remaining(store) == main.MAX_ATTEMPTS
+    assert _apply("答案：7")["approve"] is True
+
+
+def test_rejected_user_is_left_to_admins(store, request_groups):
+    store.set(
+        USER_VERIFICATION, "1_100", {"status": "rejected", "remaining_attempts": 0}
+    )
+    assert _apply("答案：7") is None
+    assert store.get(VERIFICATION_QUESTIONS, "1_100") is None
+
+
+def test_other_groups_verify_after_joining(store, request_groups, monkeypatch):
+    monkeypatch.setattr(main, "REQUEST_VERIFICATION_GROUPS", set())
+    assert _apply("答案：7") is None
+    assert store.get(VERIFICATION_QUESTIONS, "1_100") is None
@@ -0,0 +1,133 @@
+"""state_machine.py：转换的起始状态限制、一次提交中的清理和提交后的API调用"""
+
+import json
+import time
+import asyncio
+
+from app.scripts.GroupEntryVerification.state_machine import (
+    PASS,
+    FAIL,
+    REJECT,
+    KICK,
+    LEAVE,
+    VerificationStateMachine,
+)
+from app.scripts.GroupEntryVerification.stats import load_stats
+from app.scripts.GroupEntryVerification.store import (
+    USER_VERIFICATION,
+    VERIFICATION_QUESTIONS,
+    WARNING_RECORD,
+    REACHED_LIMIT,
+    MESSAGE_ID_LIST,
+)
+
+
+class RecordingWebSocket:
+    """记录发出的API调用，fail_actions 中的接口调用抛出异常"""
+
+    def __init__(self, fail_actions=()):
+        self.sent = []
+        self.fail_actions = fail_actions
+
+    async def send(self, data):
+        request = json.loads(data)
+        if request["action"] in self.fail_actions:
+            raise ConnectionError(request["action"])
+        self.sent.append((request["action"], request["params"]))
+
+
+def _seed(store, user_id, status, group_id="100", attempts=2):
+    key = f"{user_id}_{group_id}"
+    store.set(
+        USER_VERIFICATION, key, {"status": status, "remaining_attempts": attempts}
+    )
+    store.set(VERIFICATION_QUESTIONS, key, ["1 + 1 = ?", 2])
+    store.set(WARNING_RECORD, key, 1)
+
+
+def test_pass_only_applies_to_pending(store):
+    _seed(store, "1", "pending")
+    _seed(store, "2", "verified")
+    _seed(store, "3", "failed")
+    result = VerificationStateMachine().commit(
+        PASS, [(100, 1), (100, 2), (100, 3), (100, 4)]
+    )
+    assert result.applied == [("100", "1")]
+    assert result.skipped == [("100", "2"), ("100", "3"), ("100", "4")]
+
+    assert store.get(USER_VERIFICATION, "1_100")["status"] == "verified"
+    assert store.get(VERIFICATION_QUESTIONS, "1_100") is None
+    assert store.get(WARNING_RECORD, "1_100") is None
+    # 跳过的用户不做任何修改
+    assert store.get(USER_VERIFICATION, "3_100")["status"] == "failed"
+    assert store.get(VERIFICATION_QUESTIONS, "2_100") is not None
+    assert store.get(WARNING_RECORD, "3_100") == 1
+    assert store.get(USER_VERIFICATION, "4_100") is None
+
+
+def test_reject_accepts_any_state_and_missing_records(store):
+    _seed(store, "1", "verified")
+    result = VerificationStateMachine().commit(REJECT, [(100, 1), (100, 2)])
+    assert result.applied == [("100", "1"), ("100", "2")]
+    assert store.get(USER_VERIFICATION, "1_100")["status"] == "rejected"
+    # 没有验证记录的用户不会凭空创建记录
+    assert store.get(USER_VERIFICATION, "2_100") is None
+
+
+def test_kick_skips_finished_users(store):
+    _seed(store, "1", "pending")
+    _seed(store, "2", "rejected")
+    result = VerificationStateMachine().commit(KICK, [(100, 1), (100, 2)])
+    assert result.applied == [("100", "1")]
+    assert store.get(USER_VERIFICATION, "1_100")["status"] == "kicked"
+    assert store.get(USER_VERIFICATION, "2_100")["status"] == "rejected"
+
+
+def test_leave_deletes_record_and_pops_messages(store):
+    _seed(store, "1", "verified")
+    now = time.time()
+    store.set(MESSAGE_ID_LIST, "100", {"1": [[11, now], [12, now]], "2": [[13, now]]})
+    store.set(REACHED_LIMIT, "100", ["1", "2"])
+    result = VerificationStateMachine().commit(LEAVE, [(100, 1), (100, 5)])
+    # 没有记录的用户不是退群转换的对象
+    assert result.applied == [("100", "1")]
+    assert store.get(USER_VERIFICATION, "1_100") is None
+    assert result.messages == {"100": {"1": [11, 12]}}
+    assert store.get(MESSAGE_ID_LIST, "100") == {"2": [[13, now]]}
+    assert store.get(REACHED_LIMIT, "100") == ["2"]
+
+
+def test_stats_count_only_pending_users(store):
+    _seed(store, "1", "pending", attempts=3)
+    _seed(store, "2", "pending", attempts=1)
+    _seed(store, "3", "verified")
+    machine = VerificationStateMachine()
+    machine.commit(PASS, [(100, 1), (100, 3)])
+    machine.commit(FAIL, [(100, 2)])
+    stats = load_stats(100)
+    assert stats["total"]["pass"] == 1
+    assert stats["total"]["fail"] == 1
+    assert stats["pass_rate"] == 0.5
+
+
+def test_dispatch_sends_actions_and_records_failures(store):
+    _seed(store, "1", "pending")
+    _seed(store, "2", "pending")
+    store.set(MESSAGE_ID_LIST, "100", {"1": [[21, time.time()]]})
+    machine = VerificationStateMachine()
+
+    websocket = RecordingWebSocket()
+    result = asyncio.run(machine.apply(websocket, PASS, [(100, 1)]))
+    assert result.done == [("100", "1")]
+    actions = sorted(action for action, _ in websocket.sent)
+    assert actions == ["delete_msg", "set_group_ban"]
+    ban = next(params for action, params in websocket.sent if action == "set_group_ban")
+    assert ban["duration"] == 0
+
+    failing = RecordingWebSocket(fail_actions=("set_group_kick",))
+    result = asyncio.run(machine.apply(failing, FAIL, [(100, 2)]))
+    # 存储已经提交，踢人失败的用户记录在 failed 中
+    assert result.applied == [("100", "2")]
+    assert result.done == []
+    assert isinstance(result.failed[("100", "2")], ConnectionError)
+    assert store.get(USER_VERIFICATION, "2_100")["status"] == "failed"
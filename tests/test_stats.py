@@ -0,0 +1,183 @@
+"""stats.py：按群计数、固定数量的合计记录和汇总，以及验证统计命令的回复"""
+
+import json
+import asyncio
+
+import pytest
+
+from app.scripts.GroupEntryVerification import main
+from app.scripts.GroupEntryVerification.dedup import EventDeduplicator
+from app.scripts.GroupEntryVerification.inbound import (
+    InboundQueue,
+    PRIORITY_NOTICE,
+    PRIORITY_ENFORCEMENT,
+)
+from app.scripts.GroupEntryVerification.loop_monitor import LoopLagMonitor
+from app.scripts.GroupEntryVerification.message_sweep import MessageSweeper
+from app.scripts.GroupEntryVerification.rate_limit import PrivateMessageGate
+from app.scripts.GroupEntryVerification.trust import TrustCache
+from app.scripts.GroupEntryVerification.stats import (
+    JOIN,
+    STATS_TOTAL_SLOTS,
+    count_events,
+    count_join,
+    load_stats,
+    total_key_of,
+)
+from app.scripts.GroupEntryVerification import store as store_module
+from app.scripts.GroupEntryVerification.store import GroupShardStore, VERIFICATION_STATS
+
+
+def _finish(store, events_by_group):
+    store.update_tables(
+        {
+            VERIFICATION_STATS: count_events(
+                lambda group_id: events_by_group[group_id], events_by_group
+            )
+        }
+    )
+
+
+def test_counts_group_and_its_total_record(store):
+    store.update_tables({VERIFICATION_STATS: count_join(100)})
+    _finish(store, {"100": [("pass", 1)]})
+    keys = {key for key, _ in store.iter_records(VERIFICATION_STATS)}
+    assert keys == {"100", total_key_of(100)}
+
+    summary = load_stats(100)
+    assert summary["total"][JOIN] == 1
+    assert summary["recent"]["pass"] == 1
+    assert summary["pass_rate"] == 1
+    assert summary["median_attempts"] == 1
+
+
+def test_total_sums_all_groups(store):
+    groups = [str(group_id) for group_id in range(100, 140)]
+    for group_id in groups:
+        store.update_tables({VERIFICATION_STATS: count_join(group_id)})
+    # 同一次提交结束多个群的验证，同一条合计记录中的群一起计入
+    _finish(
+        store,
+        {
+            group_id: [("pass", 1)] if int(group_id) % 2 else [("fail", 3), ("kick", 3)]
+            for group_id in groups
+        },
+    )
+
+    summary = load_stats()
+    assert summary["total"][JOIN] == 40
+    assert summary["total"]["pass"] == 20
+    assert summary["total"]["fail"] == summary["total"]["kick"] == 20
+    assert summary["recent"][JOIN] == 40
+    assert summary["median_attempts"] == 3
+
+
+def test_total_reads_fixed_records(store):
+    totals = {total_key_of(group_id) for group_id in range(1000)}
+    assert totals == {f"total-{slot}" for slot in range(STATS_TOTAL_SLOTS)}
+
+    read = []
+    get = store.get
+    store.get = lambda table, key: read.append(key) or get(table, key)
+    for group_id in range(50):
+        store.update_tables({VERIFICATION_STATS: count_join(group_id)})
+    read.clear()
+    assert load_stats()["total"][JOIN] == 50
+    assert sorted(read) == sorted(totals)
+
+
+def test_groups_without_events_are_unchanged(store):
+    _finish(store, {"100": [], "200": [("leave", None)]})
+    assert store.get(VERIFICATION_STATS, "100") is None
+    assert load_stats(200)["total"]["leave"] == 1
+    assert load_stats()["total"]["leave"] == 1
+    assert load_stats()["median_attempts"] is None
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, data):
+        message = json.loads(data)
+        self.sent.append((message["action"], message["params"]))
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    """替换 main 中各组件为新实例，运行状态从零开始"""
+    monkeypatch.setattr(main, "event_deduplicator", EventDeduplicator())
+    monkeypatch.setattr(main, "private_message_gate", PrivateMessageGate(1, 0))
+    monkeypatch.setattr(main, "loop_lag_monitor", LoopLagMonitor())
+    monkeypatch.setattr(main, "trust_cache", TrustCache())
+    monkeypatch.setattr(main, "inbound_queue", InboundQueue(1, degrade_depth=0))
+    monkeypatch.setattr(main, "message_sweeper", MessageSweeper())
+    return main
+
+
+def _reply(command):
+    websocket = RecordingWebSocket()
+    asyncio.run(main.handle_stats_query(websocket, "10000", command))
+    [(action, params)] = websocket.sent
+    assert action == "send_private_msg"
+    return params["message"].splitlines()
+
+
+def test_reply_for_all_groups_includes_runtime_stats(store, runtime):
+    message = {"post_type": "message", "message_type": "group", "message_id": 1}
+    for _ in range(3):
+        runtime.event_deduplicator.is_duplicate(message)
+        runtime.private_message_gate.allow(1)
+    runtime.private_message_gate.note_not_pending(2)
+    runtime.private_message_gate.allow(2)
+    runtime.loop_lag_monitor._samples.extend([0.001] * 99 + [0.25])
+    runtime.loop_lag_monitor.max_lag = 0.25
+    runtime.trust_cache.note_verified(1)
+    runtime.trust_cache.is_trusted(1)
+    runtime.trust_cache.is_trusted(2)
+
+    async def handled():
+        pass
+
+    async def submit():
+        # 积压阈值为 0，最低优先级的提醒直接丢弃
+        await runtime.inbound_queue.submit(PRIORITY_ENFORCEMENT, handled)
+        await runtime.inbound_queue.submit(PRIORITY_NOTICE, handled)
+
+    asyncio.run(submit())
+    runtime.message_sweeper.recalled = 3
+    runtime.message_sweeper.expired = 4
+    store.update_tables({VERIFICATION_STATS: count_join(100)})
+
+    lines = _reply("验证统计")
+    assert lines[0] == "所有群验证统计"
+    assert lines[1].startswith("累计：入群 1｜")
+    assert "本进程运行状态" in lines
+    assert "重复事件：丢弃 2｜新事件 1｜淘汰 0｜缓存 1 条" in lines
+    assert "私聊过滤：限速丢弃 2｜非待验证丢弃 1｜跟踪 1 人" in lines
+    assert "事件循环延迟：中位数 1 ms，P99 250 ms，最大 250 ms" in lines
+    assert "信任放行：命中 1｜未命中 1｜信任 1 人" in lines
+    assert "入站队列：当前 0｜最深 1｜处理 1｜丢弃 1" in lines
+    assert "排队等待 P99：通知 0 ms" in lines
+    assert "验证消息清理：撤回 3｜删除过期记录 4" in lines
+    # 同步写入的存储没有写盘统计
+    assert not any(line.startswith("后台写盘") for line in lines)
+
+    # 查询一个群时只有该群的统计
+    lines = _reply("验证统计 100")
+    assert lines[0] == "群 100 验证统计"
+    assert "本进程运行状态" not in lines
+
+
+def test_reply_includes_background_writes(tmp_path, monkeypatch, runtime):
+    store = GroupShardStore(str(tmp_path), import_legacy=False, async_writes=True)
+    monkeypatch.setattr(store_module, "_store", store)
+    store.update_tables({VERIFICATION_STATS: count_join(100)})
+    assert store.flush()
+    try:
+        writes = [line for line in _reply("验证统计") if line.startswith("后台写盘")]
+    finally:
+        store.close()
+    assert len(writes) == 1
+    assert writes[0].startswith("后台写盘：写入 ")
+    assert "｜失败 0｜排队 0｜" in writes[0]
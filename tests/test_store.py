@@ -0,0 +1,123 @@
+"""store.py：按群分片的文件布局、用户索引、分片缓存的淘汰和多进程共享数据目录"""
+
+import os
+import json
+
+from app.scripts.GroupEntryVerification.store import (
+    GroupShardStore,
+    USER_VERIFICATION,
+    WARNING_RECORD,
+    REACHED_LIMIT,
+)
+
+
+def _open(tmp_path, **kwargs):
+    return GroupShardStore(str(tmp_path), import_legacy=False, **kwargs)
+
+
+def _read(tmp_path, *parts):
+    with open(os.path.join(str(tmp_path), *parts), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _pending(attempts=3):
+    return {"status": "pending", "remaining_attempts": attempts}
+
+
+def test_each_group_is_one_file(tmp_path):
+    store = _open(tmp_path)
+    store.update_tables(
+        {
+            USER_VERIFICATION: {
+                "1_100": lambda _: _pending(),
+                "1_200": lambda _: _pending(),
+            },
+            WARNING_RECORD: {"1_100": lambda _: 1},
+            REACHED_LIMIT: {"100": lambda _: ["2"]},
+        }
+    )
+    assert sorted(os.listdir(tmp_path / "groups")) == ["100.json", "200.json"]
+    assert _read(tmp_path, "groups", "100.json") == {
+        USER_VERIFICATION: {"1_100": _pending()},
+        WARNING_RECORD: {"1_100": 1},
+        REACHED_LIMIT: {"100": ["2"]},
+    }
+    assert _read(tmp_path, "groups", "200.json") == {
+        USER_VERIFICATION: {"1_200": _pending()}
+    }
+    assert store.load(USER_VERIFICATION) == {"1_100": _pending(), "1_200": _pending()}
+    assert store.load_group(WARNING_RECORD, 200) == {}
+    assert sorted(store.iter_records(USER_VERIFICATION, 100)) == [("1_100", _pending())]
+
+    # 群里最后一条记录删除后分片文件也删除
+    store.delete(USER_VERIFICATION, "1_200")
+    assert os.listdir(tmp_path / "groups") == ["100.json"]
+
+
+def test_user_index_follows_verification_records(tmp_path):
+    store = _open(tmp_path)
+    store.set(USER_VERIFICATION, "1_100", _pending())
+    store.set(USER_VERIFICATION, "1_200", _pending(2))
+    store.set(USER_VERIFICATION, "2_100", _pending())
+    # 其他表的记录不进入用户索引
+    store.set(WARNING_RECORD, "1_300", 1)
+    assert store.user_records(USER_VERIFICATION, 1) == {
+        "1_100": _pending(),
+        "1_200": _pending(2),
+    }
+    assert store.user_records(WARNING_RECORD, 1) == {}
+
+    store.delete(USER_VERIFICATION, "1_100")
+    assert store.user_records(USER_VERIFICATION, "1") == {"1_200": _pending(2)}
+    store.delete(USER_VERIFICATION, "1_200")
+    assert store.user_records(USER_VERIFICATION, "1") == {}
+    index = {}
+    for name in os.listdir(tmp_path / "users"):
+        index.update(_read(tmp_path, "users", name))
+    assert index == {"2": ["100"]}
+
+
+def test_evicted_shards_are_read_again(tmp_path):
+    store = _open(tmp_path, max_cached_shards=2)
+    for group_id in range(100, 110):
+        store.set(USER_VERIFICATION, f"1_{group_id}", _pending(group_id % 3))
+    assert len(store._groups._entries) == 2
+    for group_id in range(100, 110):
+        assert store.get(USER_VERIFICATION, f"1_{group_id}") == _pending(group_id % 3)
+    assert len(store.load(USER_VERIFICATION)) == 10
+
+
+def test_returned_records_are_copies(tmp_path):
+    store = _open(tmp_path)
+    store.set(REACHED_LIMIT, "100", ["1"])
+    store.get(REACHED_LIMIT, "100").append("2")
+    store.load_group(REACHED_LIMIT, 100)["100"].append("3")
+    assert store.get(REACHED_LIMIT, "100") == ["1"]
+
+
+def test_changes_from_another_process_are_seen(tmp_path):
+    first = _open(tmp_path)
+    second = _open(tmp_path)
+    first.set(USER_VERIFICATION, "1_100", _pending())
+    assert second.get(USER_VERIFICATION, "1_100") == _pending()
+    # 另一个进程在缓存之后修改了分片，读取时按文件状态重新加载
+    second.update(
+        USER_VERIFICATION, "1_100", lambda value: {**value, "status": "verified"}
+    )
+    # 修改时间的精度可能不足以区分两次写入，这里显式改掉
+    os.utime(tmp_path / "groups" / "100.json", ns=(1, 1))
+    assert first.get(USER_VERIFICATION, "1_100")["status"] == "verified"
+    assert first.user_records(USER_VERIFICATION, 1) == {
+        "1_100": {"status": "verified", "remaining_attempts": 3}
+    }
+
+
+def test_save_replaces_the_whole_table(tmp_path):
+    store = _open(tmp_path)
+    store.set(WARNING_RECORD, "1_100", 1)
+    store.set(WARNING_RECORD, "2_200", 2)
+    store.set(USER_VERIFICATION, "2_200", _pending())
+    store.save(WARNING_RECORD, {"3_100": 3})
+    assert store.load(WARNING_RECORD) == {"3_100": 3}
+    # 同一分片中的其他表不受影响
+    assert store.get(USER_VERIFICATION, "2_200") == _pending()
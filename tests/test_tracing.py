@@ -0,0 +1,140 @@
+"""tracing.py：验证追踪的步骤时间、追踪日志、耗时分位数和统计回复中的耗时"""
+
+import json
+import asyncio
+
+import pytest
+
+from app.scripts.GroupEntryVerification import main, tracing
+from app.scripts.GroupEntryVerification.tracing import VerificationTracer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tracing.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def traced(tmp_path):
+    """写入临时目录的追踪，测试结束后关闭日志文件"""
+    tracer = VerificationTracer(str(tmp_path))
+    yield tracer
+    if tracer._logger is not None:
+        for handler in list(tracer._logger.handlers):
+            tracer._logger.removeHandler(handler)
+            handler.close()
+
+
+def _read_traces(tmp_path):
+    with open(tmp_path / "traces.jsonl", "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _verify(tracer, clock, group_id, user_id, prompt_ms, answer_ms):
+    tracer.start(group_id, user_id)
+    clock.now += 0.01
+    tracer.step(group_id, user_id, "prompt_sent")
+    clock.now += prompt_ms / 1000
+    tracer.step(group_id, user_id, "prompt_echo")
+    clock.now += answer_ms / 1000
+    tracer.step(group_id, user_id, "answer", correct=True)
+    tracer.step(group_id, user_id, "pass")
+    tracer.step(group_id, user_id, "unban_done", ok=True)
+    tracer.finish(group_id, user_id, "pass", verified=True)
+
+
+def test_finished_trace_is_written(traced, clock, tmp_path):
+    _verify(traced, clock, 100, 1, prompt_ms=40, answer_ms=5000)
+    [trace] = _read_traces(tmp_path)
+    assert trace["group_id"] == "100"
+    assert trace["user_id"] == "1"
+    assert trace["outcome"] == "pass"
+    assert trace["duration_ms"] == 5050
+    assert [step["step"] for step in trace["steps"]] == [
+        "join",
+        "prompt_sent",
+        "prompt_echo",
+        "answer",
+        "pass",
+        "unban_done",
+    ]
+    assert trace["steps"][2]["ms"] == 50
+    assert trace["steps"][3]["correct"] is True
+    assert traced.stats()["open"] == 0
+    assert traced.stats()["finished"] == 1
+
+
+def test_rejoined_and_evicted_traces(traced, clock, tmp_path):
+    traced.max_open = 2
+    traced.start(100, 1)
+    traced.start(100, 1)
+    traced.start(100, 2)
+    traced.start(100, 3)
+    # 没有对应追踪的步骤和结束不做处理
+    traced.step(200, 1, "ban")
+    traced.finish(200, 1, "leave")
+    outcomes = [
+        (trace["user_id"], trace["outcome"]) for trace in _read_traces(tmp_path)
+    ]
+    assert outcomes == [("1", "rejoined"), ("1", "evicted")]
+    assert traced.stats()["open"] == 2
+
+
+def test_percentiles_per_group(clock):
+    tracer = VerificationTracer(None)
+    for user_id in range(100):
+        _verify(tracer, clock, 100, user_id, prompt_ms=user_id + 1, answer_ms=1000)
+    # 没有通过验证的用户不计入 verify
+    tracer.start(200, 1)
+    clock.now += 0.5
+    tracer.finish(200, 1, "leave")
+
+    timings = tracer.percentiles(100)
+    assert timings["api"]["count"] == 100
+    assert timings["api"]["p50_ms"] == 51
+    assert timings["api"]["p99_ms"] == 100
+    assert timings["handler"]["p99_ms"] == 10
+    assert timings["first_prompt"]["p50_ms"] == 61
+    assert timings["first_answer"]["p90_ms"] == 1000
+    assert timings["verify"]["count"] == 100
+    assert tracer.percentiles(200) == {}
+    assert set(tracer.stats()["groups"]) == {"100"}
+
+
+def test_repeated_steps_count_once(clock):
+    tracer = VerificationTracer(None)
+    tracer.start(100, 1)
+    tracer.step(100, 1, "prompt_sent")
+    clock.now += 1
+    tracer.step(100, 1, "prompt_echo")
+    clock.now += 1
+    tracer.step(100, 1, "prompt_echo")
+    assert tracer.percentiles(100)["api"]["count"] == 1
+    assert tracer.percentiles(100)["api"]["p50_ms"] == 1000
+
+
+def test_stats_reply_for_group_includes_timings(store, clock, monkeypatch):
+    tracer = VerificationTracer(None)
+    monkeypatch.setattr(main, "tracer", tracer)
+    _verify(tracer, clock, 100, 1, prompt_ms=90, answer_ms=20000)
+
+    sent = []
+
+    class RecordingWebSocket:
+        async def send(self, data):
+            sent.append(json.loads(data)["params"]["message"])
+
+    asyncio.run(main.handle_stats_query(RecordingWebSocket(), "10000", "验证统计 100"))
+    lines = sent[0].splitlines()
+    assert "入群到验证消息送达：中位数 100 ms，P99 100 ms" in lines
+    assert "入群到完成验证：中位数 20 秒，P99 20 秒" in lines
@@ -0,0 +1,132 @@
+"""trust.py：后台读取、只在真正通过验证时加入信任和撤销信任"""
+
+import time
+import asyncio
+
+import pytest
+
+from app.scripts.GroupEntryVerification import trust
+from app.scripts.GroupEntryVerification.trust import TrustCache
+from app.scripts.GroupEntryVerification.store import USER_VERIFICATION
+
+WINDOW = 3600
+
+
+def _record(status, joined_at):
+    return {"status": status, "remaining_attempts": 3, "joined_at": int(joined_at)}
+
+
+async def _started(cache):
+    cache.start()
+    await cache._task
+    return cache
+
+
+def test_background_load_replays_by_join_time(store):
+    now = time.time()
+    store.set(USER_VERIFICATION, "1_100", _record("verified", now - 60))
+    store.set(USER_VERIFICATION, "2_100", _record("verified", now - 2 * WINDOW))
+    # 先通过验证、之后在另一个群被踢出
+    store.set(USER_VERIFICATION, "3_100", _record("verified", now - 120))
+    store.set(USER_VERIFICATION, "3_200", _record("kicked", now - 60))
+    # 先被拒绝、之后在另一个群通过验证
+    store.set(USER_VERIFICATION, "4_100", _record("rejected", now - 120))
+    store.set(USER_VERIFICATION, "4_200", _record("verified", now - 60))
+    store.set(USER_VERIFICATION, "5_100", _record("pending", now - 60))
+    # 格式错误的旧记录键被跳过
+    store.set(USER_VERIFICATION, "6_100_x", _record("verified", now - 60))
+    cache = asyncio.run(_started(TrustCache(window=WINDOW)))
+    trusted = [user_id for user_id in "12345" if cache.is_trusted(user_id)]
+    assert trusted == ["1", "4"]
+
+
+def test_join_path_does_not_wait_for_load(store, monkeypatch):
+    monkeypatch.setattr(trust, "TRUST_LOAD_YIELD_EVERY", 1)
+    now = time.time()
+    for user_id in range(5):
+        store.set(USER_VERIFICATION, f"{user_id}_100", _record("verified", now))
+
+    async def scenario():
+        cache = TrustCache(window=WINDOW)
+        cache.start()
+        # 读取完成前只知道启动后通过验证的用户
+        before = cache.is_trusted(0)
+        cache.note_verified(9)
+        await cache._task
+        return before, cache
+
+    before, cache = asyncio.run(scenario())
+    assert not before
+    assert all(cache.is_trusted(user_id) for user_id in (0, 4, 9))
+
+
+def test_revoked_while_loading_is_not_trusted(store, monkeypatch):
+    monkeypatch.setattr(trust, "TRUST_LOAD_YIELD_EVERY", 1)
+    now = time.time()
+    for user_id in range(5):
+        store.set(USER_VERIFICATION, f"{user_id}_100", _record("verified", now))
+
+    async def scenario():
+        cache = TrustCache(window=WINDOW)
+        cache.start()
+        await asyncio.sleep(0)
+        cache.revoke(2)
+        await cache._task
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert not cache.is_trusted(2)
+    assert cache.is_trusted(3)
+
+
+def test_only_real_transitions_grant_trust(store):
+    old = time.time() - 2 * WINDOW
+    store.set(USER_VERIFICATION, "1_100", _record("verified", old))
+    store.set(USER_VERIFICATION, "2_100", _record("pending", old))
+    cache = asyncio.run(_started(TrustCache(window=WINDOW)))
+    assert not cache.is_trusted(1)
+
+    # 已经是 verified 的记录再次写入（例如状态机跳过的用户）不会延长信任
+    store.set(USER_VERIFICATION, "1_100", _record("verified", old))
+    store.update(
+        USER_VERIFICATION, "1_100", lambda value: {**value, "remaining_attempts": 1}
+    )
+    assert not cache.is_trusted(1)
+
+    store.set(USER_VERIFICATION, "2_100", _record("verified", old))
+    assert cache.is_trusted(2)
+
+
+@pytest.mark.parametrize("status", ["failed", "rejected", "kicked"])
+def test_revoking_statuses(store, status):
+    cache = asyncio.run(_started(TrustCache(window=WINDOW)))
+    store.set(USER_VERIFICATION, "1_100", _record("pending", time.time()))
+    store.set(USER_VERIFICATION, "1_100", _record("verified", time.time()))
+    assert cache.is_trusted(1)
+    store.set(USER_VERIFICATION, "1_200", _record(status, time.time()))
+    assert not cache.is_trusted(1)
+
+
+def test_leaving_keeps_trust(store):
+    cache = asyncio.run(_started(TrustCache(window=WINDOW)))
+    store.set(USER_VERIFICATION, "1_100", _record("verified", time.time()))
+    store.delete(USER_VERIFICATION, "1_100")
+    assert cache.is_trusted(1)
+
+
+def test_changes_ignored_until_started(store):
+    cache = TrustCache(window=WINDOW)
+    store.set(USER_VERIFICATION, "1_100", _record("verified", time.time()))
+    assert not cache.is_trusted(1)
+    assert cache.stats()["trusted_users"] == 0
+
+
+def test_eviction_keeps_most_recent(store):
+    cache = TrustCache(window=WINDOW, max_users=2)
+    now = time.time()
+    for user_id in range(3):
+        cache.note_verified(user_id, now + user_id)
+    assert [cache.is_trusted(user_id) for user_id in range(3)] == [False, True, True]
+    # 超过有效期的用户不再信任
+    cache.note_verified(5, now - WINDOW - 1)
+    assert not cache.is_trusted(5)
@@ -0,0 +1,221 @@
+"""
+验证过程的追踪
+
+每个入群验证从 group_increase 开始记录一条追踪，之后的每一步都带一个单调时钟的时间点
+（相对入群通知到达时的毫秒数）：
+    join          收到入群通知
+    ban           禁言调用已发出
+    prompt_sent   验证消息已发出
+    prompt_echo   验证消息的回调到达（记录了 message_id）
+    prompt_failed 验证消息的回调为失败
+    answer        用户私聊回答，附带是否正确和剩余次数
+    pass / fail / approve / reject / kick / leave   状态转换已提交
+    unban_done / kick_done  解禁或踢人的调用完成，附带是否成功
+验证结束（状态转换的API调用完成）时，整条追踪作为一行 JSON 写入按大小轮转的追踪日志
+（TRACE_DIR 下的 traces.jsonl，分片模式下每个工作进程一个文件）。
+
+同时按群汇总最近 TRACE_ROLLUP_SAMPLES 个样本的耗时分位数：
+    first_prompt  入群 -> 验证消息回调到达
+    handler       入群 -> 验证消息发出（本插件的处理耗时）
+    api           验证消息发出 -> 回调到达（OneBot 接口的耗时）
+    first_answer  验证消息回调到达 -> 用户第一次回答（用户的耗时）
+    verify        入群 -> 解禁完成（只统计通过验证的用户）
+重启之前开始的验证没有追踪，不计入统计。
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import logging.handlers
+from collections import OrderedDict, deque
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.store import DATA_DIR
+from app.scripts.GroupEntryVerification.shard import is_shard_worker, worker_index
+
+# 追踪日志目录
+TRACE_DIR = os.path.join(DATA_DIR, "traces")
+# 单个追踪日志文件的大小上限（字节）和保留的历史文件数
+TRACE_LOG_MAX_BYTES = 10 * 1024 * 1024
+TRACE_LOG_BACKUPS = 5
+# 同时保留的未结束追踪数，超过时最早的追踪以 evicted 结束
+MAX_OPEN_TRACES = 10000
+# 每个群每项耗时保留的样本数
+TRACE_ROLLUP_SAMPLES = 500
+
+# 汇总的耗时：名称 -> (起点步骤, 终点步骤)
+ROLLUP_METRICS = {
+    "first_prompt": ("join", "prompt_echo"),
+    "handler": ("join", "prompt_sent"),
+    "api": ("prompt_sent", "prompt_echo"),
+    "first_answer": ("prompt_echo", "answer"),
+}
+
+
+class _Trace:
+    __slots__ = ("group_id", "user_id", "started_at", "start", "steps", "first")
+
+    def __init__(self, group_id, user_id):
+        self.group_id = group_id
+        self.user_id = user_id
+        self.started_at = time.time()
+        self.start = time.monotonic()
+        self.steps = []
+        # 步骤名 -> 第一次出现的相对时间（秒）
+        self.first = {}
+
+    def to_dict(self, outcome):
+        return {
+            "group_id": self.group_id,
+            "user_id": self.user_id,
+            "started_at": round(self.started_at, 3),
+            "outcome": outcome,
+            "duration_ms": round((time.monotonic() - self.start) * 1000, 1),
+            "steps": self.steps,
+        }
+
+
+def _percentile(samples, p):
+    return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
+
+
+class VerificationTracer:
+    """记录每个验证的步骤时间，结束时写入追踪日志并汇总分位数"""
+
+    def __init__(self, trace_dir=TRACE_DIR, max_open=MAX_OPEN_TRACES):
+        """
+        参数:
+            trace_dir (str): 追踪日志目录，为 None 时不写文件，只汇总分位数
+            max_open (int): 同时保留的未结束追踪数
+        """
+        self.trace_dir = trace_dir
+        self.max_open = max_open
+        # (群号, QQ号) -> _Trace，按开始顺序排列
+        self._open = OrderedDict()
+        # 群号 -> {耗时名称: deque[秒]}
+        self._rollups = {}
+        self._logger = None
+        self.finished = 0
+
+    def start(self, group_id, user_id):
+        """收到入群通知时开始一条追踪，同一用户未结束的追踪以 rejoined 结束"""
+        key = (str(group_id), str(user_id))
+        if key in self._open:
+            self._write(self._open.pop(key), "rejoined")
+        while len(self._open) >= self.max_open:
+            _, trace = self._open.popitem(last=False)
+            self._write(trace, "evicted")
+        self._open[key] = _Trace(*key)
+        self.step(group_id, user_id, "join")
+
+    def step(self, group_id, user_id, name, **info):
+        """记录一个步骤，没有对应追踪时不做处理"""
+        trace = self._open.get((str(group_id), str(user_id)))
+        if trace is None:
+            return
+        offset = time.monotonic() - trace.start
+        step = {"step": name, "ms": round(offset * 1000, 1)}
+        step.update(info)
+        trace.steps.append(step)
+        if name in trace.first:
+            return
+        trace.first[name] = offset
+        for metric, (begin, end) in ROLLUP_METRICS.items():
+            if end == name and begin in trace.first:
+                self._rollup(trace.group_id, metric, offset - trace.first[begin])
+
+    def finish(self, group_id, user_id, outcome, verified=False):
+        """
+        结束追踪并写入追踪日志
+
+        参数:
+            outcome (str): 结束方式，如 pass、fail、leave
+            verified (bool): 是否通过验证，通过时计入 verify 耗时
+        """
+        trace = self._open.pop((str(group_id), str(user_id)), None)
+        if trace is None:
+            return
+        if verified:
+            self._rollup(trace.group_id, "verify", time.monotonic() - trace.start)
+        self._write(trace, outcome)
+
+    def _rollup(self, group_id, metric, seconds):
+        samples = self._rollups.setdefault(group_id, {}).get(metric)
+        if samples is None:
+            samples = self._rollups[group_id][metric] = deque(
+                maxlen=TRACE_ROLLUP_SAMPLES
+            )
+        samples.append(seconds)
+
+    def _write(self, trace, outcome):
+        self.finished += 1
+        logger = self._get_logger()
+        if logger is None:
+            return
+        try:
+            logger.info(
+                json.dumps(
+                    trace.to_dict(outcome), ensure_ascii=False, separators=(",", ":")
+                )
+            )
+        except Exception as e:
+            logging.error(f"写入验证追踪失败: {e}")
+
+    def _get_logger(self):
+        # 第一次写入时再打开文件，此时已经知道是否在分片工作进程中
+        if self._logger is None and self.trace_dir is not None:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            name = "traces.jsonl"
+            if is_shard_worker():
+                name = f"traces-{worker_index()}.jsonl"
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(self.trace_dir, name),
+                maxBytes=TRACE_LOG_MAX_BYTES,
+                backupCount=TRACE_LOG_BACKUPS,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger(f"GroupEntryVerification.trace.{name}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def percentiles(self, group_id):
+        """
+        群的各项耗时分位数（毫秒）
+
+        返回:
+            dict: {耗时名称: {"count", "p50_ms", "p90_ms", "p99_ms"}}，没有样本的耗时不出现
+        """
+        result = {}
+        for metric, samples in self._rollups.get(str(group_id), {}).items():
+            if not samples:
+                continue
+            samples = sorted(samples)
+            result[metric] = {
+                "count": len(samples),
+                "p50_ms": round(_percentile(samples, 50) * 1000, 1),
+                "p90_ms": round(_percentile(samples, 90) * 1000, 1),
+                "p99_ms": round(_percentile(samples, 99) * 1000, 1),
+            }
+        return result
+
+    def stats(self):
+        """所有群的耗时分位数和追踪数量"""
+        return {
+            "open": len(self._open),
+            "finished": self.finished,
+            "groups": {
+                group_id: self.percentiles(group_id) for group_id in self._rollups
+            },
+        }
+
+
+tracer = VerificationTracer()
@@ -0,0 +1,190 @@
+"""
+跨群的信任缓存
+
+最近 TRUST_WINDOW 内在任意一个群通过验证（答题通过、管理员批准或申请阶段通过）的用户，
+加入开启了信任的群时不再禁言和出题。
+开始处理事件时（start）在后台任务中逐批读入所有已通过验证的记录（以入群时间作为通过时间，
+偏保守），读完之前只信任启动后通过验证的用户，入群处理不会等待读取。
+同时通过存储的修改通知保持更新：记录从其他状态变为 verified 时加入信任（已经是 verified
+的记录再次写入不会延长信任），变为 failed、rejected 或 kicked 时撤销信任，
+记录被删除（退群）时信任保留到过期。
+信任放行的用户不写入验证记录，因此信任不会在群之间传递续期。
+其他进程（分片工作进程、共用 Redis 的其他实例）中的验证在缓存建立之后收不到通知，
+这些用户仍按正常流程验证。
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.GroupEntryVerification.records import (
+    Status,
+    VerificationRecord,
+    parse_key,
+)
+from app.scripts.GroupEntryVerification.store import (
+    get_store,
+    add_listener,
+    user_of,
+    USER_VERIFICATION,
+)
+
+# 通过验证后多长时间内加入其他群可以免验证（秒）
+TRUST_WINDOW = 30 * 24 * 60 * 60
+# 最多记录的用户数，超过时先淘汰最早通过验证的用户
+MAX_TRUSTED_USERS = 100000
+# 后台读取时每处理多少条记录让出一次事件循环
+TRUST_LOAD_YIELD_EVERY = 500
+
+# 撤销信任的状态
+_REVOKING_STATUSES = (
+    Status.FAILED.label,
+    Status.REJECTED.label,
+    Status.KICKED.label,
+)
+
+
+class TrustCache:
+    """最近通过验证的用户，按通过时间排序"""
+
+    def __init__(self, window=TRUST_WINDOW, max_users=MAX_TRUSTED_USERS):
+        """
+        参数:
+            window (float): 信任的有效期（秒）
+            max_users (int): 最多记录的用户数
+        """
+        self.window = window
+        self.max_users = max_users
+        # QQ号 -> 通过验证的时间，最早的在前
+        self._verified = OrderedDict()
+        self._loaded = False
+        self._task = None
+        # 后台读取期间被撤销信任的用户，读取结果中不再加入
+        self._revoked_while_loading = set()
+        self.hits = 0
+        self.misses = 0
+        add_listener(self._on_change)
+
+    @property
+    def _loading(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """在当前事件循环中开始后台读取，已经读取或正在读取时不做处理"""
+        if self._loaded or self._loading:
+            return
+        self._revoked_while_loading = set()
+        self._task = asyncio.get_running_loop().create_task(self._load())
+
+    async def _load(self):
+        deadline = time.time() - self.window
+        # (入群时间, QQ号, 是否通过验证)，只保留影响信任的记录
+        entries = []
+        try:
+            records = get_store().iter_records(USER_VERIFICATION)
+            for count, (key, value) in enumerate(records, 1):
+                if parse_key(key) is None:
+                    continue
+                record = VerificationRecord.from_dict(key, value)
+                if record.status == Status.VERIFIED and record.joined_at > deadline:
+                    entries.append((record.joined_at, str(record.user_id), True))
+                elif record.status.label in _REVOKING_STATUSES:
+                    entries.append((record.joined_at, str(record.user_id), False))
+                if count % TRUST_LOAD_YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+        except Exception as e:
+            # 读取失败时只信任之后通过验证的用户
+            logging.error(f"读取已通过验证的用户失败: {e}")
+            self._loaded = True
+            return
+
+        # 按入群时间重放，后面的记录覆盖前面的
+        loaded = OrderedDict()
+        for joined_at, user_id, verified in sorted(entries):
+            loaded.pop(user_id, None)
+            if verified:
+                loaded[user_id] = joined_at
+        for user_id in self._revoked_while_loading:
+            loaded.pop(user_id, None)
+        # 读取期间通过验证的用户更新，排在后面
+        for user_id, verified_at in self._verified.items():
+            loaded.pop(user_id, None)
+            loaded[user_id] = verified_at
+        self._verified = loaded
+        self._loaded = True
+        self._evict()
+        logging.info(f"已读取 {len(self._verified)} 个最近通过验证的用户")
+
+    def is_trusted(self, user_id):
+        """用户是否在有效期内通过过验证，后台读取完成前只知道启动后通过验证的用户"""
+        user_id = str(user_id)
+        verified_at = self._verified.get(user_id)
+        if verified_at is not None and time.time() - verified_at < self.window:
+            self.hits += 1
+            return True
+        if verified_at is not None:
+            del self._verified[user_id]
+        self.misses += 1
+        return False
+
+    def note_verified(self, user_id, when=None):
+        """记录用户通过了验证"""
+        user_id = str(user_id)
+        self._verified.pop(user_id, None)
+        self._verified[user_id] = time.time() if when is None else when
+        self._evict()
+
+    def _evict(self):
+        """从最早的一端清理已过期和超出数量的用户"""
+        deadline = time.time() - self.window
+        while self._verified and (
+            len(self._verified) > self.max_users
+            or next(iter(self._verified.values())) <= deadline
+        ):
+            self._verified.popitem(last=False)
+
+    def revoke(self, user_id):
+        """撤销用户的信任"""
+        user_id = str(user_id)
+        self._verified.pop(user_id, None)
+        if self._loading:
+            self._revoked_while_loading.add(user_id)
+
+    def _on_change(self, table, changes, previous):
+        # 没有调用过 start（没有开启信任的群）时不记录
+        if table != USER_VERIFICATION or not (self._loaded or self._loading):
+            return
+        if changes is None:
+            # 整张表被覆盖，下次 start 时重新读取
+            if self._task is not None:
+                self._task.cancel()
+                self._task = None
+            self._verified.clear()
+            self._loaded = False
+            return
+        for key, value in changes.items():
+            if value is None:
+                continue
+            status = value.get("status")
+            old = (previous or {}).get(key) or {}
+            # 只有真正变为 verified 的记录才加入信任，状态机对跳过的用户也会发出通知
+            if status == Status.VERIFIED.label:
+                if old.get("status") != Status.VERIFIED.label:
+                    self.note_verified(user_of(table, key))
+            elif status in _REVOKING_STATUSES:
+                self.revoke(user_of(table, key))
+
+    def stats(self):
+        """命中统计"""
+        return {
+            "trusted_users": len(self._verified),
+            "hits": self.hits,
+            "misses": self.misses,
+        }